@@ -30,7 +30,6 @@ __version__ = '0.1.7'
 
 # before anything about stalker create the defaults
 from stalker.config import defaults
-from stalker.models.auth import group_finder
 
 import logging
 
@@ -52,10 +51,32 @@ def main(global_config, **settings):
 
     # use the ZopeTransactionExtension for session
     db.setup(settings)
+
+    # create the helper tables of stalker_pyramid
+    import stalker_pyramid.db
+    stalker_pyramid.db.init()
+
+    # load the statuses, status lists and types
+    from stalker_pyramid import lookups
+    lookups.load()
+
+    # start resizing the uploaded images in the background
+    from stalker_pyramid import thumbnails
+    thumbnails.start(settings)
+
+    # the size of the derivative image cache
+    from stalker_pyramid import derivatives
+    derivatives.configure(settings)
+
+    # serve the files through the front proxy if it is configured
+    from stalker_pyramid import file_serving
+    file_serving.configure(settings)
+
     DBSession.remove()
     DBSession.configure(extension=ZopeTransactionExtension())
 
     # setup authorization and authentication
+    from stalker_pyramid.views import group_finder, query_logged_in_user
     authn_policy = AuthTktAuthenticationPolicy(
         'sosecret',
         hashalg='sha512',
@@ -65,11 +86,16 @@ def main(global_config, **settings):
 
     config = Configurator(
         settings=settings,
-        root_factory='stalker.models.auth.RootFactory'
+        root_factory='stalker_pyramid.views.RootFactory'
     )
     config.set_authentication_policy(authn_policy)
     config.set_authorization_policy(authz_policy)
 
+    # the logged in user is queried once per request
+    config.add_request_method(
+        query_logged_in_user, 'logged_in_user', reify=True
+    )
+
     # Configure Beaker sessions and caching
     session_factory = pyramid_beaker.session_factory_from_settings(settings)
     config.set_session_factory(session_factory)
@@ -91,6 +117,9 @@ def main(global_config, **settings):
 
     config.add_route('flash_message', '/flash_message')
 
+    # runs a list of get_ requests in one go, see stalker_pyramid.views.batch
+    config.add_route('batch', 'batch/')  # json
+
     # addresses like http:/localhost:6543/SPL/{some_path} will let SP to serve
     # those files
     # SPL   : Stalker Pyramid Local
@@ -107,6 +136,13 @@ def main(global_config, **settings):
         'FDSPL/{partial_file_path:[a-zA-Z0-9/\.]+}'
     )
 
+    # the images of the links in the sizes of stalker_pyramid.derivatives,
+    # created on the first request
+    config.add_route(
+        'serve_derivative',
+        'thumbnails/{id:[0-9]+}/{size:[a-z]+}'
+    )
+
     logger.debug(defaults.server_side_storage_path + '/{partial_file_path}')
 
     # *************************************************************************
@@ -215,6 +251,13 @@ def main(global_config, **settings):
     config.add_route('upload_files',         'upload_files')
     config.add_route('assign_thumbnail',     'assign_thumbnail')
     config.add_route('assign_reference',     'assign_reference')
+    config.add_route('get_thumbnail_jobs',   'thumbnail_jobs/')  # json
+
+    # resumable uploads, see stalker_pyramid.uploads
+    config.add_route('create_upload',        'uploads/')  # json
+    config.add_route('get_upload',           'uploads/{id}/')  # json
+    config.add_route('upload_chunk',         'uploads/{id}/chunk')  # json
+    config.add_route('finish_upload',        'uploads/{id}/finish')  # json
 
     # *************************************************************************
     # Studio
@@ -244,6 +287,7 @@ def main(global_config, **settings):
     config.add_route('get_project_tasks',          'projects/{id}/tasks/')  # json
     config.add_route('get_project_tasks_count',    'projects/{id}/tasks/count/')  # json
     config.add_route('get_project_lead',           'projects/{id}/lead/')  # json
+    config.add_route('get_project_summary',        'projects/{id}/summary/')  # json
 
     config.add_route('create_project',             'projects/create')
     config.add_route('update_project',             'projects/{id}/update')
@@ -350,6 +394,7 @@ def main(global_config, **settings):
     # config.add_route('get_user_worked_hours', 'users/{id}/{frequency}/worked_hours/')  # json
     config.add_route('get_resources',         'resources/')
     config.add_route('get_entity_resources',  'entities/{id}/resources/')
+    config.add_route('get_entity_utilization', 'entities/{id}/utilization/')
     config.add_route('get_resource',          'resources/{id}/')
 
     config.add_route('list_users',            'users/list')  # html
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+# Stalker Pyramid a Web Base Production Asset Management System
+# Copyright (C) 2009-2014 Erkan Ozgur Yilmaz
+#
+# This file is part of Stalker Pyramid.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation;
+# version 2.1 of the License.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+"""In process caches.
+
+A :class:`.TTLCache` keeps the values created for its keys for a couple of
+seconds, so the data that is needed on nearly every request (like the groups
+of the logged in user) is not queried again and again::
+
+  from stalker_pyramid.cache import TTLCache
+
+  user_ids = TTLCache(ttl=60, invalidated_by=[User])
+
+  user_id = user_ids.get(
+      login,
+      lambda: User.query.filter_by(login=login).first().id
+  )
+
+The values should be plain data, not ORM instances, as the caches are shared
+between the requests and so between the sessions.
+
+A cache is cleared as soon as an instance of one of the classes given with
+``invalidated_by`` is created, updated or deleted through the ORM in this
+process. The changes done by the other processes are picked up when the
+values expire.
+"""
+import time
+import threading
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+
+# all the caches that are invalidated by the ORM changes
+caches = []
+
+
+class TTLCache(object):
+    """A thread safe cache whose values expire after the given seconds.
+
+    :param ttl: The time to live of the values in seconds.
+    :param invalidated_by: A list of classes, the cache is cleared when an
+      instance of them is created, updated or deleted.
+    """
+
+    def __init__(self, ttl=60, invalidated_by=None):
+        self.ttl = ttl
+        self.invalidated_by = tuple(invalidated_by or [])
+        self.data = {}
+        self.lock = threading.Lock()
+        if self.invalidated_by:
+            caches.append(self)
+
+    def get(self, key, creator):
+        """Returns the value of the given key, the value is created with the
+        given creator if it is not in the cache or if it is expired.
+
+        :param key: The key of the value.
+        :param creator: A callable without any arguments returning the value.
+        """
+        now = time.time()
+        with self.lock:
+            item = self.data.get(key)
+        if item is not None and item[0] > now:
+            return item[1]
+
+        value = creator()
+        with self.lock:
+            self.data[key] = (now + self.ttl, value)
+        return value
+
+    def invalidate(self, key=None):
+        """Removes the value of the given key or clears the whole cache if the
+        key is skipped.
+        """
+        with self.lock:
+            if key is None:
+                self.data.clear()
+            else:
+                self.data.pop(key, None)
+
+
+@event.listens_for(Session, 'after_flush')
+def invalidate_caches(session, flush_context):
+    """Clears the caches which are invalidated by the flushed instances.
+
+    The same caches are cleared once more after the transaction is committed,
+    so a value created by another request between the flush and the commit
+    doesn't outlive the change.
+    """
+    if not caches:
+        return
+
+    instances = list(session.new) + list(session.dirty) + \
+        list(session.deleted)
+    for cache in caches:
+        for instance in instances:
+            if isinstance(instance, cache.invalidated_by):
+                cache.invalidate()
+                session.info.setdefault('invalidated_caches', set()).add(
+                    cache
+                )
+                break
+
+
+@event.listens_for(Session, 'after_commit')
+def invalidate_caches_after_commit(session):
+    """Clears the caches invalidated in the committed transaction again.
+    """
+    for cache in session.info.pop('invalidated_caches', []):
+        cache.invalidate()
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def forget_invalidated_caches(session, previous_transaction):
+    """Forgets the caches invalidated in the rolled back transaction.
+    """
+    session.info.pop('invalidated_caches', None)
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+# Stalker Pyramid a Web Base Production Asset Management System
+# Copyright (C) 2009-2014 Erkan Ozgur Yilmaz
+#
+# This file is part of Stalker Pyramid.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation;
+# version 2.1 of the License.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+"""Database helpers of Stalker Pyramid.
+
+Stalker Pyramid keeps a couple of helper tables next to the Stalker tables to
+speed up the raw SQL queries in the views. These tables are filled and kept
+up to date by PostgreSQL triggers, so it doesn't matter if the data is changed
+through the web interface, through Stalker or directly in the database.
+
+Every module in :data:`modules` has a ``statements`` list holding the SQL
+statements that create its tables, functions and triggers, and may have a
+``fill_functions`` list of ``(table_name, function_name)`` pairs, the function
+is called to fill the table when it is empty.
+"""
+import logging
+
+from stalker.db import DBSession
+
+from stalker_pyramid.db import (task_hierarchy, time_log_rollup,
+                                resource_utilization, thumbnail_jobs,
+                                file_store)
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.WARNING)
+
+
+# the modules that have helper tables, the order is important
+modules = [
+    task_hierarchy,
+    time_log_rollup,
+    resource_utilization,
+    thumbnail_jobs,
+    file_store,
+]
+
+
+def init():
+    """Creates the helper tables, functions and triggers of Stalker Pyramid.
+
+    It is safe to call it multiple times. Should be called after
+    ``stalker.db.setup()``. Does nothing for databases other than PostgreSQL.
+    """
+    connection = DBSession.connection()
+
+    if connection.dialect.name != 'postgresql':
+        logger.warning(
+            'Stalker Pyramid helper tables are only supported in '
+            'PostgreSQL, skipping them for %s' % connection.dialect.name
+        )
+        return
+
+    for module in modules:
+        logger.debug('creating %s' % module.__name__)
+        # the statements are executed one by one, some drivers do not allow
+        # multiple statements in one execute call
+        for statement in module.statements:
+            connection.execute(statement)
+
+        for table_name, function_name in getattr(module, 'fill_functions',
+                                                 []):
+            is_empty = connection.execute(
+                'select not exists (select 1 from "%s")' % table_name
+            ).fetchone()[0]
+            if is_empty:
+                connection.execute('select "%s"()' % function_name)
+
+    # Warning! Not using scoped_session here, it is the plain old session
+    DBSession.commit()
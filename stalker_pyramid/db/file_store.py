@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+# Stalker Pyramid a Web Base Production Asset Management System
+# Copyright (C) 2009-2014 Erkan Ozgur Yilmaz
+#
+# This file is part of Stalker Pyramid.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation;
+# version 2.1 of the License.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+"""Content addressed file store.
+
+The uploaded files are stored with the sha1 of their content in their path
+(see :func:`stalker_pyramid.views.link.store_file`), so the same file
+uploaded many times is stored once and all of its Links have the same
+full_path. The number of the Links with a full_path is the reference count
+of the file, the file is removed when its last Link is deleted.
+
+A file is locked with an advisory lock while it is stored or removed, so a
+file is never removed while a new Link is being created for it.
+"""
+from stalker_pyramid.db import queries
+
+
+statements = [
+    """
+CREATE INDEX IF NOT EXISTS "Links_full_path" ON "Links" (full_path);
+""",
+]
+
+
+# held until the end of the transaction
+queries.register(
+    'lock_file',
+    """select pg_advisory_xact_lock(hashtext(:full_path))""",
+    full_path='text'
+)
+
+
+queries.register(
+    'get_file_link_count',
+    """select count(1) from "Links" where full_path = :full_path""",
+    full_path='text'
+)
@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+# Stalker Pyramid a Web Base Production Asset Management System
+# Copyright (C) 2009-2014 Erkan Ozgur Yilmaz
+#
+# This file is part of Stalker Pyramid.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation;
+# version 2.1 of the License.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+"""Named queries.
+
+The hand written SQL queries of the views are registered here by name
+together with the types of their parameters::
+
+  from stalker_pyramid.db import queries
+
+  queries.register(
+      'get_project_assets_count',
+      '''select count(1)
+      from "Assets"
+      join "Tasks" on "Assets".id = "Tasks".id
+      where "Tasks".project_id = :project_id''',
+      project_id='integer'
+  )
+
+  count = queries.execute('get_project_assets_count', project_id=23)
+
+The values are always passed as bound parameters, so the text of a query
+doesn't change from request to request and the database can reuse its plan.
+The parts of a query that really need to change, like an order by clause
+picked from a white list, are given as fragments (``%(order_by)s`` in the
+query) and every distinct combination of fragments is a separate variant of
+the query.
+
+In PostgreSQL every variant is prepared once per connection with a
+``PREPARE`` statement and then run with ``EXECUTE``, unless the driver
+already prepares and caches the statements itself (like pg8000) or the
+result is streamed with a server side cursor. For the other databases the
+queries are executed as plain bound parameter queries.
+"""
+import re
+import hashlib
+import logging
+
+from sqlalchemy import text
+
+from stalker.db import DBSession
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.WARNING)
+
+
+# the same pattern sqlalchemy.text() uses for bound parameters
+bind_pattern = re.compile(r'(?<![:\w\x5c]):(\w+)(?!:)')
+
+# the drivers which send the parameters inline with the query, so the
+# queries should be explicitly prepared to prevent them to be planned on
+# every call
+prepare_drivers = ['psycopg2']
+
+# the key of the set of the prepared statements in the connection info
+prepared_statements_key = 'stalker_pyramid.prepared_statements'
+
+registry = {}
+
+
+class NamedQuery(object):
+    """A named SQL query with bound parameters.
+
+    :param name: The name of the query, should be unique.
+    :param sql: The SQL query. Parameters are written as ``:name`` and
+      fragments as ``%(name)s``.
+    :param types: A dictionary holding the SQL types of the parameters, like
+      ``{'project_id': 'integer'}``.
+    """
+
+    def __init__(self, name, sql, types):
+        self.name = name
+        self.sql = sql
+        self.types = types
+
+    def __repr__(self):
+        return '<NamedQuery %s>' % self.name
+
+    def bind(self, fragments=None, **values):
+        """Returns a :class:`.BoundQuery` with the given fragments and values.
+
+        :param fragments: A dictionary holding the SQL of the fragments of the
+          query. The fragments can have parameters too.
+        :param values: The values of the parameters.
+        :return: :class:`.BoundQuery`
+        """
+        sql = self.sql
+        if fragments:
+            sql = sql % fragments
+
+        param_names = []
+        for param_name in bind_pattern.findall(sql):
+            if param_name not in param_names:
+                param_names.append(param_name)
+
+        for param_name in param_names:
+            if param_name not in self.types:
+                raise KeyError(
+                    'query %s has no type for parameter %s' %
+                    (self.name, param_name)
+                )
+            if param_name not in values:
+                raise KeyError(
+                    'no value given for parameter %s of query %s' %
+                    (param_name, self.name)
+                )
+
+        return BoundQuery(
+            self,
+            sql,
+            param_names,
+            dict([(param_name, values[param_name])
+                  for param_name in param_names])
+        )
+
+
+class BoundQuery(object):
+    """A variant of a :class:`.NamedQuery` with its parameter values.
+
+    :param query: The :class:`.NamedQuery`.
+    :param sql: The SQL of the variant, the fragments are already placed.
+    :param param_names: The names of the parameters in the order they appear
+      in the SQL.
+    :param values: The values of the parameters.
+    """
+
+    def __init__(self, query, sql, param_names, values):
+        self.query = query
+        self.sql = sql
+        self.param_names = param_names
+        self.values = values
+
+        # one prepared statement for every variant of the query
+        self.statement_name = '%s_%s' % (
+            query.name[:50],
+            hashlib.md5(sql.encode('utf-8')).hexdigest()[:8]
+        )
+
+    def typed_sql(self):
+        """Returns the SQL with the parameters casted to their types, so the
+        database doesn't need to guess the type of a NULL parameter.
+        """
+        types = self.query.types
+        return bind_pattern.sub(
+            lambda m: 'CAST(:%s AS %s)' % (m.group(1), types[m.group(1)]),
+            self.sql
+        )
+
+    def prepare_sql(self):
+        """Returns the PREPARE statement of this variant.
+        """
+        types = self.query.types
+        param_names = self.param_names
+        return 'PREPARE "%(name)s"%(types)s AS %(sql)s' % {
+            'name': self.statement_name,
+            'types': '(%s)' % ', '.join(
+                [types[param_name] for param_name in param_names]
+            ) if param_names else '',
+            'sql': bind_pattern.sub(
+                lambda m: '$%s' % (param_names.index(m.group(1)) + 1),
+                self.sql
+            )
+        }
+
+    def execute_sql(self):
+        """Returns the EXECUTE statement of this variant.
+        """
+        if not self.param_names:
+            return 'EXECUTE "%s"' % self.statement_name
+        return 'EXECUTE "%s"(%s)' % (
+            self.statement_name,
+            ', '.join([':%s' % param_name for param_name in self.param_names])
+        )
+
+    def execute(self, connection=None, prepare=True):
+        """Executes the query.
+
+        :param connection: The connection to execute the query with, the
+          connection of the DBSession is used if skipped.
+        :param prepare: Set it to False to skip the PREPARE statement, needed
+          for the queries that are executed with a server side cursor.
+        :return: sqlalchemy.engine.ResultProxy
+        """
+        if connection is None:
+            connection = DBSession.connection()
+
+        if connection.dialect.name == 'postgresql' \
+           and connection.dialect.driver in prepare_drivers \
+           and prepare:
+            prepared = connection.connection.info.setdefault(
+                prepared_statements_key, set()
+            )
+            if self.statement_name not in prepared:
+                logger.debug('preparing %s' % self.statement_name)
+                connection.execute(text(self.prepare_sql()))
+                prepared.add(self.statement_name)
+            return connection.execute(text(self.execute_sql()), **self.values)
+
+        return connection.execute(text(self.typed_sql()), **self.values)
+
+
+def register(name, sql, **types):
+    """Registers a new query with the given name.
+
+    :param name: The name of the query, should be unique.
+    :param sql: The SQL query. Parameters are written as ``:name`` and
+      fragments as ``%(name)s``.
+    :param types: The SQL types of the parameters, like
+      ``project_id='integer'``.
+    :return: :class:`.NamedQuery`
+    """
+    if name in registry and registry[name].sql != sql:
+        raise ValueError('there is already a query named %s' % name)
+    query = registry[name] = NamedQuery(name, sql, types)
+    return query
+
+
+def bind(name, fragments=None, **values):
+    """Returns the query with the given name bound to the given fragments and
+    values. See :meth:`.NamedQuery.bind`.
+
+    :return: :class:`.BoundQuery`
+    """
+    return registry[name].bind(fragments, **values)
+
+
+def execute(name, fragments=None, **values):
+    """Executes the query with the given name with the given fragments and
+    values in the DBSession connection.
+
+    :return: sqlalchemy.engine.ResultProxy
+    """
+    return bind(name, fragments, **values).execute()
+
+
+def get_time_window_condition(start_column, end_column, start, end):
+    """Returns an sql condition which selects the rows that overlap with the
+    given time window. The window start and end are referenced as the
+    ``:window_start`` and ``:window_end`` bound parameters, which should be
+    given as ``timestamp`` typed parameters of the query.
+
+    :param start_column: The column holding the start of the rows.
+    :param end_column: The column holding the end of the rows.
+    :param start: A datetime.datetime instance showing the window start,
+      can be None.
+    :param end: A datetime.datetime instance showing the window end, can be
+      None.
+    :return: str
+    """
+    conditions = []
+    if end is not None:
+        conditions.append('%s < :window_end' % start_column)
+    if start is not None:
+        conditions.append('%s > :window_start' % end_column)
+    return ' and '.join(conditions) or 'true'
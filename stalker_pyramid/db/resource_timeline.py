@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+# Stalker Pyramid a Web Base Production Asset Management System
+# Copyright (C) 2009-2014 Erkan Ozgur Yilmaz
+#
+# This file is part of Stalker Pyramid.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation;
+# version 2.1 of the License.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+"""Resource timelines.
+
+Loads the time logs and the leaf tasks of a whole page of resources with one
+query each, instead of querying them resource by resource. The rows are
+tagged with the id of the resource they belong to and are grouped in to
+buckets afterwards::
+
+  from stalker_pyramid.db import resource_timeline
+
+  timelines = resource_timeline.get_timelines(
+      [department.id for department in departments],
+      resource_type='Department',
+      start=datetime.datetime(2014, 3, 1),
+      end=datetime.datetime(2014, 4, 1)
+  )
+  timelines[department.id]['time_logs']
+
+A resource can be a User or a Department, the timeline of a Department is
+made of the time logs and the tasks of its users.
+"""
+from stalker_pyramid.db import queries
+
+
+# the column holding the resource id of the rows and the extra joins needed
+# to reach to that column, per resource type
+time_log_resources = {
+    'User': {
+        'resource_id': '"TimeLogs".resource_id',
+        'join': '',
+    },
+    'Department': {
+        'resource_id': '"User_Departments".did',
+        'join': 'join "User_Departments" '
+                'on "TimeLogs".resource_id = "User_Departments".uid',
+    },
+}
+
+task_resources = {
+    'User': {
+        'resource_id': '"Task_Resources".resource_id',
+        'join': '',
+    },
+    'Department': {
+        'resource_id': '"User_Departments".did',
+        'join': 'join "User_Departments" '
+                'on "Task_Resources".resource_id = "User_Departments".uid',
+    },
+}
+
+
+queries.register(
+    'get_resource_timeline_time_logs',
+    """select
+        %(resource_id)s as resource_id,
+        "TimeLogs".id,
+        "TimeLogs".task_id,
+        extract(epoch from "TimeLogs".start::timestamp AT TIME ZONE 'UTC') * 1000 as start,
+        extract(epoch from "TimeLogs".end::timestamp AT TIME ZONE 'UTC') * 1000 as end
+    from "TimeLogs"
+        %(join)s
+    where %(resource_id)s = any(:resource_ids)
+        and %(window_condition)s
+        %(project_condition)s
+    order by resource_id, start
+    """,
+    resource_ids='integer[]',
+    window_start='timestamp',
+    window_end='timestamp',
+    project_id='integer'
+)
+
+
+queries.register(
+    'get_resource_timeline_tasks',
+    """select distinct
+        %(resource_id)s as resource_id,
+        "Tasks".id,
+        extract(epoch from "Tasks".computed_start::timestamp AT TIME ZONE 'UTC') * 1000 as start,
+        extract(epoch from "Tasks".computed_end::timestamp AT TIME ZONE 'UTC') * 1000 as end
+    from "Tasks"
+        join "Task_Resources" on "Tasks".id = "Task_Resources".task_id
+        %(join)s
+    where %(resource_id)s = any(:resource_ids)
+        and not exists (
+            select 1 from "Tasks" as "Child_Tasks"
+            where "Child_Tasks".parent_id = "Tasks".id
+        )
+        and %(window_condition)s
+        %(project_condition)s
+    order by resource_id, start
+    """,
+    resource_ids='integer[]',
+    window_start='timestamp',
+    window_end='timestamp',
+    project_id='integer'
+)
+
+
+def get_timelines(resource_ids, resource_type='User', start=None, end=None,
+                  project_id=None):
+    """Returns the time logs and the leaf tasks of the given resources.
+
+    Only the time logs and tasks that overlap with the given time window are
+    returned, a missing window start or end leaves that side of the window
+    open.
+
+    :param resource_ids: A list of User or Department ids.
+    :param resource_type: The type of the resources, "User" or "Department".
+    :param start: A datetime.datetime instance showing the window start, can
+      be None.
+    :param end: A datetime.datetime instance showing the window end, can be
+      None.
+    :param project_id: If given only the time logs and tasks of that Project
+      are returned.
+    :return: A dictionary of dictionaries in
+      ``{resource_id: {'time_logs': [...], 'tasks': [...]}}`` format, the
+      start and end of the time logs and tasks are in milliseconds since
+      epoch.
+    """
+    timelines = dict(
+        (resource_id, {'time_logs': [], 'tasks': []})
+        for resource_id in resource_ids
+    )
+    if not resource_ids:
+        return timelines
+
+    values = {
+        'resource_ids': list(resource_ids),
+        'window_start': start,
+        'window_end': end,
+        'project_id': project_id,
+    }
+
+    project_condition = ''
+    if project_id is not None:
+        project_condition = 'and "Tasks".project_id = :project_id'
+
+    time_log_resource = time_log_resources[resource_type]
+    result = queries.execute(
+        'get_resource_timeline_time_logs',
+        {
+            'resource_id': time_log_resource['resource_id'],
+            'join': time_log_resource['join'] + (
+                ' join "Tasks" on "TimeLogs".task_id = "Tasks".id'
+                if project_id is not None else ''
+            ),
+            'window_condition': queries.get_time_window_condition(
+                '"TimeLogs".start', '"TimeLogs".end', start, end
+            ),
+            'project_condition': project_condition
+        },
+        **values
+    )
+    for r in result.fetchall():
+        timelines[r[0]]['time_logs'].append({
+            'id': r[1],
+            'task_id': r[2],
+            'start': r[3],
+            'end': r[4]
+        })
+
+    task_resource = task_resources[resource_type]
+    result = queries.execute(
+        'get_resource_timeline_tasks',
+        {
+            'resource_id': task_resource['resource_id'],
+            'join': task_resource['join'],
+            'window_condition': queries.get_time_window_condition(
+                '"Tasks".computed_start', '"Tasks".computed_end', start, end
+            ),
+            'project_condition': project_condition
+        },
+        **values
+    )
+    for r in result.fetchall():
+        timelines[r[0]]['tasks'].append({
+            'id': r[1],
+            'start': r[2],
+            'end': r[3]
+        })
+
+    return timelines
@@ -0,0 +1,341 @@
+# -*- coding: utf-8 -*-
+# Stalker Pyramid a Web Base Production Asset Management System
+# Copyright (C) 2009-2014 Erkan Ozgur Yilmaz
+#
+# This file is part of Stalker Pyramid.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation;
+# version 2.1 of the License.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+"""Resource utilization index.
+
+The "Resource_Utilization" table holds the allocated and vacation seconds of
+every user per day. There is one row per user and month, and the values of the
+days are kept in arrays indexed by the day of the month, so a year of a user
+is twelve rows.
+
+* allocated: the schedule seconds of the leaf tasks of the user spread over
+  the days between the computed start and end of the tasks. The schedule
+  seconds of an effort based task are shared between its resources.
+* vacation: the duration of the vacations of the user and of the studio wide
+  vacations.
+
+The logged seconds of the users per day are in the "Resource_Daily_TimeLogs"
+table of :mod:`stalker_pyramid.db.time_log_rollup`.
+
+The table is updated by triggers on the "Vacations", "Tasks", "Task_Resources"
+and "Users" tables. The allocations currently added for a
+task are recorded in the "Task_Allocations" table, so they can be subtracted
+when the task is rescheduled.
+"""
+
+
+statements = [
+    """
+CREATE TABLE IF NOT EXISTS "Resource_Utilization" (
+    resource_id integer NOT NULL
+        REFERENCES "Users" (id) ON DELETE CASCADE,
+    month date NOT NULL,
+    allocated double precision[] NOT NULL,
+    vacation double precision[] NOT NULL,
+    PRIMARY KEY (resource_id, month)
+);
+""",
+    """
+-- no foreign keys, the rows should still be there when the trigger of a
+-- deleted task runs
+CREATE TABLE IF NOT EXISTS "Task_Allocations" (
+    task_id integer NOT NULL,
+    resource_id integer NOT NULL,
+    start timestamp NOT NULL,
+    "end" timestamp NOT NULL,
+    seconds double precision NOT NULL,
+    PRIMARY KEY (task_id, resource_id)
+);
+""",
+    """
+-- spreads the given seconds over the days between span_start and span_end in
+-- proportion to the part of the span falling in to each day and adds them to
+-- the given kind of utilization of the resource, if seconds is NULL the
+-- duration of the span is added, use a negative sign to subtract it
+CREATE OR REPLACE FUNCTION "add_resource_utilization"(
+    utilization_resource_id integer,
+    span_start timestamp,
+    span_end timestamp,
+    kind text,
+    seconds double precision,
+    sign integer
+)
+RETURNS void AS $$
+DECLARE
+    span_seconds double precision;
+    day record;
+    value double precision;
+BEGIN
+    span_seconds := extract(epoch from span_end - span_start);
+    IF span_seconds IS NULL OR span_seconds <= 0 THEN
+        RETURN;
+    END IF;
+
+    FOR day IN
+        SELECT
+            date_trunc('month', days.date)::date AS month,
+            extract(day from days.date)::integer AS index,
+            extract(epoch from
+                least(span_end, days.date + interval '1 day') -
+                greatest(span_start, days.date)
+            ) AS duration
+        FROM generate_series(
+            date_trunc('day', span_start),
+            span_end - interval '1 microsecond',
+            interval '1 day'
+        ) AS days(date)
+    LOOP
+        value := sign * day.duration;
+        IF seconds IS NOT NULL THEN
+            value := value * seconds / span_seconds;
+        END IF;
+
+        -- concurrent transactions may add the first value of the same month
+        INSERT INTO "Resource_Utilization"
+            (resource_id, month, allocated, vacation)
+        VALUES (
+            utilization_resource_id,
+            day.month,
+            array_fill(0::double precision, ARRAY[31]),
+            array_fill(0::double precision, ARRAY[31])
+        )
+        ON CONFLICT (resource_id, month) DO NOTHING;
+
+        UPDATE "Resource_Utilization"
+        SET allocated[day.index] = allocated[day.index] +
+                CASE WHEN kind = 'allocated' THEN value ELSE 0 END,
+            vacation[day.index] = vacation[day.index] +
+                CASE WHEN kind = 'vacation' THEN value ELSE 0 END
+        WHERE resource_id = utilization_resource_id AND month = day.month;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+""",
+    """
+-- subtracts the current allocations of the given task and adds them again
+-- from the computed start, computed end, schedule seconds and resources of
+-- the task, only the leaf tasks are allocated
+CREATE OR REPLACE FUNCTION "update_task_allocations"(allocation_task_id integer)
+RETURNS void AS $$
+DECLARE
+    allocation record;
+BEGIN
+    IF allocation_task_id IS NULL THEN
+        RETURN;
+    END IF;
+
+    FOR allocation IN
+        SELECT * FROM "Task_Allocations" WHERE task_id = allocation_task_id
+    LOOP
+        PERFORM "add_resource_utilization"(
+            allocation.resource_id, allocation.start, allocation."end",
+            'allocated', allocation.seconds, -1
+        );
+    END LOOP;
+    DELETE FROM "Task_Allocations" WHERE task_id = allocation_task_id;
+
+    INSERT INTO "Task_Allocations" (task_id, resource_id, start, "end", seconds)
+    SELECT
+        "Tasks".id,
+        "Task_Resources".resource_id,
+        "Tasks".computed_start,
+        "Tasks".computed_end,
+        "Tasks".schedule_seconds / CASE WHEN "Tasks".schedule_model = 'effort'
+            THEN count(*) over (partition by "Tasks".id)
+            ELSE 1
+        END
+    FROM "Tasks"
+    JOIN "Task_Resources" ON "Tasks".id = "Task_Resources".task_id
+    WHERE "Tasks".id = allocation_task_id
+        AND "Tasks".computed_start < "Tasks".computed_end
+        AND "Tasks".schedule_seconds > 0
+        AND NOT EXISTS (
+            SELECT 1 FROM "Tasks" AS "Child_Tasks"
+            WHERE "Child_Tasks".parent_id = "Tasks".id
+        );
+
+    FOR allocation IN
+        SELECT * FROM "Task_Allocations" WHERE task_id = allocation_task_id
+    LOOP
+        PERFORM "add_resource_utilization"(
+            allocation.resource_id, allocation.start, allocation."end",
+            'allocated', allocation.seconds, 1
+        );
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+""",
+    """
+-- adds the given vacation to its user or to all the users for a studio wide
+-- vacation, use a negative sign to subtract it
+CREATE OR REPLACE FUNCTION "add_vacation_utilization"(
+    vacation_user_id integer,
+    vacation_start timestamp,
+    vacation_end timestamp,
+    sign integer
+)
+RETURNS void AS $$
+BEGIN
+    PERFORM "add_resource_utilization"(
+        "Users".id, vacation_start, vacation_end, 'vacation', NULL, sign
+    )
+    FROM "Users"
+    WHERE vacation_user_id IS NULL OR "Users".id = vacation_user_id;
+END;
+$$ LANGUAGE plpgsql;
+""",
+    """
+-- recalculates the utilization table from scratch
+CREATE OR REPLACE FUNCTION "rebuild_resource_utilization"()
+RETURNS void AS $$
+BEGIN
+    DELETE FROM "Resource_Utilization";
+    DELETE FROM "Task_Allocations";
+
+    PERFORM "add_vacation_utilization"(user_id, start, "end", 1)
+    FROM "Vacations";
+
+    PERFORM "update_task_allocations"(task_id)
+    FROM (SELECT DISTINCT task_id FROM "Task_Resources") AS tasks;
+END;
+$$ LANGUAGE plpgsql;
+""",
+    """
+CREATE OR REPLACE FUNCTION "Vacations_update_utilization"()
+RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM "add_vacation_utilization"(
+            OLD.user_id, OLD.start, OLD."end", -1
+        );
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM "add_vacation_utilization"(
+            NEW.user_id, NEW.start, NEW."end", 1
+        );
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+""",
+    """
+DROP TRIGGER IF EXISTS "Vacations_utilization" ON "Vacations";
+""",
+    """
+CREATE TRIGGER "Vacations_utilization"
+    AFTER INSERT OR UPDATE OF user_id, start, "end"
+        OR DELETE ON "Vacations"
+    FOR EACH ROW
+    EXECUTE PROCEDURE "Vacations_update_utilization"();
+""",
+    """
+-- the studio wide vacations also apply to the new users
+CREATE OR REPLACE FUNCTION "Users_update_utilization"()
+RETURNS trigger AS $$
+BEGIN
+    PERFORM "add_resource_utilization"(
+        NEW.id, start, "end", 'vacation', NULL, 1
+    )
+    FROM "Vacations"
+    WHERE user_id IS NULL;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+""",
+    """
+DROP TRIGGER IF EXISTS "Users_utilization" ON "Users";
+""",
+    """
+CREATE TRIGGER "Users_utilization"
+    AFTER INSERT ON "Users"
+    FOR EACH ROW
+    EXECUTE PROCEDURE "Users_update_utilization"();
+""",
+    """
+-- a task is reallocated when its schedule changes and its old and new parents
+-- are reallocated as they may become a leaf task or stop being one
+CREATE OR REPLACE FUNCTION "Tasks_update_utilization"()
+RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM "update_task_allocations"(OLD.id);
+        PERFORM "update_task_allocations"(OLD.parent_id);
+    ELSE
+        PERFORM "update_task_allocations"(NEW.id);
+        PERFORM "update_task_allocations"(NEW.parent_id);
+        IF TG_OP = 'UPDATE'
+           AND OLD.parent_id IS DISTINCT FROM NEW.parent_id THEN
+            PERFORM "update_task_allocations"(OLD.parent_id);
+        END IF;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+""",
+    """
+DROP TRIGGER IF EXISTS "Tasks_utilization" ON "Tasks";
+""",
+    """
+CREATE TRIGGER "Tasks_utilization"
+    AFTER INSERT OR UPDATE OF parent_id, computed_start, computed_end,
+        schedule_seconds, schedule_model
+        OR DELETE ON "Tasks"
+    FOR EACH ROW
+    EXECUTE PROCEDURE "Tasks_update_utilization"();
+""",
+    """
+CREATE OR REPLACE FUNCTION "Task_Resources_update_utilization"()
+RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM "update_task_allocations"(OLD.task_id);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM "update_task_allocations"(NEW.task_id);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+""",
+    """
+DROP TRIGGER IF EXISTS "Task_Resources_utilization" ON "Task_Resources";
+""",
+    """
+CREATE TRIGGER "Task_Resources_utilization"
+    AFTER INSERT OR UPDATE OR DELETE ON "Task_Resources"
+    FOR EACH ROW
+    EXECUTE PROCEDURE "Task_Resources_update_utilization"();
+""",
+]
+
+
+# the tables filled by stalker_pyramid.db.init() with the given functions when
+# they are empty
+fill_functions = [
+    ('Resource_Utilization', 'rebuild_resource_utilization'),
+]
+
+
+def rebuild(connection):
+    """Recalculates the resource utilization table from the vacations and
+    tasks.
+
+    :param connection: A PostgreSQL connection.
+    """
+    connection.execute('select "rebuild_resource_utilization"()')
@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+# Stalker Pyramid a Web Base Production Asset Management System
+# Copyright (C) 2009-2014 Erkan Ozgur Yilmaz
+#
+# This file is part of Stalker Pyramid.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation;
+# version 2.1 of the License.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+"""Set based task hierarchy duplication.
+
+Duplicates a whole task hierarchy with a handful of ``INSERT ... SELECT``
+statements instead of creating the tasks one by one with the ORM. The tasks to
+be duplicated are collected from the "Task_Ancestors" table into the
+"Task_Duplicates" temporary table together with the ids of their duplicates,
+and that table is used to remap the ids of the tasks, of their parents and of
+their dependencies.
+
+The column lists are taken from the Stalker table definitions, so every
+column of a task is copied unless it is listed in the overrides below.
+"""
+import datetime
+
+from sqlalchemy import text
+
+from stalker import SimpleEntity, Entity, Task, Asset, Shot, Sequence
+from stalker.db import DBSession
+
+
+# the Task subclasses that have their own table
+task_subclasses = [Asset, Shot, Sequence]
+
+
+def _get_table(name):
+    """Returns the Stalker table with the given name.
+    """
+    return Task.__table__.metadata.tables[name]
+
+
+def _insert_select(table, overrides, from_clause):
+    """Generates an ``INSERT ... SELECT`` statement that copies the rows of
+    the given table which are selected with the given from clause.
+
+    :param table: A sqlalchemy Table.
+    :param overrides: A dictionary of column name and sql expression pairs
+      for the columns that should not be copied as they are. The source row
+      can be referenced as ``source``.
+    :param from_clause: The from clause of the select statement.
+    :return: str
+    """
+    columns = [column.name for column in table.c]
+    return 'INSERT INTO "%(table)s" (%(columns)s) SELECT %(values)s %(from)s' % {
+        'table': table.name,
+        'columns': ', '.join(['"%s"' % column for column in columns]),
+        'values': ', '.join([
+            overrides.get(column, 'source."%s"' % column)
+            for column in columns
+        ]),
+        'from': from_clause
+    }
+
+
+def duplicate_task_hierarchy(task_id, targets, name=None, description=None,
+                             user_id=None):
+    """Duplicates the hierarchy of the given task under each of the given
+    targets.
+
+    The duplicated tasks have the same names, descriptions, types, schedule
+    info, resources, responsible, watchers, tags and generic data with the
+    original ones, their status is set to NEW and they have no time logs,
+    versions, notes or reviews. The dependencies between the tasks in the
+    hierarchy are remapped to the duplicates, the dependencies to the tasks
+    outside of the hierarchy are preserved.
+
+    The session should be flushed before calling this function, and the
+    duplicated tasks are not in the session, query them if they are needed.
+
+    :param task_id: The id of the top most Task, Asset, Shot or Sequence of
+      the hierarchy.
+    :param targets: A list of (parent_id, project_id) tuples, the hierarchy
+      is duplicated once for each of them. The parent_id can be None to
+      duplicate the hierarchy as a root task of the project.
+    :param name: The name of the top most duplicate, the name of the task is
+      used if skipped. It is also used as the code of the top most duplicate.
+    :param description: The description of the top most duplicate, the
+      description of the task is used if skipped.
+    :param user_id: The id of the User that is duplicating the hierarchy,
+      used as the updated_by of the duplicates.
+    :return: list of the ids of the top most duplicates, in the same order
+      with the targets.
+    """
+    if not targets:
+        return []
+
+    connection = DBSession.connection()
+
+    params = {
+        'task_id': task_id,
+        'name': name,
+        'description': description,
+        'user_id': user_id,
+        'now': datetime.datetime.now(),
+    }
+
+    target_values = []
+    for i, (parent_id, project_id) in enumerate(targets):
+        target_values.append(
+            '(%s, %s::integer, %s)' % (
+                i,
+                'NULL' if parent_id is None else int(parent_id),
+                int(project_id)
+            )
+        )
+
+    # the mapping between the original tasks and their duplicates
+    connection.execute("""
+    CREATE TEMPORARY TABLE IF NOT EXISTS "Task_Duplicates" (
+        target_index integer NOT NULL,
+        parent_id integer,
+        project_id integer NOT NULL,
+        old_id integer NOT NULL,
+        new_id integer NOT NULL,
+        depth integer NOT NULL,
+        PRIMARY KEY (target_index, old_id)
+    ) ON COMMIT DROP
+    """)
+    connection.execute('DELETE FROM "Task_Duplicates"')
+
+    connection.execute(text("""
+    INSERT INTO "Task_Duplicates"
+        (target_index, parent_id, project_id, old_id, new_id, depth)
+    SELECT
+        targets.target_index,
+        targets.parent_id,
+        targets.project_id,
+        "Task_Ancestors".descendant_id,
+        nextval(pg_get_serial_sequence('"SimpleEntities"', 'id')),
+        "Task_Ancestors".depth
+    FROM "Task_Ancestors"
+    CROSS JOIN (VALUES %(targets)s) AS targets(
+        target_index, parent_id, project_id
+    )
+    WHERE "Task_Ancestors".ancestor_id = :task_id
+    ORDER BY targets.target_index, "Task_Ancestors".depth,
+        "Task_Ancestors".descendant_id
+    """ % {'targets': ', '.join(target_values)}), **params)
+
+    from_duplicates = """
+    FROM "%(table)s" AS source
+    JOIN "Task_Duplicates" ON source.%(id)s = "Task_Duplicates".old_id
+    """
+
+    # SimpleEntities and Entities
+    statements = [
+        _insert_select(
+            SimpleEntity.__table__,
+            {
+                'id': '"Task_Duplicates".new_id',
+                'name': 'CASE WHEN "Task_Duplicates".depth = 0 '
+                        'THEN coalesce(:name, source.name) '
+                        'ELSE source.name END',
+                'description': 'CASE WHEN "Task_Duplicates".depth = 0 '
+                               'THEN coalesce(:description, '
+                               'source.description) '
+                               'ELSE source.description END',
+                'updated_by_id': 'coalesce(:user_id, source.updated_by_id)',
+                'date_created': ':now',
+                'date_updated': ':now',
+            },
+            from_duplicates % {'table': 'SimpleEntities', 'id': 'id'}
+        ),
+        _insert_select(
+            Entity.__table__,
+            {'id': '"Task_Duplicates".new_id'},
+            from_duplicates % {'table': 'Entities', 'id': 'id'}
+        ),
+        # the parents should be inserted before their children for the
+        # Task_Ancestors and Task_Hierarchical_Names triggers
+        _insert_select(
+            Task.__table__,
+            {
+                'id': '"Task_Duplicates".new_id',
+                'parent_id': 'CASE WHEN "Task_Duplicates".depth = 0 '
+                             'THEN "Task_Duplicates".parent_id '
+                             'ELSE parents.new_id END',
+                'project_id': '"Task_Duplicates".project_id',
+                'status_id': '(SELECT id FROM "Statuses" '
+                             'WHERE code = \'NEW\')',
+                'total_logged_seconds': '0',
+                'review_number': '0',
+            },
+            from_duplicates % {'table': 'Tasks', 'id': 'id'} + """
+            LEFT OUTER JOIN "Task_Duplicates" AS parents
+                ON parents.target_index = "Task_Duplicates".target_index
+                AND parents.old_id = source.parent_id
+            ORDER BY "Task_Duplicates".target_index, "Task_Duplicates".depth
+            """
+        ),
+    ]
+
+    # Assets, Shots and Sequences
+    for class_ in task_subclasses:
+        overrides = {
+            'id': '"Task_Duplicates".new_id',
+            'code': 'CASE WHEN "Task_Duplicates".depth = 0 '
+                    'THEN coalesce(:name, source.code) '
+                    'ELSE source.code END',
+        }
+        if class_ is Shot:
+            overrides['code'] = 'CASE WHEN "Task_Duplicates".depth = 0 ' \
+                                'THEN coalesce(:name, source.code || \'dup\') ' \
+                                'ELSE source.code || \'dup\' END'
+        statements.append(
+            _insert_select(
+                class_.__table__,
+                overrides,
+                from_duplicates % {'table': class_.__tablename__, 'id': 'id'}
+            )
+        )
+
+    # the secondary tables
+    for table_name, column_name in [('Task_Resources', 'task_id'),
+                                    ('Task_Responsible', 'task_id'),
+                                    ('Task_Watchers', 'task_id'),
+                                    ('Entity_Tags', 'entity_id'),
+                                    ('SimpleEntity_GenericData',
+                                     'simple_entity_id')]:
+        statements.append(
+            _insert_select(
+                _get_table(table_name),
+                {column_name: '"Task_Duplicates".new_id'},
+                from_duplicates % {'table': table_name, 'id': column_name}
+            )
+        )
+
+    # the dependencies to the tasks in the hierarchy are remapped to the
+    # duplicates
+    statements.append(
+        _insert_select(
+            _get_table('Task_Dependencies'),
+            {
+                'task_id': '"Task_Duplicates".new_id',
+                'depends_to_id': 'coalesce(depends_to.new_id, '
+                                 'source.depends_to_id)',
+            },
+            from_duplicates % {'table': 'Task_Dependencies', 'id': 'task_id'}
+            + """
+            LEFT OUTER JOIN "Task_Duplicates" AS depends_to
+                ON depends_to.target_index = "Task_Duplicates".target_index
+                AND depends_to.old_id = source.depends_to_id
+            """
+        )
+    )
+
+    for statement in statements:
+        connection.execute(text(statement), **params)
+
+    result = connection.execute("""
+    SELECT new_id FROM "Task_Duplicates"
+    WHERE depth = 0
+    ORDER BY target_index
+    """)
+    return [r[0] for r in result.fetchall()]
@@ -0,0 +1,480 @@
+# -*- coding: utf-8 -*-
+# Stalker Pyramid a Web Base Production Asset Management System
+# Copyright (C) 2009-2014 Erkan Ozgur Yilmaz
+#
+# This file is part of Stalker Pyramid.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation;
+# version 2.1 of the License.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+"""Task hierarchy helper tables.
+
+The "Task_Hierarchical_Names" table holds the hierarchical name of every task
+in the following columns:
+
+  * id: the task id
+  * name: the task name
+  * path: the project code and the names of the parents of the task starting
+    from the top most one, ex: "PRJ | Assets | Characters"
+  * parent_names: the name of the task followed by its path in parenthesis,
+    ex: "Model (PRJ | Assets | Characters)"
+
+The "Task_Ancestors" table is the closure table of the task hierarchy, it
+holds one row for every (ancestor, descendant) pair with the distance between
+them in the depth column. Every task is its own ancestor with depth 0 and the
+project of a task is the top most ancestor of it, so all the tasks under a
+task or a project, all the parents of a task or all the leaf tasks under an
+entity can be queried with a single join.
+
+The "Task_Inherited_Responsibles" view uses the "Task_Ancestors" table to
+give the responsible of every task, which is the responsible of the task
+itself, of its nearest parent which has a responsible or the project lead.
+
+The tables are updated by triggers when a task is inserted, renamed,
+reparented, moved to another project or deleted or when a project code is
+changed, and only the affected sub hierarchy is recalculated. So the views can
+get the hierarchy of a task with a simple join instead of walking the whole
+task tree.
+"""
+from stalker.db import DBSession
+
+
+statements = [
+    """
+CREATE TABLE IF NOT EXISTS "Task_Hierarchical_Names" (
+    id integer NOT NULL PRIMARY KEY
+        REFERENCES "Tasks" (id) ON DELETE CASCADE,
+    name text NOT NULL,
+    path text NOT NULL,
+    parent_names text NOT NULL
+);
+""",
+    """
+-- recalculates the hierarchical names of the given task and its children
+CREATE OR REPLACE FUNCTION "update_task_hierarchical_names"(root_id integer)
+RETURNS void AS $$
+BEGIN
+    DELETE FROM "Task_Hierarchical_Names"
+    WHERE id IN (
+        WITH RECURSIVE sub_tasks(id) AS (
+                SELECT root_id
+            UNION ALL
+                SELECT "Tasks".id
+                FROM "Tasks"
+                JOIN sub_tasks ON "Tasks".parent_id = sub_tasks.id
+        )
+        SELECT id FROM sub_tasks
+    );
+
+    INSERT INTO "Task_Hierarchical_Names" (id, name, path, parent_names)
+    WITH RECURSIVE sub_tasks(id, name, path) AS (
+            SELECT
+                "Tasks".id,
+                "SimpleEntities".name::text,
+                coalesce(
+                    "Parent_Names".path || ' | ' || "Parent_Names".name,
+                    "Projects".code::text
+                )
+            FROM "Tasks"
+            JOIN "SimpleEntities" ON "Tasks".id = "SimpleEntities".id
+            JOIN "Projects" ON "Tasks".project_id = "Projects".id
+            LEFT OUTER JOIN "Task_Hierarchical_Names" AS "Parent_Names"
+                ON "Tasks".parent_id = "Parent_Names".id
+            WHERE "Tasks".id = root_id
+        UNION ALL
+            SELECT
+                "Tasks".id,
+                "SimpleEntities".name::text,
+                sub_tasks.path || ' | ' || sub_tasks.name
+            FROM "Tasks"
+            JOIN sub_tasks ON "Tasks".parent_id = sub_tasks.id
+            JOIN "SimpleEntities" ON "Tasks".id = "SimpleEntities".id
+    )
+    SELECT id, name, path, name || ' (' || path || ')'
+    FROM sub_tasks;
+END;
+$$ LANGUAGE plpgsql;
+""",
+    """
+-- recalculates the hierarchical names of all the tasks
+CREATE OR REPLACE FUNCTION "rebuild_task_hierarchical_names"()
+RETURNS void AS $$
+DECLARE
+    root record;
+BEGIN
+    DELETE FROM "Task_Hierarchical_Names";
+    FOR root IN SELECT id FROM "Tasks" WHERE parent_id IS NULL LOOP
+        PERFORM "update_task_hierarchical_names"(root.id);
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+""",
+    """
+CREATE OR REPLACE FUNCTION "Tasks_update_hierarchical_names"()
+RETURNS trigger AS $$
+BEGIN
+    PERFORM "update_task_hierarchical_names"(NEW.id);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+""",
+    """
+CREATE OR REPLACE FUNCTION "SimpleEntities_update_hierarchical_names"()
+RETURNS trigger AS $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM "Tasks" WHERE id = NEW.id) THEN
+        PERFORM "update_task_hierarchical_names"(NEW.id);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+""",
+    """
+CREATE OR REPLACE FUNCTION "Projects_update_hierarchical_names"()
+RETURNS trigger AS $$
+DECLARE
+    root record;
+BEGIN
+    FOR root IN
+        SELECT id FROM "Tasks"
+        WHERE project_id = NEW.id AND parent_id IS NULL
+    LOOP
+        PERFORM "update_task_hierarchical_names"(root.id);
+    END LOOP;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+""",
+    """
+DROP TRIGGER IF EXISTS "Tasks_hierarchical_names_insert" ON "Tasks";
+""",
+    """
+CREATE TRIGGER "Tasks_hierarchical_names_insert"
+    AFTER INSERT ON "Tasks"
+    FOR EACH ROW
+    EXECUTE PROCEDURE "Tasks_update_hierarchical_names"();
+""",
+    """
+DROP TRIGGER IF EXISTS "Tasks_hierarchical_names_update" ON "Tasks";
+""",
+    """
+CREATE TRIGGER "Tasks_hierarchical_names_update"
+    AFTER UPDATE OF parent_id, project_id ON "Tasks"
+    FOR EACH ROW
+    WHEN (OLD.parent_id IS DISTINCT FROM NEW.parent_id
+          OR OLD.project_id IS DISTINCT FROM NEW.project_id)
+    EXECUTE PROCEDURE "Tasks_update_hierarchical_names"();
+""",
+    """
+DROP TRIGGER IF EXISTS "SimpleEntities_hierarchical_names_update"
+    ON "SimpleEntities";
+""",
+    """
+CREATE TRIGGER "SimpleEntities_hierarchical_names_update"
+    AFTER UPDATE OF name ON "SimpleEntities"
+    FOR EACH ROW
+    WHEN (OLD.name IS DISTINCT FROM NEW.name)
+    EXECUTE PROCEDURE "SimpleEntities_update_hierarchical_names"();
+""",
+    """
+DROP TRIGGER IF EXISTS "Projects_hierarchical_names_update" ON "Projects";
+""",
+    """
+CREATE TRIGGER "Projects_hierarchical_names_update"
+    AFTER UPDATE OF code ON "Projects"
+    FOR EACH ROW
+    WHEN (OLD.code IS DISTINCT FROM NEW.code)
+    EXECUTE PROCEDURE "Projects_update_hierarchical_names"();
+""",
+    """
+CREATE TABLE IF NOT EXISTS "Task_Ancestors" (
+    ancestor_id integer NOT NULL
+        REFERENCES "SimpleEntities" (id) ON DELETE CASCADE,
+    descendant_id integer NOT NULL
+        REFERENCES "Tasks" (id) ON DELETE CASCADE,
+    depth integer NOT NULL,
+    PRIMARY KEY (ancestor_id, descendant_id)
+);
+""",
+    """
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_class
+        WHERE relname = 'ix_Task_Ancestors_descendant_id'
+    ) THEN
+        CREATE INDEX "ix_Task_Ancestors_descendant_id"
+            ON "Task_Ancestors" (descendant_id, depth);
+    END IF;
+END;
+$$;
+""",
+    """
+-- moves the sub hierarchy of the given task under its current parent or
+-- project
+CREATE OR REPLACE FUNCTION "update_task_ancestors"(task_id integer)
+RETURNS void AS $$
+BEGIN
+    -- disconnect the sub hierarchy from the previous ancestors
+    DELETE FROM "Task_Ancestors"
+    WHERE descendant_id IN (
+        SELECT descendant_id FROM "Task_Ancestors"
+        WHERE ancestor_id = task_id
+    )
+    AND ancestor_id NOT IN (
+        SELECT descendant_id FROM "Task_Ancestors"
+        WHERE ancestor_id = task_id
+    );
+
+    -- a newly created task
+    INSERT INTO "Task_Ancestors" (ancestor_id, descendant_id, depth)
+    SELECT task_id, task_id, 0
+    WHERE NOT EXISTS (
+        SELECT 1 FROM "Task_Ancestors"
+        WHERE ancestor_id = task_id AND descendant_id = task_id
+    );
+
+    -- connect the sub hierarchy to the ancestors of the parent
+    INSERT INTO "Task_Ancestors" (ancestor_id, descendant_id, depth)
+    SELECT
+        parents.ancestor_id,
+        sub_tasks.descendant_id,
+        parents.depth + sub_tasks.depth + 1
+    FROM "Task_Ancestors" AS sub_tasks, (
+            SELECT "Task_Ancestors".ancestor_id, "Task_Ancestors".depth
+            FROM "Tasks"
+            JOIN "Task_Ancestors"
+                ON "Tasks".parent_id = "Task_Ancestors".descendant_id
+            WHERE "Tasks".id = task_id
+        UNION ALL
+            SELECT "Tasks".project_id, 0
+            FROM "Tasks"
+            WHERE "Tasks".id = task_id
+                AND "Tasks".parent_id IS NULL
+                AND "Tasks".project_id IS NOT NULL
+    ) AS parents
+    WHERE sub_tasks.ancestor_id = task_id;
+END;
+$$ LANGUAGE plpgsql;
+""",
+    """
+-- recalculates the ancestors of all the tasks
+CREATE OR REPLACE FUNCTION "rebuild_task_ancestors"()
+RETURNS void AS $$
+BEGIN
+    DELETE FROM "Task_Ancestors";
+
+    INSERT INTO "Task_Ancestors" (ancestor_id, descendant_id, depth)
+    WITH RECURSIVE ancestors(ancestor_id, descendant_id, depth) AS (
+            SELECT id, id, 0 FROM "Tasks"
+        UNION ALL
+            SELECT
+                coalesce("Tasks".parent_id, "Tasks".project_id),
+                ancestors.descendant_id,
+                ancestors.depth + 1
+            FROM ancestors
+            JOIN "Tasks" ON ancestors.ancestor_id = "Tasks".id
+    )
+    SELECT ancestor_id, descendant_id, depth FROM ancestors;
+END;
+$$ LANGUAGE plpgsql;
+""",
+    """
+CREATE OR REPLACE FUNCTION "Tasks_update_ancestors"()
+RETURNS trigger AS $$
+BEGIN
+    PERFORM "update_task_ancestors"(NEW.id);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+""",
+    """
+DROP TRIGGER IF EXISTS "Tasks_ancestors_insert" ON "Tasks";
+""",
+    """
+CREATE TRIGGER "Tasks_ancestors_insert"
+    AFTER INSERT ON "Tasks"
+    FOR EACH ROW
+    EXECUTE PROCEDURE "Tasks_update_ancestors"();
+""",
+    """
+DROP TRIGGER IF EXISTS "Tasks_ancestors_update" ON "Tasks";
+""",
+    """
+CREATE TRIGGER "Tasks_ancestors_update"
+    AFTER UPDATE OF parent_id, project_id ON "Tasks"
+    FOR EACH ROW
+    WHEN (OLD.parent_id IS DISTINCT FROM NEW.parent_id
+          OR OLD.project_id IS DISTINCT FROM NEW.project_id)
+    EXECUTE PROCEDURE "Tasks_update_ancestors"();
+""",
+    """
+-- the responsible of the task itself or of its nearest parent which has a
+-- responsible or the lead of the project
+CREATE OR REPLACE VIEW "Task_Inherited_Responsibles" AS
+    SELECT responsibles.id, responsibles.responsible_id
+    FROM (
+        SELECT
+            "Task_Ancestors".descendant_id AS id,
+            "Task_Responsible".responsible_id,
+            rank() OVER (
+                PARTITION BY "Task_Ancestors".descendant_id
+                ORDER BY "Task_Ancestors".depth
+            ) AS rank
+        FROM "Task_Ancestors"
+        JOIN "Task_Responsible"
+            ON "Task_Ancestors".ancestor_id = "Task_Responsible".task_id
+    ) AS responsibles
+    WHERE responsibles.rank = 1
+UNION ALL
+    SELECT "Tasks".id, "Projects".lead_id
+    FROM "Tasks"
+    JOIN "Projects" ON "Tasks".project_id = "Projects".id
+    WHERE NOT EXISTS (
+        SELECT 1
+        FROM "Task_Ancestors"
+        JOIN "Task_Responsible"
+            ON "Task_Ancestors".ancestor_id = "Task_Responsible".task_id
+        WHERE "Task_Ancestors".descendant_id = "Tasks".id
+    );
+""",
+]
+
+
+# the tables filled by stalker_pyramid.db.init() with the given functions when
+# they are empty
+fill_functions = [
+    ('Task_Hierarchical_Names', 'rebuild_task_hierarchical_names'),
+    ('Task_Ancestors', 'rebuild_task_ancestors'),
+]
+
+
+def rebuild(connection):
+    """Recalculates the hierarchical names and ancestors of all the tasks.
+
+    :param connection: A PostgreSQL connection.
+    """
+    connection.execute('select "rebuild_task_hierarchical_names"()')
+    connection.execute('select "rebuild_task_ancestors"()')
+
+
+def get_ancestor_ids(entity_id):
+    """Returns the ids of the parents of the given task starting from the
+    project and ending with the direct parent of the task.
+
+    :param entity_id: The id of a Task, Asset, Shot or Sequence.
+    :return: list of integers
+    """
+    sql_query = """
+    select ancestor_id
+    from "Task_Ancestors"
+    where descendant_id = %(id)s and depth > 0
+    order by depth desc
+    """ % {'id': entity_id}
+
+    result = DBSession.connection().execute(sql_query)
+    return [r[0] for r in result.fetchall()]
+
+
+def get_descendant_ids(entity_id, max_depth=None):
+    """Returns the ids of all the tasks under the given task or project.
+
+    :param entity_id: The id of a Project, Task, Asset, Shot or Sequence.
+    :param max_depth: If given only the tasks that are at most that many
+      levels below the given entity are returned, so ``max_depth=1`` returns
+      the children of the entity.
+    :return: list of (id, parent_id) tuples where parent_id is the id of the
+      direct parent of the task or the id of the project for root tasks,
+      sorted by their distance to the given entity.
+    """
+    depth_condition = ''
+    if max_depth is not None:
+        depth_condition = 'and "Task_Ancestors".depth <= %s' % int(max_depth)
+
+    sql_query = """
+    select
+        "Tasks".id,
+        coalesce("Tasks".parent_id, "Tasks".project_id)
+    from "Task_Ancestors"
+    join "Tasks" on "Task_Ancestors".descendant_id = "Tasks".id
+    where "Task_Ancestors".ancestor_id = %(id)s
+        and "Task_Ancestors".depth > 0
+        %(depth_condition)s
+    order by "Task_Ancestors".depth, "Tasks".id
+    """ % {'id': entity_id, 'depth_condition': depth_condition}
+
+    result = DBSession.connection().execute(sql_query)
+    return [(r[0], r[1]) for r in result.fetchall()]
+
+
+def get_leaf_ids(entity_id):
+    """Returns the ids of the leaf tasks under the given task or project.
+
+    :param entity_id: The id of a Project, Task, Asset, Shot or Sequence.
+    :return: list of integers
+    """
+    sql_query = """
+    select "Task_Ancestors".descendant_id
+    from "Task_Ancestors"
+    where "Task_Ancestors".ancestor_id = %(id)s
+        and "Task_Ancestors".depth > 0
+        and not exists (
+            select 1 from "Tasks"
+            where "Tasks".parent_id = "Task_Ancestors".descendant_id
+        )
+    order by "Task_Ancestors".descendant_id
+    """ % {'id': entity_id}
+
+    result = DBSession.connection().execute(sql_query)
+    return [r[0] for r in result.fetchall()]
+
+
+def get_inherited_responsible_ids(task_id):
+    """Returns the ids of the responsible of the given task, which are the
+    responsible of the task itself, of the nearest parent that has a
+    responsible or the project lead.
+
+    :param task_id: The id of a Task, Asset, Shot or Sequence.
+    :return: list of integers
+    """
+    sql_query = """
+    select responsible_id
+    from "Task_Inherited_Responsibles"
+    where id = %(id)s and responsible_id is not NULL
+    """ % {'id': task_id}
+
+    result = DBSession.connection().execute(sql_query)
+    return [r[0] for r in result.fetchall()]
+
+
+def query_parent_names(task_id_column):
+    """Returns an sql sub query which gives the names of the parents of the
+    task with the given id column joined with ' | ', starting from the top
+    most parent, which is the same with
+    ``' | '.join([parent.name for parent in task.parents])``.
+
+    :param task_id_column: The column holding the task id in the outer query,
+      ex: '"Tasks".id'.
+    :return: str
+    """
+    return """coalesce((
+        select string_agg("Parent_SimpleEntities".name, ' | '
+                          order by "Task_Ancestors".depth desc)
+        from "Task_Ancestors"
+        join "Tasks" as "Parent_Tasks"
+            on "Task_Ancestors".ancestor_id = "Parent_Tasks".id
+        join "SimpleEntities" as "Parent_SimpleEntities"
+            on "Parent_Tasks".id = "Parent_SimpleEntities".id
+        where "Task_Ancestors".descendant_id = %s
+            and "Task_Ancestors".depth > 0
+    ), '')""" % task_id_column
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+# Stalker Pyramid a Web Base Production Asset Management System
+# Copyright (C) 2009-2014 Erkan Ozgur Yilmaz
+#
+# This file is part of Stalker Pyramid.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation;
+# version 2.1 of the License.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+"""Thumbnail job queue.
+
+The "Thumbnail_Jobs" table is the queue of the image resizing jobs of the
+uploaded files (see :mod:`stalker_pyramid.thumbnails`). A job is inserted in
+the same transaction with the Link it is created for, so it is there as long
+as the Link is there, and it survives the restarts of the server.
+
+A job has one of the following kinds:
+
+  * thumbnail: creates a thumbnail Link for the Link
+  * resize: replaces the file of the Link with a resized one (the Link is
+    used as a thumbnail itself)
+
+and goes through the queued, running and done states, or ends up in the
+failed state if it fails too many times. A running job which is not finished
+in time (the process running it has died) is claimed again, or marked as
+failed if it is out of attempts.
+"""
+from stalker_pyramid.db import queries
+
+
+statements = [
+    """
+CREATE TABLE IF NOT EXISTS "Thumbnail_Jobs" (
+    id serial PRIMARY KEY,
+    link_id integer NOT NULL
+        REFERENCES "Links" (id) ON DELETE CASCADE,
+    kind text NOT NULL,
+    state text NOT NULL DEFAULT 'queued',
+    created_by_id integer
+        REFERENCES "Users" (id) ON DELETE SET NULL,
+    attempts integer NOT NULL DEFAULT 0,
+    error text,
+    date_created timestamp NOT NULL DEFAULT now(),
+    date_started timestamp,
+    date_finished timestamp
+);
+""",
+    """
+CREATE INDEX IF NOT EXISTS "Thumbnail_Jobs_link_id"
+    ON "Thumbnail_Jobs" (link_id);
+""",
+    """
+CREATE INDEX IF NOT EXISTS "Thumbnail_Jobs_pending"
+    ON "Thumbnail_Jobs" (id) WHERE state IN ('queued', 'running');
+""",
+]
+
+
+queries.register(
+    'insert_thumbnail_job',
+    """insert into "Thumbnail_Jobs" (link_id, kind, created_by_id)
+    values (:link_id, :kind, :created_by_id)
+    """,
+    link_id='integer',
+    kind='text',
+    created_by_id='integer'
+)
+
+
+# the stale running jobs which are out of attempts are not claimed again
+queries.register(
+    'fail_stale_thumbnail_jobs',
+    """update "Thumbnail_Jobs"
+    set state = 'failed',
+        error = 'timed out',
+        date_finished = now()
+    where state = 'running'
+        and attempts >= :max_attempts
+        and date_started < now() - :timeout * interval '1 second'
+    """,
+    timeout='integer',
+    max_attempts='integer'
+)
+
+
+# claims the oldest queued jobs and the running jobs which are stale, the
+# jobs claimed by the other processes are skipped
+queries.register(
+    'claim_thumbnail_jobs',
+    """with claimed as (
+        update "Thumbnail_Jobs"
+        set state = 'running',
+            date_started = now(),
+            attempts = attempts + 1
+        where id in (
+            select id
+            from "Thumbnail_Jobs"
+            where state = 'queued'
+                or (state = 'running'
+                    and attempts < :max_attempts
+                    and date_started < now() - :timeout * interval '1 second')
+            order by id
+            limit :limit
+            for update skip locked
+        )
+        returning id, link_id, kind, created_by_id, attempts
+    )
+    select
+        claimed.id,
+        claimed.link_id,
+        claimed.kind,
+        claimed.created_by_id,
+        claimed.attempts,
+        "Links".full_path,
+        "Links".original_filename
+    from claimed
+    join "Links" on claimed.link_id = "Links".id
+    order by claimed.id
+    """,
+    timeout='integer',
+    max_attempts='integer',
+    limit='integer'
+)
+
+
+queries.register(
+    'finish_thumbnail_job',
+    """update "Thumbnail_Jobs"
+    set state = 'done',
+        error = null,
+        date_finished = now()
+    where id = :job_id
+    """,
+    job_id='integer'
+)
+
+
+# the job is queued again until it runs out of attempts
+queries.register(
+    'fail_thumbnail_job',
+    """update "Thumbnail_Jobs"
+    set state = case when attempts >= :max_attempts then 'failed'
+                     else 'queued' end,
+        error = :error,
+        date_finished = now()
+    where id = :job_id
+    """,
+    job_id='integer',
+    max_attempts='integer',
+    error='text'
+)
+
+
+# the state of the last job of the links, the links without a job are done if
+# they have a thumbnail, the resized links are their own thumbnails
+queries.register(
+    'get_thumbnail_jobs',
+    """select
+        "Links".id,
+        coalesce(
+            "Last_Jobs".state,
+            case when "Thumbnails".id is null then 'none' else 'done' end
+        ) as state,
+        "Last_Jobs".error,
+        case when "Last_Jobs".kind = 'resize' then "Links".full_path
+             else "Thumbnails".full_path end as thumbnail_full_path
+    from "Links"
+    join "SimpleEntities" on "Links".id = "SimpleEntities".id
+    left outer join "Links" as "Thumbnails"
+        on "SimpleEntities".thumbnail_id = "Thumbnails".id
+    left outer join lateral (
+        select state, error, kind
+        from "Thumbnail_Jobs"
+        where "Thumbnail_Jobs".link_id = "Links".id
+        order by "Thumbnail_Jobs".id desc
+        limit 1
+    ) as "Last_Jobs" on true
+    where "Links".id = any(:link_ids)
+    order by "Links".id
+    """,
+    link_ids='integer[]'
+)
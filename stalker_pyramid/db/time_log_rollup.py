@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+# Stalker Pyramid a Web Base Production Asset Management System
+# Copyright (C) 2009-2014 Erkan Ozgur Yilmaz
+#
+# This file is part of Stalker Pyramid.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation;
+# version 2.1 of the License.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+"""Time log rollup tables.
+
+The "Task_TimeLog_Durations" table holds the total duration of the time logs
+of every task in seconds, so the listings don't need to sum the whole
+"TimeLogs" table to calculate the percent complete of the tasks.
+
+The "Resource_Daily_TimeLogs" table holds the total duration of the time logs
+of every resource per day in seconds, a time log spanning midnight is split
+between the days.
+
+Both tables are updated by a trigger on the "TimeLogs" table, so they are
+updated in the same transaction with the time log that is created, updated or
+deleted.
+"""
+from stalker.db import DBSession
+
+
+statements = [
+    """
+CREATE TABLE IF NOT EXISTS "Task_TimeLog_Durations" (
+    task_id integer NOT NULL PRIMARY KEY
+        REFERENCES "Tasks" (id) ON DELETE CASCADE,
+    duration double precision NOT NULL
+);
+""",
+    """
+CREATE TABLE IF NOT EXISTS "Resource_Daily_TimeLogs" (
+    resource_id integer NOT NULL
+        REFERENCES "Users" (id) ON DELETE CASCADE,
+    date date NOT NULL,
+    duration double precision NOT NULL,
+    PRIMARY KEY (resource_id, date)
+);
+""",
+    """
+-- adds the duration of the given time log to the rollup tables, use a
+-- negative sign to subtract it
+CREATE OR REPLACE FUNCTION "add_time_log_duration"(
+    time_log_task_id integer,
+    time_log_resource_id integer,
+    time_log_start timestamp,
+    time_log_end timestamp,
+    sign integer
+)
+RETURNS void AS $$
+DECLARE
+    day record;
+BEGIN
+    -- upserts, so the first time logs of a task or a day created in
+    -- concurrent transactions don't violate the primary keys
+    INSERT INTO "Task_TimeLog_Durations" (task_id, duration)
+    VALUES (
+        time_log_task_id,
+        sign * extract(epoch from time_log_end - time_log_start)
+    )
+    ON CONFLICT (task_id) DO UPDATE
+    SET duration = "Task_TimeLog_Durations".duration + EXCLUDED.duration;
+
+    FOR day IN
+        SELECT
+            days.date::date AS date,
+            extract(epoch from
+                least(time_log_end, days.date + interval '1 day') -
+                greatest(time_log_start, days.date)
+            ) AS duration
+        FROM generate_series(
+            date_trunc('day', time_log_start),
+            time_log_end - interval '1 microsecond',
+            interval '1 day'
+        ) AS days(date)
+    LOOP
+        INSERT INTO "Resource_Daily_TimeLogs" (resource_id, date, duration)
+        VALUES (time_log_resource_id, day.date, sign * day.duration)
+        ON CONFLICT (resource_id, date) DO UPDATE
+        SET duration = "Resource_Daily_TimeLogs".duration + EXCLUDED.duration;
+    END LOOP;
+
+    DELETE FROM "Resource_Daily_TimeLogs"
+    WHERE resource_id = time_log_resource_id AND duration = 0;
+END;
+$$ LANGUAGE plpgsql;
+""",
+    """
+-- recalculates the rollup tables from scratch
+CREATE OR REPLACE FUNCTION "rebuild_time_log_rollups"()
+RETURNS void AS $$
+BEGIN
+    DELETE FROM "Task_TimeLog_Durations";
+    DELETE FROM "Resource_Daily_TimeLogs";
+
+    INSERT INTO "Task_TimeLog_Durations" (task_id, duration)
+    SELECT
+        task_id,
+        extract(epoch from sum("TimeLogs".end - "TimeLogs".start))
+    FROM "TimeLogs"
+    GROUP BY task_id;
+
+    INSERT INTO "Resource_Daily_TimeLogs" (resource_id, date, duration)
+    SELECT
+        "TimeLogs".resource_id,
+        days.date::date,
+        sum(extract(epoch from
+            least("TimeLogs".end, days.date + interval '1 day') -
+            greatest("TimeLogs".start, days.date)
+        ))
+    FROM "TimeLogs",
+        generate_series(
+            date_trunc('day', "TimeLogs".start),
+            "TimeLogs".end - interval '1 microsecond',
+            interval '1 day'
+        ) AS days(date)
+    GROUP BY "TimeLogs".resource_id, days.date;
+END;
+$$ LANGUAGE plpgsql;
+""",
+    """
+CREATE OR REPLACE FUNCTION "TimeLogs_update_rollups"()
+RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM "add_time_log_duration"(
+            OLD.task_id, OLD.resource_id, OLD.start, OLD."end", -1
+        );
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM "add_time_log_duration"(
+            NEW.task_id, NEW.resource_id, NEW.start, NEW."end", 1
+        );
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+""",
+    """
+DROP TRIGGER IF EXISTS "TimeLogs_rollups" ON "TimeLogs";
+""",
+    """
+CREATE TRIGGER "TimeLogs_rollups"
+    AFTER INSERT OR UPDATE OF task_id, resource_id, start, "end"
+        OR DELETE ON "TimeLogs"
+    FOR EACH ROW
+    EXECUTE PROCEDURE "TimeLogs_update_rollups"();
+""",
+]
+
+
+# the tables filled by stalker_pyramid.db.init() with the given functions when
+# they are empty
+fill_functions = [
+    ('Task_TimeLog_Durations', 'rebuild_time_log_rollups'),
+]
+
+
+def rebuild(connection):
+    """Recalculates the rollup tables from the "TimeLogs" table.
+
+    :param connection: A PostgreSQL connection.
+    """
+    connection.execute('select "rebuild_time_log_rollups"()')
+
+
+def get_resource_daily_durations(resource_ids, start, end):
+    """Returns the total time log durations of the given resources per day
+    between the given dates.
+
+    :param resource_ids: A list of User ids.
+    :param start: A datetime.date, the first day.
+    :param end: A datetime.date, the last day.
+    :return: A dictionary of dictionaries in {resource_id: {date: seconds}}
+      format.
+    """
+    durations = dict((resource_id, {}) for resource_id in resource_ids)
+    if not resource_ids:
+        return durations
+
+    sql_query = """
+    select resource_id, date, duration
+    from "Resource_Daily_TimeLogs"
+    where resource_id in (%(resource_ids)s)
+        and date between '%(start)s' and '%(end)s'
+    order by resource_id, date
+    """ % {
+        'resource_ids': ', '.join(map(str, map(int, resource_ids))),
+        'start': start.strftime('%Y-%m-%d'),
+        'end': end.strftime('%Y-%m-%d')
+    }
+
+    result = DBSession.connection().execute(sql_query)
+    for resource_id, date, duration in result.fetchall():
+        durations[resource_id][date] = duration
+    return durations
@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+# Stalker Pyramid a Web Base Production Asset Management System
+# Copyright (C) 2009-2014 Erkan Ozgur Yilmaz
+#
+# This file is part of Stalker Pyramid.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation;
+# version 2.1 of the License.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+"""Derivative images.
+
+The listings show the images in a couple of fixed sizes (a small avatar next
+to a note, a card in the references grid etc.), so instead of sending the
+whole image or its 512px thumbnail, they send the path of a derivative of the
+image in one of the following sizes::
+
+  from stalker_pyramid import derivatives
+
+  derivatives.get_derivative_path(link_id, 'avatar')
+  # 'thumbnails/23/avatar'
+
+The ``serve_derivative`` view serves these paths. A derivative is created
+from the image of the Link (or from its thumbnail if it is big enough) the
+first time it is requested and is then kept in a :class:`.DerivativeCache`,
+which is a directory in the server side storage that is limited in size,
+the least recently used files are removed when it is full.
+
+The derivative of a Link never changes (a new image is a new Link), so the
+derivatives are served with a one year max-age and the browsers don't ask
+for them again.
+"""
+import os
+import uuid
+import logging
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+
+from stalker import defaults
+
+from stalker_pyramid.db import queries
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.WARNING)
+
+
+# the bounding boxes of the derivatives
+sizes = {
+    'avatar': (64, 64),
+    'card': (256, 256),
+    'preview': (1024, 1024),
+}
+
+# the size of the thumbnails created for the Links, the derivatives smaller
+# than this are created from the thumbnails
+thumbnail_size = (512, 512)
+
+# the cache of this process
+cache = None
+
+# the size of the cache in bytes
+cache_size = 1024 * 1024 * 1024
+
+
+queries.register(
+    'get_derivative_sources',
+    """select
+        "Links".full_path,
+        "Thumbnails".full_path
+    from "Links"
+    join "SimpleEntities" on "Links".id = "SimpleEntities".id
+    left outer join "Links" as "Thumbnails"
+        on "SimpleEntities".thumbnail_id = "Thumbnails".id
+    where "Links".id = :link_id
+    """,
+    link_id='integer'
+)
+
+
+class DerivativeCache(object):
+    """A directory of derivatives limited in size.
+
+    The files are kept in the order they are used, the least recently used
+    ones are removed when the total size of the files exceeds the max size.
+    The order is kept with the modification times of the files, so it
+    survives the restarts.
+
+    :param path: The directory of the cache.
+    :param max_size: The max total size of the files in bytes.
+    """
+
+    def __init__(self, path, max_size):
+        self.path = path
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.files = None
+        self.total_size = 0
+
+    def load(self):
+        """Reads the files in the cache directory.
+        """
+        found = []
+        for root, dirs, filenames in os.walk(self.path):
+            for filename in filenames:
+                if filename.endswith('~'):
+                    continue
+                file_path = os.path.join(root, filename)
+                try:
+                    stat = os.stat(file_path)
+                except OSError:
+                    continue
+                found.append((stat.st_mtime, file_path, stat.st_size))
+
+        self.files = OrderedDict()
+        self.total_size = 0
+        for mtime, file_path, file_size in sorted(found):
+            self.files[file_path] = file_size
+            self.total_size += file_size
+
+    def get_file_path(self, link_id, size, extension):
+        """Returns the path of the derivative of the given Link.
+        """
+        return os.path.join(
+            self.path,
+            size,
+            '%02x' % (int(link_id) % 256),
+            '%s%s' % (link_id, extension)
+        )
+
+    def get(self, link_id, size):
+        """Returns the path of the derivative if it is in the cache, marks it
+        as the most recently used one.
+        """
+        with self.lock:
+            if self.files is None:
+                self.load()
+
+            for extension in ['.jpg', '.png']:
+                file_path = self.get_file_path(link_id, size, extension)
+                if file_path not in self.files:
+                    continue
+
+                file_size = self.files.pop(file_path)
+                try:
+                    os.utime(file_path, None)
+                except OSError:
+                    # removed by another process
+                    self.total_size -= file_size
+                    continue
+                self.files[file_path] = file_size
+                return file_path
+
+    def add(self, file_path):
+        """Adds the given file to the cache and removes the least recently
+        used files if the cache is full.
+        """
+        file_size = os.path.getsize(file_path)
+        with self.lock:
+            if self.files is None:
+                self.load()
+
+            self.total_size -= self.files.pop(file_path, 0)
+            self.files[file_path] = file_size
+            self.total_size += file_size
+
+            while self.total_size > self.max_size and len(self.files) > 1:
+                old_file_path, old_file_size = self.files.popitem(last=False)
+                self.total_size -= old_file_size
+                try:
+                    os.remove(old_file_path)
+                except OSError:
+                    pass
+
+
+def configure(settings):
+    """Sets the size of the cache from the ``stalker_pyramid.derivative_cache_size``
+    setting in megabytes.
+    """
+    global cache_size
+    global cache
+
+    cache_size = int(
+        settings.get('stalker_pyramid.derivative_cache_size', 1024)
+    ) * 1024 * 1024
+    cache = None
+
+
+def get_cache():
+    """Returns the cache of this process.
+    """
+    global cache
+    cache_path = os.path.join(
+        defaults.server_side_storage_path, 'derivatives'
+    )
+    if cache is None or cache.path != cache_path:
+        cache = DerivativeCache(cache_path, cache_size)
+    return cache
+
+
+def get_derivative_path(link_id, size):
+    """Returns the path of the derivative of the given Link in the given size,
+    to be used like the full_path of a Link. Returns None if there is no
+    Link.
+
+    :param link_id: The id of the Link.
+    :param size: One of the keys of ``sizes``.
+    """
+    if link_id is None:
+        return None
+    return 'thumbnails/%s/%s' % (link_id, size)
+
+
+def create_derivative(source_path, target_path, bounding_box):
+    """Creates the derivative of the given image.
+
+    :return: The path of the derivative, the extension of the given target
+      path is replaced with .png for the images with transparency.
+    """
+    img = Image.open(source_path)
+    if img.mode in ('RGBA', 'LA') or \
+            (img.mode == 'P' and 'transparency' in img.info):
+        img = img.convert('RGBA')
+        image_format = 'PNG'
+        target_path = os.path.splitext(target_path)[0] + '.png'
+    else:
+        img = img.convert('RGB')
+        image_format = 'JPEG'
+
+    img.thumbnail(bounding_box, Image.ANTIALIAS)
+
+    target_dir = os.path.dirname(target_path)
+    if not os.path.exists(target_dir):
+        try:
+            os.makedirs(target_dir)
+        except OSError:  # created by another thread
+            pass
+
+    # the same derivative can be created by two requests at the same time
+    temp_path = '%s.%s~' % (target_path, uuid.uuid4().hex)
+    try:
+        img.save(temp_path, image_format, quality=85)
+        os.rename(temp_path, target_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return target_path
+
+
+def get_derivative(link_id, size):
+    """Returns the file path of the derivative of the given Link in the given
+    size, creates it if it is not in the cache.
+
+    :param link_id: The id of the Link.
+    :param size: One of the keys of ``sizes``.
+    :return: The file path or None if there is no such Link or the file of
+      the Link is not an image.
+    """
+    from stalker_pyramid.views.link import convert_file_link_to_full_path
+
+    derivative_cache = get_cache()
+    file_path = derivative_cache.get(link_id, size)
+    if file_path:
+        return file_path
+
+    row = queries.execute('get_derivative_sources', link_id=link_id)\
+        .fetchone()
+    if row is None:
+        return None
+
+    bounding_box = sizes[size]
+    source_paths = [row[0]]
+    if row[1]:
+        # prefer the thumbnail if it is big enough
+        if bounding_box[0] <= thumbnail_size[0] and \
+                bounding_box[1] <= thumbnail_size[1]:
+            source_paths.insert(0, row[1])
+        else:
+            source_paths.append(row[1])
+
+    target_path = derivative_cache.get_file_path(link_id, size, '.jpg')
+    for source_path in source_paths:
+        try:
+            file_path = create_derivative(
+                convert_file_link_to_full_path(source_path),
+                target_path,
+                bounding_box
+            )
+        except (IOError, OSError) as e:
+            logger.debug('no derivative from %s: %s' % (source_path, e))
+            continue
+        derivative_cache.add(file_path)
+        return file_path
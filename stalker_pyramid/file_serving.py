@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+# Stalker Pyramid a Web Base Production Asset Management System
+# Copyright (C) 2009-2014 Erkan Ozgur Yilmaz
+#
+# This file is part of Stalker Pyramid.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation;
+# version 2.1 of the License.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+"""Serving the files in the server side storage.
+
+The ``serve_files`` and ``forced_download_files`` views return the responses
+of :func:`.make_file_response`, which have a strong ETag and support the
+conditional requests (304 Not Modified) and the byte ranges (206 Partial
+Content), so the browsers can seek in a video without downloading all of it.
+A range is read by seeking in the file, not by reading the file from the
+start. The files stored by their content (see
+:mod:`stalker_pyramid.db.file_store`) never change, so they are cached by the
+browsers for a year.
+
+The transfer of the file can be handed to the front proxy with the following
+settings::
+
+  # nginx
+  stalker_pyramid.file_serving_header = X-Accel-Redirect
+  stalker_pyramid.file_serving_prefix = /SPL_internal/
+
+  # Apache mod_xsendfile, lighttpd
+  stalker_pyramid.file_serving_header = X-Sendfile
+
+With X-Accel-Redirect the path of the file relative to the server side
+storage is appended to the prefix, which should be an internal location of
+nginx pointing to the server side storage::
+
+  location /SPL_internal/ {
+      internal;
+      alias /path/to/server_side_storage/;
+  }
+
+With X-Sendfile the absolute path of the file is sent.
+"""
+import os
+import re
+import urllib
+import mimetypes
+
+from pyramid.response import Response
+
+from stalker import Link, defaults
+
+from stalker_pyramid.cache import TTLCache
+from stalker_pyramid.db import queries
+
+
+# the size of the blocks read from the files
+block_size = 2 << 16
+
+# the header to hand the transfer to the front proxy, X-Accel-Redirect or
+# X-Sendfile, the files are served by the application if it is None
+offload_header = None
+
+# the internal location of the server side storage for X-Accel-Redirect
+offload_prefix = '/SPL_internal/'
+
+# the files named with the sha1 of their content
+content_filename_re = re.compile('^[0-9a-f]{40}$')
+
+# the original filenames of the link paths
+filename_cache = TTLCache(ttl=600, invalidated_by=[Link])
+
+
+queries.register(
+    'get_link_original_filename',
+    """select original_filename
+    from "Links"
+    where id = :link_id and full_path = :full_path
+    """,
+    link_id='integer',
+    full_path='text'
+)
+
+
+# the files stored by their content are shared by many Links, this is only
+# right for the older files which have one Link per path
+queries.register(
+    'get_path_original_filename',
+    """select original_filename
+    from "Links"
+    where full_path = :full_path
+    order by id
+    limit 1
+    """,
+    full_path='text'
+)
+
+
+def configure(settings):
+    """Sets how the files are served from the
+    ``stalker_pyramid.file_serving_header`` and
+    ``stalker_pyramid.file_serving_prefix`` settings.
+    """
+    global offload_header
+    global offload_prefix
+
+    offload_header = settings.get('stalker_pyramid.file_serving_header') \
+        or None
+    offload_prefix = settings.get(
+        'stalker_pyramid.file_serving_prefix', offload_prefix
+    )
+
+    if offload_header not in (None, 'X-Accel-Redirect', 'X-Sendfile'):
+        raise ValueError(
+            'stalker_pyramid.file_serving_header should be X-Accel-Redirect '
+            'or X-Sendfile, not %s' % offload_header
+        )
+
+
+class RangeFileIter(object):
+    """Iterates over the bytes of a file from start to stop in blocks.
+
+    Used as the app_iter of the file responses, WebOb calls app_iter_range()
+    for the range requests.
+
+    :param file: A file object.
+    :param start: The offset of the first byte.
+    :param stop: The offset after the last byte, None for the end of the
+      file.
+    """
+
+    def __init__(self, file, start=0, stop=None):
+        self.file = file
+        self.file.seek(start)
+        self.remaining = None if stop is None else stop - start
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        size = block_size
+        if self.remaining is not None:
+            size = min(size, self.remaining)
+        data = self.file.read(size) if size > 0 else None
+        if not data:
+            raise StopIteration
+
+        if self.remaining is not None:
+            self.remaining -= len(data)
+        return data
+
+    __next__ = next
+
+    def app_iter_range(self, start, stop):
+        return RangeFileIter(self.file, start, stop)
+
+    def close(self):
+        self.file.close()
+
+
+def get_etag(file_full_path, stat):
+    """Returns the ETag of the given file. It is the sha1 of the files stored
+    by their content, the modification time and the size of the file
+    otherwise.
+    """
+    name = os.path.splitext(os.path.basename(file_full_path))[0]
+    if content_filename_re.match(name):
+        return name
+    return '%x-%x' % (int(stat.st_mtime * 1000), stat.st_size)
+
+
+def get_original_filename(link_full_path, link_id=None):
+    """Returns the original filename of the Link with the given id and path,
+    or None if there is no such Link.
+
+    :param link_full_path: The full_path of the Link.
+    :param link_id: The id of the Link. The files stored by their content
+      are shared by many Links with different original filenames, so the
+      filename of the first Link with the given path is returned only if it
+      is skipped.
+    """
+    if link_id is None:
+        return filename_cache.get(
+            link_full_path,
+            lambda: queries.execute(
+                'get_path_original_filename',
+                full_path=link_full_path
+            ).scalar()
+        )
+
+    return filename_cache.get(
+        (link_full_path, link_id),
+        lambda: queries.execute(
+            'get_link_original_filename',
+            link_id=link_id,
+            full_path=link_full_path
+        ).scalar()
+    )
+
+
+def get_content_disposition(filename):
+    """Returns the Content-Disposition header to download the file with the
+    given filename.
+    """
+    if not isinstance(filename, unicode):
+        filename = filename.decode('utf-8', 'replace')
+
+    ascii_filename = filename.encode('ascii', 'replace')\
+        .replace('"', '').replace('\\', '')
+    return str(
+        'attachment; filename="%s"; filename*=UTF-8\'\'%s' % (
+            ascii_filename,
+            urllib.quote(filename.encode('utf-8'))
+        )
+    )
+
+
+def make_file_response(request, file_full_path, content_type=None,
+                       filename=None):
+    """Returns a response serving the given file.
+
+    :param request: The request.
+    :param file_full_path: The path of the file.
+    :param content_type: The content type, guessed from the file extension if
+      skipped.
+    :param filename: The filename to download the file with, the file is
+      shown in the browser if skipped.
+    :raises OSError: If there is no such file.
+    """
+    stat = os.stat(file_full_path)
+
+    if content_type is None:
+        content_type = mimetypes.guess_type(file_full_path, strict=False)[0] \
+            or 'application/octet-stream'
+
+    if offload_header is None:
+        response = Response(
+            content_type=str(content_type),
+            conditional_response=True
+        )
+        response.app_iter = RangeFileIter(open(file_full_path, 'rb'))
+        response.content_length = stat.st_size
+    else:
+        response = Response(content_type=str(content_type))
+        if offload_header == 'X-Accel-Redirect':
+            relative_path = os.path.relpath(
+                file_full_path, defaults.server_side_storage_path
+            )
+            response.headers[offload_header] = str(
+                offload_prefix + urllib.quote(relative_path)
+            )
+        else:
+            response.headers[offload_header] = str(file_full_path)
+
+    etag = get_etag(file_full_path, stat)
+    response.etag = etag
+    response.last_modified = stat.st_mtime
+    response.accept_ranges = 'bytes'
+
+    if content_filename_re.match(etag):
+        # the content of the file never changes
+        response.headers['Cache-Control'] = \
+            'public, max-age=31536000, immutable'
+
+    if filename:
+        response.headers['Content-Disposition'] = \
+            get_content_disposition(filename)
+
+    return response
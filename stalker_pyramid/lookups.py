@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+# Stalker Pyramid a Web Base Production Asset Management System
+# Copyright (C) 2009-2014 Erkan Ozgur Yilmaz
+#
+# This file is part of Stalker Pyramid.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation;
+# version 2.1 of the License.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+"""Lookups of the reference data.
+
+The Statuses, StatusLists and Types are a handful of rows which are looked
+up again and again by the views (the NEW, RTS and CMPL statuses while
+updating the task statuses, the StatusList of a Project while creating
+one etc.). They are loaded once in to the memory of the process and the
+views get them from here without any query::
+
+  from stalker_pyramid import lookups
+
+  status_new = lookups.get_status('NEW')
+  status_list = lookups.get_status_list('Project')
+  vacation_types = lookups.get_types('Vacation')
+
+The returned instances are merged in to the current session, so they can be
+used just like the instances queried from the database. The lookups are
+reloaded when a Status, StatusList or Type is changed through the ORM in this
+process and also every ten minutes to pick up the changes done by the other
+processes.
+
+The lookups are loaded with a separate session, so they only contain the
+committed data. Query the database if you need an instance created in the
+current transaction.
+"""
+from sqlalchemy.orm import Session, joinedload
+
+from stalker import Status, StatusList, Type
+from stalker.db import DBSession
+
+from stalker_pyramid.cache import TTLCache
+
+
+lookup_cache = TTLCache(ttl=600, invalidated_by=[Status, StatusList, Type])
+
+
+def query_lookups():
+    """Queries all the Statuses, StatusLists and Types with a separate
+    session and returns them in dictionaries. The session is closed without
+    expiring the instances, so they keep their loaded data.
+    """
+    session = Session(bind=DBSession.get_bind())
+    try:
+        statuses = session.query(Status).order_by(Status.id).all()
+        status_lists = session.query(StatusList)\
+            .options(joinedload(StatusList.statuses))\
+            .order_by(StatusList.id).all()
+        types = session.query(Type).order_by(Type.id).all()
+    finally:
+        session.close()
+
+    lookups = {
+        'statuses': {},
+        'statuses_by_id': {},
+        'status_lists': {},
+        'types': {},
+        'types_by_entity_type': {},
+    }
+
+    for status in statuses:
+        lookups['statuses'].setdefault(status.code, status)
+        lookups['statuses_by_id'][status.id] = status
+
+    for status_list in status_lists:
+        lookups['status_lists'].setdefault(
+            status_list.target_entity_type, status_list
+        )
+
+    for type_ in types:
+        lookups['types'].setdefault(
+            (type_.target_entity_type, type_.name), type_
+        )
+        lookups['types_by_entity_type'].setdefault(
+            type_.target_entity_type, []
+        ).append(type_)
+
+    return lookups
+
+
+def get_lookups():
+    """Returns the lookups, queries them if they are not loaded yet.
+    """
+    return lookup_cache.get('lookups', query_lookups)
+
+
+def load():
+    """Loads the lookups, should be called at startup after the database is
+    setup.
+    """
+    lookup_cache.invalidate()
+    get_lookups()
+
+
+def merge(instance):
+    """Merges the given instance to the current session without querying
+    the database.
+    """
+    if instance is None:
+        return None
+    return DBSession.merge(instance, load=False)
+
+
+def get_status(code):
+    """Returns the Status with the given code.
+
+    :param str code: The code of the Status, like 'NEW' or 'WIP'.
+    :return: stalker.models.status.Status or None
+    """
+    return merge(get_lookups()['statuses'].get(code))
+
+
+def get_statuses(codes):
+    """Returns the Statuses with the given codes in the given order, the
+    unknown codes are skipped.
+
+    :param codes: A list of Status codes.
+    :return: A list of stalker.models.status.Status instances.
+    """
+    statuses = get_lookups()['statuses']
+    return [merge(statuses[code]) for code in codes if code in statuses]
+
+
+def get_status_by_id(status_id):
+    """Returns the Status with the given id.
+
+    :param status_id: The id of the Status, can be a string.
+    :return: stalker.models.status.Status or None
+    """
+    try:
+        status_id = int(status_id)
+    except (TypeError, ValueError):
+        return None
+    return merge(get_lookups()['statuses_by_id'].get(status_id))
+
+
+def get_status_list(target_entity_type):
+    """Returns the StatusList of the given entity type.
+
+    :param str target_entity_type: The entity type, like 'Project'.
+    :return: stalker.models.status.StatusList or None
+    """
+    return merge(get_lookups()['status_lists'].get(target_entity_type))
+
+
+def get_type(name, target_entity_type):
+    """Returns the Type with the given name and target entity type.
+
+    :param str name: The name of the Type.
+    :param str target_entity_type: The entity type, like 'Vacation'.
+    :return: stalker.models.type.Type or None
+    """
+    return merge(get_lookups()['types'].get((target_entity_type, name)))
+
+
+def get_types(target_entity_type):
+    """Returns the Types of the given target entity type.
+
+    :param str target_entity_type: The entity type, like 'Vacation'.
+    :return: A list of stalker.models.type.Type instances.
+    """
+    return [
+        merge(type_)
+        for type_ in get_lookups()['types_by_entity_type'].get(
+            target_entity_type, []
+        )
+    ]
@@ -73,6 +73,9 @@ def main(argv=sys.argv):
     db.setup(settings)
     db.init()
 
+    import stalker_pyramid.db
+    stalker_pyramid.db.init()
+
     # create statuses
     create_statuses_and_status_lists()
     create_ticket_types()
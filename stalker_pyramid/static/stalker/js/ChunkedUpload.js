@@ -0,0 +1,164 @@
+// Stalker Pyramid
+// Copyright (C) 2013 Erkan Ozgur Yilmaz
+//
+// This file is part of Stalker Pyramid.
+//
+// This library is free software; you can redistribute it and/or
+// modify it under the terms of the GNU Lesser General Public
+// License as published by the Free Software Foundation;
+// version 2.1 of the License.
+//
+// This library is distributed in the hope that it will be useful,
+// but WITHOUT ANY WARRANTY; without even the implied warranty of
+// MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+// Lesser General Public License for more details.
+//
+// You should have received a copy of the GNU Lesser General Public
+// License along with this library; if not, write to the Free Software
+// Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+try {
+    var jQuery = require('../../jquery/jquery-2.0.3.min');
+} catch (e) {}
+
+
+(function ($) {
+    'use strict';
+
+    /**
+     * Uploads a file in chunks with the resumable upload routes, a failed
+     * chunk is retried from the offset the server has
+     *
+     * @param options
+     * @constructor
+     */
+    var ChunkedUpload = function (options) {
+        options = $.extend({
+            file: null,
+            url: '/uploads/',
+            max_retries: 5,
+            retry_delay: 2000,
+            progress: function (bytes_sent, total) {}
+        }, options);
+
+        this.file = options.file;
+        this.url = options.url;
+        this.max_retries = options.max_retries;
+        this.retry_delay = options.retry_delay;
+        this.progress = options.progress;
+
+        this.upload_id = null;
+        this.chunk_size = null;
+        this.retries = 0;
+        this.deferred = $.Deferred();
+        this.xhr = null;
+        this.canceled = false;
+    };
+
+    /**
+     * Starts the upload, returns a promise resolved with the response of the
+     * finish request ({link_ids: [...], sha1: ...})
+     */
+    ChunkedUpload.prototype.start = function () {
+        var self = this;
+        $.post(this.url, {
+            filename: this.file.name,
+            size: this.file.size
+        }).done(function (data) {
+            self.upload_id = data.upload_id;
+            self.chunk_size = data.chunk_size;
+            self.send_chunk(data.offset);
+        }).fail(function (jqXHR) {
+            self.deferred.reject(jqXHR.responseText);
+        });
+        return this.deferred.promise();
+    };
+
+    /**
+     * Cancels the upload, named like XMLHttpRequest.abort() as Dropzone
+     * calls it to cancel the uploads
+     */
+    ChunkedUpload.prototype.abort = function () {
+        this.canceled = true;
+        if (this.xhr) {
+            this.xhr.abort();
+        }
+    };
+
+    /**
+     * Sends the chunk starting from the given offset
+     */
+    ChunkedUpload.prototype.send_chunk = function (offset) {
+        var self = this;
+        if (this.canceled) {
+            return;
+        }
+        if (offset >= this.file.size) {
+            this.finish();
+            return;
+        }
+
+        var end = Math.min(offset + this.chunk_size, this.file.size);
+        this.xhr = $.ajax({
+            url: this.url + this.upload_id + '/chunk?offset=' + offset,
+            type: 'POST',
+            data: this.file.slice(offset, end),
+            processData: false,
+            contentType: 'application/octet-stream',
+            xhr: function () {
+                var xhr = $.ajaxSettings.xhr();
+                if (xhr.upload) {
+                    xhr.upload.addEventListener('progress', function (e) {
+                        self.progress(offset + e.loaded, self.file.size);
+                    });
+                }
+                return xhr;
+            }
+        }).done(function (data) {
+            self.retries = 0;
+            self.progress(data.offset, self.file.size);
+            self.send_chunk(data.offset);
+        }).fail(function () {
+            self.retry();
+        });
+    };
+
+    /**
+     * Asks the offset of the upload to the server and continues from there
+     */
+    ChunkedUpload.prototype.retry = function () {
+        var self = this;
+        if (this.canceled) {
+            return;
+        }
+        this.retries += 1;
+        if (this.retries > this.max_retries) {
+            this.deferred.reject('Upload failed: ' + this.file.name);
+            return;
+        }
+        setTimeout(function () {
+            $.getJSON(self.url + self.upload_id + '/').done(function (data) {
+                self.send_chunk(data.offset);
+            }).fail(function () {
+                self.retry();
+            });
+        }, this.retry_delay * this.retries);
+    };
+
+    /**
+     * Finishes the upload and resolves the promise with the link ids
+     */
+    ChunkedUpload.prototype.finish = function () {
+        var self = this;
+        $.post(
+            this.url + this.upload_id + '/finish'
+        ).done(function (data) {
+            self.deferred.resolve(data);
+        }).fail(function (jqXHR) {
+            self.deferred.reject(jqXHR.responseText);
+        });
+    };
+
+    window.ChunkedUpload = ChunkedUpload;
+
+}(jQuery));
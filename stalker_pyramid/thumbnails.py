@@ -0,0 +1,448 @@
+# -*- coding: utf-8 -*-
+# Stalker Pyramid a Web Base Production Asset Management System
+# Copyright (C) 2009-2014 Erkan Ozgur Yilmaz
+#
+# This file is part of Stalker Pyramid.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation;
+# version 2.1 of the License.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+"""Thumbnails of the uploaded files.
+
+Resizing a full resolution image takes a lot of time, so the views don't
+resize the uploaded images themselves::
+
+  from stalker_pyramid import thumbnails
+
+  thumbnails.create_thumbnail(link, created_by=logged_in_user)
+  thumbnails.resize(link, created_by=logged_in_user)
+
+These add a job to the "Thumbnail_Jobs" table (see
+:mod:`stalker_pyramid.db.thumbnail_jobs`) in the current transaction and
+return immediately. The jobs are run by a :class:`.ThumbnailWorker`, which
+is a thread claiming the jobs from the table and resizing the images in a
+pool of processes. The thumbnail Link is created and assigned to the Link
+when its job is done, the ``get_thumbnail_jobs`` view returns the state of
+the jobs so the pages can poll it.
+
+The worker is started by :func:`.start` with the number of processes given
+with the ``stalker_pyramid.thumbnail_workers`` setting (2 by default). It is
+only started for PostgreSQL databases and if the setting is not 0, otherwise
+the images are resized right away in the request as before.
+"""
+import os
+import logging
+import threading
+import multiprocessing
+
+import transaction
+from PIL import Image
+from sqlalchemy.orm import Session
+
+from stalker import Link
+from stalker.db import DBSession
+
+from stalker_pyramid.db import queries
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.WARNING)
+
+
+# the size of the thumbnails
+thumbnail_size = (512, 512)
+
+# the worker of this process
+worker = None
+
+# the settings the worker is started with
+worker_settings = {}
+
+
+def resize_image(source_path, target_path, keep_gifs=False):
+    """Resizes the given image to fit in to the thumbnail size and saves it
+    to the target path. Runs in the worker processes.
+
+    :param str source_path: The path of the image.
+    :param str target_path: The path of the resized image.
+    :param bool keep_gifs: Don't resize the GIF images to keep their
+      animation.
+    :return: True if the resized image is saved.
+    """
+    img = Image.open(source_path)
+    image_format = img.format
+    if keep_gifs and image_format == 'GIF':
+        return False
+
+    img.thumbnail((thumbnail_size[0] * 2, thumbnail_size[1] * 2))
+    img.thumbnail(thumbnail_size, Image.ANTIALIAS)
+
+    target_dir = os.path.dirname(target_path)
+    if not os.path.exists(target_dir):
+        try:
+            os.makedirs(target_dir)
+        except OSError:  # created by another process
+            pass
+
+    # write down to a temp file first, so the image is never served half
+    # written
+    temp_path = target_path + '~'
+    try:
+        img.save(temp_path, image_format)
+        os.rename(temp_path, target_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return True
+
+
+def get_file_path(link_full_path):
+    """Returns the path of the file of the given link path.
+    """
+    from stalker_pyramid.views.link import convert_file_link_to_full_path
+    return convert_file_link_to_full_path(link_full_path)
+
+
+def get_thumbnail_paths(link_full_path, link_original_filename):
+    """Returns the path of the file of the given link, a temp file path to
+    save the resized image to and the original filename of a thumbnail for
+    it.
+    """
+    from stalker_pyramid.views.link import generate_temp_file_path
+
+    file_full_path = get_file_path(link_full_path)
+    extension = os.path.splitext(file_full_path)[-1]
+
+    original_filename, original_extension = \
+        os.path.splitext(link_original_filename or '')
+
+    return (
+        file_full_path,
+        generate_temp_file_path(extension),
+        original_filename + '_t' + original_extension
+    )
+
+
+def store_resized_image(link, resized_full_path, thumbnail_filename,
+                        created_by_id=None, connection=None):
+    """Stores the resized image of the given link (see
+    :func:`stalker_pyramid.views.link.store_file`) and creates a thumbnail
+    Link for it. For the resize jobs the Link itself is updated to use the
+    resized image, as the stored files are shared by the Links with the same
+    content and can not be changed in place.
+
+    :param link: The Link.
+    :param resized_full_path: The path of the resized image.
+    :param thumbnail_filename: The original filename of the thumbnail, None
+      for the resize jobs.
+    :param created_by_id: The id of the User creating the thumbnail.
+    :param connection: The connection of the transaction.
+    :return: The link path of the previous file of a resized Link, to be
+      removed if it is not used anymore.
+    """
+    from stalker_pyramid.views.link import store_file
+
+    extension = os.path.splitext(resized_full_path)[-1]
+    file_full_path, link_full_path = \
+        store_file(resized_full_path, extension, connection=connection)
+
+    if thumbnail_filename is None:
+        previous_link_full_path = link.full_path
+        link.full_path = link_full_path
+        if previous_link_full_path != link_full_path:
+            return previous_link_full_path
+    else:
+        thumbnail_link = Link(
+            full_path=link_full_path,
+            original_filename=thumbnail_filename
+        )
+        thumbnail_link.created_by_id = created_by_id
+        link.thumbnail = thumbnail_link
+
+
+class ThumbnailWorker(object):
+    """Runs the thumbnail jobs in a pool of processes.
+
+    :param processes: The number of the processes.
+    :param poll_interval: The seconds to wait before checking the table
+      again when there are no jobs. The worker is woken up immediately when a
+      job is added in this process.
+    :param timeout: The seconds a job can run, a running job is claimed again
+      after that.
+    :param max_attempts: The number of times a job is tried before it is
+      marked as failed.
+    """
+
+    def __init__(self, processes=2, poll_interval=5, timeout=600,
+                 max_attempts=3):
+        self.processes = processes
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.pool = None
+        self.thread = None
+        self.pid = None
+        self.wake_event = threading.Event()
+
+    def start(self):
+        """Starts the process pool and the thread claiming the jobs.
+        """
+        # the pool is created before the thread, so the processes are not
+        # forked while the thread is running
+        self.pool = multiprocessing.Pool(self.processes)
+        self.pid = os.getpid()
+        self.thread = threading.Thread(
+            target=self.run,
+            name='ThumbnailWorker'
+        )
+        self.thread.daemon = True
+        self.thread.start()
+
+    def wake(self):
+        """Wakes the worker up to check the new jobs.
+        """
+        self.wake_event.set()
+
+    def run(self):
+        """Runs the jobs until the process ends.
+        """
+        while True:
+            # cleared before claiming, so the jobs added while running the
+            # others are not missed
+            self.wake_event.clear()
+            try:
+                job_count = self.run_jobs()
+            except Exception:
+                logger.exception('thumbnail jobs could not be run')
+                job_count = 0
+
+            if not job_count:
+                self.wake_event.wait(self.poll_interval)
+
+    def run_jobs(self):
+        """Claims as many jobs as the processes and runs them.
+
+        :return: The number of the jobs run.
+        """
+        engine = DBSession.get_bind()
+        with engine.begin() as connection:
+            queries.bind(
+                'fail_stale_thumbnail_jobs',
+                timeout=self.timeout,
+                max_attempts=self.max_attempts
+            ).execute(connection=connection)
+            jobs = queries.bind(
+                'claim_thumbnail_jobs',
+                timeout=self.timeout,
+                max_attempts=self.max_attempts,
+                limit=self.processes
+            ).execute(connection=connection).fetchall()
+
+        results = []
+        for job in jobs:
+            job_id, link_id, kind, created_by_id, attempts, \
+                link_full_path, link_original_filename = job
+            try:
+                file_full_path, resized_full_path, thumbnail_filename = \
+                    get_thumbnail_paths(link_full_path, link_original_filename)
+                if kind == 'resize':
+                    thumbnail_filename = None
+                result = self.pool.apply_async(
+                    resize_image,
+                    (file_full_path, resized_full_path, kind == 'resize')
+                )
+            except Exception as e:
+                self.fail_job(job_id, e)
+                continue
+            results.append((job_id, link_id, created_by_id, resized_full_path,
+                            thumbnail_filename, result))
+
+        for job_id, link_id, created_by_id, resized_full_path, \
+                thumbnail_filename, result in results:
+            try:
+                resized = result.get(self.timeout)
+            except Exception as e:
+                logger.warning('thumbnail job %s failed: %s' % (job_id, e))
+                self.fail_job(job_id, e)
+            else:
+                self.finish_job(
+                    job_id, link_id, created_by_id,
+                    resized_full_path if resized else None,
+                    thumbnail_filename
+                )
+
+        return len(jobs)
+
+    def finish_job(self, job_id, link_id, created_by_id, resized_full_path,
+                   thumbnail_filename):
+        """Stores the resized image, creates the thumbnail Link and assigns
+        it to the Link (or updates the Link for the resize jobs) and marks
+        the job as done in one transaction.
+
+        :param resized_full_path: The path of the resized image, None if the
+          image is not resized.
+        :param thumbnail_filename: The original filename of the thumbnail,
+          None for the resize jobs.
+        """
+        from stalker_pyramid.views.link import remove_unused_files
+
+        session = Session(bind=DBSession.get_bind())
+        previous_link_full_path = None
+        try:
+            link = session.query(Link).get(link_id)
+            if link is not None and resized_full_path is not None:
+                previous_link_full_path = store_resized_image(
+                    link,
+                    resized_full_path,
+                    thumbnail_filename,
+                    created_by_id,
+                    session.connection()
+                )
+                session.flush()
+
+            queries.bind(
+                'finish_thumbnail_job',
+                job_id=job_id
+            ).execute(connection=session.connection())
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            logger.exception('thumbnail job %s could not be finished' % job_id)
+            self.fail_job(job_id, e)
+        else:
+            if previous_link_full_path:
+                remove_unused_files(True, [previous_link_full_path])
+        finally:
+            session.close()
+            if resized_full_path and os.path.exists(resized_full_path):
+                os.remove(resized_full_path)
+
+    def fail_job(self, job_id, error):
+        """Queues the job again or marks it as failed if it is out of
+        attempts.
+        """
+        engine = DBSession.get_bind()
+        with engine.begin() as connection:
+            queries.bind(
+                'fail_thumbnail_job',
+                job_id=job_id,
+                max_attempts=self.max_attempts,
+                error='%s' % error
+            ).execute(connection=connection)
+
+
+def start(settings):
+    """Starts the worker of this process with the given settings.
+
+    :param settings: The settings of the application.
+    """
+    global worker
+    global worker_settings
+
+    worker_settings = settings
+    processes = int(settings.get('stalker_pyramid.thumbnail_workers', 2))
+    if not processes:
+        return
+
+    dialect_name = DBSession.get_bind().dialect.name
+    if dialect_name != 'postgresql':
+        logger.warning(
+            'thumbnails are created in the requests for %s' % dialect_name
+        )
+        return
+
+    worker = ThumbnailWorker(processes=processes)
+    worker.start()
+
+
+def get_worker():
+    """Returns the worker of this process, starts a new one if this process
+    is forked after the worker is started. Returns None if the thumbnails are
+    created in the requests.
+    """
+    if worker is not None and worker.pid != os.getpid():
+        start(worker_settings)
+    return worker
+
+
+def wake_worker(success):
+    """Wakes the worker up after the jobs are committed.
+    """
+    if success and worker is not None:
+        worker.wake()
+
+
+def enqueue(link, kind, created_by=None):
+    """Adds a job for the given link in the current transaction.
+    """
+    # the link needs an id
+    DBSession.flush()
+
+    queries.execute(
+        'insert_thumbnail_job',
+        link_id=link.id,
+        kind=kind,
+        created_by_id=created_by.id if created_by else None
+    )
+    transaction.get().addAfterCommitHook(wake_worker)
+
+
+def create_thumbnail(link, created_by=None):
+    """Creates a thumbnail for the given link. The thumbnail is created by the
+    worker if there is one, otherwise it is created right away.
+
+    :param link: The Link.
+    :param created_by: The User creating the thumbnail.
+    :return: The thumbnail Link or None if it is going to be created by the
+      worker.
+    """
+    if get_worker() is not None:
+        enqueue(link, 'thumbnail', created_by)
+        return None
+
+    file_full_path, resized_full_path, thumbnail_filename = \
+        get_thumbnail_paths(link.full_path, link.original_filename)
+    resize_image(file_full_path, resized_full_path)
+    store_resized_image(
+        link,
+        resized_full_path,
+        thumbnail_filename,
+        created_by.id if created_by else None
+    )
+    DBSession.add(link.thumbnail)
+    return link.thumbnail
+
+
+def resize(link, created_by=None):
+    """Resizes the file of the given link, so it can be used as a thumbnail.
+    The file is resized by the worker if there is one, otherwise it is
+    resized right away.
+    """
+    from stalker_pyramid.views.link import remove_unused_files
+
+    if get_worker() is not None:
+        enqueue(link, 'resize', created_by)
+        return
+
+    file_full_path, resized_full_path, thumbnail_filename = \
+        get_thumbnail_paths(link.full_path, link.original_filename)
+    if not resize_image(file_full_path, resized_full_path, keep_gifs=True):
+        return
+
+    previous_link_full_path = store_resized_image(
+        link, resized_full_path, None
+    )
+    if previous_link_full_path:
+        transaction.get().addAfterCommitHook(
+            remove_unused_files, args=([previous_link_full_path],)
+        )
@@ -0,0 +1,334 @@
+# -*- coding: utf-8 -*-
+# Stalker Pyramid a Web Base Production Asset Management System
+# Copyright (C) 2009-2014 Erkan Ozgur Yilmaz
+#
+# This file is part of Stalker Pyramid.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation;
+# version 2.1 of the License.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+"""Resumable uploads.
+
+Big files are uploaded in chunks, so an upload doesn't hold a request for
+minutes and a dropped connection doesn't mean starting over::
+
+  POST uploads/                        filename=plate.exr&size=4294967296
+  -> {"upload_id": "6f1c...", "offset": 0, "chunk_size": 8388608, ...}
+
+  POST uploads/6f1c.../chunk?offset=0  (the bytes of the chunk as the body)
+  -> {"upload_id": "6f1c...", "offset": 8388608, "progress": 0.19, ...}
+
+  GET uploads/6f1c.../                 (the offset to continue from)
+
+  POST uploads/6f1c.../finish          sha1=... (optional, to verify)
+  -> {"link_ids": [23], "sha1": "..."}
+
+An :class:`.Upload` is kept in the uploads directory of the server side
+storage as two files, the info of the upload as json and the bytes uploaded
+so far, so it can be continued from any process and after a restart. The
+offset of an upload is the size of its file. The file is hashed while the
+chunks are written, the hash is kept in the memory of the process and it is
+calculated again from the file only if the next chunk comes to another
+process.
+"""
+import os
+import re
+import json
+import time
+import uuid
+import fcntl
+import hashlib
+import logging
+import threading
+
+from stalker import defaults
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.WARNING)
+
+
+# the size of the chunks the clients are asked to send
+chunk_size = 8 * 1024 * 1024
+
+# the size of the blocks read from the request and the files
+block_size = 2 << 16
+
+# the seconds an unfinished upload is kept
+max_age = 7 * 24 * 60 * 60
+
+# the hashes of the uploads written in this process, upload id -> (offset,
+# hash)
+hashes = {}
+hashes_lock = threading.Lock()
+
+upload_id_re = re.compile('^[0-9a-f]{32}$')
+
+
+def get_uploads_path():
+    """Returns the path of the uploads directory.
+    """
+    return os.path.join(defaults.server_side_storage_path, 'uploads')
+
+
+class Upload(object):
+    """An upload in progress.
+
+    :param upload_id: The id of the upload.
+    :param filename: The original filename of the uploaded file.
+    :param size: The size of the file in bytes.
+    :param created_by_id: The id of the User uploading the file.
+    :param date_created: The time the upload started (in seconds since
+      epoch).
+    """
+
+    def __init__(self, upload_id, filename, size, created_by_id=None,
+                 date_created=None):
+        self.upload_id = upload_id
+        self.filename = filename
+        self.size = size
+        self.created_by_id = created_by_id
+        self.date_created = date_created or time.time()
+
+    @property
+    def info_path(self):
+        return os.path.join(get_uploads_path(), self.upload_id + '.json')
+
+    @property
+    def file_path(self):
+        return os.path.join(get_uploads_path(), self.upload_id + '.part')
+
+    @property
+    def offset(self):
+        """The number of bytes uploaded so far.
+        """
+        try:
+            return os.path.getsize(self.file_path)
+        except OSError:
+            return 0
+
+    @classmethod
+    def create(cls, filename, size, created_by_id=None):
+        """Starts a new upload.
+        """
+        size = int(size)
+        if size < 0:
+            raise ValueError('The size should be a positive integer')
+        if not filename:
+            raise ValueError('The filename should not be empty')
+
+        remove_stale_uploads()
+
+        upload = cls(uuid.uuid4().hex, filename, size, created_by_id)
+        uploads_path = get_uploads_path()
+        if not os.path.exists(uploads_path):
+            try:
+                os.makedirs(uploads_path)
+            except OSError:  # created by another process
+                pass
+
+        open(upload.file_path, 'wb').close()
+        with open(upload.info_path, 'w') as f:
+            json.dump(
+                {
+                    'filename': upload.filename,
+                    'size': upload.size,
+                    'created_by_id': upload.created_by_id,
+                    'date_created': upload.date_created
+                },
+                f
+            )
+        return upload
+
+    @classmethod
+    def get(cls, upload_id):
+        """Returns the upload with the given id or None if there is no such
+        upload.
+        """
+        if not upload_id_re.match(upload_id or ''):
+            return None
+
+        info_path = os.path.join(get_uploads_path(), upload_id + '.json')
+        try:
+            with open(info_path) as f:
+                info = json.load(f)
+        except (IOError, ValueError):
+            return None
+
+        return cls(
+            upload_id,
+            info['filename'],
+            info['size'],
+            info.get('created_by_id'),
+            info.get('date_created')
+        )
+
+    def to_dict(self):
+        """Returns the state of the upload as a dictionary.
+        """
+        offset = self.offset
+        return {
+            'upload_id': self.upload_id,
+            'filename': self.filename,
+            'size': self.size,
+            'offset': offset,
+            'progress': float(offset) / self.size if self.size else 1.0,
+            'chunk_size': chunk_size
+        }
+
+    def get_hash(self, f, offset):
+        """Returns the hash of the first offset bytes of the given file.
+        """
+        with hashes_lock:
+            hash_offset, sha1 = hashes.pop(self.upload_id, (None, None))
+
+        if hash_offset != offset:
+            # the previous chunks are written by another process
+            sha1 = hashlib.sha1()
+            f.seek(0)
+            remaining = offset
+            while remaining:
+                data = f.read(min(block_size, remaining))
+                if not data:
+                    break
+                sha1.update(data)
+                remaining -= len(data)
+        return sha1
+
+    def write(self, offset, input_file, length):
+        """Writes a chunk read from the given file at the given offset.
+
+        The offset should be the offset of the upload, so the chunks are
+        written in order. If the input ends before the given length, the
+        bytes read so far are kept and the upload can be continued from the
+        new offset.
+
+        :param offset: The offset of the chunk.
+        :param input_file: A file like object to read the chunk from.
+        :param length: The length of the chunk.
+        :return: The new offset.
+        """
+        offset = int(offset)
+        length = int(length)
+        if offset + length > self.size:
+            raise ValueError(
+                'The chunk exceeds the size of the upload: %s' % self.size
+            )
+
+        with open(self.file_path, 'r+b') as f:
+            # only one request writes to an upload at a time
+            fcntl.flock(f, fcntl.LOCK_EX)
+
+            f.seek(0, os.SEEK_END)
+            current_offset = f.tell()
+            if offset != current_offset:
+                raise ValueError(
+                    'The upload continues from offset %s not %s' %
+                    (current_offset, offset)
+                )
+
+            sha1 = self.get_hash(f, offset)
+            f.seek(offset)
+            remaining = length
+            try:
+                while remaining:
+                    data = input_file.read(min(block_size, remaining))
+                    if not data:
+                        break
+                    f.write(data)
+                    sha1.update(data)
+                    remaining -= len(data)
+            finally:
+                f.flush()
+                with hashes_lock:
+                    hashes[self.upload_id] = (f.tell(), sha1)
+
+        return offset + length - remaining
+
+    def finish(self, expected_sha1=None):
+        """Checks if the whole file is uploaded and moves it to its place in
+        the server side storage (or removes it if the same file is already
+        there).
+
+        :param expected_sha1: The sha1 of the file calculated by the client,
+          the upload is removed if it doesn't match.
+        :return: The file path and the link path of the file and its sha1.
+        """
+        # imported here to avoid a circular import
+        from stalker_pyramid.views.link import store_file
+
+        with open(self.file_path, 'r+b') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+
+            f.seek(0, os.SEEK_END)
+            offset = f.tell()
+            if offset != self.size:
+                raise ValueError(
+                    'The upload is not complete, %s of %s bytes are '
+                    'uploaded' % (offset, self.size)
+                )
+
+            sha1 = self.get_hash(f, offset).hexdigest()
+            if expected_sha1 and expected_sha1.lower() != sha1:
+                self.remove()
+                raise ValueError(
+                    'The uploaded file is corrupted, its sha1 is %s not %s' %
+                    (sha1, expected_sha1)
+                )
+
+            extension = os.path.splitext(self.filename)[1]
+            file_full_path, link_full_path = \
+                store_file(self.file_path, extension, sha1)
+
+        self.remove()
+        return file_full_path, link_full_path, sha1
+
+    def remove(self):
+        """Removes the files of the upload.
+        """
+        with hashes_lock:
+            hashes.pop(self.upload_id, None)
+
+        for path in [self.file_path, self.info_path]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def remove_stale_uploads():
+    """Removes the uploads which are not continued for max_age seconds.
+    """
+    uploads_path = get_uploads_path()
+    if not os.path.exists(uploads_path):
+        return
+
+    stale_time = time.time() - max_age
+    for filename in os.listdir(uploads_path):
+        upload_id, extension = os.path.splitext(filename)
+        if extension != '.json':
+            continue
+
+        upload = Upload(upload_id, None, 0)
+        try:
+            last_modified = max(
+                os.path.getmtime(path)
+                for path in [upload.info_path, upload.file_path]
+                if os.path.exists(path)
+            )
+        except (OSError, ValueError):
+            continue
+
+        if last_modified < stale_time:
+            logger.warning('removing stale upload: %s' % upload_id)
+            upload.remove()
@@ -18,19 +18,28 @@
 # License along with this library; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
 
+import re
+import json
 import logging
 import calendar
 import datetime
+import decimal
+import urllib
 
 from pyramid.httpexceptions import HTTPServerError, HTTPForbidden
 from pyramid.view import view_config
 from pyramid.response import Response
-from pyramid.security import has_permission, authenticated_userid
+from pyramid.security import (has_permission, authenticated_userid,
+                              effective_principals, Allow)
 
-from stalker import log, User, Tag
+from stalker import log, User, Group, Permission, Tag, Studio, Project
+from stalker.models.auth import RootFactory as StalkerRootFactory
 from stalker.db import DBSession
 import transaction
 
+from stalker_pyramid.cache import TTLCache
+from stalker_pyramid.db import queries
+
 
 logger = logging.getLogger(__name__)
 logger.setLevel(log.logging_level)
@@ -154,16 +163,102 @@ class StdErrToHTMLConverter():
         return str_buffer
 
 
+# the ACL of the root factory, both as it is and compiled
+acl_cache = TTLCache(ttl=60, invalidated_by=[User, Group, Permission])
+
+
+def get_root_acl():
+    """Returns the ACL of the root factory, which is composed from all the
+    users, groups and permissions. The result is cached for a minute or until
+    a User, Group or Permission is changed.
+    """
+    return acl_cache.get(
+        'acl',
+        lambda: StalkerRootFactory(None).__acl__
+    )
+
+
+def compile_acl(acl):
+    """Compiles the given ACL to a dictionary of dictionaries in
+    ``{principal: {permission: (position, allowed)}}`` format, where the
+    position is the index of the first ACE granting or denying that
+    permission to that principal. So the ACE that
+    ``ACLAuthorizationPolicy`` would pick for a set of principals is the one
+    with the lowest position.
+
+    :param acl: A list of (access, principal, permissions) tuples, where the
+      permissions can be a single permission or a list of them.
+    """
+    compiled = {}
+    for position, (access, principal, permissions) in enumerate(acl):
+        if isinstance(permissions, basestring):
+            permissions = [permissions]
+        principal_permissions = compiled.setdefault(principal, {})
+        for permission in permissions:
+            if permission not in principal_permissions:
+                principal_permissions[permission] = \
+                    (position, access == Allow)
+    return compiled
+
+
+def get_compiled_root_acl():
+    """Returns the compiled ACL of the root factory, see
+    :func:`.compile_acl`.
+    """
+    return acl_cache.get(
+        'compiled_acl',
+        lambda: compile_acl(get_root_acl())
+    )
+
+
+class RootFactory(StalkerRootFactory):
+    """The root factory of Stalker with a cached ACL.
+    """
+
+    @property
+    def __acl__(self):
+        return get_root_acl()
+
+
 class PermissionChecker(object):
-    """Helper class for permission check
+    """Helper class for permission check.
+
+    The permissions are checked against the compiled root ACL and the results
+    are memoized per request, so checking the same permission again and
+    again in a template is cheap.
     """
 
     def __init__(self, request):
         self.has_permission = has_permission
         self.request = request
+        if not hasattr(request, 'checked_permissions'):
+            request.checked_permissions = {}
+        self.checked_permissions = request.checked_permissions
+
+    def check(self, perm):
+        """checks the given permission without the memoization
+        """
+        context = self.request.context
+        if not isinstance(context, StalkerRootFactory):
+            return bool(self.has_permission(perm, context, self.request))
+
+        compiled_acl = get_compiled_root_acl()
+        matches = [
+            compiled_acl[principal][perm]
+            for principal in effective_principals(self.request)
+            if perm in compiled_acl.get(principal, {})
+        ]
+        if not matches:
+            return False
+        return min(matches)[1]
 
     def __call__(self, perm):
-        return self.has_permission(perm, self.request.context, self.request)
+        try:
+            return self.checked_permissions[perm]
+        except KeyError:
+            allowed = self.check(perm)
+            self.checked_permissions[perm] = allowed
+            return allowed
 
 
 def multi_permission_checker(request, permissions):
@@ -234,6 +329,36 @@ def get_date_range(request, date_range_attr):
     return start, end
 
 
+def get_time_window(request, start_attr='start', end_attr='end'):
+    """Extracts the start and end of a time window from the given request.
+
+    The values can be given as milliseconds or seconds since epoch (as sent
+    by FullCalendar 1.x) or as "YYYY-MM-DD" dates (as sent by FullCalendar
+    2.x). Missing values are returned as None.
+
+    :param request: the request instance
+    :param start_attr: the attribute name of the window start
+    :param end_attr: the attribute name of the window end
+    :return: (datetime.datetime, datetime.datetime) tuple
+    """
+    window = []
+    for attr_name in [start_attr, end_attr]:
+        value = request.params.get(attr_name)
+        if not value:
+            window.append(None)
+        elif value.isdigit():
+            value = int(value)
+            if value < 10 ** 11:
+                # seconds
+                value *= 1000
+            window.append(from_milliseconds(value))
+        else:
+            window.append(
+                datetime.datetime.strptime(value[:10], '%Y-%m-%d')
+            )
+    return tuple(window)
+
+
 def get_datetime(request, date_attr, time_attr):
     """Extracts a UTC  datetime object from the given request
     :param request: the request object
@@ -259,17 +384,182 @@ def get_datetime(request, date_attr, time_attr):
     )
 
 
+# the id, groups and ACL of the users by their login
+identity_cache = TTLCache(ttl=60, invalidated_by=[User, Group, Permission])
+
+
+def get_identity(login):
+    """Returns the id, groups and ACL of the User with the given login. The
+    result is cached for a minute or until a User, Group or Permission is
+    changed.
+
+    :param login: The login of the user
+    :return: dict with ``id``, ``groups`` (in ['Group:{group_name}'] format)
+      and ``acl`` keys or None if there is no user with the given login
+    """
+    def query_identity():
+        user = User.query.filter_by(login=login).first()
+        if not user:
+            return None
+        return {
+            'id': user.id,
+            'groups': ['Group:' + group.name for group in user.groups],
+            'acl': user.__acl__
+        }
+
+    return identity_cache.get(login, query_identity)
+
+
+def group_finder(login, request):
+    """Returns the groups of the given login in ['Group:{group_name}'] format
+    for the authentication policy. Works as the group_finder of Stalker but
+    uses the cached identity of the user.
+
+    :param login: The login of the user, both '{login}' and 'User:{login}'
+      format is accepted.
+    :param request: The Request object
+    """
+    if ':' in login:
+        login = login.split(':')[1]
+
+    identity = get_identity(login)
+    if identity:
+        return identity['groups']
+    return []
+
+
+def query_logged_in_user(request):
+    """Returns the logged in User or None. It is the reified
+    ``logged_in_user`` property of the requests, so the user is queried once
+    per request, use :func:`.get_logged_in_user` to get the user.
+
+    :param request: Request object
+    """
+    login = authenticated_userid(request)
+    if login is None:
+        return None
+
+    identity = get_identity(login)
+    if identity is None:
+        return None
+    return User.query.get(identity['id'])
+
+
 def get_logged_in_user(request):
     """Returns the logged in user
 
     :param request: Request object
     """
-    user = User.query.filter_by(login=authenticated_userid(request)).first()
+    try:
+        user = request.logged_in_user
+    except AttributeError:
+        # the request doesn't have the request properties, like the test
+        # requests
+        user = query_logged_in_user(request)
     if not user:
         raise HTTPForbidden(request)
     return user
 
 
+queries.register(
+    'get_entity_type',
+    'select entity_type from "SimpleEntities" where id = :entity_id',
+    entity_id='integer'
+)
+
+
+def get_entity_type(entity_id):
+    """Returns the entity_type of the entity with the given id without
+    loading the entity itself
+
+    :param entity_id: The id of the entity
+    :return: str or None if there is no entity with the given id
+    """
+    data = queries.execute('get_entity_type', entity_id=entity_id).fetchone()
+    return data[0] if data else None
+
+
+queries.register(
+    'get_navigation_studio',
+    """select
+        "Studios".id,
+        "SimpleEntities".name,
+        "Links".full_path
+    from "Studios"
+        join "SimpleEntities" on "Studios".id = "SimpleEntities".id
+        left outer join "Links" on "SimpleEntities".thumbnail_id = "Links".id
+    order by "Studios".id
+    limit 1
+    """
+)
+
+
+queries.register(
+    'get_navigation_projects',
+    """select
+        "Projects".id,
+        "SimpleEntities".name,
+        "Projects".code,
+        "SimpleEntities_Status".name,
+        "Statuses".code,
+        "Links".full_path
+    from "Projects"
+        join "SimpleEntities" on "Projects".id = "SimpleEntities".id
+        left outer join "Statuses" on "Projects".status_id = "Statuses".id
+        left outer join "SimpleEntities" as "SimpleEntities_Status" on "Statuses".id = "SimpleEntities_Status".id
+        left outer join "Links" on "SimpleEntities".thumbnail_id = "Links".id
+    order by "Projects".id
+    """
+)
+
+
+# the studio and projects shown in the navbar and sidebars
+navigation_cache = TTLCache(ttl=60, invalidated_by=[Studio, Project])
+
+
+def get_navigation_context():
+    """Returns a lightweight snapshot of the Studio and the Projects to be
+    used in the navbar and sidebars instead of the Studio and Project
+    instances. The result is cached for a minute or until a Studio or
+    Project is created, updated or deleted.
+
+    :return: dict with ``studio`` and ``projects`` keys, the studio is a
+      dict with ``id``, ``name`` and ``thumbnail_full_path`` keys (or None if
+      there is no studio) and the projects is a list of dicts with ``id``,
+      ``name``, ``code``, ``status``, ``status_code`` and
+      ``thumbnail_full_path`` keys.
+    """
+    def query_navigation_context():
+        r = queries.execute('get_navigation_studio').fetchone()
+        studio = None
+        if r:
+            studio = {
+                'id': r[0],
+                'name': r[1],
+                'thumbnail_full_path': r[2]
+            }
+
+        result = queries.execute('get_navigation_projects')
+        projects = [
+            {
+                'id': r[0],
+                'name': r[1],
+                'code': r[2],
+                'status': r[3],
+                'status_code': r[4],
+                'thumbnail_full_path': r[5]
+            }
+            for r in result.fetchall()
+        ]
+
+        return {
+            'studio': studio,
+            'projects': projects
+        }
+
+    return navigation_cache.get('navigation', query_navigation_context)
+
+
 def get_multi_integer(request, attr_name, method='POST'):
     """Extracts multi data from request.POST
 
@@ -335,6 +625,197 @@ def get_user_os(request):
         return 'osx'
 
 
+def get_range(request):
+    """Extracts the range requested by the dojo JsonRest store from the
+    "Range: items=0-24" header (or "X-Range" header) of the given request.
+
+    :param request: Request object
+    :return: (offset, limit) tuple, limit is None if the whole data is
+      requested
+    """
+    range_header = request.headers.get('Range') or \
+        request.headers.get('X-Range') or ''
+    match = re.match(r'items=(\d+)-(\d+)', range_header.strip())
+    if not match:
+        return 0, None
+
+    first, last = int(match.group(1)), int(match.group(2))
+    return first, max(last - first + 1, 0)
+
+
+def get_order_by(request, columns, default):
+    """Extracts the sort order requested by the dojo JsonRest store which is
+    in "sort(+name,-start)" format in the query string (or in the "sort"
+    parameter) and converts it to an SQL order by clause.
+
+    :param request: Request object
+    :param columns: A dictionary that maps the sortable attribute names to
+      SQL expressions, attributes that are not in this dictionary are skipped
+      to prevent SQL injection.
+    :param default: The order by clause to be used when no sort order is
+      requested.
+    :return: str
+    """
+    sort_string = request.params.get('sort')
+    if not sort_string:
+        match = re.search(
+            r'sort\(([^)]*)\)', urllib.unquote(request.query_string)
+        )
+        if match:
+            sort_string = match.group(1)
+
+    if not sort_string:
+        return default
+
+    order_by = []
+    for attr in sort_string.split(','):
+        attr = attr.strip()
+        direction = 'asc'
+        if attr[:1] == '-':
+            direction = 'desc'
+        attr = attr.lstrip('+- ')
+        if attr in columns:
+            order_by.append('%s %s' % (columns[attr], direction))
+
+    if not order_by:
+        return default
+
+    return 'order by %s' % ', '.join(order_by)
+
+
+def get_limit_offset(offset, limit):
+    """Returns the SQL limit and offset clause for the given offset and limit
+
+    :param offset: The index of the first row
+    :param limit: The row count, None for all the rows
+    :return: str
+    """
+    if limit is None:
+        return 'offset %s' % offset
+    return 'limit %s offset %s' % (limit, offset)
+
+
+class JSONStream(object):
+    """An app_iter that runs the given raw SQL query with a server side cursor
+    and writes the rows as a JSON array batch by batch, so the memory usage
+    doesn't depend on the row count.
+
+    The query runs in its own connection, because the session connection is
+    returned back to the pool when pyramid_tm ends the transaction, which
+    happens before the WSGI server iterates the response. The connection is
+    closed when the iteration ends or when the WSGI server calls close().
+
+    :param sql_query: The raw SQL query or a
+      :class:`stalker_pyramid.db.queries.BoundQuery`.
+    :param row_converter: A callable that converts a row to a json
+      compatible object.
+    :param batch_size: The number of rows fetched from the cursor at once.
+    """
+
+    def __init__(self, sql_query, row_converter, batch_size=1000):
+        self.row_converter = row_converter
+        self.batch_size = batch_size
+        self.connection = DBSession.get_bind().connect()
+        try:
+            # execute the query right now to raise any errors in the view
+            connection = self.connection.execution_options(
+                stream_results=True
+            )
+            if hasattr(sql_query, 'execute'):
+                self.result = sql_query.execute(connection, prepare=False)
+            else:
+                self.result = connection.execute(sql_query)
+        except:
+            self.connection.close()
+            raise
+
+    def __iter__(self):
+        dumps = json.JSONEncoder(default=json_default).encode
+        row_converter = self.row_converter
+        try:
+            yield '['
+            separator = ''
+            while True:
+                rows = self.result.fetchmany(self.batch_size)
+                if not rows:
+                    break
+                yield separator + ','.join(
+                    [dumps(row_converter(r)) for r in rows]
+                )
+                separator = ','
+            yield ']'
+        finally:
+            self.close()
+
+    def close(self):
+        """closes the result and the connection
+        """
+        if not self.connection.closed:
+            self.result.close()
+            self.connection.close()
+
+
+def json_default(obj):
+    """Converts the objects that the json module can not serialize, like the
+    Decimals returned for numeric columns
+    """
+    if isinstance(obj, decimal.Decimal):
+        return float(obj)
+    if isinstance(obj, datetime.datetime):
+        return milliseconds_since_epoch(obj)
+    raise TypeError('%r is not JSON serializable' % obj)
+
+
+def stream_json(sql_query, row_converter, batch_size=1000):
+    """Returns a Response that streams the result of the given raw SQL query
+    as a JSON array. See :class:`.JSONStream` for details.
+
+    :param sql_query: The raw SQL query or a
+      :class:`stalker_pyramid.db.queries.BoundQuery`.
+    :param row_converter: A callable that converts a row to a json
+      compatible object.
+    :param batch_size: The number of rows fetched from the cursor at once.
+    :return: pyramid.response.Response
+    """
+    return Response(
+        app_iter=JSONStream(sql_query, row_converter, batch_size),
+        content_type='application/json',
+        charset='UTF-8'
+    )
+
+
+def get_total_count(rows, offset, count_query):
+    """Returns the total row count of a paged query which has a
+    ``count(*) over ()`` column as its last column, so the rows and the total
+    count are queried in one round trip.
+
+    :param rows: The rows returned by the paged query.
+    :param offset: The offset of the paged query.
+    :param count_query: A callable returning the total count, it is only
+      called when there are no rows in the requested range, because then the
+      total count can not be read from the rows.
+    :return: int
+    """
+    if rows:
+        first_row = rows[0]
+        return first_row[len(first_row) - 1]
+    if offset:
+        return count_query()
+    return 0
+
+
+def get_content_range(offset, count, total):
+    """Returns the value of the Content-Range header for the dojo JsonRest
+    store.
+
+    :param offset: The index of the first item returned
+    :param count: The count of the items returned
+    :param total: The total count of the items
+    :return: str
+    """
+    return '%s-%s/%s' % (offset, offset + count - 1, total)
+
+
 def seconds_since_epoch(dt):
     """converts the given datetime.datetime instance to an integer showing the
     seconds from epoch, and does it without using the strftime('%s') which
@@ -23,14 +23,18 @@ import datetime
 
 from pyramid.httpexceptions import HTTPOk
 from pyramid.view import view_config
-from stalker import Type, Status, Asset, Studio, Entity, Project
+from stalker import Asset, Studio, Entity, Project
 from stalker.db import DBSession
 
 import logging
 from webob import Response
 import stalker_pyramid
+from stalker_pyramid import lookups
+from stalker_pyramid.db import queries
 from stalker_pyramid.views import get_logged_in_user, PermissionChecker, \
-    milliseconds_since_epoch
+    milliseconds_since_epoch, get_range, get_order_by, get_content_range, \
+    get_total_count
+from stalker_pyramid.views.type import query_type
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -56,22 +60,11 @@ def update_asset(request):
     type_name = request.params.get('type_name')
 
     status_id = request.params.get('status_id')
-    status = Status.query.filter_by(id=status_id).first()
+    status = lookups.get_status_by_id(status_id)
 
     if asset and name and code and type_name and status:
         # get the type
-        type_ = Type.query\
-            .filter_by(target_entity_type='Asset')\
-            .filter_by(name=type_name)\
-            .first()
-
-        if type_ is None:
-            # create a new Type
-            type_ = Type(
-                name=type_name,
-                code=type_name,
-                target_entity_type='Asset'
-            )
+        type_ = query_type('Asset', type_name)
 
         # update the asset
         logger.debug('code      : %s' % code)
@@ -88,6 +81,17 @@ def update_asset(request):
     return HTTPOk()
 
 
+queries.register(
+    'get_assets_count',
+    """select count(1)
+    from "Assets"
+        join "Tasks" on "Assets".id = "Tasks".id
+    where "Tasks".project_id = :project_id
+    """,
+    project_id='integer'
+)
+
+
 @view_config(
     route_name='get_entity_assets_count',
     renderer='json',
@@ -103,13 +107,11 @@ def get_assets_count(request):
     """
     project_id = request.matchdict.get('id', -1)
 
-    sql_query = """select count(1)
-    from "Assets"
-        join "Tasks" on "Assets".id = "Tasks".id
-    where "Tasks".project_id = %s
-    """ % project_id
+    return queries.execute(
+        'get_assets_count',
+        project_id=project_id
+    ).fetchone()[0]
 
-    return DBSession.connection().execute(sql_query).fetchone()[0]
 
 @view_config(
     route_name='list_project_assets',
@@ -151,16 +153,9 @@ def list_project_assets(request):
 
 
 
-@view_config(
-    route_name='get_assets_types',
-    renderer='json'
-)
-def get_assets_types(request):
-    """returns the Asset Types
-    """
-
-
-    sql_query ="""select
+queries.register(
+    'get_assets_types',
+    """select
      "Assets_Types_SimpleEntities".id,
      "Assets_Types_SimpleEntities".name
 
@@ -174,9 +169,19 @@ def get_assets_types(request):
         "Assets_Types_SimpleEntities".id
      order by "Assets_Types_SimpleEntities".name
      """
+)
+
+
+@view_config(
+    route_name='get_assets_types',
+    renderer='json'
+)
+def get_assets_types(request):
+    """returns the Asset Types
+    """
 
 
-    result = DBSession.connection().execute(sql_query)
+    result = queries.execute('get_assets_types')
 
     return_data = [
         {
@@ -200,6 +205,26 @@ def get_assets_types(request):
     resp.content_range = content_range
     return resp
 
+
+queries.register(
+    'get_assets_type_task_types',
+    """select
+        "SimpleEntities".id as type_id,
+        "SimpleEntities".name as type_name
+    from "SimpleEntities"
+    join "SimpleEntities" as "Task_SimpleEntities" on "SimpleEntities".id = "Task_SimpleEntities".type_id
+    join "Tasks" on "Task_SimpleEntities".id = "Tasks".id
+    join "Assets" on "Tasks".parent_id = "Assets".id
+    join "SimpleEntities" as "Assets_SimpleEntities" on "Assets_SimpleEntities".id = "Assets".id
+
+    %(where_condition)s
+
+    group by "SimpleEntities".id, "SimpleEntities".name
+    order by "SimpleEntities".name""",
+    type_id='integer'
+)
+
+
 @view_config(
     route_name='get_assets_children_task_type',
     renderer='json'
@@ -217,31 +242,16 @@ def get_assets_type_task_types(request):
     logger.debug('type_id %s'% type_id)
 
 
-    sql_query = """select
-        "SimpleEntities".id as type_id,
-        "SimpleEntities".name as type_name
-    from "SimpleEntities"
-    join "SimpleEntities" as "Task_SimpleEntities" on "SimpleEntities".id = "Task_SimpleEntities".type_id
-    join "Tasks" on "Task_SimpleEntities".id = "Tasks".id
-    join "Assets" on "Tasks".parent_id = "Assets".id
-    join "SimpleEntities" as "Assets_SimpleEntities" on "Assets_SimpleEntities".id = "Assets".id
-
-    %(where_condition)s
-
-    group by "SimpleEntities".id, "SimpleEntities".name
-    order by "SimpleEntities".name"""
-
-
     where_condition = ''
 
     if type_id:
-        where_condition = 'where "Assets_SimpleEntities".type_id = %(type_id)s'%{'type_id': type_id}
-
-    sql_query = sql_query %{'where_condition':where_condition}
-
+        where_condition = 'where "Assets_SimpleEntities".type_id = :type_id'
 
-
-    result = DBSession.connection().execute(sql_query)
+    result = queries.execute(
+        'get_assets_type_task_types',
+        {'where_condition': where_condition},
+        type_id=type_id
+    )
 
     return_data = [
         {
@@ -266,28 +276,9 @@ def get_assets_type_task_types(request):
     return resp
 
 
-@view_config(
-    route_name='get_entity_assets',
-    renderer='json',
-    permission='List_Asset'
-)
-@view_config(
-    route_name='get_project_assets',
-    renderer='json',
-    permission='List_Asset'
-)
-def get_assets(request):
-    """returns all the Assets of a given Project
+queries.register(
+    'get_assets',
     """
-    logger.debug('*** get_assets method starts ***')
-
-    project_id = request.matchdict.get('id', -1)
-    asset_type_id = request.params.get('asset_type_id', None)
-
-    asset_id = request.params.get('entity_id', None)
-
-
-    sql_query = """
         select
             "Assets".id as asset_id,
             "Asset_SimpleEntities".name as asset_name,
@@ -319,7 +310,8 @@ def get_assets(request):
                             else 0
                         end)) * 100.0
                 )) as percent_complete,
-            "Assets_Types_SimpleEntities".name as asset_type_name
+            "Assets_Types_SimpleEntities".name as asset_type_name,
+            count(*) over () as total_count
         from "Tasks"
         join "Assets" on "Assets".id = "Tasks".parent_id
         join "SimpleEntities" as "Asset_SimpleEntities" on "Assets".id = "Asset_SimpleEntities".id
@@ -351,14 +343,8 @@ def get_assets(request):
         join "Statuses" as "Task_Statuses" on "Tasks".status_id = "Task_Statuses".id
         join "SimpleEntities" as "Task_Statuses_SimpleEntities" on "Task_Statuses_SimpleEntities".id = "Tasks".status_id
 
-        left outer join (
-                    select
-                        "TimeLogs".task_id,
-                        extract(epoch from sum("TimeLogs".end::timestamp AT TIME ZONE 'UTC' - "TimeLogs".start::timestamp AT TIME ZONE 'UTC')) as duration
-                    from "TimeLogs"
-                    group by task_id
-                ) as "Task_TimeLogs" on "Task_TimeLogs".task_id = "Tasks".id
-        where "Tasks".project_id = %(project_id)s  %(where_conditions)s
+        left outer join "Task_TimeLog_Durations" as "Task_TimeLogs" on "Task_TimeLogs".task_id = "Tasks".id
+        where "Tasks".project_id = :project_id %(where_conditions)s
         group by
             "Assets".id,
             "Asset_SimpleEntities".name,
@@ -367,30 +353,77 @@ def get_assets(request):
             "Distinct_Asset_Statuses".asset_status_code,
             "Distinct_Asset_Statuses".asset_status_html_class,
             "Assets_Types_SimpleEntities".name
-        order by "Asset_SimpleEntities".name
+        %(order_by)s
+        limit :limit offset :offset
+    """,
+    project_id='integer',
+    asset_type_id='integer',
+    asset_id='integer',
+    offset='integer',
+    limit='integer'
+)
 
+
+@view_config(
+    route_name='get_entity_assets',
+    renderer='json',
+    permission='List_Asset'
+)
+@view_config(
+    route_name='get_project_assets',
+    renderer='json',
+    permission='List_Asset'
+)
+def get_assets(request):
+    """returns all the Assets of a given Project
     """
+    logger.debug('*** get_assets method starts ***')
+
+    project_id = request.matchdict.get('id', -1)
+    asset_type_id = request.params.get('asset_type_id', None)
+
+    asset_id = request.params.get('entity_id', None)
+
 
     where_conditions = ''
 
     if asset_type_id:
-        where_conditions = """and "Assets_Types_SimpleEntities".id = %(asset_type_id)s""" %({'asset_type_id':asset_type_id})
+        where_conditions = 'and "Assets_Types_SimpleEntities".id = :asset_type_id'
     if asset_id:
-        where_conditions = """and "Assets".id = %(asset_id)s""" %({'asset_id':asset_id})
-
-
-    sql_query = sql_query % {'where_conditions':where_conditions, 'project_id':project_id}
+        where_conditions = 'and "Assets".id = :asset_id'
 
     update_asset_permission = \
         PermissionChecker(request)('Update_Asset')
     delete_asset_permission = \
         PermissionChecker(request)('Delete_Asset')
 
-    result = DBSession.connection().execute(sql_query)
+    offset, limit = get_range(request)
+    order_by = get_order_by(
+        request,
+        {
+            'id': '"Assets".id',
+            'name': '"Asset_SimpleEntities".name',
+            'type': '"Assets_Types_SimpleEntities".name'
+        },
+        'order by "Asset_SimpleEntities".name'
+    )
+
+    rows = queries.execute(
+        'get_assets',
+        {
+            'where_conditions': where_conditions,
+            'order_by': order_by
+        },
+        project_id=project_id,
+        asset_type_id=asset_type_id,
+        asset_id=asset_id,
+        offset=offset,
+        limit=limit
+    ).fetchall()
 
     return_data = []
 
-    for r in result.fetchall():
+    for r in rows:
         r_data = {
             'id': r[0],
             'name': r[1],
@@ -453,6 +486,28 @@ def get_assets(request):
     #     } for r in result.fetchall()
     # ]
 
+    def count_assets():
+        # the first row of the first page has the total count
+        first_rows = queries.execute(
+            'get_assets',
+            {
+                'where_conditions': where_conditions,
+                'order_by': ''
+            },
+            project_id=project_id,
+            asset_type_id=asset_type_id,
+            asset_id=asset_id,
+            offset=0,
+            limit=1
+        ).fetchall()
+        return get_total_count(first_rows, 0, None)
+
+    total_count = get_total_count(rows, offset, count_assets)
 
-
-    return return_data
+    resp = Response(
+        json_body=return_data
+    )
+    resp.content_range = get_content_range(
+        offset, len(return_data), total_count
+    )
+    return resp
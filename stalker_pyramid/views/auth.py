@@ -28,13 +28,18 @@ from sqlalchemy import or_
 import transaction
 
 import stalker_pyramid
-from stalker import (defaults, User, Department, Group, Project, Studio,
-                     Permission, EntityType)
+from stalker import (defaults, User, Department, Group, Permission,
+                     EntityType)
 from stalker.db import DBSession
+from stalker_pyramid.db import queries, resource_timeline
 from stalker_pyramid.views import (log_param, get_logged_in_user,
+                                   get_entity_type,
                                    PermissionChecker, get_multi_integer,
                                    get_tags, milliseconds_since_epoch,
-                                   StdErrToHTMLConverter)
+                                   StdErrToHTMLConverter, get_range,
+                                   get_order_by, get_content_range,
+                                   get_total_count, get_time_window,
+                                   get_navigation_context)
 
 import logging
 
@@ -221,6 +226,39 @@ def update_user(request):
     )
 
 
+# the joins and where clauses to filter the users of an entity
+user_entity_filters = {
+    'Project': """join "Project_Users" on "Users".id = "Project_Users".user_id
+    where "Project_Users".project_id = :entity_id
+    """,
+    'Department': """join "User_Departments" on "Users".id = "User_Departments".uid
+    where "User_Departments".did = :entity_id
+    """,
+    'Group': """join "User_Groups" on "Users".id = "User_Groups".uid
+    where "User_Groups".gid = :entity_id
+    """,
+    'Task': """join "Task_Resources" on "Users".id = "Task_Resources".resource_id
+    where "Task_Resources".task_id = :entity_id
+    """,
+    'User': """where "Users".id = :entity_id
+    """
+}
+
+
+queries.register(
+    'get_users_count',
+    """select
+        count("Users".id)
+    from "SimpleEntities"
+    join "Users" on "SimpleEntities".id = "Users".id
+    %(entity_filter)s
+    %(name_condition)s
+    """,
+    entity_id='integer',
+    name_filter='text'
+)
+
+
 @view_config(
     route_name='get_entity_users_count',
     renderer='json',
@@ -247,10 +285,7 @@ def get_users_count(request):
 
     entity_type = None
     if entity_id:
-        sql_query = \
-            'select entity_type from "SimpleEntities" where id=%s' % entity_id
-        data = DBSession.connection().execute(sql_query).fetchone()
-        entity_type = data[0] if data else None
+        entity_type = get_entity_type(entity_id)
 
     logger.debug('entity_id  : %s' % entity_id)
     logger.debug('entity_type: %s' % entity_type)
@@ -259,9 +294,36 @@ def get_users_count(request):
         # there is no entity_type for that entity
         return []
 
-    start = time.time()
-    sql_query = """select
-        count("Users".id)
+    entity_filter = user_entity_filters.get(entity_type, '')
+    name_filter = request.params.get('name')
+
+    return queries.execute(
+        'get_users_count',
+        {
+            'entity_filter': entity_filter,
+            'name_condition': get_user_name_condition(entity_filter,
+                                                      name_filter)
+        },
+        entity_id=entity_id,
+        name_filter='%%%s%%' % name_filter
+    ).fetchone()[0]
+
+
+queries.register(
+    'get_users',
+    """select
+        "Users".id,
+        "SimpleEntities".name,
+        "Users".login,
+        "Users".email,
+        user_departments."dep_ids",
+        user_departments."dep_names",
+        user_groups."group_ids",
+        user_groups."group_names",
+        tasks.task_count,
+        tickets.ticket_count,
+        "Links".full_path,
+        count(*) over () as total_count
     from "SimpleEntities"
     join "Users" on "SimpleEntities".id = "Users".id
     left outer join (
@@ -295,28 +357,33 @@ def get_users_count(request):
         group by owner_id, name
     ) as tickets on tickets.owner_id = "Users".id
     left outer join "Links" on "SimpleEntities".thumbnail_id = "Links".id
-    """
+    %(entity_filter)s
+    %(name_condition)s
+    %(order_by)s
+    limit :limit offset :offset
+    """,
+    entity_id='integer',
+    name_filter='text',
+    limit='integer',
+    offset='integer'
+)
+
 
-    if entity_type == "Project":
-        sql_query += """join "Project_Users" on "Users".id = "Project_Users".user_id
-        where "Project_Users".project_id = %(id)s
-        """ % {'id': entity_id}
-    elif entity_type == "Department":
-        sql_query += """join "User_Departments" on "Users".id = "User_Departments".uid
-        where "User_Departments".did = %(id)s
-        """ % {'id': entity_id}
-    elif entity_type == "Group":
-        sql_query += """join "User_Groups" on "Users".id = "User_Groups".uid
-        where "User_Groups".gid = %(id)s
-        """ % {'id': entity_id}
-    elif entity_type == "Task":
-        sql_query += """join "Task_Resources" on "Users".id = "Task_Resources".resource_id
-        where "Task_Resources".task_id = %(id)s
-        """ % {'id': entity_id}
-    elif entity_type == "User":
-        sql_query += 'where "Users".id = %s' % entity_id
-
-    return DBSession.connection().execute(sql_query).fetchone()[0]
+def get_user_name_condition(entity_filter, name_filter):
+    """Returns the condition that filters the users by their names.
+
+    :param entity_filter: The entity filter from :data:`user_entity_filters`
+      that the condition is going to be appended to.
+    :param name_filter: The part of the user names to look for, no condition
+      is returned if it is empty. The value of the ``:name_filter`` bind
+      parameter should be wrapped with "%" signs.
+    :return: str
+    """
+    if not name_filter:
+        return ''
+    return '%s "SimpleEntities".name ilike :name_filter' % (
+        'and' if entity_filter else 'where'
+    )
 
 
 @view_config(
@@ -358,10 +425,7 @@ def get_users(request):
 
 
     if entity_id:
-        sql_query = \
-            'select entity_type from "SimpleEntities" where id=%s' % entity_id
-        data = DBSession.connection().execute(sql_query).fetchone()
-        entity_type = data[0] if data else None
+        entity_type = get_entity_type(entity_id)
         delete_user_action ='/entities/%(id)s/%(entity_id)s/remove/dialog'
 
     logger.debug('entity_id  : %s' % entity_id)
@@ -371,76 +435,41 @@ def get_users(request):
         # there is no entity_type for that entity
         return []
 
-    start = time.time()
-    sql_query = """select
-        "Users".id,
-        "SimpleEntities".name,
-        "Users".login,
-        "Users".email,
-        user_departments."dep_ids",
-        user_departments."dep_names",
-        user_groups."group_ids",
-        user_groups."group_names",
-        tasks.task_count,
-        tickets.ticket_count,
-        "Links".full_path
-    from "SimpleEntities"
-    join "Users" on "SimpleEntities".id = "Users".id
-    left outer join (
-        select
-            uid,
-            array_agg(did) as dep_ids,
-            array_agg(name) as dep_names
-        from "User_Departments"
-        join "SimpleEntities" on "User_Departments".did = "SimpleEntities".id
-        group by uid
-    ) as user_departments on user_departments.uid = "Users".id
-    left outer join (
-        select
-            uid,
-            array_agg(gid) as group_ids,
-            array_agg(name) as group_names
-        from "User_Groups"
-        join "SimpleEntities" on "User_Groups".gid = "SimpleEntities".id
-        group by uid
-    ) as user_groups on user_groups.uid = "Users".id
-    left outer join (
-        select resource_id, count(task_id) as task_count from "Task_Resources" group by resource_id
-    ) as tasks on tasks.resource_id = "Users".id
-    left outer join (
-        select
-            owner_id,
-            count("Tickets".id) as ticket_count
-        from "Tickets"
-        join "SimpleEntities" on "Tickets".status_id = "SimpleEntities".id
-        where "SimpleEntities".name = 'New'
-        group by owner_id, name
-    ) as tickets on tickets.owner_id = "Users".id
-    left outer join "Links" on "SimpleEntities".thumbnail_id = "Links".id
-    """
+    entity_filter = user_entity_filters.get(entity_type, '')
+    name_filter = request.params.get('name')
+    name_condition = get_user_name_condition(entity_filter, name_filter)
 
-    if entity_type == "Project":
-        sql_query += """join "Project_Users" on "Users".id = "Project_Users".user_id
-        where "Project_Users".project_id = %(id)s
-        """ % {'id': entity_id}
-    elif entity_type == "Department":
-        sql_query += """join "User_Departments" on "Users".id = "User_Departments".uid
-        where "User_Departments".did = %(id)s
-        """ % {'id': entity_id}
-    elif entity_type == "Group":
-        sql_query += """join "User_Groups" on "Users".id = "User_Groups".uid
-        where "User_Groups".gid = %(id)s
-        """ % {'id': entity_id}
-    elif entity_type == "Task":
-        sql_query += """join "Task_Resources" on "Users".id = "Task_Resources".resource_id
-        where "Task_Resources".task_id = %(id)s
-        """ % {'id': entity_id}
-    elif entity_type == "User":
-        sql_query += 'where "Users".id = %s' % entity_id
-
-    sql_query += 'order by "SimpleEntities".name'
-
-    result = DBSession.connection().execute(sql_query)
+    offset, limit = get_range(request)
+    order_by = get_order_by(
+        request,
+        {
+            'id': '"Users".id',
+            'name': '"SimpleEntities".name',
+            'login': '"Users".login',
+            'email': '"Users".email',
+            'tasksCount': 'coalesce(tasks.task_count, 0)',
+            'ticketsCount': 'coalesce(tickets.ticket_count, 0)'
+        },
+        'order by "SimpleEntities".name'
+    )
+
+    values = {
+        'entity_id': entity_id,
+        'name_filter': '%%%s%%' % name_filter,
+        'offset': offset,
+        'limit': limit
+    }
+
+    start = time.time()
+    rows = queries.execute(
+        'get_users',
+        {
+            'entity_filter': entity_filter,
+            'name_condition': name_condition,
+            'order_by': order_by
+        },
+        **values
+    ).fetchall()
     data = [
         {
             'id': r[0],
@@ -455,8 +484,8 @@ def get_users(request):
             ] if r[4] else [],
             'groups': [
                 {
-                    'id': r[6],
-                    'name': r[7]
+                    'id': r[6][i],
+                    'name': r[7][i]
                 } for i in range(len(r[6]))
             ] if r[6] else [],
             'tasksCount': r[8] or 0,
@@ -464,13 +493,31 @@ def get_users(request):
             'thumbnail_full_path': r[10] if r[10] else None,
             'update_user_action':'/users/%s/update/dialog' % r[0] if update_user_permission else None,
             'delete_user_action':delete_user_action % {'id':r[0],'entity_id':entity_id} if delete_user_permission else None
-        } for r in result.fetchall()
+        } for r in rows
     ]
 
+    total_count = get_total_count(
+        rows,
+        offset,
+        lambda: queries.execute(
+            'get_users_count',
+            {
+                'entity_filter': entity_filter,
+                'name_condition': name_condition
+            },
+            **values
+        ).fetchone()[0]
+    )
+
     end = time.time()
     logger.debug('get_users took : %s seconds for %s rows' %
                  ((end - start), len(data)))
-    return data
+
+    resp = Response(
+        json_body=data
+    )
+    resp.content_range = get_content_range(offset, len(data), total_count)
+    return resp
 
 
 
@@ -596,8 +643,7 @@ def login(request):
 def home(request):
     logged_in_user = get_logged_in_user(request)
 
-    studio = Studio.query.first()
-    projects = Project.query.all()
+    navigation_context = get_navigation_context()
 
     flash_message = request.params.get('flash')
     if flash_message:
@@ -605,11 +651,11 @@ def home(request):
 
     return {
         'stalker_pyramid': stalker_pyramid,
-        'studio': studio,
+        'studio': navigation_context['studio'],
         'logged_in_user': logged_in_user,
         'has_permission': PermissionChecker(request),
         'milliseconds_since_epoch': milliseconds_since_epoch,
-        'projects': projects,
+        'projects': navigation_context['projects'],
         'entity': logged_in_user
     }
 
@@ -656,6 +702,64 @@ def check_email_availability(request):
     }
 
 
+# the queries returning the resources listed in the resource view, the time
+# logs and tasks of the resources are loaded by the resource_timeline module
+resource_sql_queries = {
+    'User': """select
+        "SimpleEntities".id,
+        "SimpleEntities".name,
+        "SimpleEntities".entity_type,
+        1 as resource_count
+    from "SimpleEntities"
+    where "SimpleEntities".entity_type = 'User'
+        %(resource_condition)s
+    """,
+    'Department': """select
+        "SimpleEntities".id,
+        "SimpleEntities".name,
+        "SimpleEntities".entity_type,
+        count(*) as resource_count
+    from "SimpleEntities"
+    join "User_Departments" on "User_Departments".did = "SimpleEntities".id
+    where "SimpleEntities".entity_type = 'Department'
+        %(resource_condition)s
+    group by "SimpleEntities".id, "SimpleEntities".name,
+        "SimpleEntities".entity_type
+    """,
+    'Department_Users': """select
+        "Users".id,
+        "SimpleEntities".name,
+        "SimpleEntities".entity_type,
+        1 as resource_count
+    from "Users"
+    join "SimpleEntities" on "SimpleEntities".id = "Users".id
+    join "User_Departments" on "User_Departments".uid = "Users".id
+    where "User_Departments".did = :parent_id
+    """,
+}
+
+
+queries.register(
+    'get_resources_count',
+    """select count(1) from (%(resources)s) as resources""",
+    resource_id='integer',
+    parent_id='integer'
+)
+
+
+queries.register(
+    'get_resources',
+    """select * from (%(resources)s) as resources
+    %(order_by)s
+    limit :limit offset :offset
+    """,
+    resource_id='integer',
+    parent_id='integer',
+    limit='integer',
+    offset='integer'
+)
+
+
 @view_config(
     route_name='get_entity_resources',
     permission='Read_User',
@@ -672,220 +776,104 @@ def check_email_availability(request):
     renderer='json'
 )
 def get_resources(request):
-    """returns Users for Resource View
-    """
-    # TODO: This is a very ugly function, please define the borders and use cases correctly and then clean it
+    """returns Users or Departments for Resource View together with their
+    time logs and leaf tasks.
+
+    /resources/ returns all the Users, /resources/{id}/ returns the given User
+    or Department or all the Departments for a Studio or Project and the
+    ``parent_id`` parameter returns the Users of a Department.
 
+    The time logs and tasks can be limited to a time window with the
+    ``start`` and ``end`` parameters.
+    """
     start = time.time()
-    # return users for now
-    # /resources/
-    # /resources/26/
     resource_id = request.matchdict.get('id')
     logger.debug('resource_id: %s' % resource_id)
 
     parent_id = request.params.get('parent_id')
     logger.debug('parent_id: %s' % parent_id)
 
-    execute = DBSession.connection().execute
+    window_start, window_end = get_time_window(request)
 
-    entity_type = None
     if resource_id:
         # get the entity type of that resource
-        data = execute('select entity_type from "SimpleEntities" where id=%s' %
-                       resource_id).fetchone()
-        if data:
-            entity_type = data[0]
-        else:
+        entity_type = get_entity_type(resource_id)
+        if not entity_type:
             return []
     else:
         # default to User
         entity_type = "User"
     logger.debug('entity_type : %s' % entity_type)
 
-    # get resource details plus time logs
-    if not parent_id:
-        if entity_type == 'Department':
-            resource_sql_query = """select
-                "SimpleEntities".id,
-                "SimpleEntities".name,
-                "SimpleEntities".entity_type,
-                count(*) as resource_count
-            from "SimpleEntities"
-            join "User_Departments" on "User_Departments".did = "SimpleEntities".id
-            where "SimpleEntities".entity_type = '%s'
-            """ % entity_type
-        elif entity_type == 'User':
-            resource_sql_query = """select
-                "SimpleEntities".id,
-                "SimpleEntities".name,
-                "SimpleEntities".entity_type,
-                1 as resource_count
-            from "SimpleEntities"
-            where "SimpleEntities".entity_type = '%s'
-            """ % entity_type
-        elif entity_type in ['Studio', 'Project']:
-            resource_sql_query = """select
-                "SimpleEntities".id,
-                "SimpleEntities".name,
-                "SimpleEntities".entity_type,
-                count(*) as resource_count
-            from "SimpleEntities"
-            join "User_Departments" on "User_Departments".did = "SimpleEntities".id
-            """
-
-        if resource_id and entity_type not in ["Studio", "Project"]:
-            resource_sql_query += "and id=%s group by id, name, entity_type order by name" % resource_id
-        else:
-            resource_sql_query += "group by id, name, entity_type order by name"
-
-        # if the given entity is a Department return all the time logs of the
-        # users of that department
-        time_log_query = """select
-            "TimeLogs".id,
-            "TimeLogs".task_id,
-            extract(epoch from "TimeLogs".start::timestamp AT TIME ZONE 'UTC') * 1000 as start,
-            extract(epoch from "TimeLogs".end::timestamp AT TIME ZONE 'UTC') * 1000 as end
-        from "TimeLogs"
-        """
-
-        tasks_query = """select
-            "Tasks".id,
-            extract(epoch from "Tasks".computed_start::timestamp AT TIME ZONE 'UTC') * 1000 as start,
-            extract(epoch from "Tasks".computed_end::timestamp AT TIME ZONE 'UTC') * 1000 as end
-        from "Tasks"
-        """
-
+    resource_condition = ''
+    project_id = None
+    if parent_id:
+        # return the users of the department
+        resources = resource_sql_queries['Department_Users']
+        resource_type = 'User'
         has_children = False
+    elif entity_type in ['User', 'Department']:
+        resources = resource_sql_queries[entity_type]
+        if resource_id:
+            resource_condition = 'and "SimpleEntities".id = :resource_id'
+        resource_type = entity_type
+        has_children = entity_type == 'Department'
+    elif entity_type in ['Studio', 'Project']:
+        # return all the departments, limited to the project tasks for a
+        # Project
+        resources = resource_sql_queries['Department']
+        resource_type = 'Department'
+        has_children = True
+        if entity_type == 'Project':
+            project_id = resource_id
+    else:
+        return []
 
-        if entity_type == "User":
-            time_log_query += "where resource_id = %s"
-
-            tasks_query += """join "Task_Resources" on "Tasks".id = "Task_Resources".task_id
-                where not (
-                    exists (
-                        select 1
-                        from (
-                            select "Tasks".parent_id
-                            from "SimpleEntities"
-                                join "Tasks" on "SimpleEntities".id = "Tasks".id
-                            ) AS all_tasks
-                        where all_tasks.parent_id = "Tasks".id
-                    )
-                ) and resource_id = %s
-            """
-
-            has_children = False
-        elif entity_type in ["Department", "Studio"]:
-            time_log_query += """
-            join "User_Departments" on "User_Departments".uid = "TimeLogs".resource_id
-            where did = %s"""
-
-            tasks_query += """join "Task_Resources" on "Tasks".id = "Task_Resources".task_id
-            join "User_Departments" on "Task_Resources".resource_id = "User_Departments".uid
-            where not (
-                exists (
-                    select 1
-                    from (
-                        select "Tasks".parent_id
-                        from "SimpleEntities"
-                            join "Tasks" on "SimpleEntities".id = "Tasks".id
-                        ) AS all_tasks
-                    where all_tasks.parent_id = "Tasks".id
-                )
-            )
-            and did = %s
-            group by "Tasks".id, "Tasks".start, "Tasks".end, "Tasks".computed_start, "Tasks".computed_end
-            order by start
-            """
-
-            has_children = True
-        elif entity_type == "Project":
-            # the resource is a Project return all the project tasks and
-            # return all the time logs of the users in that project
-            time_log_query += """
-            join "User_Departments" on "User_Departments".uid = "TimeLogs".resource_id
-            -- where did = %s
-            """
-
-            tasks_query += """
-            -- select all the leaf tasks of the users of a specific Project
-            select
-                "Tasks".id,
-                extract(epoch from "Tasks".computed_start::timestamp AT TIME ZONE 'UTC') * 1000 as start,
-                extract(epoch from "Tasks".computed_end::timestamp AT TIME ZONE 'UTC') * 1000 as end
-            from "Tasks"
-                where not (
-                    exists (
-                        select 1
-                        from (
-                            select "Tasks".parent_id
-                            from "SimpleEntities"
-                                join "Tasks" on "SimpleEntities".id = "Tasks".id
-                            ) AS all_tasks
-                        where all_tasks.parent_id = "Tasks".id
-                    )
-                ) and project_id = %s
-            group by id, start, "end", "Tasks".computed_start, "Tasks".computed_end
-            order by start
-            """
-
-            has_children = True
+    resources = resources % {'resource_condition': resource_condition}
 
-    else:
-        # return departments ??? should also return Groups, Project etc.
-        # that contains users
-        resource_sql_query = """select
-            "Users".id,
-            "SimpleEntities".name,
-            "SimpleEntities".entity_type,
-            1 as resource_count
-        from "Users"
-        join "SimpleEntities" on "SimpleEntities".id = "Users".id
-        join "User_Departments" on "User_Departments".uid = "Users".id
-        join "Departments" on "User_Departments".did = "Departments".id
-        where "Departments".id = %s
-        order by name
-        """ % parent_id
-
-        time_log_query = """select
-            "TimeLogs".id,
-            "TimeLogs".task_id,
-            extract(epoch from "TimeLogs".start::timestamp AT TIME ZONE 'UTC') * 1000 as start,
-            extract(epoch from "TimeLogs".end::timestamp AT TIME ZONE 'UTC') * 1000 as end
-        from "TimeLogs"
-        where resource_id = %s
-        """
-
-        tasks_query = """select
-            "Tasks".id,
-            extract(epoch from "Tasks".computed_start::timestamp AT TIME ZONE 'UTC') * 1000 as start,
-            extract(epoch from "Tasks".computed_end::timestamp AT TIME ZONE 'UTC') * 1000 as end
-        from "Tasks"
-            join "Task_Resources" on "Tasks".id = "Task_Resources".task_id
-        where
-            not (
-                exists (
-                    select 1
-                    from (
-                        select "Tasks".parent_id
-                        from "SimpleEntities"
-                            join "Tasks" on "SimpleEntities".id = "Tasks".id
-                        ) AS all_tasks
-                    where all_tasks.parent_id = "Tasks".id
-                )
-            ) and resource_id = %s
-        """
+    # page the resources with the requested range and sort order
+    offset, limit = get_range(request)
+    order_by = get_order_by(
+        request,
+        {
+            'id': 'resources.id',
+            'name': 'resources.name',
+            'resource_count': 'resources.resource_count'
+        },
+        'order by resources.name'
+    )
 
-        has_children = False
+    values = {
+        'resource_id': resource_id,
+        'parent_id': parent_id,
+        'limit': limit,
+        'offset': offset
+    }
 
-    logger.debug('resource_sql_query : %s' % resource_sql_query)
-    logger.debug('time_log_query : %s' % time_log_query)
-    logger.debug('tasks_sql_query : %s' % tasks_query)
+    total_count = None
+    if limit is not None:
+        total_count = queries.execute(
+            'get_resources_count',
+            {'resources': resources},
+            **values
+        ).fetchone()[0]
 
-    resources_result = execute(resource_sql_query).fetchall()
+    resources_result = queries.execute(
+        'get_resources',
+        {'resources': resources, 'order_by': order_by},
+        **values
+    ).fetchall()
 
     logger.debug('resources_result : %s' % resources_result)
 
+    timelines = resource_timeline.get_timelines(
+        [rr[0] for rr in resources_result],
+        resource_type=resource_type,
+        start=window_start,
+        end=window_end,
+        project_id=project_id
+    )
+
     link = '/%s/%s/view' % (entity_type.lower(), '%s')
     data = [
         {
@@ -895,21 +883,8 @@ def get_resources(request):
             'resource_count': rr[3],
             'hasChildren': has_children,
             'link': link % rr[0],
-            'time_logs': [
-                {
-                    'id': tr[0],
-                    'task_id': tr[1],
-                    'start': tr[2],
-                    'end': tr[3]
-                } for tr in execute(time_log_query % rr[0]).fetchall()
-            ],
-            'tasks': [
-                {
-                    'id': tr[0],
-                    'start': tr[1],
-                    'end': tr[2]
-                } for tr in execute(tasks_query % rr[0]).fetchall()
-            ]
+            'time_logs': timelines[rr[0]]['time_logs'],
+            'tasks': timelines[rr[0]]['tasks']
         } for rr in resources_result
     ]
 
@@ -917,7 +892,9 @@ def get_resources(request):
     logger.debug('get_resources took : %s seconds' % (end - start))
 
     data_count = len(data)
-    content_range = '%s-%s/%s' % (0, data_count - 1, data_count)
+    if total_count is None:
+        total_count = data_count
+    content_range = get_content_range(offset, data_count, total_count)
 
     resp = Response(
         json_body=data
@@ -926,6 +903,104 @@ def get_resources(request):
     return resp
 
 
+queries.register(
+    'get_entity_utilization',
+    """select
+        users.id,
+        "SimpleEntities".name,
+        array_agg(
+            round(coalesce("Resource_Utilization".allocated[extract(day from days.date)::integer], 0))::integer
+            order by days.date
+        ),
+        array_agg(
+            round(coalesce("Resource_Daily_TimeLogs".duration, 0))::integer
+            order by days.date
+        ),
+        array_agg(
+            round(coalesce("Resource_Utilization".vacation[extract(day from days.date)::integer], 0))::integer
+            order by days.date
+        )
+    from (
+        select "Users".id
+        from "Users"
+        %(entity_filter)s
+    ) as users
+    join "SimpleEntities" on users.id = "SimpleEntities".id
+    cross join generate_series(:start_date, :end_date, interval '1 day') as days(date)
+    left outer join "Resource_Utilization"
+        on "Resource_Utilization".resource_id = users.id
+        and "Resource_Utilization".month = date_trunc('month', days.date)::date
+    left outer join "Resource_Daily_TimeLogs"
+        on "Resource_Daily_TimeLogs".resource_id = users.id
+        and "Resource_Daily_TimeLogs".date = days.date::date
+    group by users.id, "SimpleEntities".name
+    order by "SimpleEntities".name
+    """,
+    entity_id='integer',
+    start_date='date',
+    end_date='date'
+)
+
+
+@view_config(
+    route_name='get_entity_utilization',
+    permission='Read_User',
+    renderer='json'
+)
+def get_entity_utilization(request):
+    """returns the allocated, logged and vacation seconds of the users of a
+    User, Department, Group, Project or Studio per day as arrays.
+
+    The days are given with the ``start`` and ``end`` parameters, the current
+    month is used by default.
+    """
+    entity_id = request.matchdict.get('id')
+    entity_type = get_entity_type(entity_id)
+
+    if entity_type == 'Studio':
+        entity_filter = ''
+    elif entity_type in user_entity_filters:
+        entity_filter = user_entity_filters[entity_type]
+    else:
+        transaction.abort()
+        return Response('Can not get the utilization of %s' % entity_id, 500)
+
+    start, end = get_time_window(request)
+    today = datetime.date.today()
+    if start is None:
+        start = today.replace(day=1)
+    else:
+        start = start.date()
+    if end is None:
+        end = (start.replace(day=28) + datetime.timedelta(days=4))
+        end -= datetime.timedelta(days=end.day)
+    else:
+        end = end.date()
+
+    result = queries.execute(
+        'get_entity_utilization',
+        {'entity_filter': entity_filter},
+        entity_id=entity_id,
+        start_date=start,
+        end_date=end
+    )
+
+    return {
+        'start': start.strftime('%Y-%m-%d'),
+        'end': end.strftime('%Y-%m-%d'),
+        'resources': [
+            {
+                'id': r[0],
+                'name': r[1],
+                'allocated': r[2],
+                'logged': r[3],
+                'vacation': r[4]
+            }
+            for r in result.fetchall()
+        ]
+    }
+
+
 @view_config(
     route_name='delete_user_dialog',
     renderer='templates/modals/confirm_dialog.jinja2'
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+# Stalker Pyramid a Web Base Production Asset Management System
+# Copyright (C) 2009-2014 Erkan Ozgur Yilmaz
+#
+# This file is part of Stalker Pyramid.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation;
+# version 2.1 of the License.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+"""Batch requests.
+
+The pages request a lot of small json data, and every request goes through
+the whole tween stack, loads the session and authenticates the user again.
+The ``batch/`` route takes a list of requests as json in the request body::
+
+  [
+      {"name": "entity", "route": "get_entity", "matchdict": {"id": 23}},
+      {"name": "wip_tasks", "route": "get_user_tasks_count",
+       "matchdict": {"id": 10}, "params": {"status": ["WIP", "HREV"]}}
+  ]
+
+and runs them in the same process as subrequests without the tweens, so they
+are all in the transaction and the session of the batch request and the
+logged in user and the checked permissions are shared between them. The
+responses are returned in a dictionary with the names of the requests as the
+keys (the route name is used if there is no name)::
+
+  {
+      "entity": {"status": 200, "body": [...], "content_range": null},
+      "wip_tasks": {"status": 200, "body": 3, "content_range": null}
+  }
+
+Only the routes starting with ``get_`` can be batched, as the other views
+change the data and are not meant to be called in a batch.
+"""
+import json
+import logging
+import urllib
+
+import transaction
+
+from pyramid.httpexceptions import HTTPException
+from pyramid.interfaces import IRoutesMapper
+from pyramid.request import Request
+from pyramid.response import Response
+from pyramid.view import view_config
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+# the maximum number of requests in one batch
+max_batch_size = 100
+
+# the attributes of the batch request that are shared with the subrequests,
+# so they are loaded only once
+shared_attributes = ['session', 'logged_in_user', 'checked_permissions']
+
+# the shared attributes that are loaded from the database, they are detached
+# when the transaction is aborted
+loaded_attributes = ['logged_in_user']
+
+
+def make_subrequest(request, route_name, matchdict=None, params=None):
+    """Returns a GET request for the given route, which shares the cookies and
+    the loaded session, user and permissions of the given request.
+
+    :param request: The batch request.
+    :param route_name: The name of the route.
+    :param matchdict: The values of the placeholders of the route path.
+    :param params: The query parameters, the values can be lists.
+    """
+    path = request.route_path(
+        route_name,
+        **dict([(str(key), u'%s' % value)
+                for key, value in (matchdict or {}).items()])
+    )
+
+    query = []
+    for key, values in (params or {}).items():
+        if not isinstance(values, list):
+            values = [values]
+        for value in values:
+            query.append((key.encode('utf-8'), (u'%s' % value).encode('utf-8')))
+    if query:
+        path = '%s?%s' % (path, urllib.urlencode(query))
+
+    headers = {}
+    if 'Cookie' in request.headers:
+        headers['Cookie'] = request.headers['Cookie']
+
+    subrequest = Request.blank(
+        path,
+        base_url=request.application_url,
+        headers=headers
+    )
+
+    if not hasattr(request, 'checked_permissions'):
+        request.checked_permissions = {}
+
+    for attribute in shared_attributes:
+        try:
+            value = getattr(request, attribute)
+        except AttributeError:
+            continue
+        setattr(subrequest, attribute, value)
+
+    return subrequest
+
+
+def forget_loaded_attributes(request):
+    """Removes the shared attributes loaded from the database from the given
+    batch request, so they are loaded again for the next subrequest.
+
+    Used when a subrequest fails, as the transaction is aborted and the
+    objects loaded in the session of the batch are detached.
+    """
+    for attribute in loaded_attributes:
+        request.__dict__.pop(attribute, None)
+
+
+def get_response_data(response):
+    """Returns the status, the body and the Content-Range of the given
+    response as a dictionary.
+    """
+    if response.content_type == 'application/json':
+        body = json.loads(response.body.decode(response.charset or 'utf-8'))
+    else:
+        body = response.body.decode(response.charset or 'utf-8', 'replace')
+
+    return {
+        'status': response.status_int,
+        'body': body,
+        'content_range': response.headers.get('Content-Range')
+    }
+
+
+def invoke_batch_item(request, item):
+    """Runs one request of a batch and returns its response data.
+
+    :param request: The batch request.
+    :param item: A dictionary with the route, matchdict and params keys.
+    """
+    route_name = item.get('route')
+    mapper = request.registry.getUtility(IRoutesMapper)
+
+    if not route_name or mapper.get_route(route_name) is None:
+        return {
+            'status': 404,
+            'body': 'There is no route named: %s' % route_name,
+            'content_range': None
+        }
+
+    if not route_name.startswith('get_'):
+        return {
+            'status': 400,
+            'body': 'Only the get_ routes can be batched: %s' % route_name,
+            'content_range': None
+        }
+
+    try:
+        subrequest = make_subrequest(
+            request,
+            route_name,
+            item.get('matchdict'),
+            item.get('params')
+        )
+    except KeyError as e:
+        return {
+            'status': 400,
+            'body': 'Missing matchdict value %s for route: %s' %
+                    (e, route_name),
+            'content_range': None
+        }
+
+    try:
+        response = request.invoke_subrequest(subrequest, use_tweens=False)
+    except HTTPException as e:
+        response = e
+    except Exception as e:
+        # the transaction may not be usable anymore, start a new one for the
+        # rest of the batch
+        logger.exception('batch request %s failed' % route_name)
+        transaction.abort()
+        forget_loaded_attributes(request)
+        return {
+            'status': 500,
+            'body': '%s' % e,
+            'content_range': None
+        }
+
+    if response.status_int >= 500:
+        # most of the views abort the transaction before returning an error
+        forget_loaded_attributes(request)
+
+    return get_response_data(response)
+
+
+@view_config(
+    route_name='batch',
+    renderer='json',
+    request_method='POST'
+)
+def batch(request):
+    """runs the requests given as a json list in the request body and returns
+    their responses in a dictionary
+    """
+    try:
+        items = request.json_body
+    except ValueError:
+        transaction.abort()
+        return Response('The batch should be a json list', 500)
+
+    if not isinstance(items, list) or \
+            not all([isinstance(item, dict) for item in items]):
+        transaction.abort()
+        return Response('The batch should be a json list', 500)
+
+    if len(items) > max_batch_size:
+        transaction.abort()
+        return Response(
+            'A batch can have at most %s requests' % max_batch_size, 500
+        )
+
+    responses = {}
+    for item in items:
+        name = item.get('name') or item.get('route')
+        responses[name] = invoke_batch_item(request, item)
+
+    return responses
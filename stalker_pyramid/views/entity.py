@@ -32,7 +32,10 @@ import transaction
 import stalker_pyramid
 from stalker_pyramid.views import (PermissionChecker, get_logged_in_user,
                                    milliseconds_since_epoch, get_multi_integer,
-                                   multi_permission_checker, get_multi_string, StdErrToHTMLConverter)
+                                   multi_permission_checker, get_multi_string, StdErrToHTMLConverter,
+                                   get_time_window,
+                                   get_navigation_context)
+from stalker_pyramid.db import task_hierarchy, queries
 
 
 logger = logging.getLogger(__name__)
@@ -292,15 +295,13 @@ def get_entity_related_data(request):
     logger.debug('get_entity_related_data')
     logged_in_user = get_logged_in_user(request)
 
-    studio = Studio.query.first()
-
     entity_id = request.matchdict.get('id')
     if not entity_id:
-        entity = studio
+        entity = Studio.query.first()
     else:
         entity = Entity.query.filter_by(id=entity_id).first()
 
-    projects = Project.query.all()
+    navigation_context = get_navigation_context()
     mode = request.matchdict.get('mode', None)
     came_from = request.params.get('came_from', request.url)
 
@@ -311,8 +312,8 @@ def get_entity_related_data(request):
         'logged_in_user': logged_in_user,
         'milliseconds_since_epoch': milliseconds_since_epoch,
         'stalker_pyramid': stalker_pyramid,
-        'projects': projects,
-        'studio': studio,
+        'projects': navigation_context['projects'],
+        'studio': navigation_context['studio'],
         'came_from': came_from
     }
 
@@ -334,6 +335,7 @@ def get_entity(request):
         }
     ]
 
+
 @view_config(
     route_name='list_entity_tasks_by_filter',
     renderer='templates/task/list/list_entity_tasks_by_filter.jinja2',
@@ -583,6 +585,53 @@ def remove_entity_from_entity(request):
     )
 
 
+queries.register(
+    'get_entity_time_log_events',
+    """select
+        "TimeLogs".id,
+        "SimpleEntities".name,
+        """ + task_hierarchy.query_parent_names('"TimeLogs".task_id') + """,
+        "TimeLogs".start,
+        "TimeLogs".end,
+        "Status_SimpleEntities".name
+    from "TimeLogs"
+    join "Tasks" on "TimeLogs".task_id = "Tasks".id
+    join "SimpleEntities" on "Tasks".id = "SimpleEntities".id
+    join "SimpleEntities" as "Status_SimpleEntities"
+        on "Tasks".status_id = "Status_SimpleEntities".id
+    where ("TimeLogs".resource_id = :entity_id
+           or "TimeLogs".task_id = :entity_id)
+        and %(window_condition)s
+    order by "TimeLogs".start
+    """,
+    entity_id='integer',
+    window_start='timestamp',
+    window_end='timestamp'
+)
+
+
+queries.register(
+    'get_entity_task_events',
+    """select
+        "Tasks".id,
+        "SimpleEntities".name,
+        """ + task_hierarchy.query_parent_names('"Tasks".id') + """,
+        "Tasks".start,
+        "Tasks".end,
+        "Status_SimpleEntities".name
+    from "Tasks"
+    join "SimpleEntities" on "Tasks".id = "SimpleEntities".id
+    join "SimpleEntities" as "Status_SimpleEntities"
+        on "Tasks".status_id = "Status_SimpleEntities".id
+    where %(entity_condition)s
+        and %(window_condition)s
+    order by "Tasks".start
+    """,
+    entity_id='integer',
+    window_start='timestamp',
+    window_end='timestamp'
+)
+
 
 @view_config(
     route_name='get_entity_events',
@@ -610,31 +659,50 @@ def get_entity_events(request):
 
     events = []
 
-    # if entity.time_logs:
+    if not entity:
+        return events
+
+    window_start, window_end = get_time_window(request)
+
     if 'time_log' in keys:
-        for time_log in entity.time_logs:
-            # logger.debug('time_log.task.id : %s' % time_log.task.id)
-            # assert isinstance(time_log, TimeLog)
+        result = queries.execute(
+            'get_entity_time_log_events',
+            {
+                'window_condition': queries.get_time_window_condition(
+                    '"TimeLogs".start', '"TimeLogs".end',
+                    window_start, window_end
+                )
+            },
+            entity_id=entity.id,
+            window_start=window_start,
+            window_end=window_end
+        )
+
+        for r in result.fetchall():
             events.append({
-                'id': time_log.id,
-                'entity_type': time_log.plural_class_name.lower(),
-                'title': '%s (%s)' % (
-                    time_log.task.name,
-                    ' | '.join(
-                        [parent.name for parent in time_log.task.parents])),
-                'start': milliseconds_since_epoch(time_log.start),
-                'end': milliseconds_since_epoch(time_log.end),
+                'id': r[0],
+                'entity_type': 'timelogs',
+                'title': '%s (%s)' % (r[1], r[2]),
+                'start': milliseconds_since_epoch(r[3]),
+                'end': milliseconds_since_epoch(r[4]),
                 'className': 'label-success',
                 'allDay': False,
-                'status': time_log.task.status.name
+                'status': r[5]
             })
 
     if 'vacation' in keys:
-        vacations = Vacation.query.filter(Vacation.user == None).all()
+        from sqlalchemy import or_
+        vacations = Vacation.query.filter(Vacation.user == None)
         if isinstance(entity, User):
-            vacations.extend(entity.vacations)
+            vacations = Vacation.query.filter(
+                or_(Vacation.user == None, Vacation.user == entity)
+            )
+        if window_end is not None:
+            vacations = vacations.filter(Vacation.start < window_end)
+        if window_start is not None:
+            vacations = vacations.filter(Vacation.end > window_start)
 
-        for vacation in vacations:
+        for vacation in vacations.all():
 
             events.append({
                 'id': vacation.id,
@@ -648,21 +716,43 @@ def get_entity_events(request):
             })
 
     if 'task' in keys:
-        today = datetime.datetime.today()
-        for task in entity.tasks:
+        entity_condition = None
+        if isinstance(entity, User):
+            entity_condition = """"Tasks".id in (
+                select task_id from "Task_Resources"
+                where resource_id = :entity_id
+            )"""
+        elif isinstance(entity, Project):
+            entity_condition = '"Tasks".project_id = :entity_id'
+
+        if entity_condition:
+            today = datetime.datetime.today()
+            task_window_start = \
+                max(today, window_start) if window_start else today
+            result = queries.execute(
+                'get_entity_task_events',
+                {
+                    'entity_condition': entity_condition,
+                    'window_condition': queries.get_time_window_condition(
+                        '"Tasks".start', '"Tasks".end',
+                        task_window_start, window_end
+                    )
+                },
+                entity_id=entity.id,
+                window_start=task_window_start,
+                window_end=window_end
+            )
 
-            if today < task.end:
+            for r in result.fetchall():
                 events.append({
-                    'id': task.id,
+                    'id': r[0],
                     'entity_type': 'tasks',
-                    'title': '%s (%s)' % (
-                        task.name,
-                        ' | '.join([parent.name for parent in task.parents])),
-                    'start': milliseconds_since_epoch(task.start),
-                    'end': milliseconds_since_epoch(task.end),
+                    'title': '%s (%s)' % (r[1], r[2]),
+                    'start': milliseconds_since_epoch(r[3]),
+                    'end': milliseconds_since_epoch(r[4]),
                     'className': 'label',
                     'allDay': False,
-                    'status': task.status.name
+                    'status': r[5]
                 })
 
     return events
@@ -744,10 +834,9 @@ def list_search_result(request):
         Entity.name.ilike('%' + qString + '%')
     ).all()
 
-    projects = Project.query.all()
     logged_in_user = get_logged_in_user(request)
 
-    studio = Studio.query.first()
+    navigation_context = get_navigation_context()
 
     return {
         'entity': entity,
@@ -755,8 +844,8 @@ def list_search_result(request):
         'logged_in_user': logged_in_user,
         'milliseconds_since_epoch': milliseconds_since_epoch,
         'stalker_pyramid': stalker_pyramid,
-        'projects': projects,
-        'studio': studio,
+        'projects': navigation_context['projects'],
+        'studio': navigation_context['studio'],
         'results':results
     }
 
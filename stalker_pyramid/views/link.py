@@ -21,19 +21,21 @@
 import os
 import time
 import logging
+import re
 import uuid
-import base64
+import hashlib
+import binascii
 import transaction
-from HTMLParser import HTMLParser
-from PIL import Image
 
 from pyramid.response import Response, FileResponse
 from pyramid.view import view_config
-from pyramid.httpexceptions import HTTPOk
+from pyramid.httpexceptions import HTTPOk, HTTPNotFound
 
 from stalker.db import DBSession
 from stalker import Entity, Link, defaults
 
+from stalker_pyramid import derivatives, file_serving, thumbnails, uploads
+from stalker_pyramid.db import queries
 from stalker_pyramid.views import (get_logged_in_user, get_multi_integer,
                                    get_tags, StdErrToHTMLConverter)
 
@@ -62,77 +64,122 @@ class ImageData(object):
         self.base64_data = temp_data[1].split(',')[1]
 
 
-class ImgToLinkConverter(HTMLParser):
-    """An HTMLParser derivative that parses HTML data and replaces the ``src``
-    attributes in <img> tags with Link paths
+# the start of the data of an inline image, the data runs until the closing
+# quote of the src attribute
+img_data_re = re.compile(
+    r'''<img\b[^>]*?\bsrc\s*=\s*(["'])data:([^;,"'>]*);base64,''',
+    re.IGNORECASE
+)
+
+
+def get_image_extension(mime_type):
+    """returns the file extension for the given image mime type (ex:
+    image/svg+xml -> .svg)
+    """
+    subtype = mime_type.split('/')[-1].split('+')[0]
+    return '.%s' % re.sub('[^a-zA-Z0-9]', '', subtype)
+
+
+def decode_base64_to_file(data, start, end, output_file):
+    """decodes the base64 data between start and end in the given string to
+    the given file in blocks, without copying the whole data
+
+    :returns str: The sha1 of the decoded data.
+    """
+    sha1 = hashlib.sha1()
+    remainder = ''
+    block_size = 4 << 16  # a multiple of 4
+    for block_start in xrange(start, end, block_size):
+        block = data[block_start:min(block_start + block_size, end)]
+        if isinstance(block, unicode):
+            block = block.encode('ascii')
+
+        # skip the white spaces, and decode the characters in groups of 4
+        block = remainder + block.translate(None, ' \t\r\n')
+        length = len(block) - len(block) % 4
+        remainder = block[length:]
+
+        decoded = binascii.a2b_base64(block[:length])
+        output_file.write(decoded)
+        sha1.update(decoded)
+
+    if remainder:
+        # the padding is missing
+        decoded = binascii.a2b_base64(
+            remainder + '=' * (-len(remainder) % 4)
+        )
+        output_file.write(decoded)
+        sha1.update(decoded)
+
+    return sha1.hexdigest()
+
+
+def iter_img_data_replaced_with_links(raw_data, links):
+    """yields the parts of the given html where the data of the inline images
+    (<img src="data:image/png;base64,...">) are replaced with the paths of
+    new Links, in one pass over the html
+
+    The data of each image is decoded straight to a file, the created Links
+    are appended to the given list.
+    """
+    position = 0
+    while True:
+        match = img_data_re.search(raw_data, position)
+        if match is None:
+            break
+
+        data_start = match.end()
+        data_end = raw_data.find(match.group(1), data_start)
+        if data_end == -1:
+            # not closed
+            break
+
+        temp_file_path = generate_temp_file_path()
+        with open(temp_file_path, 'wb') as f:
+            sha1 = decode_base64_to_file(raw_data, data_start, data_end, f)
+
+        # the same screenshot is stored once
+        file_full_path, link_full_path = store_file(
+            temp_file_path,
+            get_image_extension(match.group(2)),
+            sha1
+        )
+
+        new_link = Link(
+            full_path=link_full_path,
+            original_filename=os.path.basename(link_full_path)
+        )
+        DBSession.add(new_link)
+        links.append(new_link)
+
+        # everything up to the data, then the link path
+        yield raw_data[position:match.end(1)]
+        yield '/%s' % link_full_path
+        position = data_end
+
+    yield raw_data[position:]
+
+
+class ImgToLinkConverter(object):
+    """Replaces the data of the inline images in html with the paths of new
+    Links (see iter_img_data_replaced_with_links)
     """
 
     def __init__(self):
-        HTMLParser.__init__(self)
-        self.raw_img_to_url = []
         self.links = []
         self.raw_data = ''
 
     def feed(self, data):
-        """the overridden feed method which stores the original data
+        """replaces the images in the given data, the result is stored in
+        raw_data
         """
-        HTMLParser.feed(self, data)
-        self.raw_data = data
-
-    def handle_starttag(self, tag, attrs):
-        # print tag, attrs
-        attrs_dict = {}
-        if tag == 'img':
-            # convert attributes to a dict
-            for attr in attrs:
-                attrs_dict[attr[0]] = attr[1]
-            src = attrs_dict['src']
-
-            # check if it contains data
-            if not src.startswith('data'):
-                return
-
-            # get the file type and use it as extension
-            image_data = ImageData(src)
-            # generate a path for this file
-            file_full_path, link_full_path = \
-                generate_local_file_path(image_data.extension)
-            original_name = os.path.basename(link_full_path)
-
-            # create folders
-            try:
-                os.makedirs(os.path.dirname(file_full_path))
-            except OSError:
-                # path exists
-                pass
-
-            with open(file_full_path, 'wb') as f:
-                f.write(
-                    base64.decodestring(image_data.base64_data)
-                )
-
-            # create Link instances
-            # create a Link instance and return it
-            new_link = Link(
-                full_path=link_full_path,
-                original_filename=original_name,
-            )
-            DBSession.add(new_link)
-            self.links.append(new_link)
-
-            # save data to be replaced in the raw content
-            self.raw_img_to_url.append(
-                (src, link_full_path)
-            )
+        self.raw_data = \
+            ''.join(iter_img_data_replaced_with_links(data, self.links))
 
     def replace_urls(self):
-        """replaces the raw image data with the url in the given data
+        """returns the data with the images replaced, they are already
+        replaced in feed()
         """
-        for img_to_url in self.raw_img_to_url:
-            self.raw_data = self.raw_data.replace(
-                img_to_url[0],
-                '/%s' % img_to_url[1]
-            )
         return self.raw_data
 
 
@@ -143,10 +190,8 @@ def replace_img_data_with_links(raw_data):
     :returns str, list: string containing html data with the ``src`` parameters
       of <img> tags are replaced with Link addresses and the generated links
     """
-    parser = ImgToLinkConverter()
-    parser.feed(raw_data)
-    parser.replace_urls()
-    return parser.raw_data, parser.links
+    links = []
+    return ''.join(iter_img_data_replaced_with_links(raw_data, links)), links
 
 
 @view_config(
@@ -181,6 +226,125 @@ def upload_files(request):
         }
 
 
+def query_upload(request):
+    """Returns the upload of the logged in user with the id in the matchdict
+    or None if there is no such upload.
+    """
+    upload = uploads.Upload.get(request.matchdict.get('id'))
+    if upload is None or \
+       upload.created_by_id != get_logged_in_user(request).id:
+        return None
+    return upload
+
+
+@view_config(
+    route_name='create_upload',
+    renderer='json',
+    request_method='POST'
+)
+def create_upload(request):
+    """starts a resumable upload of a file with the given filename and size,
+    the chunks of the file are uploaded with upload_chunk
+    """
+    filename = request.params.get('filename')
+    size = request.params.get('size')
+    logged_in_user = get_logged_in_user(request)
+
+    try:
+        upload = uploads.Upload.create(filename, size, logged_in_user.id)
+    except (TypeError, ValueError) as e:
+        transaction.abort()
+        return Response('%s' % e, 500)
+
+    return upload.to_dict()
+
+
+@view_config(
+    route_name='get_upload',
+    renderer='json'
+)
+def get_upload(request):
+    """returns the offset and the progress of the given upload, the upload
+    continues from this offset
+    """
+    upload = query_upload(request)
+    if upload is None:
+        transaction.abort()
+        return Response(
+            'There is no upload with id: %s' % request.matchdict.get('id'),
+            500
+        )
+
+    return upload.to_dict()
+
+
+@view_config(
+    route_name='upload_chunk',
+    renderer='json',
+    request_method='POST'
+)
+def upload_chunk(request):
+    """writes the request body to the given upload at the given offset
+    """
+    upload = query_upload(request)
+    if upload is None:
+        transaction.abort()
+        return Response(
+            'There is no upload with id: %s' % request.matchdict.get('id'),
+            500
+        )
+
+    try:
+        upload.write(
+            request.GET.get('offset'),
+            request.body_file,
+            request.content_length or 0
+        )
+    except (TypeError, ValueError, IOError) as e:
+        transaction.abort()
+        return Response('%s' % e, 500)
+
+    return upload.to_dict()
+
+
+@view_config(
+    route_name='finish_upload',
+    renderer='json',
+    request_method='POST'
+)
+def finish_upload(request):
+    """creates the Link of the given upload after all of its chunks are
+    uploaded, returns the link ids like upload_files
+    """
+    upload = query_upload(request)
+    if upload is None:
+        transaction.abort()
+        return Response(
+            'There is no upload with id: %s' % request.matchdict.get('id'),
+            500
+        )
+
+    try:
+        file_full_path, link_full_path, sha1 = \
+            upload.finish(request.params.get('sha1'))
+    except (ValueError, IOError, OSError) as e:
+        transaction.abort()
+        return Response('%s' % e, 500)
+
+    new_link = Link(
+        full_path=link_full_path,
+        original_filename=upload.filename,
+        created_by=get_logged_in_user(request)
+    )
+    DBSession.add(new_link)
+    DBSession.flush()
+
+    return {
+        'link_ids': [new_link.id],
+        'sha1': sha1
+    }
+
+
 @view_config(
     route_name='assign_thumbnail',
 )
@@ -202,17 +366,12 @@ def assign_thumbnail(request):
     if entity and link:
         entity.thumbnail = link
 
-        # resize the thumbnail
-        file_full_path = convert_file_link_to_full_path(link.full_path)
-        img = Image.open(file_full_path)
-        if img.format != 'GIF':
-            img.thumbnail((1024, 1024))
-            img.thumbnail((512, 512), Image.ANTIALIAS)
-            img.save(file_full_path)
-
         DBSession.add(entity)
         DBSession.add(link)
 
+        # resize the thumbnail
+        thumbnails.resize(link, created_by=logged_in_user)
+
     return HTTPOk()
 
 
@@ -254,15 +413,15 @@ def assign_reference(request):
         # assign all the tags to the links
         for link in links:
             link.tags.extend(tags)
-            # generate thumbnail
-            thumbnail = generate_thumbnail(link)
-            link.thumbnail = thumbnail
-            thumbnail.created_by = logged_in_user
-            DBSession.add(thumbnail)
 
         DBSession.add(entity)
         DBSession.add_all(links)
 
+        # generate thumbnails, they are created in the background and
+        # get_thumbnail_jobs tells when they are ready
+        for link in links:
+            thumbnails.create_thumbnail(link, created_by=logged_in_user)
+
     # return new links as json data
     # in response text
     return [
@@ -272,6 +431,8 @@ def assign_reference(request):
             'original_filename': link.original_filename,
             'thumbnail': link.thumbnail.full_path
             if link.thumbnail else link.full_path,
+            'thumbnail_full_path': link.thumbnail.full_path
+            if link.thumbnail else None,
             'tags': [tag.name for tag in link.tags]
         } for link in links
     ]
@@ -296,44 +457,38 @@ def convert_file_link_to_full_path(link_path):
     return file_full_path
 
 
-def generate_thumbnail(link):
-    """Generates a thumbnail for the given link
-
-    :param link: Generates a thumbnail for the given link
-    :return:
+queries.register(
+    'get_entity_references',
     """
-    # TODO: support video files (somehow, gif thumbs may be???)
-    file_full_path = convert_file_link_to_full_path(link.full_path)
-
-    extension = os.path.splitext(file_full_path)[-1]
-
-    link_original_filename, link_original_extension = \
-        os.path.splitext(link.original_filename)
-
-    thumbnail_original_filename = \
-        link_original_filename + '_t' + link_original_extension
-
-    # generate thumbnails for those references
-    img = Image.open(file_full_path)
-    img.thumbnail((1024, 1024))  # TODO: connect this to a config variable
-    img.thumbnail((512, 512), Image.ANTIALIAS)
-
-    thumbnail_full_path, thumbnail_link_full_path = \
-        generate_local_file_path(extension)
-
-    # create the dirs before saving
-    try:
-        os.makedirs(os.path.dirname(thumbnail_full_path))
-    except OSError:  # path exists
-        pass
-    img.save(thumbnail_full_path)
-
-    # create a link to be the thumbnail of the original
-    thumbnail = Link(
-        full_path=thumbnail_link_full_path,
-        original_filename=thumbnail_original_filename
-    )
-    return thumbnail
+    -- select all links assigned to a project tasks or assigned to a task and its children
+    select
+        "Links".id,
+        "Links".full_path,
+        "Links".original_filename,
+        "Thumbnails".full_path as "thumbnail_full_path",
+        array_agg("SimpleEntities_Tags".name) as tags,
+        array_agg("Task_References".task_id) as entity_id,
+        array_agg("SimpleEntities_Tasks".name) as task_name,
+        array_agg("SimpleEntities_Tasks".entity_type) as entity_type
+    from "Task_References"
+    join "Task_Ancestors" as child_tasks on child_tasks.descendant_id = "Task_References".task_id
+    join "Links" on "Task_References".link_id = "Links".id
+    join "SimpleEntities" on "Links".id = "SimpleEntities".id
+    left outer join "Links" as "Thumbnails" on "SimpleEntities".thumbnail_id = "Thumbnails".id
+    join "Entity_Tags" on "Links".id = "Entity_Tags".entity_id
+    join "Tags" on "Entity_Tags".tag_id = "Tags".id
+    join "SimpleEntities" as "SimpleEntities_Tags" on "Tags".id = "SimpleEntities_Tags".id
+    join "SimpleEntities" as "SimpleEntities_Tasks" on "Task_References".task_id = "SimpleEntities_Tasks".id
+    where child_tasks.ancestor_id = :entity_id -- show also children references
+    group by "Links".id, "Thumbnails".full_path, "Links".full_path,
+             "Links".original_filename
+    order by "Links".id
+    %(offset_limit)s
+    """,
+    entity_id='integer',
+    offset='integer',
+    limit='integer'
+)
 
 
 @view_config(route_name='get_project_references', renderer='json')
@@ -356,53 +511,19 @@ def get_entity_references(request):
     # using Raw SQL queries here to fasten things up quite a bit and also do
     # some fancy queries like getting all the references of tasks of a project
     # also with their tags
-    sql_query = """
-    -- select all links assigned to a project tasks or assigned to a task and its children
-    select
-        "Links".id,
-        "Links".full_path,
-        "Links".original_filename,
-        "Thumbnails".full_path as "thumbnail_full_path",
-        array_agg("SimpleEntities_Tags".name) as tags,
-        array_agg("Task_References".task_id) as entity_id,
-        array_agg("SimpleEntities_Tasks".name) as task_name,
-        array_agg("SimpleEntities_Tasks".entity_type) as entity_type
-    from "Task_References"
-    join (
-        with recursive parent_ids(id, parent_id, project_id) as (
-            select task.id, task.parent_id, task.project_id from "Tasks" task
-        union all
-            select task.id, parent.parent_id, task.project_id
-            from "Tasks" task, parent_ids parent
-            where task.parent_id = parent.id
-        )
-        select
-            distinct parent_ids.id as id
-            from parent_ids
-
-            where parent_ids.id = %(id)s or parent_ids.parent_id = %(id)s or parent_ids.project_id = %(id)s -- show also children references
-
-            group by parent_ids.id, parent_id, project_id
-            order by parent_ids.id
-    ) as child_tasks on child_tasks.id = "Task_References".task_id
-    join "Links" on "Task_References".link_id = "Links".id
-    join "SimpleEntities" on "Links".id = "SimpleEntities".id
-    join "Links" as "Thumbnails" on "SimpleEntities".thumbnail_id = "Thumbnails".id
-    join "Entity_Tags" on "Links".id = "Entity_Tags".entity_id
-    join "Tags" on "Entity_Tags".tag_id = "Tags".id
-    join "SimpleEntities" as "SimpleEntities_Tags" on "Tags".id = "SimpleEntities_Tags".id
-    join "SimpleEntities" as "SimpleEntities_Tasks" on "Task_References".task_id = "SimpleEntities_Tasks".id
-    group by "Links".id, "Thumbnails".full_path, "Links".full_path,
-             "Links".original_filename
-    order by "Links".id
-    """ % {'id': entity_id}
-
+    offset_limit = ''
     if offset and limit:
-        sql_query += "offset %s limit %s" % (offset, limit)
+        offset_limit = 'offset :offset limit :limit'
 
     time_time = time.time
     db_start = time_time()
-    result = DBSession.connection().execute(sql_query)
+    result = queries.execute(
+        'get_entity_references',
+        {'offset_limit': offset_limit},
+        entity_id=entity_id,
+        offset=offset,
+        limit=limit
+    )
     db_end = time_time()
     db_time = db_end - db_start
 
@@ -412,7 +533,9 @@ def get_entity_references(request):
             'id': r[0],
             'full_path': r[1],
             'original_filename': r[2],
-            'thumbnail_full_path': r[3],
+            'thumbnail_full_path':
+                derivatives.get_derivative_path(r[0], 'card')
+                if r[3] else None,
             'tags': r[4],
             'entity_ids': r[5],
             'entity_names': r[6],
@@ -427,6 +550,28 @@ def get_entity_references(request):
     return return_val
 
 
+queries.register(
+    'get_entity_references_count',
+    """
+    select count(*) from (
+        select
+            "Links".id
+        from "Task_References"
+        join "Task_Ancestors" as child_tasks on child_tasks.descendant_id = "Task_References".task_id
+        join "Links" on "Task_References".link_id = "Links".id
+        join "SimpleEntities" on "Links".id = "SimpleEntities".id
+        join "Entity_Tags" on "Links".id = "Entity_Tags".entity_id
+        join "Tags" on "Entity_Tags".tag_id = "Tags".id
+        join "SimpleEntities" as "SimpleEntities_Tags" on "Tags".id = "SimpleEntities_Tags".id
+        join "SimpleEntities" as "SimpleEntities_Tasks" on "Task_References".task_id = "SimpleEntities_Tasks".id
+        where child_tasks.ancestor_id = :entity_id -- show also children references
+        group by "Links".id
+    ) as data
+    """,
+    entity_id='integer'
+)
+
+
 @view_config(route_name='get_project_references_count', renderer='json')
 @view_config(route_name='get_task_references_count', renderer='json')
 @view_config(route_name='get_asset_references_count', renderer='json')
@@ -444,51 +589,48 @@ def get_entity_references_count(request):
     # using Raw SQL queries here to fasten things up quite a bit and also do
     # some fancy queries like getting all the references of tasks of a project
     # also with their tags
-    sql_query = """
-    select count(*) from (
-        select
-            "Links".id
-        from "Task_References"
-        join (
-            with recursive parent_ids(id, parent_id, project_id) as (
-                select task.id, task.parent_id, task.project_id from "Tasks" task
-            union all
-                select task.id, parent.parent_id, task.project_id
-                from "Tasks" task, parent_ids parent
-                where task.parent_id = parent.id
-            )
-            select
-                distinct parent_ids.id as id --, coalesce(parent_ids.parent_id, parent_ids.project_id) as parent_id
-                from parent_ids
-
-                where parent_ids.id = %(id)s or parent_ids.parent_id = %(id)s or parent_ids.project_id = %(id)s -- show also children references
-
-                group by parent_ids.id, parent_id, project_id
-                order by parent_ids.id
-        ) as child_tasks on child_tasks.id = "Task_References".task_id
-        join "Links" on "Task_References".link_id = "Links".id
-        join "SimpleEntities" on "Links".id = "SimpleEntities".id
-        join "Links" as "Thumbnails" on "SimpleEntities".thumbnail_id = "Thumbnails".id
-        join "Entity_Tags" on "Links".id = "Entity_Tags".entity_id
-        join "Tags" on "Entity_Tags".tag_id = "Tags".id
-        join "SimpleEntities" as "SimpleEntities_Tags" on "Tags".id = "SimpleEntities_Tags".id
-        join "SimpleEntities" as "SimpleEntities_Tasks" on "Task_References".task_id = "SimpleEntities_Tasks".id
-        group by "Links".id
-    ) as data
-    """ % {'id': entity_id}
-
-    result = DBSession.connection().execute(sql_query)
+    result = queries.execute(
+        'get_entity_references_count',
+        entity_id=entity_id
+    )
     return result.fetchone()[0]
 
 
-def generate_local_file_path(extension):
+@view_config(
+    route_name='get_thumbnail_jobs',
+    renderer='json'
+)
+def get_thumbnail_jobs(request):
+    """returns the state of the thumbnail jobs of the given links, the state
+    is one of queued, running, done or failed (none if there is no job and no
+    thumbnail)
+    """
+    link_ids = get_multi_integer(request, 'link_ids[]', 'GET')
+
+    if not link_ids:
+        return []
+
+    result = queries.execute('get_thumbnail_jobs', link_ids=link_ids)
+    return [
+        {
+            'link_id': r[0],
+            'state': r[1],
+            'error': r[2],
+            'thumbnail_full_path': r[3]
+        } for r in result.fetchall()
+    ]
+
+
+def generate_local_file_path(extension, sha1=None):
     """generates file paths in server side storage
 
     :param extension: desired file extension
+    :param sha1: The sha1 of the content of the file, the same content always
+      has the same path. A random path is generated if it is not given.
     :return:
     """
     # upload it to the stalker server side storage path
-    new_filename = uuid.uuid4().hex + extension
+    new_filename = (sha1 or uuid.uuid4().hex) + extension
     first_folder = new_filename[:2]
     second_folder = new_filename[2:4]
     file_path = os.path.join(
@@ -512,21 +654,125 @@ def generate_local_file_path(extension):
     return file_full_path, link_full_path
 
 
+def generate_temp_file_path(extension=''):
+    """generates a temp file path in server side storage, to write a file
+    before it is stored with store_file()
+    """
+    temp_path = os.path.join(defaults.server_side_storage_path, 'tmp')
+    if not os.path.exists(temp_path):
+        try:
+            os.makedirs(temp_path)
+        except OSError:  # created by another request
+            pass
+    return os.path.join(temp_path, uuid.uuid4().hex + extension)
+
+
+def hash_file(file_full_path):
+    """returns the sha1 of the given file
+    """
+    sha1 = hashlib.sha1()
+    with open(file_full_path, 'rb') as f:
+        while True:
+            data = f.read(2 << 16)
+            if not data:
+                break
+            sha1.update(data)
+    return sha1.hexdigest()
+
+
+def lock_file(link_full_path, connection=None):
+    """locks the file of the given link path until the end of the transaction,
+    so it is not removed while a Link is created for it (PostgreSQL only)
+    """
+    if connection is None:
+        connection = DBSession.connection()
+    if connection.dialect.name != 'postgresql':
+        return
+    queries.bind(
+        'lock_file',
+        full_path=link_full_path
+    ).execute(connection=connection)
+
+
+def store_file(temp_file_path, extension, sha1=None, connection=None):
+    """moves the given file to its content addressed path in the server side
+    storage (see stalker_pyramid.db.file_store), the file is removed if there
+    is already a file with the same content
+
+    :param temp_file_path: The path of the file, which is moved or removed.
+    :param extension: The file extension.
+    :param sha1: The sha1 of the file, it is calculated if not given.
+    :param connection: The connection of the transaction the Link of the file
+      is going to be created in, the session connection by default.
+    :return: The file path and the link path of the stored file.
+    """
+    if sha1 is None:
+        sha1 = hash_file(temp_file_path)
+
+    file_full_path, link_full_path = generate_local_file_path(extension, sha1)
+    lock_file(link_full_path, connection)
+
+    if os.path.exists(file_full_path):
+        # same content is already stored
+        os.remove(temp_file_path)
+    else:
+        try:
+            os.makedirs(os.path.dirname(file_full_path))
+        except OSError:
+            # path exists
+            pass
+        os.rename(temp_file_path, file_full_path)
+
+    return file_full_path, link_full_path
+
+
+def remove_unused_files(success, link_full_paths):
+    """removes the files of the given link paths which are not used by any
+    Link anymore, to be used as an after commit hook of the transaction
+    deleting the Links::
+
+      transaction.get().addAfterCommitHook(
+          remove_unused_files, args=([link.full_path],)
+      )
+
+    :param success: If the transaction is committed.
+    :param link_full_paths: The full_paths of the deleted Links.
+    """
+    if not success:
+        return
+
+    engine = DBSession.get_bind()
+    for link_full_path in set(link_full_paths):
+        with engine.begin() as connection:
+            lock_file(link_full_path, connection)
+            link_count = queries.bind(
+                'get_file_link_count',
+                full_path=link_full_path
+            ).execute(connection=connection).scalar()
+            if link_count:
+                continue
+
+            try:
+                os.remove(convert_file_link_to_full_path(link_full_path))
+            except OSError:
+                pass
+
+
 def upload_files_to_server(request, file_params):
     """Uploads files from a request.POST to the given path
 
-    Uses the hex representation of a uuid4 sequence as the filename.
+    Uses the sha1 of the file as the filename, so the same file is stored
+    once.
 
-    The first two digits of the uuid4 is used for the first folder name,
+    The first two digits of the sha1 is used for the first folder name,
     there are 256 possible variations, then the third and fourth characters
     are used for the second folder name (again 256 other possibilities) and
-    then the uuid4 sequence with the original file extension generates the
-    filename.
+    then the sha1 with the original file extension generates the filename.
 
     The extension is used on purpose where OSes like windows can infer the file
     type from the extension.
 
-    SPL/{{uuid4[:2]}}/{{uuid4[2:4]}}//{{uuid4}}.extension
+    SPL/{{sha1[:2]}}/{{sha1[2:4]}}//{{sha1}}.extension
 
     :param request: The request object.
     :param str file_params: The name of the parameter that holds the files.
@@ -545,27 +791,22 @@ def upload_files_to_server(request, file_params):
         logger.debug('extension  : %s' % extension)
         logger.debug('input_file : %s' % input_file)
 
-        file_full_path, link_full_path = generate_local_file_path(extension)
-        file_path = os.path.dirname(file_full_path)
-
         # write down to a temp file first
-        temp_file_path = file_full_path + '~'
-
-        # create folders
-        os.makedirs(file_path)
-
-        output_file = open(temp_file_path, 'wb')  # TODO: guess ascii or binary mode
-
-        input_file.seek(0)
-        while True:  # TODO: use 'with'
-            data = input_file.read(2 << 16)
-            if not data:
-                break
-            output_file.write(data)
-        output_file.close()
-
-        # data is written completely, rename temp file to original file
-        os.rename(temp_file_path, file_full_path)
+        temp_file_path = generate_temp_file_path()
+        sha1 = hashlib.sha1()
+
+        with open(temp_file_path, 'wb') as output_file:
+            input_file.seek(0)
+            while True:
+                data = input_file.read(2 << 16)
+                if not data:
+                    break
+                output_file.write(data)
+                sha1.update(data)
+
+        # data is written completely, move it to its place
+        file_full_path, link_full_path = \
+            store_file(temp_file_path, extension, sha1.hexdigest())
 
         # create a Link instance and return it
         new_link = Link(
@@ -576,7 +817,8 @@ def upload_files_to_server(request, file_params):
         DBSession.add(new_link)
         links.append(new_link)
 
-    transaction.commit()
+    # the links need their ids
+    DBSession.flush()
     return links
 
 
@@ -596,10 +838,13 @@ def delete_reference(request):
         # check if it has a thumbnail
         if ref.thumbnail:
             # remove the file first
-            files_to_remove.append(ref.thumbnail.full_path)
+            thumbnail = ref.thumbnail
+            files_to_remove.append(thumbnail.full_path)
 
-            # delete the thumbnail Link from the database
-            DBSession.delete(ref.thumbnail)
+            # delete the thumbnail Link from the database, after it is
+            # detached from the ref which is still referencing it
+            ref.thumbnail = None
+            DBSession.delete(thumbnail)
         # remove the reference itself
         files_to_remove.append(ref.full_path)
 
@@ -614,14 +859,10 @@ def delete_reference(request):
             task.references.remove(ref)
         DBSession.delete(ref)
 
-        # now delete files
-        for f in files_to_remove:
-            # convert the paths to system path
-            f_system = convert_file_link_to_full_path(f)
-            try:
-                os.remove(f_system)
-            except OSError:
-                pass
+        # now delete the files which are not used by other Links
+        transaction.get().addAfterCommitHook(
+            remove_unused_files, args=(files_to_remove,)
+        )
 
         response = Response('%s removed successfully' % original_filename)
         response.status_int = 200
@@ -641,31 +882,63 @@ def serve_files(request):
     """
     partial_file_path = request.matchdict['partial_file_path']
     file_full_path = convert_file_link_to_full_path(partial_file_path)
-    return FileResponse(file_full_path)
+    try:
+        return file_serving.make_file_response(request, file_full_path)
+    except OSError:
+        return HTTPNotFound('There is no file: %s' % partial_file_path)
 
 
 @view_config(
     route_name='forced_download_files'
 )
 def force_download_files(request):
-    """serves files but forces to download
+    """serves files but forces to download, the file is downloaded with the
+    original filename of the Link given with the link_id parameter
     """
     partial_file_path = request.matchdict['partial_file_path']
     file_full_path = convert_file_link_to_full_path(partial_file_path)
-    # get the link to get the original file name
-    link = Link.query.filter(
-        Link.full_path == 'SPL/' + partial_file_path).first()
-    if link:
-        original_filename = link.original_filename
-    else:
-        original_filename = os.path.basename(file_full_path)
 
-    response = FileResponse(
-        file_full_path,
-        request=request,
-        content_type='application/force-download',
-    )
-    # update the content-disposition header
-    response.headers['content-disposition'] = \
-        str('attachment; filename=' + original_filename)
+    link_id = request.params.get('link_id')
+    try:
+        link_id = int(link_id) if link_id else None
+    except ValueError:
+        return HTTPNotFound('There is no link with id: %s' % link_id)
+
+    # get the original file name of the link
+    original_filename = \
+        file_serving.get_original_filename(
+            'SPL/' + partial_file_path, link_id
+        ) or os.path.basename(file_full_path)
+
+    try:
+        return file_serving.make_file_response(
+            request,
+            file_full_path,
+            content_type='application/force-download',
+            filename=original_filename
+        )
+    except OSError:
+        return HTTPNotFound('There is no file: %s' % partial_file_path)
+
+
+@view_config(
+    route_name='serve_derivative'
+)
+def serve_derivative(request):
+    """serves the image of the given link in the given size, the image is
+    created on the first request
+    """
+    link_id = int(request.matchdict['id'])
+    size = request.matchdict['size']
+
+    if size not in derivatives.sizes:
+        return HTTPNotFound('There is no thumbnail size: %s' % size)
+
+    file_full_path = derivatives.get_derivative(link_id, size)
+    if file_full_path is None:
+        return HTTPNotFound('No image for link with id: %s' % link_id)
+
+    response = FileResponse(file_full_path, request=request)
+    # the image of a link does not change
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
     return response
@@ -35,11 +35,14 @@ from stalker.db import DBSession
 from stalker import (defaults, User, Task, Review, Entity, Note, Type)
 from stalker.exceptions import CircularDependencyError, StatusError
 
+from stalker_pyramid import derivatives
+from stalker_pyramid.db import queries
 from stalker_pyramid.views import (PermissionChecker, get_logged_in_user,
                                    get_multi_integer, milliseconds_since_epoch,
                                    StdErrToHTMLConverter,
                                    multi_permission_checker,
                                    dummy_email_address, local_to_utc, get_user_os)
+from stalker_pyramid.views.link import replace_img_data_with_links
 from stalker_pyramid.views.type import query_type
 
 
@@ -68,9 +71,13 @@ def create_entity_note(request):
         return Response('There is no entity with id: %s' % entity_id, 500)
 
 
-    logger.debug('content %s' % content)
-
     if content != '':
+        # convert images to Links
+        content, links = replace_img_data_with_links(content)
+        for link in links:
+            link.created_by = logged_in_user
+
+        logger.debug('content %s' % content)
 
         note_type = Type.query.filter_by(name='Simple Text').first()
         if note_type is None:
@@ -98,6 +105,29 @@ def create_entity_note(request):
     return Response('Task note is created')
 
 
+queries.register(
+    'get_entity_notes',
+    """select  "User_SimpleEntities".id as user_id,
+                "User_SimpleEntities".name,
+                "Users_Thumbnail_Links".id,
+                "Notes_SimpleEntities".id as note_id,
+                "Notes_SimpleEntities".description,
+                "Notes_SimpleEntities".date_created,
+                "Notes_Types_SimpleEntities".id,
+                "Notes_Types_SimpleEntities".name,
+                "Notes_Types_SimpleEntities".html_class
+
+        from "Notes"
+        join "SimpleEntities" as "Notes_SimpleEntities" on "Notes_SimpleEntities".id = "Notes".id
+        left outer join "SimpleEntities" as "Notes_Types_SimpleEntities" on "Notes_Types_SimpleEntities".id = "Notes_SimpleEntities".type_id
+        join "SimpleEntities" as "User_SimpleEntities" on "Notes_SimpleEntities".created_by_id = "User_SimpleEntities".id
+        join "Links" as "Users_Thumbnail_Links" on "Users_Thumbnail_Links".id = "User_SimpleEntities".thumbnail_id
+        where "Notes".entity_id = :entity_id
+        order by "Notes_SimpleEntities".date_created desc""",
+    entity_id='integer'
+)
+
+
 @view_config(
     route_name='get_entity_notes',
     renderer='json'
@@ -115,34 +145,14 @@ def get_entity_notes(request):
         return Response('There is no entity with id: %s' % entity_id, 500)
 
 
-    sql_query = """select  "User_SimpleEntities".id as user_id,
-                "User_SimpleEntities".name,
-                "Users_Thumbnail_Links".full_path,
-                "Notes_SimpleEntities".id as note_id,
-                "Notes_SimpleEntities".description,
-                "Notes_SimpleEntities".date_created,
-                "Notes_Types_SimpleEntities".id,
-                "Notes_Types_SimpleEntities".name,
-                "Notes_Types_SimpleEntities".html_class
-
-        from "Notes"
-        join "SimpleEntities" as "Notes_SimpleEntities" on "Notes_SimpleEntities".id = "Notes".id
-        left outer join "SimpleEntities" as "Notes_Types_SimpleEntities" on "Notes_Types_SimpleEntities".id = "Notes_SimpleEntities".type_id
-        join "SimpleEntities" as "User_SimpleEntities" on "Notes_SimpleEntities".created_by_id = "User_SimpleEntities".id
-        join "Links" as "Users_Thumbnail_Links" on "Users_Thumbnail_Links".id = "User_SimpleEntities".thumbnail_id
-        where "Notes".entity_id = %(entity_id)s
-        order by "Notes_SimpleEntities".date_created desc"""
-
-
-    sql_query = sql_query % {'entity_id': entity_id}
-
-    result = DBSession.connection().execute(sql_query)
+    result = queries.execute('get_entity_notes', entity_id=entity_id)
 
     return_data = [
         {
             'created_by_id': r[0],
             'created_by_name': r[1],
-            'created_by_thumbnail': r[2],
+            'created_by_thumbnail':
+                derivatives.get_derivative_path(r[2], 'avatar'),
             'note_id': r[3],
             'content': r[4],
             'created_date': milliseconds_since_epoch(r[5]),
@@ -22,16 +22,20 @@ import time
 import datetime
 import logging
 
-from pyramid.httpexceptions import HTTPOk, HTTPServerError, HTTPFound
+from pyramid.httpexceptions import (HTTPOk, HTTPServerError, HTTPFound,
+                                    HTTPNotFound)
 from pyramid.view import view_config
 
 from stalker.db import DBSession
 from stalker import (User, ImageFormat, Repository, Structure, Status,
-                     StatusList, Project, Entity, Studio)
+                     Project, Entity, Studio)
 
+from stalker_pyramid import lookups
+from stalker_pyramid.db import queries
 from stalker_pyramid.views import (get_date, get_date_range,
                                    get_logged_in_user,
-                                   milliseconds_since_epoch)
+                                   milliseconds_since_epoch, PermissionChecker,
+                                   get_entity_type)
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -89,8 +93,7 @@ def create_project(request):
         # lets create the project
 
         # status list
-        status_list = StatusList.query \
-            .filter_by(target_entity_type='Project').first()
+        status_list = lookups.get_status_list('Project')
 
         try:
             new_project = Project(
@@ -156,7 +159,7 @@ def update_project(request):
     lead = User.query.filter_by(id=lead_id).first()
 
     status_id = request.params.get('status_id', -1)
-    status = Status.query.filter_by(id=status_id).first()
+    status = lookups.get_status_by_id(status_id)
 
     # get the dates
     start = get_date(request, 'start')
@@ -257,6 +260,53 @@ def get_project_lead(request):
     return lead_data
 
 
+queries.register(
+    'get_project_tasks_today',
+    """select "Tasks".id,
+           "SimpleEntities".name,
+           array_agg(distinct("SimpleEntities_Resource".id)),
+           array_agg(distinct("SimpleEntities_Resource".name)),
+           "SimpleEntities_Status".name,
+           "SimpleEntities_Status".html_class,
+           (coalesce("Task_TimeLogs".duration, 0.0))::float /
+           ("Tasks".schedule_timing * (case "Tasks".schedule_unit
+                when 'min' then 60
+                when 'h' then :working_seconds_per_hour
+                when 'd' then :working_seconds_per_day
+                when 'w' then :working_seconds_per_week
+                when 'm' then :working_seconds_per_month
+                when 'y' then :working_seconds_per_year
+                else 0
+            end)) * 100.0 as percent_complete
+    from "Tasks"
+        join "SimpleEntities" on "Tasks".id = "SimpleEntities".id
+        join "Task_Resources" on "Tasks".id = "Task_Resources".task_id
+        join "SimpleEntities" as "SimpleEntities_Resource" on "Task_Resources".resource_id = "SimpleEntities_Resource".id
+        join "Statuses" on "Tasks".status_id = "Statuses".id
+        join "SimpleEntities" as "SimpleEntities_Status" on "Statuses".id = "SimpleEntities_Status".id
+        left outer join "Task_TimeLog_Durations" as "Task_TimeLogs" on "Task_TimeLogs".task_id = "Tasks".id
+        left outer join "TimeLogs" on "Tasks".id = "TimeLogs".task_id
+    where "Tasks".project_id = :project_id
+        %(action_condition)s
+    group by "Tasks".id,
+         "SimpleEntities".name,
+         "SimpleEntities_Status".name,
+         "SimpleEntities_Status".html_class,
+         "Task_TimeLogs".duration,
+         "Tasks".schedule_timing,
+         "Tasks".schedule_unit
+    """,
+    project_id='integer',
+    start_of_today='timestamp',
+    end_of_today='timestamp',
+    working_seconds_per_hour='integer',
+    working_seconds_per_day='integer',
+    working_seconds_per_week='integer',
+    working_seconds_per_month='integer',
+    working_seconds_per_year='integer'
+)
+
+
 @view_config(
     route_name='get_project_tasks_today',
     renderer='json'
@@ -276,58 +326,17 @@ def get_project_tasks_today(request):
 
     start = time.time()
 
-    sql_query = """select "Tasks".id,
-           "SimpleEntities".name,
-           array_agg(distinct("SimpleEntities_Resource".id)),
-           array_agg(distinct("SimpleEntities_Resource".name)),
-           "SimpleEntities_Status".name,
-           "SimpleEntities_Status".html_class,
-           (coalesce("Task_TimeLogs".duration, 0.0))::float /
-           ("Tasks".schedule_timing * (case "Tasks".schedule_unit
-                when 'min' then 60
-                when 'h' then %(working_seconds_per_hour)s
-                when 'd' then %(working_seconds_per_day)s
-                when 'w' then %(working_seconds_per_week)s
-                when 'm' then %(working_seconds_per_month)s
-                when 'y' then %(working_seconds_per_year)s
-                else 0
-            end)) * 100.0 as percent_complete
-    from "Tasks"
-        join "SimpleEntities" on "Tasks".id = "SimpleEntities".id
-        join "Task_Resources" on "Tasks".id = "Task_Resources".task_id
-        join "SimpleEntities" as "SimpleEntities_Resource" on "Task_Resources".resource_id = "SimpleEntities_Resource".id
-        join "Statuses" on "Tasks".status_id = "Statuses".id
-        join "SimpleEntities" as "SimpleEntities_Status" on "Statuses".id = "SimpleEntities_Status".id
-        left outer join (
-            select
-                "TimeLogs".task_id,
-                extract(epoch from sum("TimeLogs".end::timestamp AT TIME ZONE 'UTC' - "TimeLogs".start::timestamp AT TIME ZONE 'UTC')) as duration
-            from "TimeLogs"
-            group by task_id
-        ) as "Task_TimeLogs" on "Task_TimeLogs".task_id = "Tasks".id
-        left outer join "TimeLogs" on "Tasks".id = "TimeLogs".task_id
-        """
-
+    action_condition = ''
     if action == 'progress':
-        sql_query += """where
-            "Tasks".computed_start::timestamp AT TIME ZONE 'UTC' < '%(end_of_today)s' and
-            "Tasks".computed_end::timestamp AT TIME ZONE 'UTC' > '%(start_of_today)s'"""
+        action_condition = """and
+            "Tasks".computed_start::timestamp AT TIME ZONE 'UTC' < :end_of_today and
+            "Tasks".computed_end::timestamp AT TIME ZONE 'UTC' > :start_of_today"""
     elif action == 'end':
-        sql_query += """where
-            "Tasks".computed_end::timestamp AT TIME ZONE 'UTC' > '%(start_of_today)s' and
-            "Tasks".computed_end::timestamp AT TIME ZONE 'UTC' <= '%(end_of_today)s'
+        action_condition = """and
+            "Tasks".computed_end::timestamp AT TIME ZONE 'UTC' > :start_of_today and
+            "Tasks".computed_end::timestamp AT TIME ZONE 'UTC' <= :end_of_today
             """
 
-    sql_query += """   and "Tasks".project_id = %(project_id)s
-        group by "Tasks".id,
-             "SimpleEntities".name,
-             "SimpleEntities_Status".name,
-             "SimpleEntities_Status".html_class,
-             "Task_TimeLogs".duration,
-             "Tasks".schedule_timing,
-             "Tasks".schedule_unit
-        """
-
     studio = Studio.query.first()
     assert isinstance(studio, Studio)
 
@@ -337,20 +346,18 @@ def get_project_tasks_today(request):
     ws_per_month = ws_per_week * 4
     ws_per_year = studio.yearly_working_days * ws_per_day
 
-    sql_query = sql_query % {
-        'project_id': project_id,
-        'start_of_today': start_of_today.strftime('%Y-%m-%d %H:%M:%S'),
-        'end_of_today': end_of_today.strftime('%Y-%m-%d %H:%M:%S'),
-        'working_seconds_per_hour': ws_per_hour,
-        'working_seconds_per_day': ws_per_day,
-        'working_seconds_per_week': ws_per_week,
-        'working_seconds_per_month': ws_per_month,
-        'working_seconds_per_year': ws_per_year
-    }
-
-    logger.debug('sql_query : %s' % sql_query)
-
-    result = DBSession.connection().execute(sql_query)
+    result = queries.execute(
+        'get_project_tasks_today',
+        {'action_condition': action_condition},
+        project_id=project_id,
+        start_of_today=start_of_today,
+        end_of_today=end_of_today,
+        working_seconds_per_hour=ws_per_hour,
+        working_seconds_per_day=ws_per_day,
+        working_seconds_per_week=ws_per_week,
+        working_seconds_per_month=ws_per_month,
+        working_seconds_per_year=ws_per_year
+    )
 
     data = [
         {
@@ -372,3 +379,118 @@ def get_project_tasks_today(request):
     logger.debug('%s rows took : %s seconds' % (len(data), (end - start)))
 
     return data
+
+
+queries.register(
+    'get_project_summary',
+    """with task_counts as (
+        select
+            "SimpleEntities".entity_type,
+            "Tasks".status_id,
+            not exists (
+                select 1 from "Tasks" as "Child_Tasks"
+                where "Child_Tasks".parent_id = "Tasks".id
+            ) as is_leaf,
+            count(*) as count
+        from "Tasks"
+        join "SimpleEntities" on "Tasks".id = "SimpleEntities".id
+        where "Tasks".project_id = :project_id
+        group by 1, 2, 3
+    )
+    select
+        coalesce(sum(count), 0)::integer as tasks_count,
+        coalesce(sum(count) filter (where entity_type = 'Asset'), 0)::integer as assets_count,
+        coalesce(sum(count) filter (where entity_type = 'Sequence'), 0)::integer as sequences_count,
+        coalesce(sum(count) filter (where entity_type = 'Shot'), 0)::integer as shots_count,
+        array_agg(status_id) filter (where is_leaf) as leaf_status_ids,
+        array_agg(count) filter (where is_leaf) as leaf_counts,
+        (
+            select count("Users".id)
+            from "SimpleEntities"
+            join "Users" on "SimpleEntities".id = "Users".id
+            join "Project_Users" on "Users".id = "Project_Users".user_id
+            where "Project_Users".project_id = :project_id
+        ) as users_count,
+        (
+            select count(*) filter (where "Ticket_Statuses".code != 'CLS')
+            from "Tickets"
+            join "Statuses" as "Ticket_Statuses" on "Tickets".status_id = "Ticket_Statuses".id
+            where "Tickets".project_id = :project_id
+        ) as open_tickets_count,
+        (
+            select count(distinct "Links".id)
+            from "Task_References"
+            join "Task_Ancestors" as child_tasks on child_tasks.descendant_id = "Task_References".task_id
+            join "Links" on "Task_References".link_id = "Links".id
+            join "SimpleEntities" on "Links".id = "SimpleEntities".id
+            join "Entity_Tags" on "Links".id = "Entity_Tags".entity_id
+            where child_tasks.ancestor_id = :project_id
+        ) as references_count,
+        (
+            select count(*)
+            from "Reviews"
+            join "Tasks" as "Review_Tasks" on "Review_Tasks".id = "Reviews".task_id
+            join "Statuses" as "Reviews_Statuses" on "Reviews_Statuses".id = "Reviews".status_id
+            where "Review_Tasks".project_id = :project_id
+                and "Reviews_Statuses".code = 'NEW'
+                and exists (
+                    select 1 from "User_Departments"
+                    where "User_Departments".uid = "Reviews".reviewer_id
+                )
+        ) as reviews_count
+    from task_counts
+    """,
+    project_id='integer'
+)
+
+
+@view_config(
+    route_name='get_project_summary',
+    renderer='json'
+)
+def get_project_summary(request):
+    """returns the counts shown in the sidebar and the dashboard of a project
+    in one go, the tasks_stats are in the get_entity_tasks_stats format
+    """
+    project_id = request.matchdict.get('id', -1)
+
+    if get_entity_type(project_id) != 'Project':
+        return HTTPNotFound('There is no project with id: %s' % project_id)
+
+    r = queries.execute(
+        'get_project_summary',
+        project_id=project_id
+    ).fetchone()
+
+    leaf_counts = {}
+    for status_id, count in zip(r[4] or [], r[5] or []):
+        if status_id is not None:
+            leaf_counts[status_id] = leaf_counts.get(status_id, 0) + count
+
+    tasks_stats = []
+    for status_id, count in sorted(leaf_counts.items()):
+        status = lookups.get_status_by_id(status_id)
+        if status is None:
+            continue
+        tasks_stats.append({
+            'tasks_count': count,
+            'status_id': status_id,
+            'status_code': status.code,
+            'status_name': status.name,
+            'status_color': status.html_class,
+            'status_icon': ''
+        })
+
+    has_permission = PermissionChecker(request)
+
+    return {
+        'tasks_count': r[0],
+        'assets_count': r[1] if has_permission('List_Asset') else None,
+        'sequences_count': r[2],
+        'shots_count': r[3],
+        'users_count': r[6] if has_permission('List_User') else None,
+        'open_tickets_count': r[7],
+        'references_count': r[8],
+        'reviews_count': r[9],
+        'tasks_stats': tasks_stats
+    }
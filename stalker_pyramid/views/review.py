@@ -23,17 +23,36 @@ import transaction
 from pyramid.response import Response
 from pyramid.view import view_config
 
-from stalker.db import DBSession
 from stalker import (User, Task, Project)
 
+from stalker_pyramid import derivatives
+from stalker_pyramid.db import queries
 from stalker_pyramid.views import get_logged_in_user
-from stalker_pyramid.views.task import query_of_tasks_hierarchical_name_table
 
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
 
+queries.register(
+    'get_task_reviewers',
+    """
+        select
+            "Reviewers".name as reviewers_name,
+            "Reviewers".id as reviewers_id
+
+        from "Reviews"
+            join "Tasks" as "Review_Tasks" on "Review_Tasks".id = "Reviews".task_id
+            join "SimpleEntities" as "Reviewers" on "Reviewers".id = "Reviews".reviewer_id
+
+        where "Review_Tasks".id = :task_id
+
+        group by "Reviewers".id, "Reviewers".name
+    """,
+    task_id='integer'
+)
+
+
 @view_config(
     route_name='get_task_reviewers',
     renderer='json'
@@ -50,29 +69,7 @@ def get_task_reviewers(request):
         transaction.abort()
         return Response('There is no task with id: %s' % task_id, 500)
 
-    sql_query = """
-        select
-            "Reviewers".name as reviewers_name,
-            "Reviewers".id as reviewers_id
-
-        from "Reviews"
-            join "Tasks" as "Review_Tasks" on "Review_Tasks".id = "Reviews".task_id
-            join "SimpleEntities" as "Reviewers" on "Reviewers".id = "Reviews".reviewer_id
-
-        %(where_conditions)s
-
-        group by "Reviewers".id, "Reviewers".name
-    """
-
-    where_conditions = """where "Review_Tasks".id = %(task_id)s""" % {
-        'task_id': task.id
-    }
-
-    logger.debug('where_conditions %s ' % where_conditions)
-
-    sql_query = sql_query % {'where_conditions': where_conditions}
-
-    result = DBSession.connection().execute(sql_query)
+    result = queries.execute('get_task_reviewers', task_id=task.id)
 
     return_data = [
         {
@@ -101,9 +98,9 @@ def get_task_reviews(request):
         transaction.abort()
         return Response('There is no task with id: %s' % task_id, 500)
 
-    where_conditions = """where "Review_Tasks".id = %(task_id)s""" %{'task_id': task.id}
+    where_conditions = """where "Review_Tasks".id = :task_id"""
 
-    return get_reviews(request,where_conditions)
+    return get_reviews(request, where_conditions, task_id=task.id)
 
 
 @view_config(
@@ -122,10 +119,10 @@ def get_task_reviews_count(request):
         transaction.abort()
         return Response('There is no task with id: %s' % task_id, 500)
 
-    where_conditions = """where "Review_Tasks".id = %(task_id)s
-    and "Reviews_Statuses".code ='NEW' """ % {'task_id': task_id}
+    where_conditions = """where "Review_Tasks".id = :task_id
+    and "Reviews_Statuses".code ='NEW' """
 
-    reviews = get_reviews(request, where_conditions)
+    reviews = get_reviews(request, where_conditions, task_id=task_id)
 
     return len(reviews)
 
@@ -146,7 +143,7 @@ def get_task_last_reviews(request):
         transaction.abort()
         return Response('There is no task with id: %s' % task_id, 500)
 
-    where_condition1 = """where "Review_Tasks".id = %(task_id)s""" % {'task_id':task_id}
+    where_condition1 = """where "Review_Tasks".id = :task_id"""
     where_condition2 = ''
 
     logger.debug("task.status.code : %s" % task.status.code)
@@ -154,7 +151,7 @@ def get_task_last_reviews(request):
         where_condition2 =""" and "Review_Tasks".review_number +1 = "Reviews".review_number"""
         where_conditions = '%s %s' % (where_condition1, where_condition2)
 
-        reviews = get_reviews(request,where_conditions)
+        reviews = get_reviews(request, where_conditions, task_id=task_id)
 
     else:
         # where_condition2 =""" and "Review_Tasks".review_number = "Reviews".review_number"""
@@ -171,8 +168,9 @@ def get_task_last_reviews(request):
                 'reviewer_id': responsible.id,
                 'reviewer_name': responsible.name,
                 'reviewer_thumbnail_full_path':
-                responsible.thumbnail.full_path
-                if responsible.thumbnail else None,
+                derivatives.get_derivative_path(
+                    responsible.thumbnail_id, 'avatar'
+                ),
                 'reviewer_department': responsible.departments[0].name
             }
             for responsible in task.responsible
@@ -197,9 +195,9 @@ def get_user_reviews(request):
         transaction.abort()
         return Response('There is no user with id: %s' % reviewer_id, 500)
 
-    where_conditions = """where "Reviews".reviewer_id = %(reviewer_id)s"""% {'reviewer_id':reviewer_id}
+    where_conditions = """where "Reviews".reviewer_id = :reviewer_id"""
 
-    return get_reviews(request, where_conditions)
+    return get_reviews(request, where_conditions, reviewer_id=reviewer_id)
 
 
 @view_config(
@@ -218,10 +216,10 @@ def get_user_reviews_count(request):
         transaction.abort()
         return Response('There is no user with id: %s' % reviewer_id, 500)
 
-    where_conditions = """where "Reviews".reviewer_id = %(reviewer_id)s
-    and "Reviews_Statuses".code ='NEW' """ % {'reviewer_id': reviewer_id}
+    where_conditions = """where "Reviews".reviewer_id = :reviewer_id
+    and "Reviews_Statuses".code ='NEW' """
 
-    reviews = get_reviews(request, where_conditions)
+    reviews = get_reviews(request, where_conditions, reviewer_id=reviewer_id)
 
     return len(reviews)
 
@@ -242,10 +240,9 @@ def get_project_reviews(request):
         transaction.abort()
         return Response('There is no user with id: %s' % project_id, 500)
 
-    where_conditions = 'where "Review_Tasks".project_id = %(project_id)s' %\
-                       {'project_id': project_id}
+    where_conditions = 'where "Review_Tasks".project_id = :project_id'
 
-    return get_reviews(request, where_conditions)
+    return get_reviews(request, where_conditions, project_id=project_id)
 
 
 @view_config(
@@ -264,22 +261,17 @@ def get_project_reviews_count(request):
         transaction.abort()
         return Response('There is no user with id: %s' % project_id, 500)
 
-    where_conditions =  """where "Review_Tasks".project_id = %(project_id)s
-    and "Reviews_Statuses".code ='NEW' """ % {'project_id':project_id}
+    where_conditions =  """where "Review_Tasks".project_id = :project_id
+    and "Reviews_Statuses".code ='NEW' """
 
-    reviews = get_reviews(request,where_conditions)
+    reviews = get_reviews(request, where_conditions, project_id=project_id)
 
     return len(reviews)
 
 
-def get_reviews(request, where_conditions):
-    """TODO: add docstring
+queries.register(
+    'get_reviews',
     """
-    logger.debug('get_reviews is running')
-
-    logged_in_user = get_logged_in_user(request)
-
-    sql_query = """
     select
         "Reviews".review_number as review_number,
         "Reviews".id as review_id,
@@ -291,7 +283,7 @@ def get_reviews(request, where_conditions):
         "Review_Tasks".review_number as task_review_number,
         "Reviews".reviewer_id as reviewer_id,
         "Reviewers_SimpleEntities".name as reviewer_name,
-        "Reviewers_SimpleEntities_Links".full_path as reviewer_thumbnail_path,
+        "Reviewers_SimpleEntities".thumbnail_id as reviewer_thumbnail_id,
         array_agg("Reviewer_Departments_SimpleEntities".name) as reviewer_departments,
         extract(epoch from"Reviews_Simple_Entities".date_created::timestamp AT TIME ZONE 'UTC') * 1000 as date_created
 
@@ -303,9 +295,7 @@ def get_reviews(request, where_conditions):
         join "SimpleEntities" as "Reviewers_SimpleEntities" on "Reviewers_SimpleEntities".id = "Reviews".reviewer_id
         join "User_Departments" as "Reviewers_Departments" on "Reviewers_Departments".uid = "Reviews".reviewer_id
         join "SimpleEntities" as "Reviewer_Departments_SimpleEntities" on "Reviewer_Departments_SimpleEntities".id = "Reviewers_Departments".did
-        left join (%(tasks_hierarchical_name_table)s) as "ParentTasks" on "Review_Tasks".id = "ParentTasks".id
-
-        left outer join "Links" as "Reviewers_SimpleEntities_Links" on "Reviewers_SimpleEntities_Links".id = "Reviewers_SimpleEntities".thumbnail_id
+        left join "Task_Hierarchical_Names" as "ParentTasks" on "Review_Tasks".id = "ParentTasks".id
 
     %(where_conditions)s
 
@@ -322,16 +312,35 @@ def get_reviews(request, where_conditions):
         "Review_Tasks".review_number,
         "Reviews".reviewer_id,
         "Reviewers_SimpleEntities".name,
-        "Reviewers_SimpleEntities_Links".full_path
+        "Reviewers_SimpleEntities".thumbnail_id
 
     order by "Reviews_Simple_Entities".date_created desc
+    """,
+    task_id='integer',
+    reviewer_id='integer',
+    project_id='integer'
+)
+
+
+def get_reviews(request, where_conditions, **values):
+    """Returns the reviews selected with the given where conditions.
+
+    :param request: Request object
+    :param where_conditions: The where clause of the query, the values are
+      given as bound parameters like ``:task_id``.
+    :param values: The values of the bound parameters in the where clause.
     """
+    logger.debug('get_reviews is running')
 
-    logger.debug('where_conditions: %s ' % where_conditions)
+    logged_in_user = get_logged_in_user(request)
 
-    sql_query = sql_query % {'where_conditions': where_conditions, 'tasks_hierarchical_name_table': query_of_tasks_hierarchical_name_table()}
+    logger.debug('where_conditions: %s ' % where_conditions)
 
-    result = DBSession.connection().execute(sql_query)
+    result = queries.execute(
+        'get_reviews',
+        {'where_conditions': where_conditions},
+        **values
+    )
 
     return_data = [
         {
@@ -345,7 +354,8 @@ def get_reviews(request, where_conditions):
             'task_review_number': r[7],
             'reviewer_id': r[8],
             'reviewer_name': r[9],
-            'reviewer_thumbnail_full_path':r[10],
+            'reviewer_thumbnail_full_path':
+                derivatives.get_derivative_path(r[10], 'avatar'),
             'reviewer_department':r[11],
             'date_created':r[12],
             'is_reviewer':'1' if logged_in_user.id == r[8] else None
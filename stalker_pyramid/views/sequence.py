@@ -24,8 +24,10 @@ from pyramid.httpexceptions import HTTPServerError, HTTPOk
 from pyramid.view import view_config
 
 from stalker.db import DBSession
-from stalker import Project, StatusList, Status, Sequence, Entity
+from stalker import Project, Sequence, Entity
 
+from stalker_pyramid import lookups
+from stalker_pyramid.db import queries
 from stalker_pyramid.views import get_logged_in_user, milliseconds_since_epoch
 
 logger = logging.getLogger(__name__)
@@ -44,7 +46,7 @@ def create_sequence(request):
     code = request.params.get('code')
 
     status_id = request.params.get('status_id')
-    status = Status.query.filter_by(id=status_id).first()
+    status = lookups.get_status_by_id(status_id)
 
     project_id = request.params.get('project_id')
     project = Project.query.filter_by(id=project_id).first()
@@ -56,9 +58,7 @@ def create_sequence(request):
         description = request.params.get('description')
 
         # get the status_list
-        status_list = StatusList.query.filter_by(
-            target_entity_type='Sequence'
-        ).first()
+        status_list = lookups.get_status_list('Sequence')
 
         # there should be a status_list
         # TODO: you should think about how much possible this is
@@ -103,7 +103,7 @@ def update_sequence(request):
     code = request.params.get('code')
 
     status_id = request.params.get('status_id')
-    status = Status.query.filter_by(id=status_id).first()
+    status = lookups.get_status_by_id(status_id)
 
     if sequence and code and name and status:
         # get descriptions
@@ -150,6 +150,17 @@ def get_sequences(request):
     ]
 
 
+queries.register(
+    'get_project_sequences_count',
+    """select
+        count(1)
+    from "Sequences"
+        join "Tasks" on "Sequences".id = "Tasks".id
+    where "Tasks".project_id = :project_id""",
+    project_id='integer'
+)
+
+
 @view_config(
     route_name='get_project_sequences_count',
     renderer='json'
@@ -163,13 +174,10 @@ def get_project_sequences_count(request):
     """
     project_id = request.matchdict.get('id', -1)
 
-    sql_query = """select
-        count(1)
-    from "Sequences"
-        join "Tasks" on "Sequences".id = "Tasks".id
-    where "Tasks".project_id = %s""" % project_id
-
-    return DBSession.connection().execute(sql_query).fetchone()[0]
+    return queries.execute(
+        'get_project_sequences_count',
+        project_id=project_id
+    ).fetchone()[0]
 
 
 @view_config(
@@ -23,11 +23,15 @@ from pyramid.httpexceptions import HTTPServerError, HTTPOk
 from pyramid.view import view_config
 
 from stalker.db import DBSession
-from stalker import Sequence, StatusList, Status, Shot, Project, Entity
+from stalker import Sequence, Shot, Project, Entity
 
 import logging
 from webob import Response
-from stalker_pyramid.views import get_logged_in_user, PermissionChecker
+from stalker_pyramid import lookups
+from stalker_pyramid.db import queries
+from stalker_pyramid.views import (get_logged_in_user, PermissionChecker,
+                                   get_range, get_order_by, get_content_range,
+                                   get_total_count)
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -45,7 +49,7 @@ def create_shot(request):
     code = request.params.get('code')
 
     status_id = request.params.get('status_id')
-    status = Status.query.filter_by(id=status_id).first()
+    status = lookups.get_status_by_id(status_id)
 
     project_id = request.params.get('project_id')
     project = Project.query.filter_by(id=project_id).first()
@@ -59,9 +63,7 @@ def create_shot(request):
         sequence = Sequence.query.filter_by(id=sequence_id).first()
 
         # get the status_list
-        status_list = StatusList.query.filter_by(
-            target_entity_type='Shot'
-        ).first()
+        status_list = lookups.get_status_list('Shot')
 
         # there should be a status_list
         # TODO: you should think about how much possible this is
@@ -110,7 +112,7 @@ def update_shot(request):
     cut_out = int(request.params.get('cut_out', 1))
 
     status_id = request.params.get('status_id')
-    status = Status.query.filter_by(id=status_id).first()
+    status = lookups.get_status_by_id(status_id)
 
     if shot and code and name and status:
         # get descriptions
@@ -142,15 +144,9 @@ def update_shot(request):
     return HTTPOk()
 
 
-@view_config(
-    route_name='get_shots_children_task_type',
-    renderer='json'
-)
-def get_shots_children_task_type(request):
-    """returns the Task Types defined under the Shot container
-    """
-
-    sql_query = """select
+queries.register(
+    'get_shots_children_task_type',
+    """select
         "SimpleEntities".id as type_id,
         "SimpleEntities".name as type_name
     from "SimpleEntities"
@@ -159,8 +155,18 @@ def get_shots_children_task_type(request):
     join "Shots" on "Tasks".parent_id = "Shots".id
     group by "SimpleEntities".id, "SimpleEntities".name
     order by "SimpleEntities".name"""
+)
+
 
-    result = DBSession.connection().execute(sql_query)
+@view_config(
+    route_name='get_shots_children_task_type',
+    renderer='json'
+)
+def get_shots_children_task_type(request):
+    """returns the Task Types defined under the Shot container
+    """
+
+    result = queries.execute('get_shots_children_task_type')
 
     return_data = [
         {
@@ -185,6 +191,17 @@ def get_shots_children_task_type(request):
     return resp
 
 
+queries.register(
+    'get_shots_count',
+    """select
+        count(1)
+    from "Shots"
+        join "Tasks" on "Shots".id = "Tasks".id
+    where "Tasks".project_id = :project_id""",
+    project_id='integer'
+)
+
+
 @view_config(
     route_name='get_entity_shots_count',
     renderer='json'
@@ -198,34 +215,40 @@ def get_shots_count(request):
     """
     project_id = request.matchdict.get('id', -1)
 
-    sql_query = """select
-        count(1)
-    from "Shots"
-        join "Tasks" on "Shots".id = "Tasks".id
-    where "Tasks".project_id = %s""" % project_id
+    return queries.execute(
+        'get_shots_count',
+        project_id=project_id
+    ).fetchone()[0]
 
-    return DBSession.connection().execute(sql_query).fetchone()[0]
 
+# the shots which have child tasks, used for paging and counting
+shots_with_tasks_sql_query = """select
+    %(columns)s
+from "Shots"
+join "SimpleEntities" as "Shot_SimpleEntities" on "Shots".id = "Shot_SimpleEntities".id
+left join "Shot_Sequences" on "Shot_Sequences".shot_id = "Shots".id
+where exists (
+    select 1 from "Tasks" where "Tasks".parent_id = "Shots".id
+) and %(where_condition)s
+%(group_by)s
+"""
 
-@view_config(
-    route_name='get_entity_shots',
-    renderer='json'
-)
-@view_config(
-    route_name='get_project_shots',
-    renderer='json'
-)
-def get_shots(request):
-    """returns all the Shots of the given Project
-    """
-    entity_id = request.matchdict.get('id', -1)
-    entity = Entity.query.filter_by(id=entity_id).first()
 
-    shot_id = request.params.get('entity_id', None)
+queries.register(
+    'get_shots_with_tasks_count',
+    shots_with_tasks_sql_query % {
+        'columns': 'count(distinct "Shots".id)',
+        'where_condition': '%(where_condition)s',
+        'group_by': ''
+    },
+    sequence_id='integer',
+    shot_id='integer'
+)
 
-    logger.debug('get_shots function starts : ')
 
-    sql_query = """select
+queries.register(
+    'get_shots',
+    """select
     "Shots".id as shot_id,
     "Shot_SimpleEntities".name as shot_name,
     "Shot_SimpleEntities".description as shot_description,
@@ -257,7 +280,8 @@ def get_shots(request):
                 end)) * 100.0
         )) as percent_complete,
     "Shot_Sequences".sequence_id as sequence_id,
-    "Shot_Sequences_SimpleEntities".name as sequence_name
+    "Shot_Sequences_SimpleEntities".name as sequence_name,
+    %(total_count)s as total_count
 from "Tasks"
 join "Shots" on "Shots".id = "Tasks".parent_id
 join "SimpleEntities" as "Shot_SimpleEntities" on "Shots".id = "Shot_SimpleEntities".id
@@ -288,14 +312,9 @@ join "Statuses" as "Task_Statuses" on "Tasks".status_id = "Task_Statuses".id
 join "SimpleEntities" as "Task_Statuses_SimpleEntities" on "Task_Statuses_SimpleEntities".id = "Tasks".status_id
 left join "Shot_Sequences" on "Shot_Sequences".shot_id = "Shots".id
 left join "SimpleEntities" as "Shot_Sequences_SimpleEntities" on "Shot_Sequences_SimpleEntities".id = "Shot_Sequences".sequence_id
-left outer join (
-            select
-                "TimeLogs".task_id,
-                extract(epoch from sum("TimeLogs".end::timestamp AT TIME ZONE 'UTC' - "TimeLogs".start::timestamp AT TIME ZONE 'UTC')) as duration
-            from "TimeLogs"
-            group by task_id
-        ) as "Task_TimeLogs" on "Task_TimeLogs".task_id = "Tasks".id
-%(where_condition)s
+left outer join "Task_TimeLog_Durations" as "Task_TimeLogs" on "Task_TimeLogs".task_id = "Tasks".id
+%(page_join)s
+where %(where_condition)s
 group by
     "Shots".id,
     "Shot_SimpleEntities".name,
@@ -305,22 +324,77 @@ group by
     "Distinct_Shot_Statuses".shot_status_html_class,
     "Shot_Sequences".sequence_id,
     "Shot_Sequences_SimpleEntities".name
-order by "Shot_SimpleEntities".name
-"""
+%(order_by)s
+""",
+    sequence_id='integer',
+    shot_id='integer',
+    offset='integer',
+    limit='integer'
+)
 
-    # set the content range to prevent JSONRest Store to query the data twice
-    content_range = '%s-%s/%s'
-    where_condition = ''
+
+@view_config(
+    route_name='get_entity_shots',
+    renderer='json'
+)
+@view_config(
+    route_name='get_project_shots',
+    renderer='json'
+)
+def get_shots(request):
+    """returns all the Shots of the given Project
+    """
+    entity_id = request.matchdict.get('id', -1)
+    entity = Entity.query.filter_by(id=entity_id).first()
+
+    shot_id = request.params.get('entity_id', None)
+
+    logger.debug('get_shots function starts : ')
+
+    where_condition = 'true'
 
     if entity.entity_type == 'Sequence':
-        where_condition = 'where "Shot_Sequences".sequence_id = %s' % entity_id
+        where_condition = '"Shot_Sequences".sequence_id = :sequence_id'
 
     elif entity.entity_type == 'Project':
-        where_condition = ''
+        where_condition = 'true'
 
 
     if shot_id:
-        where_condition = 'where "Shots".id = %(shot_id)s'%({'shot_id':shot_id})
+        where_condition = '"Shots".id = :shot_id'
+
+    offset, limit = get_range(request)
+    order_by = get_order_by(
+        request,
+        {
+            'id': '"Shots".id',
+            'name': '"Shot_SimpleEntities".name'
+        },
+        'order by "Shot_SimpleEntities".name'
+    )
+
+    values = {
+        'sequence_id': entity_id,
+        'shot_id': shot_id,
+        'offset': offset,
+        'limit': limit
+    }
+
+    # the shots are counted in the same query with a window function
+    total_count_column = 'count(*) over ()'
+    page_join = ''
+    if limit is not None:
+        # only get the shots in the requested range, they are counted
+        # before the limit is applied
+        page_join = 'join (%s) as "Shot_Page" on "Shots".id = "Shot_Page".id' % (
+            shots_with_tasks_sql_query % {
+                'columns': '"Shots".id, count(*) over () as total_count',
+                'where_condition': where_condition,
+                'group_by': 'group by "Shots".id, "Shot_SimpleEntities".name '
+                            '%s limit :limit offset :offset' % order_by
+            }
+        )
+        total_count_column = 'max("Shot_Page".total_count)'
 
 
     update_shot_permission = \
@@ -328,15 +402,23 @@ order by "Shot_SimpleEntities".name
     delete_shot_permission = \
         PermissionChecker(request)('Delete_Shot')
 
-    sql_query = sql_query % {'where_condition': where_condition}
     logger.debug('entity_id : %s' % entity_id)
 
     # convert to dgrid format right here in place
-    result = DBSession.connection().execute(sql_query)
+    rows = queries.execute(
+        'get_shots',
+        {
+            'where_condition': where_condition,
+            'order_by': order_by,
+            'page_join': page_join,
+            'total_count': total_count_column
+        },
+        **values
+    ).fetchall()
 
     return_data = []
 
-    for r in result.fetchall():
+    for r in rows:
         r_data = {
             'id': r[0],
             'name': r[1],
@@ -382,7 +464,18 @@ order by "Shot_SimpleEntities".name
         return_data.append(r_data)
 
     shot_count = len(return_data)
-    content_range = content_range % (0, shot_count - 1, shot_count)
+    total_count = get_total_count(
+        rows,
+        offset,
+        lambda: queries.execute(
+            'get_shots_with_tasks_count',
+            {'where_condition': where_condition},
+            **values
+        ).fetchone()[0]
+    )
+
+    # set the content range to prevent JSONRest Store to query the data twice
+    content_range = get_content_range(offset, shot_count, total_count)
 
     resp = Response(
         json_body=return_data
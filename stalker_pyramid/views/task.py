@@ -33,17 +33,21 @@ from pyramid_mailer.message import Message, Attachment
 from sqlalchemy.exc import IntegrityError
 
 from stalker.db import DBSession
-from stalker import (defaults, User, Task, Entity, Project, StatusList,
-                     Status, TaskJugglerScheduler, Studio, Asset, Shot,
-                     Sequence, Ticket, Type, Note, Review)
+from stalker import (defaults, User, Task, Entity, Project, Status,
+                     TaskJugglerScheduler, Studio, Asset, Shot, Sequence,
+                     Ticket, Note, Review)
 from stalker.exceptions import CircularDependencyError, StatusError
 
+from stalker_pyramid import lookups
+from stalker_pyramid.db import task_hierarchy, task_duplicate, queries
 from stalker_pyramid.views import (PermissionChecker, get_logged_in_user,
                                    get_multi_integer, milliseconds_since_epoch,
                                    StdErrToHTMLConverter,
                                    multi_permission_checker,
                                    dummy_email_address, local_to_utc,
-                                   get_user_os)
+                                   get_user_os, get_range, get_order_by,
+                                   get_content_range, get_total_count,
+                                   stream_json, get_time_window)
 from stalker_pyramid.views.link import (replace_img_data_with_links,
                                         convert_file_link_to_full_path)
 from stalker_pyramid.views.type import query_type
@@ -53,81 +57,25 @@ logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
 
-def query_of_tasks_hierarchical_name_table():
-    """gives query string of finding parents names by hierarchically
-    """
-    query = """
-    (
-        SELECT
-            task_parents.id,
-            "Task_SimpleEntities".name || ' (' || "Projects".code || ' | ' || task_parents.parent_names || ')' as parent_names
-        FROM (
-            SELECT
-                task_parents.id,
-                array_agg(task_parents.parent_id) as parent_ids,
-                array_agg(task_parents.n) as n,
-                array_to_string(
-                    array_agg(task_parents.parent_name),
-                    ' | '
-                ) as parent_names
-            FROM (
-                WITH RECURSIVE parent_ids(id, parent_id, n) as (
-                        SELECT task.id, task.parent_id, 0
-                        FROM "Tasks" AS task
-                        WHERE task.parent_id IS NOT NULL
-                    UNION ALL
-                        SELECT task.id, parent.parent_id, parent.n + 1
-                        FROM "Tasks" task, parent_ids parent
-                        WHERE task.parent_id = parent.id
-                )
-                SELECT
-                    parent_ids.id as id,
-                    parent_ids.n as n,
-                    parent_ids.parent_id AS parent_id,
-                    "ParentTask_SimpleEntities".name as parent_name
-                FROM parent_ids
-                JOIN "SimpleEntities" as "ParentTask_SimpleEntities" ON parent_ids.parent_id = "ParentTask_SimpleEntities".id
-                ORDER BY id, parent_ids.n DESC
-            ) as task_parents
-            GROUP BY task_parents.id
-        ) as task_parents
-        JOIN "Tasks" ON task_parents.id = "Tasks".id
-        JOIN "Projects" ON "Tasks".project_id = "Projects".id
-        JOIN "SimpleEntities" as "Task_SimpleEntities" ON "Tasks".id = "Task_SimpleEntities".id
-    )
-    UNION
-    (
-        SELECT
-            "Tasks".id,
-            "Task_SimpleEntities".name || ' (' || "Projects".code || ')' as parent_names
-        FROM "Tasks"
-        JOIN "Projects" ON "Tasks".project_id = "Projects".id
-        JOIN "SimpleEntities" as "Task_SimpleEntities" on "Tasks".id = "Task_SimpleEntities".id
-        WHERE "Tasks".parent_id IS NULL
-    )
+queries.register(
+    'get_task_hierarchical_name',
     """
-
-    return query
+        Select
+            "Task_Hierarchical_Names".parent_names as task_name
+        from "Task_Hierarchical_Names"
+        where "Task_Hierarchical_Names".id = :task_id
+    """,
+    task_id='integer'
+)
 
 
 def get_task_hierarchical_name(task_id):
     """ give task names in hierarchy"""
 
-    sql_query = """
-        Select
-            "ParentTasks".parent_names as task_name
-        from (
-            %(tasks_hierarchical_name_table)s
-        ) as "ParentTasks"
-        where "ParentTasks".id =%(task_id)s
-    """
-    sql_query = sql_query % {
-        'tasks_hierarchical_name_table':
-        query_of_tasks_hierarchical_name_table(),
-        'task_id': task_id
-    }
-
-    result = DBSession.connection().execute(sql_query).fetchone()
+    result = queries.execute(
+        'get_task_hierarchical_name',
+        task_id=task_id
+    ).fetchone()
     task_hierarchical_name = result[0]
     return task_hierarchical_name
 
@@ -191,9 +139,9 @@ def update_task_statuses_with_dependencies(task):
         # do nothing, its status will be decided by its children
         return
 
-    status_new = Status.query.filter(Status.code == 'NEW').first()
-    status_rts = Status.query.filter(Status.code == 'RTS').first()
-    status_cmpl = Status.query.filter(Status.code == 'CMPL').first()
+    status_new = lookups.get_status('NEW')
+    status_rts = lookups.get_status('RTS')
+    status_cmpl = lookups.get_status('CMPL')
 
     if not task.depends:
         # doesn't have any dependency
@@ -251,7 +199,7 @@ def duplicate_task(task):
         }
 
     # all duplicated tasks are new tasks
-    new = Status.query.filter(Status.code == 'NEW').first()
+    new = lookups.get_status('NEW')
 
     dup_task = class_(
         name=task.name,
@@ -303,7 +251,8 @@ def walk_hierarchy(task):
 
 
 def find_leafs_in_hierarchy(task, leafs=None):
-    """Walks through task hierarchy and finds all of the leaf tasks
+    """Finds all of the leaf tasks under the given task by using the
+    "Task_Ancestors" table
 
     :param task: The starting task
     :return:
@@ -311,13 +260,10 @@ def find_leafs_in_hierarchy(task, leafs=None):
     if not leafs:
         leafs = []
 
-    # start from the given task
-    logger.debug('walking on task : %s' % task)
-    for child in task.children:
-        if child.is_leaf:
-            leafs.append(child)
-        else:
-            leafs.extend(find_leafs_in_hierarchy(child, leafs))
+    logger.debug('finding leafs of task : %s' % task)
+    leaf_ids = task_hierarchy.get_leaf_ids(task.id)
+    if leaf_ids:
+        leafs.extend(Task.query.filter(Task.id.in_(leaf_ids)).all())
     return leafs
 
 
@@ -391,81 +337,194 @@ def cleanup_duplicate_residuals(task):
 def duplicate_task_hierarchy(request):
     """Duplicates the given task hierarchy.
 
-    Walks through the hierarchy of the given task and duplicates every
-    instance it finds in a new task.
+    Duplicates the given task and all the tasks under it. In PostgreSQL the
+    whole hierarchy is duplicated with a couple of INSERT ... SELECT
+    statements, for the other databases it walks through the hierarchy and
+    duplicates every instance it finds in a new task.
 
     task: The task that wanted to be duplicated
+    target_id: The ids of the Tasks or Projects that the hierarchy will be
+      duplicated under, it can be given multiple times to duplicate the
+      hierarchy to many places at once. The hierarchy is duplicated next to
+      the original one if skipped.
 
     :return: A list of stalker.models.task.Task
     """
     task_id = request.matchdict.get('id')
     task = Task.query.filter_by(id=task_id).first()
 
+    if not task:
+        transaction.abort()
+        return Response(
+            'No task can be found with the given id: %s' % task_id, 500)
+
     name = request.params.get('name', task.name + ' - Duplicate')
     description = request.params.get('description', task.description)
 
-    if task:
-        dup_task = walk_and_duplicate_task_hierarchy(task)
-        update_dependencies_in_duplicated_hierarchy(task)
+    target_ids = get_multi_integer(request, 'target_id', 'GET')
+    targets = []
+    for target_id in target_ids:
+        target = Entity.query.filter_by(id=target_id).first()
+        if isinstance(target, Task):
+            targets.append((target.id, target.project.id))
+        elif isinstance(target, Project):
+            targets.append((None, target.id))
+        else:
+            transaction.abort()
+            return Response(
+                'No task or project can be found with the given id: %s' %
+                target_id, 500)
+
+    if not targets:
+        targets = [(task.parent.id if task.parent else None, task.project.id)]
+
+    if DBSession.connection().dialect.name == 'postgresql':
+        logged_in_user = get_logged_in_user(request)
+        DBSession.flush()
+        task_duplicate.duplicate_task_hierarchy(
+            task.id,
+            targets,
+            name=name,
+            description=description,
+            user_id=logged_in_user.id if logged_in_user else None
+        )
+    else:
+        for parent_id, project_id in targets:
+            if project_id != task.project.id:
+                transaction.abort()
+                return Response(
+                    'Duplicating tasks to other projects is only supported '
+                    'in PostgreSQL', 500)
 
-        cleanup_duplicate_residuals(task)
-        # update the parent
-        dup_task.parent = task.parent
-        # just rename the dup_task
+            dup_task = walk_and_duplicate_task_hierarchy(task)
+            update_dependencies_in_duplicated_hierarchy(task)
 
-        dup_task.name = name
-        dup_task.code = name
-        dup_task.description = description
+            cleanup_duplicate_residuals(task)
+            # update the parent
+            if parent_id is not None:
+                dup_task.parent = Task.query.get(parent_id)
+            # just rename the dup_task
 
-        DBSession.add(dup_task)
+            dup_task.name = name
+            dup_task.code = name
+            dup_task.description = description
 
-        #update_task_statuses_with_dependencies(dup_task)
-        #leafs = find_leafs_in_hierarchy(dup_task)
-    else:
-        transaction.abort()
-        return Response(
-            'No task can be found with the given id: %s' % task_id, 500)
+            DBSession.add(dup_task)
 
     return Response('Task %s is duplicated successfully' % task.id)
 
 
+def prefetch_tasks(tasks, batch_size=500):
+    """Loads the relations of the given tasks that are used by the DGrid Gantt
+    converters in bulk.
+
+    The parents of the tasks are loaded level by level, and then the status,
+    project, project lead, dependencies, resources, responsible, children and
+    time logs of the tasks and their parents are loaded with a couple of
+    queries per relation. All of them end up in the identity map of the
+    session, so the converters don't need to query the database for every
+    task.
+
+    :param tasks: List of Stalker Tasks.
+    :param batch_size: The maximum number of task ids in one query.
+    :return: list of Stalker Tasks, the given tasks and their parents
+    """
+    from sqlalchemy.orm import joinedload, subqueryload
+    from stalker.models.task import TaskDependency
+
+    def load(ids, *options):
+        ids = list(ids)
+        loaded = []
+        for i in range(0, len(ids), batch_size):
+            loaded.extend(
+                Task.query
+                .filter(Task.id.in_(ids[i:i + batch_size]))
+                .options(*options)
+                .all()
+            )
+        return loaded
+
+    tasks_by_id = dict((task.id, task) for task in tasks)
+
+    # the parents, one query per level
+    parent_ids = set([task.parent_id for task in tasks if task.parent_id])
+    while parent_ids:
+        parents = load(parent_ids - set(tasks_by_id))
+        for parent in parents:
+            tasks_by_id[parent.id] = parent
+        parent_ids = set([
+            parent.parent_id for parent in parents if parent.parent_id
+        ]) - set(tasks_by_id)
+
+    if tasks_by_id:
+        load(
+            tasks_by_id.keys(),
+            joinedload(Task.status),
+            joinedload(Task.parent),
+            joinedload(Task._project).joinedload(Project.lead),
+            joinedload(Task._project).joinedload(Project.status),
+            subqueryload(Task.task_depends_to)
+            .joinedload(TaskDependency.depends_to),
+            subqueryload(Task.resources),
+            subqueryload(Task._responsible),
+            subqueryload(Task.children),
+            subqueryload(Task.time_logs),
+        )
+
+    return tasks_by_id.values()
+
+
 def convert_to_dgrid_gantt_project_format(projects):
     """Converts the given projects to the DGrid Gantt compatible json format.
 
+    The root tasks of all the projects are loaded with one query to calculate
+    the schedule and logged seconds of the projects.
+
     :param projects: List of Stalker Project.
     :return: json compatible dictionary
     """
+    root_tasks = {}
+    project_ids = [project.id for project in projects]
+    if project_ids:
+        tasks = Task.query\
+            .filter(Task.project_id.in_(project_ids))\
+            .filter(Task.parent_id == None)\
+            .all()
+        prefetch_tasks(tasks)
+        for task in tasks:
+            root_tasks.setdefault(task.project_id, []).append(task)
 
-    from sqlalchemy import func
-
-    def hasChildren(project):
-        return bool(
-            DBSession.query(func.count(Task.id))
-            .join(Task.project, Project.tasks)
-            .filter(Project.id == project.id)
-            .first()[0]
-        )
-
-    return [
-        {
+    data = []
+    for project in projects:
+        tasks = root_tasks.get(project.id, [])
+        total_logged_seconds = 0
+        schedule_seconds = 0
+        for task in tasks:
+            if task.total_logged_seconds is None \
+               or task.schedule_seconds is None:
+                task.update_schedule_info()
+            total_logged_seconds += task.total_logged_seconds
+            schedule_seconds += task.schedule_seconds
+
+        data.append({
             'bid_timing': project.duration.days,
             'bid_unit': 'd',
-            'completed': project.total_logged_seconds / project.schedule_seconds if project.schedule_seconds else 0,
+            'completed': total_logged_seconds / schedule_seconds if schedule_seconds else 0,
             'description': project.description,
             'end': milliseconds_since_epoch(
                 project.computed_end if project.computed_end else project.end),
             'id': project.id,
             'link': '/projects/%s/view' % project.id,
             'name': project.name,
-            'hasChildren': hasChildren(project),
-            'schedule_seconds': project.schedule_seconds,
+            'hasChildren': bool(tasks),
+            'schedule_seconds': schedule_seconds,
             'start': milliseconds_since_epoch(
                 project.computed_start if project.computed_start else project.start),
-            'total_logged_seconds': project.total_logged_seconds,
+            'total_logged_seconds': total_logged_seconds,
             'type': project.entity_type,
             'status': project.status.code.lower()
-        } for project in projects
-    ]
+        })
+    return data
 
 
 def convert_to_dgrid_gantt_task_format(tasks):
@@ -479,6 +538,9 @@ def convert_to_dgrid_gantt_task_format(tasks):
         response.text = u'This is a not a list of tasks'
         raise response
 
+    # load the relations of all the tasks at once
+    prefetch_tasks(tasks)
+
     return [
         {
             'bid_timing': task.bid_timing,
@@ -522,6 +584,165 @@ def convert_to_dgrid_gantt_task_format(tasks):
     ]
 
 
+# the tasks in the DGrid Gantt format, see query_dgrid_gantt_tasks()
+queries.register(
+    'query_dgrid_gantt_tasks',
+    """select
+        "Tasks".id,
+        "SimpleEntities".name,
+        "SimpleEntities".description,
+        "SimpleEntities".entity_type,
+        "Tasks".bid_timing,
+        "Tasks".bid_unit,
+        coalesce("Tasks".parent_id, "Tasks".project_id) as parent_id,
+        "Tasks".project_id,
+        "Tasks".priority,
+        "Tasks".schedule_constraint,
+        "Tasks".schedule_model,
+        coalesce("Tasks".schedule_seconds,
+            "Tasks".schedule_timing * (case "Tasks".schedule_unit
+                when 'min' then 60
+                when 'h' then 3600
+                when 'd' then 32400
+                when 'w' then 147600
+                when 'm' then 590400
+                when 'y' then 7696277
+                else 0
+            end)
+        ) as schedule_seconds,
+        "Tasks".schedule_timing,
+        "Tasks".schedule_unit,
+        coalesce("Tasks".computed_start, "Tasks".start) as start,
+        coalesce("Tasks".computed_end, "Tasks".end) as end,
+        lower("Task_Status".code) as status,
+        exists (
+            select 1
+            from "Tasks" as "Child_Tasks"
+            where "Child_Tasks".parent_id = "Tasks".id
+        ) as hasChildren,
+        "Tasks".total_logged_seconds,
+        coalesce("Task_TimeLogs".duration, 0) as time_log_duration,
+        """ + task_hierarchy.query_parent_names('"Tasks".id') + """ as hierarchy_name
+    from "Tasks"
+    join "SimpleEntities" on "Tasks".id = "SimpleEntities".id
+    join "Statuses" as "Task_Status" on "Tasks".status_id = "Task_Status".id
+    left outer join "Task_TimeLog_Durations" as "Task_TimeLogs"
+        on "Task_TimeLogs".task_id = "Tasks".id
+    where %(where_condition)s
+    order by "Tasks".start, "Tasks".id
+    """,
+    entity_id='integer',
+    depth='integer'
+)
+
+
+# the related users and tasks of the selected tasks, returns
+# (task_id, id, name) rows
+dgrid_gantt_related_sql_query = """select
+        "%(table)s".%(task_column)s,
+        "SimpleEntities".id,
+        "SimpleEntities".name
+    from "%(table)s"
+    join "SimpleEntities"
+        on "%(table)s".%(related_column)s = "SimpleEntities".id
+    where "%(table)s".%(task_column)s in (
+        select "Tasks".id from "Tasks" where %%(where_condition)s
+    )
+    order by "SimpleEntities".name
+    """
+
+dgrid_gantt_related_queries = [
+    ('dependencies', 'Task_Dependencies', 'task_id', 'depends_to_id'),
+    ('resources', 'Task_Resources', 'task_id', 'resource_id'),
+    ('responsible', 'Task_Inherited_Responsibles', 'id', 'responsible_id')
+]
+
+for key, table, task_column, related_column in dgrid_gantt_related_queries:
+    queries.register(
+        'query_dgrid_gantt_task_%s' % key,
+        dgrid_gantt_related_sql_query % {
+            'table': table,
+            'task_column': task_column,
+            'related_column': related_column
+        },
+        entity_id='integer',
+        depth='integer'
+    )
+
+
+def query_dgrid_gantt_tasks(where_condition, **values):
+    """Returns the tasks matching the given where condition in the DGrid Gantt
+    compatible json format.
+
+    Generates the same data with :func:`convert_to_dgrid_gantt_task_format`
+    but uses a fixed number of queries whatever the number of tasks is, one
+    for the tasks and one for each of the dependencies, resources and
+    responsible of them.
+
+    :param where_condition: An sql where condition which can reference the
+      "Tasks" table. The values in it are given as ``:entity_id`` and
+      ``:depth`` bound parameters.
+    :param values: The values of the bound parameters in the where condition.
+    :return: list of json compatible dictionaries sorted by the task start
+    """
+    fragments = {'where_condition': where_condition}
+
+    related = {}
+    for key, table, task_column, related_column in \
+            dgrid_gantt_related_queries:
+        data = related[key] = {}
+        result = queries.execute(
+            'query_dgrid_gantt_task_%s' % key,
+            fragments,
+            **values
+        )
+        for r in result.fetchall():
+            data.setdefault(r[0], []).append({'id': r[1], 'name': r[2]})
+
+    result = queries.execute('query_dgrid_gantt_tasks', fragments, **values)
+
+    data = []
+    for r in result.fetchall():
+        task_id = r[0]
+        has_children = r[17]
+        schedule_seconds = r[11]
+        # container tasks keep the total of their children, leaf tasks use
+        # the total of their time logs
+        total_logged_seconds = \
+            r[18] or 0 if has_children else r[19]
+        data.append({
+            'bid_timing': r[4],
+            'bid_unit': r[5],
+            'completed':
+                float(total_logged_seconds) / schedule_seconds
+                if schedule_seconds else 0,
+            'dependencies': related['dependencies'].get(task_id, []),
+            'description': r[2],
+            'end': milliseconds_since_epoch(r[15]),
+            'hasChildren': has_children,
+            'hierarchy_name': r[20],
+            'id': task_id,
+            'link': '/%ss/%s/view' % (r[3].lower(), task_id),
+            'name': r[1],
+            'parent': r[6],
+            'project_id': r[7],
+            'priority': r[8],
+            'resources': related['resources'].get(task_id, [])
+            if not has_children else [],
+            'responsible': related['responsible'].get(task_id, []),
+            'schedule_constraint': r[9],
+            'schedule_model': r[10],
+            'schedule_seconds': schedule_seconds,
+            'schedule_timing': r[12],
+            'schedule_unit': r[13],
+            'start': milliseconds_since_epoch(r[14]),
+            'status': r[16],
+            'total_logged_seconds': total_logged_seconds,
+            'type': r[3],
+        })
+    return data
+
+
 @view_config(
     route_name='inline_update_task'
 )
@@ -556,8 +777,11 @@ def inline_update_task(request):
 
         if attr_name == 'type':
 
-            type_query = Type.query.filter_by(target_entity_type=task.entity_type)
-            type_ = type_query.filter_by(id=attr_value).first()
+            type_ = None
+            for entity_type_type in lookups.get_types(task.entity_type):
+                if str(entity_type_type.id) == str(attr_value):
+                    type_ = entity_type_type
+                    break
 
             if not type_:
                 transaction.abort()
@@ -757,6 +981,11 @@ def update_task(request):
 
 def depth_first_flatten(task, task_array=None):
     """Does a depth first flattening on the child tasks of the given task.
+
+    The whole hierarchy is retrieved from the "Task_Ancestors" table with one
+    query and all of the tasks are loaded with another one, instead of
+    walking the hierarchy task by task.
+
     :param task: start from this task
     :param task_array: previous flattened task array
     :return: list of flat tasks
@@ -768,11 +997,27 @@ def depth_first_flatten(task, task_array=None):
     if task:
         if task not in task_array:
             task_array.append(task)
-            # take a tour in children
-        for child_task in task.children:
-            task_array.append(child_task)
-            # recursive call
-            task_array = depth_first_flatten(child_task, task_array)
+
+        hierarchy = task_hierarchy.get_descendant_ids(task.id)
+        if hierarchy:
+            children = {}
+            for child_id, parent_id in hierarchy:
+                children.setdefault(parent_id, []).append(child_id)
+
+            tasks_by_id = dict(
+                (t.id, t) for t in Task.query.filter(
+                    Task.id.in_([child_id for child_id, _ in hierarchy])
+                ).all()
+            )
+
+            visited = set(t.id for t in task_array)
+            to_visit = list(reversed(children.get(task.id, [])))
+            while to_visit:
+                child_id = to_visit.pop()
+                if child_id not in visited:
+                    visited.add(child_id)
+                    task_array.append(tasks_by_id[child_id])
+                to_visit.extend(reversed(children.get(child_id, [])))
 
     return task_array
 
@@ -805,20 +1050,9 @@ def raw_data_to_array(raw_data):
     return data
 
 
-@view_config(
-    route_name='get_tasks',
-    renderer='json'
-)
-def get_tasks(request):
-    """RESTful version of getting all tasks
-    """
-    logger.debug('get_tasks is running')
-    start = time.time()
-
-    parent_id = request.params.get('parent_id')
-    task_id = request.params.get('task_id')
-
-    sql_query = """select
+queries.register(
+    'get_tasks',
+    """select
         "Tasks".bid_timing as bid_timing,
         "Tasks".bid_unit as bid_unit,
                 coalesce(
@@ -891,13 +1125,7 @@ def get_tasks(request):
     from "Tasks"
         left outer join "Tasks" as "Parent_Tasks" on "Tasks".parent_id = "Parent_Tasks".id
         -- TimeLogs for Leaf Tasks
-        left outer join (
-            select
-                "TimeLogs".task_id,
-                extract(epoch from sum("TimeLogs".end::timestamp AT TIME ZONE 'UTC' - "TimeLogs".start::timestamp AT TIME ZONE 'UTC')) as duration
-            from "TimeLogs"
-            group by task_id
-        ) as "Task_TimeLogs" on "Task_TimeLogs".task_id = "Tasks".id
+        left outer join "Task_TimeLog_Durations" as "Task_TimeLogs" on "Task_TimeLogs".task_id = "Tasks".id
         -- Dependencies
         left outer join (
             select
@@ -911,35 +1139,11 @@ def get_tasks(request):
         -- hierarcy name
         join (
             select
-                parent_data.id as id,
-                "SimpleEntities".name || ' (' || "SimpleEntities".id || ') (' ||
-                array_to_string(array_agg(
-                    case
-                        when "SimpleEntities_parent".entity_type = 'Project'
-                        then "Projects".code
-                        else "SimpleEntities_parent".name
-                    end),
-                    ' | '
-                ) || ')'
-                as parent_names
-                from (
-                    with recursive parent_ids(id, parent_id, n) as (
-                            select task.id, coalesce(task.parent_id, task.project_id), 0
-                            from "Tasks" task
-                        union all
-                            select task.id, parent.parent_id, parent.n + 1
-                            from "Tasks" task, parent_ids parent
-                            where task.parent_id = parent.id
-                    )
-                    select
-                        parent_ids.id, parent_id as parent_id, parent_ids.n
-                        from parent_ids
-                        order by id, parent_ids.n desc
-                ) as parent_data
-                join "SimpleEntities" on "SimpleEntities".id = parent_data.id
-                join "SimpleEntities" as "SimpleEntities_parent" on "SimpleEntities_parent".id = parent_data.parent_id
-                left outer join "Projects" on parent_data.parent_id = "Projects".id
-                group by parent_data.id, "SimpleEntities".name, "SimpleEntities".id
+                "Task_Hierarchical_Names".id,
+                "Task_Hierarchical_Names".name || ' (' ||
+                "Task_Hierarchical_Names".id || ') (' ||
+                "Task_Hierarchical_Names".path || ')' as parent_names
+            from "Task_Hierarchical_Names"
         ) as "Task_Hierarchy" on "Tasks".id = "Task_Hierarchy".id
         -- resources
         left outer join (
@@ -978,9 +1182,65 @@ def get_tasks(request):
         "Task_Status".code,
         "Parent_Tasks".id,
         "Tasks".project_id
-    order by "SimpleEntities".name
+    %(order_by)s
+    """,
+    task_id='integer',
+    parent_id='integer',
+    offset='integer',
+    limit='integer'
+)
+
+
+queries.register(
+    'get_tasks_count',
+    """select
+        count(1)
+    from "Tasks"
+        left outer join "Tasks" as "Parent_Tasks" on "Tasks".parent_id = "Parent_Tasks".id
+    where %(where_condition)s
+    """,
+    task_id='integer',
+    parent_id='integer'
+)
+
+
+@view_config(
+    route_name='get_tasks',
+    renderer='json'
+)
+def get_tasks(request):
+    """RESTful version of getting all tasks
+    """
+    logger.debug('get_tasks is running')
+    start = time.time()
+
+    parent_id = request.params.get('parent_id')
+    task_id = request.params.get('task_id')
+
+    # the ids of the tasks in the requested range
+    page_sql_query = """select
+        "Tasks".id
+    from "Tasks"
+        left outer join "Tasks" as "Parent_Tasks" on "Tasks".parent_id = "Parent_Tasks".id
+        join "SimpleEntities" on "Tasks".id = "SimpleEntities".id
+    where %(where_condition)s
+    %(order_by)s
+    limit :limit offset :offset
     """
 
+    offset, limit = get_range(request)
+    order_by = get_order_by(
+        request,
+        {
+            'id': '"Tasks".id',
+            'name': '"SimpleEntities".name',
+            'priority': '"Tasks".priority',
+            'start': 'coalesce("Tasks".computed_start, "Tasks".start)',
+            'end': 'coalesce("Tasks".computed_end, "Tasks".end)'
+        },
+        'order by "SimpleEntities".name'
+    )
+
     # set the content range to prevent JSONRest Store to query the data twice
     content_range = '%s-%s/%s'
     where_condition = ''
@@ -1009,25 +1269,54 @@ def get_tasks(request):
             return resp
 
         elif isinstance(task, Task):
-            where_condition = '"Tasks".id = %s' % task_id
+            where_condition = '"Tasks".id = :task_id'
 
     elif parent_id:
         parent = Entity.query.filter(Entity.id == parent_id).first()
         if isinstance(parent, Project):
-            where_condition = '"Parent_Tasks".id is NULL and "Tasks".project_id = %s' % parent_id
+            where_condition = '"Parent_Tasks".id is NULL and "Tasks".project_id = :parent_id'
         elif isinstance(parent, Task):
-            where_condition = '"Parent_Tasks".id = %s' % parent_id
+            where_condition = '"Parent_Tasks".id = :parent_id'
 
-    sql_query = sql_query % {'where_condition': where_condition}
+    values = {
+        'task_id': task_id,
+        'parent_id': parent_id,
+        'offset': offset,
+        'limit': limit
+    }
 
+    # the total count is needed for the content range before streaming
+    total_count = queries.execute(
+        'get_tasks_count',
+        {'where_condition': where_condition},
+        **values
+    ).fetchone()[0]
+
+    if limit is not None:
+        # only get the tasks in the requested range
+        where_condition = '"Tasks".id in (%s)' % (
+            page_sql_query % {
+                'where_condition': where_condition,
+                'order_by': order_by
+            }
+        )
 
-    # convert to dgrid format right here in place
-    result = DBSession.connection().execute(sql_query)
+    sql_query = queries.bind(
+        'get_tasks',
+        {
+            'where_condition': where_condition,
+            'order_by': order_by
+        },
+        **values
+    )
 
     # use local functions to speed things up
     local_raw_data_to_array = raw_data_to_array
-    return_data = [
-        {
+
+    def convert_to_dgrid_format(r):
+        """converts the given row to dgrid format
+        """
+        return {
             'bid_timing': r[0],
             'bid_unit': r[1],
             'completed': r[2],
@@ -1051,22 +1340,119 @@ def get_tasks(request):
             'total_logged_seconds': r[20],
             'type': r[21],
         }
-        for r in result.fetchall()
-    ]
 
-    task_count = len(return_data)
-    content_range = content_range % (0, task_count - 1, task_count)
+    # stream the result in dgrid format
+    resp = stream_json(sql_query, convert_to_dgrid_format)
+
+    task_count = max(0, total_count - offset)
+    if limit is not None:
+        task_count = min(task_count, limit)
+    resp.content_range = get_content_range(offset, task_count, total_count)
 
-    # logger.debug('return_data: %s' % return_data)
     end = time.time()
-    logger.debug('%s rows retrieved in %s seconds' % (len(return_data),
-                                                      (end - start)))
+    logger.debug('get_tasks query took %s seconds' % (end - start))
+    return resp
 
-    resp = Response(
-        json_body=return_data
+
+queries.register(
+    'get_entity_child_tasks',
+    """select
+        "Tasks".id,
+        count(*) over () as total_count
+    from "Tasks"
+        join "SimpleEntities" on "Tasks".id = "SimpleEntities".id
+    where %(parent_condition)s %(resource_condition)s
+    %(order_by)s
+    limit :limit offset :offset
+    """,
+    parent_id='integer',
+    user_id='integer',
+    offset='integer',
+    limit='integer'
+)
+
+
+queries.register(
+    'get_entity_child_tasks_count',
+    """select count(1)
+    from "Tasks"
+    where %(parent_condition)s %(resource_condition)s
+    """,
+    parent_id='integer',
+    user_id='integer'
+)
+
+
+queries.register(
+    'get_entity_projects',
+    """select
+        "Projects".id,
+        count(*) over () as total_count
+    from "Projects"
+        join "SimpleEntities" on "Projects".id = "SimpleEntities".id
+        %(user_join)s
+    %(order_by)s
+    limit :limit offset :offset
+    """,
+    user_id='integer',
+    offset='integer',
+    limit='integer'
+)
+
+
+queries.register(
+    'get_entity_projects_count',
+    """select count(1)
+    from "Projects"
+        %(user_join)s
+    """,
+    user_id='integer'
+)
+
+
+# the children of the parent which are assigned to the user or have a
+# descendant assigned to the user
+user_child_tasks_condition = """and exists (
+        select 1
+        from "Task_Ancestors"
+            join "Task_Resources"
+                on "Task_Resources".task_id = "Task_Ancestors".descendant_id
+        where "Task_Ancestors".ancestor_id = "Tasks".id
+            and "Task_Resources".resource_id = :user_id
+    )"""
+
+
+def query_paged_ids(query_name, fragments, offset, **values):
+    """Runs the given paged query, which returns the ids and the
+    ``count(*) over ()`` column, and the count query named as
+    ``<query_name>_count`` if the total count can not be read from the rows.
+
+    :return: (ids, total_count) tuple
+    """
+    rows = queries.execute(
+        query_name, fragments, offset=offset, **values
+    ).fetchall()
+    total_count = get_total_count(
+        rows,
+        offset,
+        lambda: queries.execute(
+            '%s_count' % query_name, fragments, **values
+        ).fetchone()[0]
     )
-    resp.content_range = content_range
-    return resp
+    return [r[0] for r in rows], total_count
+
+
+def query_in_order(class_, ids):
+    """Returns the instances of the given class with the given ids in the
+    order of the ids.
+    """
+    if not ids:
+        return []
+    instances = dict(
+        (instance.id, instance)
+        for instance in class_.query.filter(class_.id.in_(ids)).all()
+    )
+    return [instances[id_] for id_ in ids]
 
 
 @view_config(
@@ -1088,61 +1474,101 @@ def get_entity_tasks(request):
     parent_id = request.params.get('parent_id')
     parent = Entity.query.filter_by(id=parent_id).first()
 
+    offset, limit = get_range(request)
+    sortable_columns = {
+        'id': '"SimpleEntities".id',
+        'name': '"SimpleEntities".name',
+        'start': 'coalesce(%(table)s.computed_start, %(table)s.start)',
+        'end': 'coalesce(%(table)s.computed_end, %(table)s.end)'
+    }
+
     return_data = []
-    # set the content range to prevent JSONRest Store to query the data twice
-    content_range = '%s-%s/%s'
+    total_count = 0
 
-    if entity:
+    if entity and isinstance(entity, (User, Studio)):
         if parent:
             #logger.debug('there is a parent')
-            tasks = []
+            parent_condition = 'false'
+            if isinstance(parent, Task):
+                parent_condition = '"Tasks".parent_id = :parent_id'
+            elif isinstance(parent, Project):
+                parent_condition = \
+                    '"Tasks".parent_id is NULL ' \
+                    'and "Tasks".project_id = :parent_id'
+
+            columns = dict(
+                (attr, column % {'table': '"Tasks"'})
+                for attr, column in sortable_columns.items()
+            )
+            columns['priority'] = '"Tasks".priority'
+            fragments = {
+                'parent_condition': parent_condition,
+                'resource_condition': '',
+                'order_by': get_order_by(
+                    request, columns, 'order by "SimpleEntities".name'
+                )
+            }
+            values = {
+                'parent_id': parent.id,
+                'user_id': entity.id,
+                'limit': limit
+            }
+
+            task_ids = []
             if isinstance(entity, User):
-                # get user tasks
-                entity_tasks = entity.tasks
-
-                # add all parents
-                entity_tasks_and_parents = []
-                for task in entity_tasks:
-                    entity_tasks_and_parents.extend(task.parents)
-                entity_tasks_and_parents.extend(entity_tasks)
-
-                parents_children = []
-                if isinstance(parent, Task):
-                    parents_children = parent.children
-                elif isinstance(parent, Project):
-                    parents_children = parent.root_tasks
-
-                for child in parents_children:
-                    if child in entity_tasks_and_parents:
-                        tasks.append(child)
-
-                if not tasks:
-                    # there are no children
-                    tasks = parents_children
-
-            elif isinstance(entity, Studio):
-                if isinstance(parent, Task):
-                    tasks = parent.children
-                elif isinstance(parent, Project):
-                    tasks = parent.root_tasks
-
-            return_data = convert_to_dgrid_gantt_task_format(tasks)
+                # get the children related to the user tasks
+                user_fragments = dict(fragments)
+                user_fragments['resource_condition'] = \
+                    user_child_tasks_condition
+                task_ids, total_count = query_paged_ids(
+                    'get_entity_child_tasks', user_fragments, offset,
+                    **values
+                )
+
+            if not total_count:
+                # there are no children related to the user, list all of
+                # them
+                task_ids, total_count = query_paged_ids(
+                    'get_entity_child_tasks', fragments, offset, **values
+                )
+
+            return_data = convert_to_dgrid_gantt_task_format(
+                query_in_order(Task, task_ids)
+            )
         else:
             #logger.debug('no parent')
             # no parent,
             # just return projects of the entity
-            entity_projects = []
+            user_join = ''
             if isinstance(entity, User):
-                entity_projects = entity.projects
-            elif isinstance(entity, Studio):
-                entity_projects = Project.query.all()
+                user_join = """join "Project_Users"
+            on "Project_Users".project_id = "Projects".id
+            and "Project_Users".user_id = :user_id"""
+
+            columns = dict(
+                (attr, column % {'table': '"Projects"'})
+                for attr, column in sortable_columns.items()
+            )
+            project_ids, total_count = query_paged_ids(
+                'get_entity_projects',
+                {
+                    'user_join': user_join,
+                    'order_by': get_order_by(
+                        request, columns, 'order by "SimpleEntities".name'
+                    )
+                },
+                offset,
+                user_id=entity.id,
+                limit=limit
+            )
 
-            return_data = \
-                convert_to_dgrid_gantt_project_format(entity_projects)
+            return_data = convert_to_dgrid_gantt_project_format(
+                query_in_order(Project, project_ids)
+            )
+
+    # set the content range to prevent JSONRest Store to query the data twice
+    content_range = get_content_range(offset, len(return_data), total_count)
 
-        content_range = content_range % (0,
-                                         len(return_data) - 1,
-                                         len(return_data))
     end = time.time()
     logger.debug('%s rows retrieved in %s seconds' % (len(return_data),
                                                       (end - start)))
@@ -1153,6 +1579,24 @@ def get_entity_tasks(request):
     resp.content_range = content_range
     return resp
 
+
+queries.register(
+    'get_user_tasks',
+    """select
+        "Tasks".id  as task_id,
+        "ParentTasks".parent_names as name
+    from "Tasks"
+        join "Task_Resources" on "Task_Resources".task_id = "Tasks".id
+        join "Statuses" as "Task_Statuses" on "Task_Statuses".id = "Tasks".status_id
+        left join "Task_Hierarchical_Names" as "ParentTasks" on "Tasks".id = "ParentTasks".id
+    where "Task_Resources".resource_id = :user_id
+        %(status_condition)s
+    """,
+    user_id='integer',
+    status_codes='text[]'
+)
+
+
 @view_config(
     route_name='get_user_tasks',
     renderer='json'
@@ -1166,44 +1610,23 @@ def get_user_tasks(request):
     # get all the tasks related in the given project
     user_id = request.matchdict.get('id', -1)
 
-    sql_query = """select
-        "Tasks".id  as task_id,
-        "ParentTasks".parent_names as name
-    from "Tasks"
-        join "Task_Resources" on "Task_Resources".task_id = "Tasks".id
-        join "Statuses" as "Task_Statuses" on "Task_Statuses".id = "Tasks".status_id
-        left join (
-            %(tasks_hierarchical_name_table)s
-        ) as "ParentTasks" on "Tasks".id = "ParentTasks".id
-        %(where_condition)s
-    """
-
-    where_condition = 'where "Task_Resources".resource_id = %s' % user_id
-
     statuses = []
     status_codes = request.GET.getall('status')
     if status_codes:
-        statuses = Status.query.filter(Status.code.in_(status_codes)).all()
+        statuses = lookups.get_statuses(status_codes)
 
+    status_condition = ''
     if statuses:
-        temp_buffer = [where_condition]
-        temp_buffer.append(""" and (""")
-        for i, status in enumerate(statuses):
-            if i > 0:
-                temp_buffer.append(' or')
-            temp_buffer.append(""" "Task_Statuses".code='%s'""" % status.code)
-        temp_buffer.append(' )')
-        where_condition = ''.join(temp_buffer)
-
-    logger.debug('where_condition: %s' % where_condition)
-
-    sql_query = sql_query % {
-        'tasks_hierarchical_name_table':
-            query_of_tasks_hierarchical_name_table(),
-        'where_condition': where_condition
-    }
+        status_condition = 'and "Task_Statuses".code = any(:status_codes)'
 
-    result = DBSession.connection().execute(sql_query)
+    logger.debug('status_condition: %s' % status_condition)
+
+    result = queries.execute(
+        'get_user_tasks',
+        {'status_condition': status_condition},
+        user_id=user_id,
+        status_codes=[status.code for status in statuses]
+    )
 
     return_data = [
         {
@@ -1260,67 +1683,84 @@ def get_task_children(request):
 def get_gantt_tasks(request):
     """returns all the tasks in the database related to the given entity in
     jQueryGantt compatible json format
+
+    The tasks are queried with a fixed number of queries. The depth parameter
+    can be used to only return the tasks that are at most that many levels
+    below the entity (or below the projects for the Studio), the rest of the
+    hierarchy can then be expanded with get_gantt_task_children.
     """
     entity_id = request.matchdict.get('id', -1)
     entity = Entity.query.filter_by(id=entity_id).first()
 
-    #logger.debug('entity : %s' % entity)
-
-    tasks = []
+    depth = request.params.get('depth')
+    depth_condition = ''
+    if depth:
+        depth = int(depth)
+        depth_condition = 'and "Task_Ancestors".depth <= :depth'
+
+    descendants_condition = """"Tasks".id in (
+        select "Task_Ancestors".descendant_id
+        from "Task_Ancestors"
+        where "Task_Ancestors".ancestor_id %(ancestor_condition)s
+            %(depth_condition)s
+    )"""
+
+    dgrid_data = []
+    where_condition = None
     if entity:
         if isinstance(entity, Project):
             # return both the project and the root tasks of its
             project = entity
             dgrid_data = convert_to_dgrid_gantt_project_format([project])
-            dgrid_data.extend(
-                convert_to_dgrid_gantt_task_format(project.root_tasks))
-            return dgrid_data
+            if not depth:
+                depth = 1
+                depth_condition = 'and "Task_Ancestors".depth <= :depth'
+            where_condition = descendants_condition % {
+                'ancestor_condition': '= :entity_id',
+                'depth_condition': depth_condition
+            }
         elif isinstance(entity, User):
             user = entity
-            # sort the tasks with the project.id
-            if user is not None:
-                # TODO: just return root tasks to make it fast
-                # get the user projects and then tasks of the user
-                dgrid_data = convert_to_dgrid_gantt_project_format(
-                    user.projects)
-
-                user_tasks_with_parents = []
-                for task in user.tasks:
-                    user_tasks_with_parents.append(task)
-                    user_tasks_with_parents.extend(task.parents)
-
-                tasks = list(set(user_tasks_with_parents))
-                dgrid_data.extend(convert_to_dgrid_gantt_task_format(tasks))
-                return dgrid_data
+            # get the user projects and then tasks of the user with their
+            # parents
+            dgrid_data = convert_to_dgrid_gantt_project_format(user.projects)
+            where_condition = """"Tasks".id in (
+                select "Task_Ancestors".ancestor_id
+                from "Task_Ancestors"
+                join "Task_Resources"
+                    on "Task_Ancestors".descendant_id = "Task_Resources".task_id
+                where "Task_Resources".resource_id = :entity_id
+            )"""
         elif entity.entity_type == 'Studio':
-            projects = Project.query.all()
-            for project in projects:
-                # get the tasks who is a root task
-                root_tasks = Task.query \
-                    .filter(Task.project == project) \
-                    .filter(Task.parent == None).all()
-
-                # do a depth first search for child tasks
-                for root_task in root_tasks:
-                    # logger.debug('root_task: %s, parent: %s' % (root_task, root_task.parent))
-                    tasks.extend(depth_first_flatten(root_task))
-
-        else:  # Task, Asset, Shot, Sequence
-            tasks.append(entity)
-            tasks.extend(entity.parents)
-            tasks.extend(depth_first_flatten(entity))
-            tasks = list(set(tasks))
-
-    tasks.sort(key=lambda x: x.start)
+            where_condition = descendants_condition % {
+                'ancestor_condition': 'in (select id from "Projects")',
+                'depth_condition': depth_condition
+            }
+        elif isinstance(entity, Task):  # Task, Asset, Shot, Sequence
+            # the task, its parents and its children
+            where_condition = """(
+                "Tasks".id in (
+                    select "Task_Ancestors".ancestor_id
+                    from "Task_Ancestors"
+                    where "Task_Ancestors".descendant_id = :entity_id
+                ) or %(descendants_condition)s
+            )""" % {
+                'descendants_condition': descendants_condition % {
+                    'ancestor_condition': '= :entity_id',
+                    'depth_condition': depth_condition
+                }
+            }
 
-    # logger.debug('tasks count: %i' % len(tasks))
-    # for task in tasks:
-    #     logger.debug('------------------------------')
-    #     logger.debug('task name: %s' % task.name)
-    #     logger.debug('start date: %s' % task.start)
-    #     logger.debug('end date: %s' % task.end)
+    if where_condition:
+        dgrid_data.extend(
+            query_dgrid_gantt_tasks(
+                where_condition,
+                entity_id=entity.id,
+                depth=depth or None
+            )
+        )
 
-    return convert_to_dgrid_gantt_task_format(tasks)
+    return dgrid_data
 
 
 @view_config(
@@ -1344,6 +1784,17 @@ def get_gantt_task_children(request):
     return []
 
 
+queries.register(
+    'get_project_tasks_count',
+    """select
+        count(1)
+    from "Tasks"
+    where "Tasks".project_id = :project_id
+    """,
+    project_id='integer'
+)
+
+
 @view_config(
     route_name='get_project_tasks_count',
     renderer='json'
@@ -1354,13 +1805,24 @@ def get_project_tasks_count(request):
     """
     project_id = request.matchdict.get('id', -1)
 
-    sql_query = """select
-        count(1)
-    from "Tasks"
-    where "Tasks".project_id = %s
-    """ % project_id
+    return queries.execute(
+        'get_project_tasks_count',
+        project_id=project_id
+    ).fetchone()[0]
+
 
-    return DBSession.connection().execute(sql_query).fetchone()[0]
+queries.register(
+    'get_project_tasks',
+    """
+    SELECT
+        "Task_Hierarchical_Names".id,
+        "Task_Hierarchical_Names".name || ' (' || "Task_Hierarchical_Names".id || ') (' || "Task_Hierarchical_Names".path || ')' as parent_names
+    FROM "Task_Hierarchical_Names"
+    JOIN "Tasks" ON "Task_Hierarchical_Names".id = "Tasks".id
+    WHERE "Tasks".project_id = :project_id
+    """,
+    project_id='integer'
+)
 
 
 @view_config(
@@ -1376,59 +1838,7 @@ def get_project_tasks(request):
 
     start = time.time()
 
-    sql_query = """
-    (
-        SELECT
-            task_parents.id,
-            "Task_SimpleEntities".name || ' (' || "Task_SimpleEntities".id || ') (' || "Projects".code || ' | ' || task_parents.parent_names || ')' as parent_names
-        FROM (
-            SELECT
-                task_parents.id,
-                array_agg(task_parents.parent_id) as parent_ids,
-                array_agg(task_parents.n) as n,
-                array_to_string(
-                    array_agg(task_parents.parent_name),
-                    ' | '
-                ) as parent_names
-            FROM (
-                WITH RECURSIVE parent_ids(id, parent_id, n) as (
-                        SELECT task.id, task.parent_id, 0
-                        FROM "Tasks" AS task
-                        WHERE task.parent_id IS NOT NULL
-                    UNION ALL
-                        SELECT task.id, parent.parent_id, parent.n + 1
-                        FROM "Tasks" task, parent_ids parent
-                        WHERE task.parent_id = parent.id
-                )
-                SELECT
-                    parent_ids.id as id,
-                    parent_ids.n as n,
-                    parent_ids.parent_id AS parent_id,
-                    "ParentTask_SimpleEntities".name as parent_name
-                FROM parent_ids
-                JOIN "SimpleEntities" as "ParentTask_SimpleEntities" ON parent_ids.parent_id = "ParentTask_SimpleEntities".id
-                ORDER BY id, parent_ids.n DESC
-            ) as task_parents
-            GROUP BY task_parents.id
-        ) as task_parents
-        JOIN "Tasks" ON task_parents.id = "Tasks".id
-        JOIN "Projects" ON "Tasks".project_id = "Projects".id
-        JOIN "SimpleEntities" as "Task_SimpleEntities" ON "Tasks".id = "Task_SimpleEntities".id
-        WHERE "Tasks".project_id = %(p_id)s
-    )
-    UNION
-    (
-        SELECT
-            "Tasks".id,
-            "Task_SimpleEntities".name || ' (' || "Task_SimpleEntities".id || ') (' || "Projects".code || ')' as parent_names
-        FROM "Tasks"
-        JOIN "Projects" ON "Tasks".project_id = "Projects".id
-        JOIN "SimpleEntities" as "Task_SimpleEntities" on "Tasks".id = "Task_SimpleEntities".id
-        WHERE "Tasks".parent_id IS NULL AND "Tasks".project_id = %(p_id)s
-    )
-    """ % {'p_id': project_id}
-
-    result = DBSession.connection().execute(sql_query)
+    result = queries.execute('get_project_tasks', project_id=project_id)
 
     data = [
         {
@@ -1457,7 +1867,7 @@ def get_user_tasks_count(request):
     statuses = []
     status_codes = request.GET.getall('status')
     if status_codes:
-        statuses = Status.query.filter(Status.code.in_(status_codes)).all()
+        statuses = lookups.get_statuses(status_codes)
 
     tasks = []
     if statuses:
@@ -1468,19 +1878,9 @@ def get_user_tasks_count(request):
     return len(tasks)
 
 
-@view_config(
-    route_name='get_entity_tasks_stats',
-    renderer='json'
-)
-def get_entity_tasks_stats(request):
-    """runs when viewing an task
+queries.register(
+    'get_entity_tasks_stats',
     """
-    entity_id = request.matchdict.get('id', -1)
-    entity = Entity.query.filter_by(id=entity_id).first()
-
-    logger.debug('get_entity_tasks_stats is starts')
-
-    sql_query = """
         select
             count("Tasks".id) as count,
             "Statuses".id as status_id,
@@ -1509,22 +1909,38 @@ def get_entity_tasks_stats(request):
            "Statuses".id,
            "Statuses_SimpleEntities".name,
            "Statuses_SimpleEntities".html_class
+    """,
+    entity_id='integer'
+)
+
+
+@view_config(
+    route_name='get_entity_tasks_stats',
+    renderer='json'
+)
+def get_entity_tasks_stats(request):
+    """runs when viewing an task
     """
+    entity_id = request.matchdict.get('id', -1)
+    entity = Entity.query.filter_by(id=entity_id).first()
+
+    logger.debug('get_entity_tasks_stats is starts')
+
     where_condition_for_entity = ''
 
     if isinstance(entity, User):
         where_condition_for_entity = \
             'join "Task_Resources" on "Task_Resources".task_id = "Tasks".id ' \
-            'where "Task_Resources".resource_id =%s' % entity_id
+            'where "Task_Resources".resource_id = :entity_id'
     elif isinstance(entity, Project):
-        where_condition_for_entity = 'where "Tasks".project_id =%s' % entity_id
-
-    sql_query = sql_query % {
-        'where_condition_for_entity': where_condition_for_entity
-    }
+        where_condition_for_entity = 'where "Tasks".project_id = :entity_id'
 
     # convert to dgrid format right here in place
-    result = DBSession.connection().execute(sql_query)
+    result = queries.execute(
+        'get_entity_tasks_stats',
+        {'where_condition_for_entity': where_condition_for_entity},
+        entity_id=entity_id
+    )
 
     return_data = [
         {
@@ -1545,27 +1961,9 @@ def get_entity_tasks_stats(request):
     return resp
 
 
-@view_config(
-    route_name='get_entity_tasks_by_filter',
-    renderer='json'
-)
-def get_entity_tasks_by_filter(request):
-    """returns all the tasks in the database related to the given entity in
-    flat json format
-    """
-
-    logged_in_user = get_logged_in_user(request)
-
-     # get all the tasks related in the given project
-    entity_id = request.matchdict.get('id', -1)
-    entity = Entity.query.filter_by(id=entity_id).first()
-
-    logger.debug('entity_id: %s'% entity_id)
-
-    filter_id = request.matchdict.get('f_id', -1)
-    filter = Entity.query.filter_by(id=filter_id).first()
-
-    sql_query = """select
+queries.register(
+    'get_entity_tasks_by_filter',
+    """select
     "Task_Resources".task_id as task_id,
     "ParentTasks".parent_names as task_name,
     array_agg("Responsible_SimpleEntities".id) as responsible_id,
@@ -1605,99 +2003,14 @@ def get_entity_tasks_by_filter(request):
     join "SimpleEntities" as "Project_SimpleEntities"on "Project_SimpleEntities".id = "Tasks".project_id
     join "Statuses" on "Statuses".id = "Tasks".status_id
     join "SimpleEntities" as "Statuses_SimpleEntities" on "Statuses_SimpleEntities".id = "Statuses".id
-    left outer join (
-        select
-            "TimeLogs".task_id,
-            extract(epoch from sum("TimeLogs".end::timestamp AT TIME ZONE 'UTC' - "TimeLogs".start::timestamp AT TIME ZONE 'UTC')) as duration
-            from "TimeLogs"
-            group by task_id
-        ) as "Task_TimeLogs" on "Task_TimeLogs".task_id = "Tasks".id
+    left outer join "Task_TimeLog_Durations" as "Task_TimeLogs" on "Task_TimeLogs".task_id = "Tasks".id
     join "SimpleEntities" as "Tasks_SimpleEntities" on "Tasks_SimpleEntities".id = "Task_Resources".task_id
 
 join "SimpleEntities" as "Resource_SimpleEntities" on "Resource_SimpleEntities".id = "Task_Resources".resource_id
-join ((
-    -- get tasks responsible from parents
-    -- so find all the tasks that doesn't have a responsible but one of their parents has
-    with recursive go_to_parent(id, parent_id) as (
-            select task.id, task.parent_id
-            from "Tasks" as task
-            left outer join "Task_Responsible" on task.id = "Task_Responsible".task_id
-            where "Task_Responsible".responsible_id is NULL
-        union all
-            select g.id, task.parent_id
-            from go_to_parent as g
-            join "Tasks" as task on g.parent_id = task.id
-            join "Task_Responsible" on task.id = "Task_Responsible".task_id
-            where task.parent_id is not NULL and "Task_Responsible".responsible_id is NULL
-    )
-    select
-        g.id,
-        "Task_Responsible".responsible_id
-    from go_to_parent as g
-    join "Tasks" as parent_task on g.parent_id = parent_task.id
-    join "Task_Responsible" on parent_task.id = "Task_Responsible".task_id
-    where "Task_Responsible".responsible_id is not NULL
-    order by g.id
-    )
-    union
-    (
-        -- select all the tasks that has a responsible
-        select
-            id,
-            responsible_id
-        from "Tasks"
-        join "Task_Responsible" on "Tasks".id = "Task_Responsible".task_id
-        where "Task_Responsible".responsible_id is not NULL
-    )
-    union
-    (
-        -- select all the residual tasks that are not in the previous union
-        select
-            "Tasks".id,
-            "Projects".lead_id
-        from "Tasks"
-        join "Projects" on "Tasks".project_id = "Projects".id
-        left outer join (
-            (
-                -- get tasks responsible from parents
-                -- so find all the tasks that doesn't have a responsible but one of their parents has
-                with recursive go_to_parent(id, parent_id) as (
-                        select task.id, task.parent_id
-                        from "Tasks" as task
-                        left outer join "Task_Responsible" on task.id = "Task_Responsible".task_id
-                        where "Task_Responsible".responsible_id is NULL
-                    union all
-                        select g.id, task.parent_id
-                        from go_to_parent as g
-                        join "Tasks" as task on g.parent_id = task.id
-                        join "Task_Responsible" on task.id = "Task_Responsible".task_id
-                        where task.parent_id is not NULL and "Task_Responsible".responsible_id is NULL
-                )
-                select
-                    g.id
-                from go_to_parent as g
-                join "Tasks" as parent_task on g.parent_id = parent_task.id
-                join "Task_Responsible" on parent_task.id = "Task_Responsible".task_id
-                where "Task_Responsible".responsible_id is not NULL
-                order by g.id
-            )
-            union
-            (
-                -- select all the tasks that has a responsible
-                select
-                    id
-                from "Tasks"
-                join "Task_Responsible" on "Tasks".id = "Task_Responsible".task_id
-                where responsible_id is not NULL
-            )
-        ) as prev_query on "Tasks".id = prev_query.id
-        where prev_query.id is NULL
-    )) as "Tasks_Responsible" on "Tasks_Responsible".id = "Tasks".id
+join "Task_Inherited_Responsibles" as "Tasks_Responsible" on "Tasks_Responsible".id = "Tasks".id
     left join "SimpleEntities" as "Responsible_SimpleEntities" on "Responsible_SimpleEntities".id = "Tasks_Responsible".responsible_id
     left join "SimpleEntities" as "Type_SimpleEntities" on "Tasks_SimpleEntities".type_id = "Type_SimpleEntities".id
-    left join (
-        %(tasks_hierarchical_name_table)s
-    ) as "ParentTasks" on "Tasks".id = "ParentTasks".id
+    left join "Task_Hierarchical_Names" as "ParentTasks" on "Tasks".id = "ParentTasks".id
 
     left outer join (
         select
@@ -1722,33 +2035,60 @@ join ((
         "Project_SimpleEntities".id,
         "Project_SimpleEntities".name,
         type_name
+    """,
+    entity_id='integer',
+    filter_id='integer'
+)
+
+
+@view_config(
+    route_name='get_entity_tasks_by_filter',
+    renderer='json'
+)
+def get_entity_tasks_by_filter(request):
+    """returns all the tasks in the database related to the given entity in
+    flat json format
     """
+
+    logged_in_user = get_logged_in_user(request)
+
+     # get all the tasks related in the given project
+    entity_id = request.matchdict.get('id', -1)
+    entity = Entity.query.filter_by(id=entity_id).first()
+
+    logger.debug('entity_id: %s'% entity_id)
+
+    filter_id = request.matchdict.get('f_id', -1)
+    filter = Entity.query.filter_by(id=filter_id).first()
+
     where_condition_for_entity = ''
 
     if isinstance(entity, User):
          where_condition_for_entity = \
-             '"Task_Resources".resource_id = %s' % entity_id
+             '"Task_Resources".resource_id = :entity_id'
     elif isinstance(entity, Project):
-        where_condition_for_entity = '"Tasks".project_id =%s' % entity_id
+        where_condition_for_entity = '"Tasks".project_id = :entity_id'
 
     where_condition_for_filter = ''
 
     if isinstance(filter, User):
          where_condition_for_entity = ''
          where_condition_for_filter = \
-             '"Tasks_Responsible".responsible_id = %s' % filter_id
+             '"Tasks_Responsible".responsible_id = :filter_id'
     elif isinstance(filter, Status):
         where_condition_for_filter = \
-            'and "Statuses_SimpleEntities".id = %s' % filter_id
-
-    sql_query = sql_query % {
-        'tasks_hierarchical_name_table': query_of_tasks_hierarchical_name_table(),
-        'where_condition_for_entity': where_condition_for_entity,
-        'where_condition_for_filter': where_condition_for_filter
-    }
+            'and "Statuses_SimpleEntities".id = :filter_id'
 
     # convert to dgrid format right here in place
-    result = DBSession.connection().execute(sql_query)
+    result = queries.execute(
+        'get_entity_tasks_by_filter',
+        {
+            'where_condition_for_entity': where_condition_for_entity,
+            'where_condition_for_filter': where_condition_for_filter
+        },
+        entity_id=entity_id,
+        filter_id=filter_id
+    )
 
     return_data = [
         {
@@ -2047,9 +2387,7 @@ def create_task(request):
     kwargs['parent'] = parent
 
     # get the status_list
-    status_list = StatusList.query \
-        .filter_by(target_entity_type=entity_type) \
-        .first()
+    status_list = lookups.get_status_list(entity_type)
 
     logger.debug('status_list: %s' % status_list)
 
@@ -2072,9 +2410,9 @@ def create_task(request):
 
     # check the statuses of the dependencies to decide the newly created task
     # status
-    status_wfd = Status.query.filter_by(code='WFD').first()
-    status_rts = Status.query.filter_by(code='RTS').first()
-    status_cmpl = Status.query.filter_by(code='CMPL').first()
+    status_wfd = lookups.get_status('WFD')
+    status_rts = lookups.get_status('RTS')
+    status_cmpl = lookups.get_status('CMPL')
     status = status_rts
 
     #if depends:
@@ -2188,15 +2526,9 @@ def auto_schedule_tasks(request):
         return Response(c.html(replace_links=True), 500)
 
 
-def get_last_version_of_task(request, is_published=''):
-    """finds last published version of task
+queries.register(
+    'get_last_version_of_task',
     """
-    version = None
-
-    task_id = request.matchdict.get('id')
-    task = Task.query.filter_by(id=task_id).first()
-
-    sql_query = """
        select
            "Versions".id as version_id,
            "Versions".parent_id as parent_id,
@@ -2213,7 +2545,7 @@ def get_last_version_of_task(request, is_published=''):
            join "SimpleEntities" as "Version_SimpleEntities" on "Version_SimpleEntities".id = "Versions".id
            join "SimpleEntities" as "Created_by_SimpleEntities" on "Created_by_SimpleEntities".id = "Version_SimpleEntities".created_by_id
 
-       where "Version_Tasks".id = %(task_id)s and "Versions".take_name = 'Main' %(is_published_condition)s
+       where "Version_Tasks".id = :task_id and "Versions".take_name = 'Main' %(is_published_condition)s
 
        group by
            "Versions".id,
@@ -2227,22 +2559,34 @@ def get_last_version_of_task(request, is_published=''):
 
        order by date_updated desc
        limit 1
-       """
+       """,
+    task_id='integer',
+    is_published='boolean'
+)
+
+
+def get_last_version_of_task(request, is_published=''):
+    """finds last published version of task
+    """
+    version = None
+
+    task_id = request.matchdict.get('id')
+    task = Task.query.filter_by(id=task_id).first()
 
     is_published_condition = ''
 
     if is_published != '':
         is_published_condition = \
-            """ and "Versions".is_published = '%s'""" % is_published
+            ' and "Versions".is_published = :is_published'
 
     logger.debug('%s' % is_published_condition)
 
-    sql_query = sql_query % {
-        'task_id': task_id,
-        'is_published_condition': is_published_condition
-    }
-
-    result = DBSession.connection().execute(sql_query).fetchone()
+    result = queries.execute(
+        'get_last_version_of_task',
+        {'is_published_condition': is_published_condition},
+        task_id=task_id,
+        is_published=is_published
+    ).fetchone()
     if result:
         user_os = get_user_os(request)
         repo = task.project.repository
@@ -2300,7 +2644,7 @@ def review_task_dialog(request):
 
     logged_in_user = get_logged_in_user(request)
 
-    status_new = Status.query.filter_by(code='NEW').first()
+    status_new = lookups.get_status('NEW')
     review = Review.query.filter(Review.reviewer_id == logged_in_user.id).filter(Review.task_id==entity.id).filter(Review.status==status_new).first()
 
     came_from = request.params.get('came_from', request.url)
@@ -2369,7 +2713,7 @@ def approve_task(request):
     send_email = request.params.get('send_email', 1)  # for testing purposes
     description = request.params.get('description', 1)
 
-    status_new = Status.query.filter_by(code='NEW').first()
+    status_new = lookups.get_status('NEW')
 
     review = Review.query\
         .filter(Review.reviewer_id == logged_in_user.id)\
@@ -2520,7 +2864,7 @@ def request_revision(request):
         'y': 'years'
     }[schedule_unit]
 
-    status_new = Status.query.filter_by(code='NEW').first()
+    status_new = lookups.get_status('NEW')
     review = Review.query\
         .filter(Review.reviewer_id == logged_in_user.id)\
         .filter(Review.task_id == task.id)\
@@ -2984,20 +3328,9 @@ def request_extra_time(request):
     return Response('There is no task with id : %s' % task_id, 500)
 
 
-@view_config(
-    route_name='get_entity_versions_used_by_tasks',
-    renderer='json'
-)
-def get_entity_versions_used_by_tasks(request):
-    """returns all the Shots of the given Project
-    """
-    logger.debug('get_versions is running')
-
-    entity_id = request.matchdict.get('id', -1)
-
-    logger.debug('entity_id : %s' % entity_id)
-
-    sql_query = """select
+queries.register(
+    'get_entity_versions_used_by_tasks',
+    """select
     "Input_Version_Task_SimpleEntities".id,
     "Input_Version_Task_SimpleEntities".name,
     "Task_Resources_SimpleEntities".id as resource_id,
@@ -3015,21 +3348,38 @@ from "Tasks"
     join "Task_Resources"  on "Task_Resources".task_id = "Input_Version_Tasks".id
     join "SimpleEntities" as "Task_Resources_SimpleEntities" on "Task_Resources_SimpleEntities".id = "Task_Resources".resource_id
 
-where "Tasks".id = %(task_id)s
+where "Tasks".id = :task_id
 group by "Input_Version_Task_SimpleEntities".id,
 "Tasks_SimpleEntities".name,
 "Task_Resources_SimpleEntities".id,
 "Task_Resources_SimpleEntities".name,
 "Input_Version_Task_Statuses_SimpleEntities".html_class
+    """,
+    task_id='integer'
+)
+
+
+@view_config(
+    route_name='get_entity_versions_used_by_tasks',
+    renderer='json'
+)
+def get_entity_versions_used_by_tasks(request):
+    """returns all the Shots of the given Project
     """
+    logger.debug('get_versions is running')
+
+    entity_id = request.matchdict.get('id', -1)
+
+    logger.debug('entity_id : %s' % entity_id)
 
     # set the content range to prevent JSONRest Store to query the data twice
     content_range = '%s-%s/%s'
     task_id = entity_id
 
-    sql_query = sql_query % {'task_id': task_id}
-
-    result = DBSession.connection().execute(sql_query)
+    result = queries.execute(
+        'get_entity_versions_used_by_tasks',
+        task_id=task_id
+    )
 
     return_data = [
         {
@@ -3123,58 +3473,99 @@ def delete_task(request):
     return Response('Successfully deleted task: %s' % task_id)
 
 
-def get_child_task_events(task):
-    task_events = []
+# the leaf tasks under the task with the given id, used by get_task_events()
+task_events_leaf_tasks_condition = """"Tasks".id in (
+        select "Task_Ancestors".descendant_id
+        from "Task_Ancestors"
+        where "Task_Ancestors".ancestor_id = :task_id
+            and not exists (
+                select 1 from "Tasks" as "Child_Tasks"
+                where "Child_Tasks".parent_id = "Task_Ancestors".descendant_id
+            )
+    )"""
 
-    if task.children:
-        for child in task.children:
-            task_events.extend(get_child_task_events(child))
-    else:
-        resources = []
-        for resource in task.resources:
-            resources.append({'name': resource.name, 'id': resource.id})
 
-        # logger.debug('resources %s' % resources)
-        task_events.append({
-            'id': task.id,
-            'entity_type': task.plural_class_name.lower(),
-            # 'title': '%s (%s)' % (
-            #     task.name,
-            #     ' | '.join([parent.name for parent in task.parents])),
-            'title': task.name,
-            'start': milliseconds_since_epoch(task.start),
-            'end': milliseconds_since_epoch(task.end),
-            'className': 'label',
-            'allDay': False,
-            'status': task.status.name,
-            'status_color': task.status.html_class,
-            'resources': resources,
-            'percent_complete': task.percent_complete,
-            'total_logged_seconds': task.total_logged_seconds,
-            'schedule_seconds': task.schedule_seconds
-            # 'hours_to_complete': time_log.hours_to_complete,
-            # 'notes': time_log.notes
-        })
+queries.register(
+    'get_task_task_events',
+    """select
+        "Tasks".id,
+        lower("SimpleEntities".entity_type) || 's',
+        "SimpleEntities".name,
+        "Tasks".start,
+        "Tasks".end,
+        "Status_SimpleEntities".name,
+        "Status_SimpleEntities".html_class,
+        coalesce("Tasks".schedule_seconds,
+            "Tasks".schedule_timing * (case "Tasks".schedule_unit
+                when 'min' then 60
+                when 'h' then 3600
+                when 'd' then 32400
+                when 'w' then 147600
+                when 'm' then 590400
+                when 'y' then 7696277
+                else 0
+            end)
+        ) as schedule_seconds,
+        coalesce("Task_TimeLogs".duration, 0) as total_logged_seconds
+    from "Tasks"
+    join "SimpleEntities" on "Tasks".id = "SimpleEntities".id
+    join "SimpleEntities" as "Status_SimpleEntities"
+        on "Tasks".status_id = "Status_SimpleEntities".id
+    left outer join "Task_TimeLog_Durations" as "Task_TimeLogs"
+        on "Task_TimeLogs".task_id = "Tasks".id
+    where """ + task_events_leaf_tasks_condition + """
+        and %(window_condition)s
+    order by "Tasks".start
+    """,
+    task_id='integer',
+    window_start='timestamp',
+    window_end='timestamp'
+)
 
-        for time_log in task.time_logs:
-        # logger.debug('time_log.task.id : %s' % time_log.task.id)
-        # assert isinstance(time_log, TimeLog)
-            task_events.append({
-                'id': time_log.id,
-                'entity_type': time_log.plural_class_name.lower(),
-                'resource_name': time_log.resource.name,
-                'title': time_log.task.name,
-                'start': milliseconds_since_epoch(time_log.start),
-                'end': milliseconds_since_epoch(time_log.end),
-                'className': 'label-success',
-                'allDay': False,
-                'status': time_log.task.status.name,
-                'status_color': time_log.task.status.html_class
-            })
-            # logger.debug('resource_id %s' % time_log.resource.id)
-            # logger.debug('resource_name %s' % time_log.resource.name)
-
-    return task_events
+
+queries.register(
+    'get_task_resource_events',
+    """select
+        "Task_Resources".task_id,
+        "SimpleEntities".id,
+        "SimpleEntities".name
+    from "Task_Resources"
+    join "Tasks" on "Task_Resources".task_id = "Tasks".id
+    join "SimpleEntities" on "Task_Resources".resource_id = "SimpleEntities".id
+    where """ + task_events_leaf_tasks_condition + """
+        and %(window_condition)s
+    """,
+    task_id='integer',
+    window_start='timestamp',
+    window_end='timestamp'
+)
+
+
+queries.register(
+    'get_task_time_log_events',
+    """select
+        "TimeLogs".id,
+        "Resource_SimpleEntities".name,
+        "SimpleEntities".name,
+        "TimeLogs".start,
+        "TimeLogs".end,
+        "Status_SimpleEntities".name,
+        "Status_SimpleEntities".html_class
+    from "TimeLogs"
+    join "Tasks" on "TimeLogs".task_id = "Tasks".id
+    join "SimpleEntities" on "Tasks".id = "SimpleEntities".id
+    join "SimpleEntities" as "Status_SimpleEntities"
+        on "Tasks".status_id = "Status_SimpleEntities".id
+    join "SimpleEntities" as "Resource_SimpleEntities"
+        on "TimeLogs".resource_id = "Resource_SimpleEntities".id
+    where """ + task_events_leaf_tasks_condition + """
+        and %(window_condition)s
+    order by "TimeLogs".start
+    """,
+    task_id='integer',
+    window_start='timestamp',
+    window_end='timestamp'
+)
 
 
 @view_config(
@@ -3182,6 +3573,12 @@ def get_child_task_events(task):
     renderer='json'
 )
 def get_task_events(request):
+    """returns the leaf tasks under the given task and their time logs as
+    calendar events.
+
+    The start and end parameters can be used to only return the events that
+    overlap with the time window that the calendar is showing.
+    """
     if not multi_permission_checker(
             request, ['Read_User', 'Read_TimeLog', 'Read_Vacation']):
         return HTTPForbidden(headers=request)
@@ -3193,8 +3590,84 @@ def get_task_events(request):
 
     logger.debug('task_id : %s' % task_id)
 
+    if not task:
+        return []
+
+    window_start, window_end = get_time_window(request)
+
+    window_values = {
+        'task_id': task.id,
+        'window_start': window_start,
+        'window_end': window_end
+    }
+
+    resources = {}
+    result = queries.execute(
+        'get_task_resource_events',
+        {
+            'window_condition': queries.get_time_window_condition(
+                '"Tasks".start', '"Tasks".end', window_start, window_end
+            )
+        },
+        **window_values
+    )
+    for r in result.fetchall():
+        resources.setdefault(r[0], []).append({'name': r[2], 'id': r[1]})
+
     events = []
-    events.extend(get_child_task_events(task))
+    result = queries.execute(
+        'get_task_task_events',
+        {
+            'window_condition': queries.get_time_window_condition(
+                '"Tasks".start', '"Tasks".end', window_start, window_end
+            )
+        },
+        **window_values
+    )
+    for r in result.fetchall():
+        schedule_seconds = r[7]
+        total_logged_seconds = r[8]
+        events.append({
+            'id': r[0],
+            'entity_type': r[1],
+            'title': r[2],
+            'start': milliseconds_since_epoch(r[3]),
+            'end': milliseconds_since_epoch(r[4]),
+            'className': 'label',
+            'allDay': False,
+            'status': r[5],
+            'status_color': r[6],
+            'resources': resources.get(r[0], []),
+            'percent_complete':
+                total_logged_seconds / float(schedule_seconds) * 100
+                if schedule_seconds else 0,
+            'total_logged_seconds': total_logged_seconds,
+            'schedule_seconds': schedule_seconds
+        })
+
+    result = queries.execute(
+        'get_task_time_log_events',
+        {
+            'window_condition': queries.get_time_window_condition(
+                '"TimeLogs".start', '"TimeLogs".end', window_start, window_end
+            )
+        },
+        **window_values
+    )
+    for r in result.fetchall():
+        events.append({
+            'id': r[0],
+            'entity_type': 'timelogs',
+            'resource_name': r[1],
+            'title': r[2],
+            'start': milliseconds_since_epoch(r[3]),
+            'end': milliseconds_since_epoch(r[4]),
+            'className': 'label-success',
+            'allDay': False,
+            'status': r[5],
+            'status_color': r[6]
+        })
+
     return events
 
 
@@ -33,10 +33,14 @@ from pyramid_mailer.message import Message, Attachment
 from stalker.db import DBSession
 from stalker import User, Ticket, Project, Note, Type, Task
 
+from stalker_pyramid import lookups
+from stalker_pyramid.db import queries
 from stalker_pyramid.views import (get_logged_in_user, PermissionChecker,
                                    milliseconds_since_epoch,
                                    dummy_email_address, local_to_utc,
-                                   get_multi_integer)
+                                   get_multi_integer, get_range, get_order_by,
+                                   get_content_range, get_total_count,
+                                   get_entity_type)
 from stalker_pyramid.views.link import (replace_img_data_with_links,
                                         convert_file_link_to_full_path)
 
@@ -92,7 +96,7 @@ def create_ticket_dialog(request):
         'owner_id':owner_id,
         'project': project,
         'ticket_types':
-            Type.query.filter_by(target_entity_type='Ticket').all(),
+            lookups.get_types('Ticket'),
         'ticket_priorities': [
             "TRIVIAL",
             "MINOR",
@@ -418,6 +422,54 @@ def update_ticket(request):
     return Response('Successfully updated ticket')
 
 
+queries.register(
+    'get_tickets',
+    """select
+        "SimpleEntities_Ticket".id,
+        "SimpleEntities_Ticket".name,
+        "Tickets".number,
+        "Tickets".summary,
+        "Tickets".project_id,
+        "SimpleEntities_Project".name as project_name,
+        "Tickets".owner_id as owner_id,
+        "SimpleEntities_Owner".name as owner_name,
+        "SimpleEntities_Ticket".date_created,
+        "SimpleEntities_Ticket".date_updated,
+        "SimpleEntities_Ticket".created_by_id,
+        "SimpleEntities_CreatedBy".name as created_by_name,
+        "SimpleEntities_Ticket".updated_by_id,
+        "SimpleEntities_UpdatedBy".name as updated_by_name,
+        "SimpleEntities_Status".name as status_name,
+        "Tickets".priority,
+        "SimpleEntities_Type".name as type_name,
+        count(*) over () as total_count
+    from "Tickets"
+    join "SimpleEntities" as "SimpleEntities_Ticket" on "Tickets".id = "SimpleEntities_Ticket".id
+    join "SimpleEntities" as "SimpleEntities_Project" on "Tickets".project_id = "SimpleEntities_Project".id
+    left outer join "SimpleEntities" as "SimpleEntities_Owner" on "Tickets".owner_id = "SimpleEntities_Owner".id
+    left outer join "SimpleEntities" as "SimpleEntities_CreatedBy" on "SimpleEntities_Ticket".created_by_id = "SimpleEntities_CreatedBy".id
+    left outer join "SimpleEntities" as "SimpleEntities_UpdatedBy" on "SimpleEntities_Ticket".updated_by_id = "SimpleEntities_UpdatedBy".id
+    join "SimpleEntities" as "SimpleEntities_Status" on "Tickets".status_id = "SimpleEntities_Status".id
+    left outer join "SimpleEntities" as "SimpleEntities_Type" on "SimpleEntities_Ticket".type_id = "SimpleEntities_Type".id
+    %(where_condition)s
+    %(order_by)s
+    limit :limit offset :offset
+    """,
+    entity_id='integer',
+    offset='integer',
+    limit='integer'
+)
+
+
+queries.register(
+    'get_tickets_count',
+    """select count(1) from "Tickets"
+    %(where_condition)s
+    """,
+    entity_id='integer'
+)
+
+
 @view_config(
     route_name='get_tickets',
     renderer='json'
@@ -447,57 +499,56 @@ def get_tickets(request):
     entity_type = None
     if entity_id:
         # get the entity type
-        sql_query = \
-            'select entity_type from "SimpleEntities" where id=%s' % entity_id
-        data = DBSession.connection().execute(sql_query).fetchone()
-        entity_type = data[0] if data else None
+        entity_type = get_entity_type(entity_id)
 
     logger.debug('entity_id  : %s' % entity_id)
     logger.debug('entity_type: %s' % entity_type)
 
-    sql_query = """select
-        "SimpleEntities_Ticket".id,
-        "SimpleEntities_Ticket".name,
-        "Tickets".number,
-        "Tickets".summary,
-        "Tickets".project_id,
-        "SimpleEntities_Project".name as project_name,
-        "Tickets".owner_id as owner_id,
-        "SimpleEntities_Owner".name as owner_name,
-        "SimpleEntities_Ticket".date_created,
-        "SimpleEntities_Ticket".date_updated,
-        "SimpleEntities_Ticket".created_by_id,
-        "SimpleEntities_CreatedBy".name as created_by_name,
-        "SimpleEntities_Ticket".updated_by_id,
-        "SimpleEntities_UpdatedBy".name as updated_by_name,
-        "SimpleEntities_Status".name as status_name,
-        "Tickets".priority,
-        "SimpleEntities_Type".name as type_name
-    from "Tickets"
-    join "SimpleEntities" as "SimpleEntities_Ticket" on "Tickets".id = "SimpleEntities_Ticket".id
-    join "SimpleEntities" as "SimpleEntities_Project" on "Tickets".project_id = "SimpleEntities_Project".id
-    left outer join "SimpleEntities" as "SimpleEntities_Owner" on "Tickets".owner_id = "SimpleEntities_Owner".id
-    left outer join "SimpleEntities" as "SimpleEntities_CreatedBy" on "SimpleEntities_Ticket".created_by_id = "SimpleEntities_CreatedBy".id
-    left outer join "SimpleEntities" as "SimpleEntities_UpdatedBy" on "SimpleEntities_Ticket".updated_by_id = "SimpleEntities_UpdatedBy".id
-    join "SimpleEntities" as "SimpleEntities_Status" on "Tickets".status_id = "SimpleEntities_Status".id
-    left outer join "SimpleEntities" as "SimpleEntities_Type" on "SimpleEntities_Ticket".type_id = "SimpleEntities_Type".id
-    """
-
+    where_condition = ''
     if entity_type:
         if entity_type == u"Project":
-            sql_query += """where "Tickets".project_id = %s""" % entity_id
+            where_condition = """where "Tickets".project_id = :entity_id"""
         elif entity_type == u"User":
-            sql_query += """where "Tickets".owner_id = %s""" % entity_id
+            where_condition = """where "Tickets".owner_id = :entity_id"""
         else:
-            sql_query += \
+            where_condition = \
                 """join "Ticket_SimpleEntities" on
                     "Tickets".id = "Ticket_SimpleEntities".ticket_id
-                where "Ticket_SimpleEntities".simple_entity_id = %s
-                """ % entity_id
-    sql_query += 'order by "Tickets".number'
+                where "Ticket_SimpleEntities".simple_entity_id = :entity_id
+                """
+
+    offset, limit = get_range(request)
+    order_by = get_order_by(
+        request,
+        {
+            'id': '"Tickets".id',
+            'number': '"Tickets".number',
+            'name': '"SimpleEntities_Ticket".name',
+            'summary': '"Tickets".summary',
+            'project_name': '"SimpleEntities_Project".name',
+            'owner_name': '"SimpleEntities_Owner".name',
+            'date_created': '"SimpleEntities_Ticket".date_created',
+            'date_updated': '"SimpleEntities_Ticket".date_updated',
+            'created_by_name': '"SimpleEntities_CreatedBy".name',
+            'updated_by_name': '"SimpleEntities_UpdatedBy".name',
+            'status': '"SimpleEntities_Status".name',
+            'priority': '"Tickets".priority',
+            'type': '"SimpleEntities_Type".name'
+        },
+        'order by "Tickets".number'
+    )
 
     start = time.time()
-    result = DBSession.connection().execute(sql_query)
+    rows = queries.execute(
+        'get_tickets',
+        {
+            'where_condition': where_condition,
+            'order_by': order_by
+        },
+        entity_id=entity_id,
+        offset=offset,
+        limit=limit
+    ).fetchall()
     data = [
         {
             'id': r[0],
@@ -517,12 +568,27 @@ def get_tickets(request):
             'status': r[14],
             'priority': r[15],
             'type': r[16]
-        } for r in result.fetchall()
+        } for r in rows
     ]
     end = time.time()
     logger.debug('get_entity_tickets took : %s seconds for %s rows' % (
     end - start, len(data)))
-    return data
+
+    total_count = get_total_count(
+        rows,
+        offset,
+        lambda: queries.execute(
+            'get_tickets_count',
+            {'where_condition': where_condition},
+            entity_id=entity_id
+        ).fetchone()[0]
+    )
+
+    resp = Response(
+        json_body=data
+    )
+    resp.content_range = get_content_range(offset, len(data), total_count)
+    return resp
 
 
 @view_config(
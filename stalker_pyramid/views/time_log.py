@@ -27,12 +27,15 @@ from pyramid.response import Response
 from pyramid.view import view_config
 
 from stalker.db import DBSession
-from stalker import defaults, Task, User, Studio, TimeLog, Entity, Status
+from stalker import defaults, Task, User, Studio, TimeLog, Entity
 from stalker.exceptions import OverBookedError, DependencyViolationError
 
+from stalker_pyramid import lookups
+from stalker_pyramid.db import queries
 from stalker_pyramid.views import (get_logged_in_user,
                                    PermissionChecker, milliseconds_since_epoch,
-                                   get_date, StdErrToHTMLConverter)
+                                   get_date, StdErrToHTMLConverter,
+                                   stream_json, get_entity_type)
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -228,6 +231,31 @@ def update_time_log(request):
     return Response('TimeLog has been updated successfully')
 
 
+queries.register(
+    'get_time_logs',
+    """select
+        "TimeLogs".id,
+        "TimeLogs".task_id,
+        "SimpleEntities_Task".name,
+        "SimpleEntities_Status".name,
+        parent_names.path,
+        "TimeLogs".resource_id,
+        "SimpleEntities_Resource".name,
+        extract(epoch from "TimeLogs".end::timestamp AT TIME ZONE 'UTC' - "TimeLogs".start::timestamp AT TIME ZONE 'UTC') as total_seconds,
+        extract(epoch from "TimeLogs".start::timestamp AT TIME ZONE 'UTC') * 1000 as start,
+        extract(epoch from "TimeLogs".end::timestamp AT TIME ZONE 'UTC') * 1000 as end
+    from "TimeLogs"
+    join "Tasks" on "TimeLogs".task_id = "Tasks".id
+    join "SimpleEntities" as "SimpleEntities_Task" on "Tasks".id = "SimpleEntities_Task".id
+    join "SimpleEntities" as "SimpleEntities_Status" on "Tasks".status_id = "SimpleEntities_Status".id
+    join "SimpleEntities" as "SimpleEntities_Resource" on "TimeLogs".resource_id = "SimpleEntities_Resource".id
+    join "Task_Hierarchical_Names" as parent_names on "TimeLogs".task_id = parent_names.id
+    %(where_condition)s
+    """,
+    entity_id='integer'
+)
+
+
 @view_config(
     route_name='get_entity_time_logs',
     renderer='json'
@@ -243,77 +271,22 @@ def get_time_logs(request):
     entity_id = request.matchdict.get('id', -1)
     logger.debug('entity_id : %s' % entity_id)
 
-    data = DBSession.connection().execute(
-        'select entity_type from "SimpleEntities" where id=%s' % entity_id
-    ).fetchone()
-
-    entity_type = None
-    if len(data):
-        entity_type = data[0]
+    entity_type = get_entity_type(entity_id)
 
     logger.debug('entity_type : %s' % entity_type)
 
-    sql_query = """select
-        "TimeLogs".id,
-        "TimeLogs".task_id,
-        "SimpleEntities_Task".name,
-        "SimpleEntities_Status".name,
-        parent_names.parent_name,
-        "TimeLogs".resource_id,
-        "SimpleEntities_Resource".name,
-        extract(epoch from "TimeLogs".end::timestamp AT TIME ZONE 'UTC' - "TimeLogs".start::timestamp AT TIME ZONE 'UTC') as total_seconds,
-        extract(epoch from "TimeLogs".start::timestamp AT TIME ZONE 'UTC') * 1000 as start,
-        extract(epoch from "TimeLogs".end::timestamp AT TIME ZONE 'UTC') * 1000 as end
-    from "TimeLogs"
-    join "Tasks" on "TimeLogs".task_id = "Tasks".id
-    join "SimpleEntities" as "SimpleEntities_Task" on "Tasks".id = "SimpleEntities_Task".id
-    join "SimpleEntities" as "SimpleEntities_Status" on "Tasks".status_id = "SimpleEntities_Status".id
-    join "SimpleEntities" as "SimpleEntities_Resource" on "TimeLogs".resource_id = "SimpleEntities_Resource".id
-    join (
-        select
-            parent_data.id,
-            "SimpleEntities".name,
-            array_to_string(array_agg(
-                case
-                    when "SimpleEntities_parent".entity_type = 'Project'
-                    then "Projects".code
-                    else "SimpleEntities_parent".name
-                end),
-                ' | '
-            ) as parent_name
-            from (
-                with recursive parent_ids(id, parent_id, n) as (
-                        select task.id, coalesce(task.parent_id, task.project_id), 0
-                        from "Tasks" task
-                    union
-                        select task.id, parent.parent_id, parent.n + 1
-                        from "Tasks" task, parent_ids parent
-                        where task.parent_id = parent.id
-                )
-                select
-                    parent_ids.id, parent_id as parent_id, parent_ids.n
-                    from parent_ids
-                    order by id, parent_ids.n desc
-            ) as parent_data
-            join "SimpleEntities" on "SimpleEntities".id = parent_data.id
-            join "SimpleEntities" as "SimpleEntities_parent" on "SimpleEntities_parent".id = parent_data.parent_id
-            left outer join "Projects" on parent_data.parent_id = "Projects".id
-            group by parent_data.id, "SimpleEntities".name
-    ) as parent_names on "TimeLogs".task_id = parent_names.id
-    """
-
+    where_condition = ''
     if entity_type == u'User':
-        sql_query += 'where "TimeLogs".resource_id = %s' % entity_id
+        where_condition = 'where "TimeLogs".resource_id = :entity_id'
     elif entity_type == u'Task':
-        sql_query += 'where "TimeLogs".task_id = %s' % entity_id
+        where_condition = 'where "TimeLogs".task_id = :entity_id'
     elif entity_type is None:
         return []
 
-    result = DBSession.connection().execute(sql_query)
-
-    start = time.time()
-    data = [
-        {
+    def convert_to_time_log_format(r):
+        """converts the given row to time log format
+        """
+        return {
             'id': r[0],
             'entity_type': 'timelogs',
             'task_id': r[1],
@@ -327,11 +300,22 @@ def get_time_logs(request):
             'end': r[9],
             'className': 'label-important',
             'allDay': '0'
-        } for r in result.fetchall()
-    ]
+        }
+
+    start = time.time()
+    resp = stream_json(
+        queries.bind(
+            'get_time_logs',
+            {'where_condition': where_condition},
+            entity_id=entity_id
+        ),
+        convert_to_time_log_format
+    )
     end = time.time()
-    logger.debug('get_entity_time_logs took: %s seconds' % (end - start))
-    return data
+    logger.debug('get_entity_time_logs query took: %s seconds' %
+                 (end - start))
+    return resp
+
 
 @view_config(
     route_name='delete_time_log',
@@ -351,7 +335,7 @@ def delete_time_log(request):
             'Can not find a Time_log with id: %s' % time_log_id, 500
         )
 
-    status_cmpl = Status.query.filter(Status.code == 'CMPL').first()
+    status_cmpl = lookups.get_status('CMPL')
 
     if time_log.task.status in [status_cmpl]:
         transaction.abort()
@@ -375,7 +359,7 @@ def delete_time_log(request):
         task = Task.query.get(task_id)
         assert isinstance(task, Task)
         if not task.time_logs:
-            status_new = Status.query.filter(Status.code == 'NEW').first()
+            status_new = lookups.get_status('NEW')
             task.status = status_new
 
     return Response('Successfully deleted time_log: %s' % time_log_id)
@@ -23,6 +23,8 @@ from pyramid.view import view_config
 from stalker.db import DBSession
 from stalker import Type
 
+from stalker_pyramid import lookups
+
 import logging
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -43,9 +45,7 @@ def get_types(request):
                 'name': type_.name,
                 'id': type_.id
             }
-            for type_ in Type.query.filter(
-                Type._target_entity_type == target_entity_type
-            ).all()
+            for type_ in lookups.get_types(target_entity_type)
         ]
     else:
         return [type_.name for type_ in Type.query.all()]
@@ -57,8 +57,11 @@ def query_type(entity_type, type_name):
     if not type_name:
         return None
 
-    type_query = Type.query.filter_by(target_entity_type=entity_type)
-    type_ = type_query.filter_by(name=type_name).first()
+    type_ = lookups.get_type(type_name, entity_type)
+    if type_ is None:
+        # it may be created in this transaction
+        type_query = Type.query.filter_by(target_entity_type=entity_type)
+        type_ = type_query.filter_by(name=type_name).first()
     if type_name and type_ is None:
         # create a new Type
         logger.debug('creating new %s type: %s' % (
@@ -25,11 +25,13 @@ from pyramid.httpexceptions import HTTPOk, HTTPServerError
 from pyramid.view import view_config
 
 from stalker.db import DBSession
-from stalker import defaults, User, Studio, Vacation, Type, Entity
+from stalker import defaults, User, Studio, Vacation, Entity
 
+from stalker_pyramid import lookups
 from stalker_pyramid.views import (get_logged_in_user, PermissionChecker,
                                    milliseconds_since_epoch, get_date,
                                    StdErrToHTMLConverter)
+from stalker_pyramid.views.type import query_type
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -63,11 +65,10 @@ def create_vacation_dialog(request):
 
     logger.debug('entity %s ' % entity)
 
-    vacation_types = \
-        Type.query\
-            .filter(Type.target_entity_type == 'Vacation')\
-            .filter(Type.name != 'StudioWide')\
-            .all()
+    vacation_types = [
+        type_ for type_ in lookups.get_types('Vacation')
+        if type_.name != 'StudioWide'
+    ]
 
     studio = Studio.query.first()
 
@@ -76,10 +77,10 @@ def create_vacation_dialog(request):
 
     if entity.entity_type == 'Studio':
         # user = studio
-        vacation_types =\
-            Type.query\
-                .filter(Type.target_entity_type == 'Vacation')\
-                .filter(Type.name == 'StudioWide').all()
+        vacation_types = [
+            type_ for type_ in lookups.get_types('Vacation')
+            if type_.name == 'StudioWide'
+        ]
 
     return {
         'mode': 'create',
@@ -111,8 +112,7 @@ def update_vacation_dialog(request):
     vacation_id = request.matchdict.get('id', -1)
     vacation = Vacation.query.filter_by(id=vacation_id).first()
 
-    vacation_types = Type.query.filter(
-        Type.target_entity_type == 'Vacation').all()
+    vacation_types = lookups.get_types('Vacation')
 
     studio = Studio.query.first()
 
@@ -122,11 +122,10 @@ def update_vacation_dialog(request):
     user = vacation.user
     if not vacation.user:
         user = studio
-        vacation_types = \
-            Type.query\
-                .filter(Type.target_entity_type == 'Vacation')\
-                .filter(Type.name == 'StudioWide')\
-                .all()
+        vacation_types = [
+            type_ for type_ in lookups.get_types('Vacation')
+            if type_.name == 'StudioWide'
+        ]
 
     return {
         'mode': 'update',
@@ -171,21 +170,11 @@ def create_vacation(request):
         # we are ready to create the time log
         # Vacation should handle the extension of the effort
 
-        type_ = Type.query \
-            .filter_by(target_entity_type='Vacation') \
-            .filter_by(name=type_name) \
-            .first()
-
-        if type_ is None:
-            # create a new Type
-            # TODO: should we check for permission here
-            #       or will it be already done in the UI
-            #       (ex. filteringSelect instead of comboBox)
-            type_ = Type(
-                name=type_name,
-                code=type_name,
-                target_entity_type='Vacation'
-            )
+        # get the type or create a new one
+        # TODO: should we check for permission here
+        #       or will it be already done in the UI
+        #       (ex. filteringSelect instead of comboBox)
+        type_ = query_type('Vacation', type_name)
 
         if not user:
             logger.debug('its a studio vacation')
@@ -253,21 +242,11 @@ def update_vacation(request):
     if vacation and start_date and end_date:
         # we are ready to create the time log
         # Vacation should handle the extension of the effort
-        type_ = Type.query \
-            .filter_by(target_entity_type='Vacation') \
-            .filter_by(name=type_name) \
-            .first()
-
-        if type_ is None:
-            # create a new Type
-            # TODO: should we check for permission here
-            #       or will it be already done in the UI
-            #       (ex. filteringSelect instead of comboBox)
-            type_ = Type(
-                name=type_name,
-                code=type_name,
-                target_entity_type='Vacation'
-            )
+        # get the type or create a new one
+        # TODO: should we check for permission here
+        #       or will it be already done in the UI
+        #       (ex. filteringSelect instead of comboBox)
+        type_ = query_type('Vacation', type_name)
 
         vacation.updated_by = logged_in_user
         vacation.type = type_
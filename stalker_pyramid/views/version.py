@@ -21,6 +21,7 @@ import os
 import logging
 import shutil
 
+import transaction
 from pyramid.httpexceptions import HTTPOk
 from pyramid.view import view_config
 
@@ -31,7 +32,8 @@ from stalker import Task, TimeLog, Version, Link, Entity, defaults
 
 from stalker_pyramid.views import (get_logged_in_user, get_user_os,
                                    PermissionChecker, get_multi_integer)
-from stalker_pyramid.views.link import convert_file_link_to_full_path
+from stalker_pyramid.views.link import (convert_file_link_to_full_path,
+                                        remove_unused_files)
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -176,12 +178,15 @@ def assign_version(request):
                      version.absolute_full_path)
 
         shutil.copyfile(full_path, version.absolute_full_path)
-        os.remove(full_path)
 
-        # it is now safe to delete the link
+        # it is now safe to delete the link, its file is removed if it is
+        # not used by other links
         DBSession.add(task)
         DBSession.delete(link)
         DBSession.add(version)
+        transaction.get().addAfterCommitHook(
+            remove_unused_files, args=([link.full_path],)
+        )
 
     return HTTPOk()
 
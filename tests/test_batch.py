@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+# Stalker Pyramid a Web Base Production Asset Management System
+# Copyright (C) 2009-2014 Erkan Ozgur Yilmaz
+#
+# This file is part of Stalker Pyramid.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation;
+# version 2.1 of the License.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+import json
+
+import unittest2
+
+from pyramid import testing
+from pyramid.httpexceptions import HTTPNotFound
+from pyramid.request import Request
+from pyramid.response import Response
+
+from stalker_pyramid.views.batch import batch
+
+
+def get_thing(request):
+    """a dummy view returning its matchdict and params
+    """
+    return {
+        'id': request.matchdict['id'],
+        'status': request.GET.getall('status')
+    }
+
+
+def get_missing_thing(request):
+    """a dummy view raising an HTTPException
+    """
+    raise HTTPNotFound('no thing')
+
+
+def get_broken_thing(request):
+    """a dummy view raising an unexpected error
+    """
+    raise ValueError('broken thing')
+
+
+def query_user(request):
+    """a dummy logged_in_user request property returning a new user every
+    time it is queried
+    """
+    query_user.count += 1
+    return {'id': query_user.count, 'detached': False}
+
+query_user.count = 0
+
+
+def get_user(request):
+    """a dummy view using the logged in user, which fails if the user is
+    detached
+    """
+    if request.logged_in_user['detached']:
+        raise ValueError('the user is detached')
+    return request.logged_in_user['id']
+
+
+def get_aborting_thing(request):
+    """a dummy view returning an error after aborting the transaction, which
+    detaches the logged in user
+    """
+    request.logged_in_user['detached'] = True
+    return Response('aborted', 500)
+
+
+def get_detaching_thing(request):
+    """a dummy view raising an unexpected error after detaching the logged in
+    user
+    """
+    request.logged_in_user['detached'] = True
+    raise ValueError('detached')
+
+
+def get_checked_permissions(request):
+    """a dummy view which records a permission to the checked permissions
+    """
+    request.checked_permissions[request.matchdict['id']] = True
+    return sorted(request.checked_permissions.keys())
+
+
+class BatchTestCase(unittest2.TestCase):
+    """tests the stalker_pyramid.views.batch module
+    """
+
+    def setUp(self):
+        """setup the test
+        """
+        self.config = testing.setUp()
+        routes = [
+            ('batch', 'batch/', batch, 'POST'),
+            ('get_thing', 'things/{id}/', get_thing, None),
+            ('get_missing_thing', 'things/{id}/missing/', get_missing_thing,
+             None),
+            ('get_broken_thing', 'things/{id}/broken/', get_broken_thing,
+             None),
+            ('get_checked_permissions', 'permissions/{id}/',
+             get_checked_permissions, None),
+            ('get_user', 'user/', get_user, None),
+            ('get_aborting_thing', 'aborting/', get_aborting_thing, None),
+            ('get_detaching_thing', 'detaching/', get_detaching_thing,
+             None),
+            ('update_thing', 'things/{id}/update', get_thing, None),
+        ]
+        for route_name, pattern, view, request_method in routes:
+            self.config.add_route(route_name, pattern)
+            self.config.add_view(
+                view,
+                route_name=route_name,
+                renderer='json',
+                request_method=request_method
+            )
+        self.config.add_request_method(
+            query_user, 'logged_in_user', reify=True
+        )
+        self.app = self.config.make_wsgi_app()
+
+    def tearDown(self):
+        testing.tearDown()
+
+    def post_batch(self, items):
+        """posts the given items to the batch route and returns the response
+        """
+        request = Request.blank(
+            '/batch/',
+            method='POST',
+            body=json.dumps(items),
+            content_type='application/json'
+        )
+        return request.get_response(self.app)
+
+    def test_batch_returns_the_responses_by_name(self):
+        """testing if the responses are returned with the names of the
+        requests or with the route names
+        """
+        response = self.post_batch([
+            {'name': 'thing1', 'route': 'get_thing',
+             'matchdict': {'id': 1}, 'params': {'status': ['WIP', 'CMPL']}},
+            {'route': 'get_thing', 'matchdict': {'id': 2}}
+        ])
+        self.assertEqual(200, response.status_int)
+        self.assertEqual(
+            {
+                'thing1': {
+                    'status': 200,
+                    'body': {'id': '1', 'status': ['WIP', 'CMPL']},
+                    'content_range': None
+                },
+                'get_thing': {
+                    'status': 200,
+                    'body': {'id': '2', 'status': []},
+                    'content_range': None
+                }
+            },
+            response.json_body
+        )
+
+    def test_batch_returns_the_errors_of_the_requests(self):
+        """testing if the failed requests have their own status and the rest
+        of the batch is still run
+        """
+        response = self.post_batch([
+            {'name': 'missing', 'route': 'get_missing_thing',
+             'matchdict': {'id': 1}},
+            {'name': 'broken', 'route': 'get_broken_thing',
+             'matchdict': {'id': 1}},
+            {'name': 'unknown', 'route': 'get_unknown_thing'},
+            {'name': 'update', 'route': 'update_thing',
+             'matchdict': {'id': 1}},
+            {'name': 'no_id', 'route': 'get_thing'},
+            {'name': 'thing', 'route': 'get_thing', 'matchdict': {'id': 3}}
+        ])
+        data = response.json_body
+        self.assertEqual(404, data['missing']['status'])
+        self.assertEqual(500, data['broken']['status'])
+        self.assertEqual('broken thing', data['broken']['body'])
+        self.assertEqual(404, data['unknown']['status'])
+        self.assertEqual(400, data['update']['status'])
+        self.assertEqual(400, data['no_id']['status'])
+        self.assertEqual(200, data['thing']['status'])
+
+    def test_batch_loads_the_user_again_after_a_failed_request(self):
+        """testing if the logged in user is shared between the requests of a
+        batch and it is loaded again after a failed request, as it is
+        detached
+        """
+        response = self.post_batch([
+            {'name': 'user1', 'route': 'get_user'},
+            {'name': 'user2', 'route': 'get_user'},
+            {'name': 'aborting', 'route': 'get_aborting_thing'},
+            {'name': 'user3', 'route': 'get_user'},
+            {'name': 'detaching', 'route': 'get_detaching_thing'},
+            {'name': 'user4', 'route': 'get_user'}
+        ])
+        data = response.json_body
+        self.assertEqual(500, data['aborting']['status'])
+        self.assertEqual(500, data['detaching']['status'])
+        for name in ['user1', 'user2', 'user3', 'user4']:
+            self.assertEqual(200, data[name]['status'])
+        self.assertEqual(data['user1']['body'], data['user2']['body'])
+        self.assertNotEqual(data['user2']['body'], data['user3']['body'])
+        self.assertNotEqual(data['user3']['body'], data['user4']['body'])
+
+    def test_batch_shares_the_checked_permissions(self):
+        """testing if the checked permissions are shared between the requests
+        of a batch
+        """
+        response = self.post_batch([
+            {'name': 'first', 'route': 'get_checked_permissions',
+             'matchdict': {'id': 'Read_Task'}},
+            {'name': 'second', 'route': 'get_checked_permissions',
+             'matchdict': {'id': 'List_User'}}
+        ])
+        data = response.json_body
+        self.assertEqual(['Read_Task'], data['first']['body'])
+        self.assertEqual(['List_User', 'Read_Task'], data['second']['body'])
+
+    def test_batch_with_invalid_body(self):
+        """testing if a batch which is not a json list is rejected
+        """
+        self.assertEqual(500, self.post_batch({'route': 'get_thing'}).status_int)
+        request = Request.blank('/batch/', method='POST', body='not json')
+        self.assertEqual(500, request.get_response(self.app).status_int)
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+# Stalker Pyramid a Web Base Production Asset Management System
+# Copyright (C) 2009-2014 Erkan Ozgur Yilmaz
+#
+# This file is part of Stalker Pyramid.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation;
+# version 2.1 of the License.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+import unittest2
+
+from pyramid import testing
+
+from stalker import db, User, Group, Tag
+from stalker.db import DBSession
+
+from stalker_pyramid.cache import TTLCache
+from stalker_pyramid.views import get_identity, group_finder, identity_cache
+
+
+class TTLCacheTestCase(unittest2.TestCase):
+    """tests the stalker_pyramid.cache.TTLCache class
+    """
+
+    def setUp(self):
+        """setup the test
+        """
+        self.config = testing.setUp()
+        db.setup({'sqlalchemy.url': 'sqlite:///:memory:'})
+        self.calls = []
+
+    def tearDown(self):
+        DBSession.remove()
+        testing.tearDown()
+
+    def creator(self):
+        """a creator that counts its calls
+        """
+        self.calls.append(1)
+        return len(self.calls)
+
+    def test_get_creates_the_value_once(self):
+        """testing if get() calls the creator only once for a key
+        """
+        cache = TTLCache(ttl=60)
+        self.assertEqual(1, cache.get('key', self.creator))
+        self.assertEqual(1, cache.get('key', self.creator))
+        self.assertEqual(2, cache.get('other key', self.creator))
+
+    def test_get_creates_the_value_again_when_it_is_expired(self):
+        """testing if get() calls the creator again for an expired value
+        """
+        cache = TTLCache(ttl=-1)
+        self.assertEqual(1, cache.get('key', self.creator))
+        self.assertEqual(2, cache.get('key', self.creator))
+
+    def test_invalidate(self):
+        """testing if invalidate() removes the value of the given key or all
+        the values
+        """
+        cache = TTLCache(ttl=60)
+        cache.get('key1', self.creator)
+        cache.get('key2', self.creator)
+        cache.invalidate('key1')
+        self.assertEqual(3, cache.get('key1', self.creator))
+        self.assertEqual(2, cache.get('key2', self.creator))
+        cache.invalidate()
+        self.assertEqual(4, cache.get('key2', self.creator))
+
+    def test_flushing_an_invalidating_class_clears_the_cache(self):
+        """testing if the cache is cleared when an instance of the classes in
+        invalidated_by is flushed
+        """
+        cache = TTLCache(ttl=60, invalidated_by=[User])
+        cache.get('key', self.creator)
+
+        DBSession.add(Tag(name='Tag1'))
+        DBSession.flush()
+        self.assertEqual(1, cache.get('key', self.creator))
+
+        DBSession.add(
+            User(name='User1', login='user1', email='user1@users.com',
+                 password='pass')
+        )
+        DBSession.flush()
+        self.assertEqual(2, cache.get('key', self.creator))
+
+
+class IdentityTestCase(unittest2.TestCase):
+    """tests the identity helpers of stalker_pyramid.views
+    """
+
+    def setUp(self):
+        """setup the test
+        """
+        self.config = testing.setUp()
+        db.setup({'sqlalchemy.url': 'sqlite:///:memory:'})
+        identity_cache.invalidate()
+
+        self.group1 = Group(name='Group1')
+        self.user1 = User(
+            name='User1',
+            login='user1',
+            email='user1@users.com',
+            password='pass',
+            groups=[self.group1]
+        )
+        DBSession.add(self.user1)
+        DBSession.flush()
+
+    def tearDown(self):
+        DBSession.remove()
+        identity_cache.invalidate()
+        testing.tearDown()
+
+    def test_get_identity(self):
+        """testing if get_identity() returns the id and groups of the user
+        """
+        identity = get_identity('user1')
+        self.assertEqual(self.user1.id, identity['id'])
+        self.assertEqual(['Group:Group1'], identity['groups'])
+
+    def test_get_identity_returns_none_for_unknown_logins(self):
+        """testing if get_identity() returns None for an unknown login
+        """
+        self.assertIsNone(get_identity('unknown'))
+
+    def test_group_finder(self):
+        """testing if group_finder() returns the groups of the user for both
+        login formats
+        """
+        self.assertEqual(['Group:Group1'], group_finder('user1', None))
+        self.assertEqual(['Group:Group1'], group_finder('User:user1', None))
+        self.assertEqual([], group_finder('unknown', None))
+
+    def test_group_finder_is_updated_when_the_groups_change(self):
+        """testing if group_finder() returns the new groups of the user after
+        the groups of the user are changed
+        """
+        self.assertEqual(['Group:Group1'], group_finder('user1', None))
+        self.user1.groups.append(Group(name='Group2'))
+        DBSession.flush()
+        self.assertEqual(
+            ['Group:Group1', 'Group:Group2'],
+            sorted(group_finder('user1', None))
+        )
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+# Stalker Pyramid a Web Base Production Asset Management System
+# Copyright (C) 2009-2014 Erkan Ozgur Yilmaz
+#
+# This file is part of Stalker Pyramid.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation;
+# version 2.1 of the License.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+import os
+import shutil
+import tempfile
+
+import unittest2
+from PIL import Image
+
+from stalker_pyramid import derivatives
+
+
+class DerivativesTestCase(unittest2.TestCase):
+    """tests the stalker_pyramid.derivatives module
+    """
+
+    def setUp(self):
+        """set up the test
+        """
+        self.temp_path = tempfile.mkdtemp()
+        self.cache = derivatives.DerivativeCache(
+            os.path.join(self.temp_path, 'derivatives'), 100
+        )
+
+    def tearDown(self):
+        """clean up the test
+        """
+        shutil.rmtree(self.temp_path)
+
+    def create_file(self, link_id, size, file_size, mtime=None):
+        """creates a file in the cache and returns its path
+        """
+        file_path = self.cache.get_file_path(link_id, size, '.jpg')
+        if not os.path.exists(os.path.dirname(file_path)):
+            os.makedirs(os.path.dirname(file_path))
+        with open(file_path, 'wb') as f:
+            f.write('x' * file_size)
+        if mtime is not None:
+            os.utime(file_path, (mtime, mtime))
+        return file_path
+
+    def test_create_derivative(self):
+        """testing if create_derivative() saves the image resized to fit in to
+        the given size and saves the images with transparency as png
+        """
+        source_path = os.path.join(self.temp_path, 'plate.png')
+        Image.new('RGBA', (1024, 512)).save(source_path, 'PNG')
+
+        target_path = os.path.join(self.temp_path, 'card', '10.jpg')
+        file_path = derivatives.create_derivative(
+            source_path, target_path, derivatives.sizes['card']
+        )
+        self.assertEqual(
+            os.path.join(self.temp_path, 'card', '10.png'), file_path
+        )
+        self.assertEqual((256, 128), Image.open(file_path).size)
+        self.assertEqual(['10.png'], os.listdir(os.path.dirname(file_path)))
+
+    def test_cache_removes_least_recently_used_files(self):
+        """testing if the cache removes the least recently used files when it
+        is full
+        """
+        file_path1 = self.create_file(1, 'card', 40, mtime=1000)
+        file_path2 = self.create_file(2, 'card', 40, mtime=2000)
+
+        # use the older one
+        self.assertEqual(file_path1, self.cache.get(1, 'card'))
+
+        file_path3 = self.create_file(3, 'avatar', 40)
+        self.cache.add(file_path3)
+
+        self.assertTrue(os.path.exists(file_path1))
+        self.assertFalse(os.path.exists(file_path2))
+        self.assertTrue(os.path.exists(file_path3))
+        self.assertEqual(80, self.cache.total_size)
+        self.assertIsNone(self.cache.get(2, 'card'))
+
+    def test_cache_skips_removed_files(self):
+        """testing if the cache doesn't return the files removed by the other
+        processes
+        """
+        file_path = self.create_file(1, 'card', 40)
+        self.assertEqual(file_path, self.cache.get(1, 'card'))
+
+        os.remove(file_path)
+        self.assertIsNone(self.cache.get(1, 'card'))
+        self.assertEqual(0, self.cache.total_size)
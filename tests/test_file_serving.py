@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+# Stalker Pyramid a Web Base Production Asset Management System
+# Copyright (C) 2009-2014 Erkan Ozgur Yilmaz
+#
+# This file is part of Stalker Pyramid.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation;
+# version 2.1 of the License.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+import os
+import shutil
+import tempfile
+
+import unittest2
+from pyramid import testing
+from webob import Request
+
+from stalker import defaults
+
+from stalker_pyramid import file_serving
+
+
+class FileServingTestCase(unittest2.TestCase):
+    """tests the stalker_pyramid.file_serving module
+    """
+
+    def setUp(self):
+        """set up the test
+        """
+        defaults.server_side_storage_path = tempfile.mkdtemp()
+        self.data = ''.join([chr(i % 256) for i in range(1000000)])
+        self.file_full_path = os.path.join(
+            defaults.server_side_storage_path,
+            'ab', 'cd', 'abcd%s.mov' % ('0' * 36)
+        )
+        os.makedirs(os.path.dirname(self.file_full_path))
+        with open(self.file_full_path, 'wb') as f:
+            f.write(self.data)
+
+    def tearDown(self):
+        """clean up the test
+        """
+        file_serving.configure({})
+        shutil.rmtree(defaults.server_side_storage_path)
+
+    def get_response(self, **headers):
+        """returns the response of a request with the given headers
+        """
+        response = file_serving.make_file_response(
+            testing.DummyRequest(), self.file_full_path
+        )
+        return Request.blank('/', headers=headers).get_response(response)
+
+    def test_make_file_response(self):
+        """testing if make_file_response() serves the whole file with the
+        sha1 in its name as the ETag
+        """
+        response = self.get_response()
+        self.assertEqual(200, response.status_int)
+        self.assertEqual('video/quicktime', response.content_type)
+        self.assertEqual('abcd%s' % ('0' * 36), response.etag)
+        self.assertEqual('bytes', response.accept_ranges)
+        self.assertEqual(self.data, response.body)
+
+    def test_make_file_response_with_range(self):
+        """testing if make_file_response() serves the requested range
+        """
+        response = self.get_response(Range='bytes=500000-500099')
+        self.assertEqual(206, response.status_int)
+        self.assertEqual('bytes 500000-500099/1000000',
+                         response.headers['Content-Range'])
+        self.assertEqual(self.data[500000:500100], response.body)
+
+        response = self.get_response(Range='bytes=2000000-')
+        self.assertEqual(416, response.status_int)
+
+    def test_make_file_response_not_modified(self):
+        """testing if make_file_response() returns 304 if the ETag matches
+        """
+        response = self.get_response(
+            **{'If-None-Match': '"abcd%s"' % ('0' * 36)}
+        )
+        self.assertEqual(304, response.status_int)
+        self.assertEqual('', response.body)
+
+    def test_make_file_response_with_x_accel_redirect(self):
+        """testing if make_file_response() hands the file to the front proxy
+        """
+        file_serving.configure({
+            'stalker_pyramid.file_serving_header': 'X-Accel-Redirect',
+            'stalker_pyramid.file_serving_prefix': '/SPL_internal/'
+        })
+        response = file_serving.make_file_response(
+            testing.DummyRequest(), self.file_full_path, filename=u'platé.mov'
+        )
+        self.assertEqual(
+            '/SPL_internal/ab/cd/abcd%s.mov' % ('0' * 36),
+            response.headers['X-Accel-Redirect']
+        )
+        self.assertEqual('', response.body)
+        self.assertEqual(
+            'attachment; filename="plat?.mov"; '
+            'filename*=UTF-8\'\'plat%C3%A9.mov',
+            response.headers['Content-Disposition']
+        )
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+# Stalker Pyramid a Web Base Production Asset Management System
+# Copyright (C) 2009-2014 Erkan Ozgur Yilmaz
+#
+# This file is part of Stalker Pyramid.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation;
+# version 2.1 of the License.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+import json
+import decimal
+
+import unittest2
+
+from pyramid import testing
+
+from stalker import db
+
+from stalker_pyramid.views import stream_json, json_default
+
+
+class JSONStreamTestCase(unittest2.TestCase):
+    """tests the stalker_pyramid.views.JSONStream class
+    """
+
+    def setUp(self):
+        """setup the test
+        """
+        self.config = testing.setUp()
+        db.setup({'sqlalchemy.url': 'sqlite:///:memory:'})
+
+        self.sql_query = """select 1, 'a'
+        union all select 2, 'b'
+        union all select 3, 'c'
+        """
+
+    def tearDown(self):
+        testing.tearDown()
+
+    def test_stream_json_returns_a_json_array(self):
+        """testing if stream_json() returns all the rows as a json array
+        """
+        response = stream_json(
+            self.sql_query,
+            lambda r: {'id': r[0], 'name': r[1]},
+            batch_size=2
+        )
+        self.assertEqual('application/json', response.content_type)
+        self.assertEqual(
+            [{'id': 1, 'name': 'a'},
+             {'id': 2, 'name': 'b'},
+             {'id': 3, 'name': 'c'}],
+            json.loads(response.body)
+        )
+
+    def test_stream_json_with_no_rows(self):
+        """testing if stream_json() returns an empty json array when there
+        are no rows
+        """
+        response = stream_json(
+            'select 1 where 1 = 0',
+            lambda r: r[0]
+        )
+        self.assertEqual([], json.loads(response.body))
+
+    def test_close_closes_the_connection(self):
+        """testing if the connection is closed when the app_iter is closed
+        before it is consumed
+        """
+        response = stream_json(self.sql_query, lambda r: r[0])
+        response.app_iter.close()
+        self.assertTrue(response.app_iter.connection.closed)
+
+    def test_json_default_converts_decimals(self):
+        """testing if json_default() converts Decimals to floats
+        """
+        self.assertEqual(1.5, json_default(decimal.Decimal('1.5')))
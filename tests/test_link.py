@@ -20,11 +20,22 @@
 import shutil
 
 import os
+import base64
+import hashlib
 import tempfile
 import unittest2
 
-from stalker import defaults, Link
-from stalker_pyramid.views.link import ImageData, ImgToLinkConverter
+from pyramid import testing
+
+from stalker import db, defaults, Link
+from stalker.db import DBSession
+
+from stalker_pyramid import file_serving
+from stalker_pyramid.views.link import (ImageData, ImgToLinkConverter,
+                                        replace_img_data_with_links,
+                                        convert_file_link_to_full_path,
+                                        generate_temp_file_path, store_file,
+                                        force_download_files)
 
 
 class ImageDataTestCase(unittest2.TestCase):
@@ -51,10 +62,12 @@ class ImgToLinkConverterTestCase(unittest2.TestCase):
         """set up the test
         """
         defaults.server_side_storage_path = tempfile.mkdtemp()
+        db.setup({'sqlalchemy.url': 'sqlite:///:memory:'})
 
     def tearDown(self):
         """clean up the test
         """
+        DBSession.remove()
         shutil.rmtree(defaults.server_side_storage_path)
 
     def test_img_to_link_converter_is_working_properly(self):
@@ -81,3 +94,100 @@ class ImgToLinkConverterTestCase(unittest2.TestCase):
         replaced_data = raw_data % link_path
 
         self.assertEqual(parser.raw_data, replaced_data)
+
+    def test_img_to_link_converter_stores_same_image_once(self):
+        """testing if the ImgToLinkConverter stores the same image data in
+        the same file
+        """
+        raw_data = '<img src="%s"><img src="%s">'
+        base64_data = 'data:image/jpeg;base64,/9j/4QA6RXhpZgAA'
+
+        parser = ImgToLinkConverter()
+        parser.feed(raw_data % (base64_data, base64_data))
+
+        self.assertEqual(len(parser.links), 2)
+        self.assertEqual(parser.links[0].full_path, parser.links[1].full_path)
+        self.assertEqual(
+            '%s.jpeg' % hashlib.sha1(
+                base64.decodestring('/9j/4QA6RXhpZgAA')
+            ).hexdigest(),
+            os.path.basename(parser.links[0].full_path)
+        )
+        self.assertEqual(
+            [], os.listdir(os.path.join(defaults.server_side_storage_path,
+                                        'tmp'))
+        )
+
+    def test_replace_img_data_with_links_many_images(self):
+        """testing if replace_img_data_with_links() replaces all the inline
+        images and keeps the rest of the html as it is
+        """
+        png_data = base64.encodestring(
+            '\x89PNG\r\n' + ''.join([chr(i % 256) for i in range(100000)])
+        )
+        raw_data = u'<div>é</div>' + u''.join([
+            u'<p>%s</p><IMG class="x" src=\'data:image/png;base64,%s\'>' %
+            (i, png_data if i % 2 else png_data.replace('\n', ''))
+            for i in range(10)
+        ]) + u'<img src="/SPL/aa/bb/c.png"><img src="data:image/png'
+
+        data, links = replace_img_data_with_links(raw_data)
+
+        self.assertEqual(10, len(links))
+        link_path = links[0].full_path
+        self.assertTrue(link_path.endswith('.png'))
+        self.assertTrue(all([link.full_path == link_path for link in links]))
+        self.assertEqual(
+            u'<div>é</div>' + u''.join([
+                u'<p>%s</p><IMG class="x" src=\'/%s\'>' % (i, link_path)
+                for i in range(10)
+            ]) + u'<img src="/SPL/aa/bb/c.png"><img src="data:image/png',
+            data
+        )
+        with open(convert_file_link_to_full_path(link_path), 'rb') as f:
+            self.assertEqual(base64.decodestring(png_data), f.read())
+
+
+class ForceDownloadFilesTestCase(unittest2.TestCase):
+    """tests the force_download_files view
+    """
+
+    def setUp(self):
+        """set up the test
+        """
+        self.config = testing.setUp()
+        defaults.server_side_storage_path = tempfile.mkdtemp()
+        db.setup({'sqlalchemy.url': 'sqlite:///:memory:'})
+        file_serving.filename_cache.invalidate()
+
+    def tearDown(self):
+        """clean up the test
+        """
+        DBSession.remove()
+        shutil.rmtree(defaults.server_side_storage_path)
+        testing.tearDown()
+
+    def test_force_download_files_uses_the_filename_of_the_link(self):
+        """testing if the file shared by many links is downloaded with the
+        original filename of the link given with the link_id parameter
+        """
+        temp_file_path = generate_temp_file_path('.txt')
+        with open(temp_file_path, 'w') as f:
+            f.write('some data')
+        file_full_path, link_full_path = store_file(temp_file_path, '.txt')
+        link1 = Link(full_path=link_full_path, original_filename='first.txt')
+        link2 = Link(full_path=link_full_path, original_filename='second.txt')
+        DBSession.add_all([link1, link2])
+        DBSession.commit()
+
+        partial_file_path = link_full_path[len('SPL/'):]
+        for link, params in [(link1, {}),
+                             (link1, {'link_id': str(link1.id)}),
+                             (link2, {'link_id': str(link2.id)})]:
+            request = testing.DummyRequest(params=params)
+            request.matchdict['partial_file_path'] = partial_file_path
+            response = force_download_files(request)
+            self.assertIn(
+                'filename="%s"' % link.original_filename,
+                response.headers['Content-Disposition']
+            )
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+# Stalker Pyramid a Web Base Production Asset Management System
+# Copyright (C) 2009-2014 Erkan Ozgur Yilmaz
+#
+# This file is part of Stalker Pyramid.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation;
+# version 2.1 of the License.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+import unittest2
+
+from pyramid import testing
+
+from stalker import db, Status, StatusList, Type
+from stalker.db import DBSession
+
+from stalker_pyramid import lookups
+
+
+class LookupsTestCase(unittest2.TestCase):
+    """tests the stalker_pyramid.lookups module
+    """
+
+    def setUp(self):
+        """setup the test
+        """
+        self.config = testing.setUp()
+        db.setup({'sqlalchemy.url': 'sqlite:///:memory:'})
+        lookups.lookup_cache.invalidate()
+
+        self.status1 = Status(name='Status 1', code='STS1')
+        self.status2 = Status(name='Status 2', code='STS2')
+        self.status_list = StatusList(
+            name='Lookup Statuses',
+            statuses=[self.status1, self.status2],
+            target_entity_type='Lookup'
+        )
+        self.type1 = Type(name='Type1', code='T1', target_entity_type='Lookup')
+        self.type2 = Type(name='Type2', code='T2', target_entity_type='Lookup')
+        DBSession.add_all([self.status_list, self.type1, self.type2])
+        DBSession.commit()
+
+    def tearDown(self):
+        DBSession.remove()
+        lookups.lookup_cache.invalidate()
+        testing.tearDown()
+
+    def test_get_status(self):
+        """testing if get_status() returns the Status with the given code in
+        the current session
+        """
+        status = lookups.get_status('STS1')
+        self.assertEqual(self.status1.id, status.id)
+        self.assertIn(status, DBSession)
+        self.assertIsNone(lookups.get_status('UNKNOWN'))
+
+    def test_get_statuses(self):
+        """testing if get_statuses() returns the Statuses in the given order
+        and skips the unknown codes
+        """
+        self.assertEqual(
+            [self.status2.id, self.status1.id],
+            [s.id for s in lookups.get_statuses(['STS2', 'UNKNOWN', 'STS1'])]
+        )
+
+    def test_get_status_by_id(self):
+        """testing if get_status_by_id() accepts string ids and returns None
+        for invalid ids
+        """
+        self.assertEqual(
+            self.status2.id,
+            lookups.get_status_by_id(str(self.status2.id)).id
+        )
+        self.assertIsNone(lookups.get_status_by_id('not an id'))
+        self.assertIsNone(lookups.get_status_by_id(None))
+
+    def test_get_status_list(self):
+        """testing if get_status_list() returns the StatusList of the given
+        entity type with its statuses
+        """
+        status_list = lookups.get_status_list('Lookup')
+        self.assertEqual(self.status_list.id, status_list.id)
+        self.assertEqual(
+            ['STS1', 'STS2'],
+            sorted(s.code for s in status_list.statuses)
+        )
+
+    def test_get_type_and_get_types(self):
+        """testing if get_type() and get_types() return the Types of the
+        given entity type
+        """
+        self.assertEqual(self.type2.id, lookups.get_type('Type2', 'Lookup').id)
+        self.assertIsNone(lookups.get_type('Type2', 'Other'))
+        self.assertEqual(
+            ['Type1', 'Type2'],
+            [t.name for t in lookups.get_types('Lookup')]
+        )
+        self.assertEqual([], lookups.get_types('Other'))
+
+    def test_lookups_are_reloaded_after_a_change_is_committed(self):
+        """testing if the lookups are reloaded after a Type is created
+        """
+        self.assertEqual(2, len(lookups.get_types('Lookup')))
+        DBSession.add(
+            Type(name='Type3', code='T3', target_entity_type='Lookup')
+        )
+        DBSession.commit()
+        self.assertEqual(
+            ['Type1', 'Type2', 'Type3'],
+            [t.name for t in lookups.get_types('Lookup')]
+        )
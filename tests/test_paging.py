@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+# Stalker Pyramid a Web Base Production Asset Management System
+# Copyright (C) 2009-2014 Erkan Ozgur Yilmaz
+#
+# This file is part of Stalker Pyramid.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation;
+# version 2.1 of the License.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+
+import unittest2
+
+from pyramid import testing
+
+from stalker_pyramid.views import (get_range, get_order_by, get_limit_offset,
+                                   get_content_range, get_total_count)
+
+
+class PagingTestCase(unittest2.TestCase):
+    """tests the paging helpers of the dgrid JsonRest views
+    """
+
+    def setUp(self):
+        """setup the test
+        """
+        self.columns = {
+            'id': '"Tasks".id',
+            'name': '"SimpleEntities".name'
+        }
+        self.default = 'order by "Tasks".id'
+
+    def test_get_range_without_range_header(self):
+        """testing if get_range() returns (0, None) when there is no Range
+        header
+        """
+        request = testing.DummyRequest()
+        self.assertEqual((0, None), get_range(request))
+
+    def test_get_range_with_range_header(self):
+        """testing if get_range() returns the offset and limit from the Range
+        header
+        """
+        request = testing.DummyRequest(headers={'Range': 'items=50-99'})
+        self.assertEqual((50, 50), get_range(request))
+
+    def test_get_range_with_x_range_header(self):
+        """testing if get_range() returns the offset and limit from the
+        X-Range header
+        """
+        request = testing.DummyRequest(headers={'X-Range': 'items=0-24'})
+        self.assertEqual((0, 25), get_range(request))
+
+    def test_get_range_with_invalid_range_header(self):
+        """testing if get_range() ignores a Range header which is not in
+        items=a-b format
+        """
+        request = testing.DummyRequest(headers={'Range': 'bytes=0-24'})
+        self.assertEqual((0, None), get_range(request))
+
+    def test_get_order_by_without_sort(self):
+        """testing if get_order_by() returns the default when there is no sort
+        """
+        request = testing.DummyRequest()
+        self.assertEqual(
+            self.default,
+            get_order_by(request, self.columns, self.default)
+        )
+
+    def test_get_order_by_with_dojo_sort(self):
+        """testing if get_order_by() parses the dojo sort(+a,-b) format
+        """
+        request = testing.DummyRequest()
+        request.query_string = 'parent_id=10&sort(%2Bname,-id)'
+        self.assertEqual(
+            'order by "SimpleEntities".name asc, "Tasks".id desc',
+            get_order_by(request, self.columns, self.default)
+        )
+
+    def test_get_order_by_with_sort_param(self):
+        """testing if get_order_by() uses the sort parameter
+        """
+        request = testing.DummyRequest(params={'sort': '-name'})
+        self.assertEqual(
+            'order by "SimpleEntities".name desc',
+            get_order_by(request, self.columns, self.default)
+        )
+
+    def test_get_order_by_skips_unknown_attributes(self):
+        """testing if get_order_by() skips the attributes that are not in the
+        columns dictionary
+        """
+        request = testing.DummyRequest(params={'sort': '-password;drop'})
+        self.assertEqual(
+            self.default,
+            get_order_by(request, self.columns, self.default)
+        )
+
+    def test_get_limit_offset(self):
+        """testing if get_limit_offset() returns the correct clause
+        """
+        self.assertEqual('limit 25 offset 50', get_limit_offset(50, 25))
+        self.assertEqual('offset 0', get_limit_offset(0, None))
+
+    def test_get_content_range(self):
+        """testing if get_content_range() returns the correct Content-Range
+        """
+        self.assertEqual('50-74/1000', get_content_range(50, 25, 1000))
+        self.assertEqual('0--1/0', get_content_range(0, 0, 0))
+
+    def test_get_total_count_from_the_rows(self):
+        """testing if get_total_count() returns the last column of the first
+        row without running the count query
+        """
+        def count_query():
+            raise AssertionError('count query should not run')
+
+        rows = [(1, 'Task1', 12), (2, 'Task2', 12)]
+        self.assertEqual(12, get_total_count(rows, 0, count_query))
+
+    def test_get_total_count_past_the_last_page(self):
+        """testing if get_total_count() runs the count query when a page past
+        the end is requested
+        """
+        self.assertEqual(12, get_total_count([], 50, lambda: 12))
+        self.assertEqual(0, get_total_count([], 0, lambda: 12))
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+# Stalker Pyramid a Web Base Production Asset Management System
+# Copyright (C) 2009-2014 Erkan Ozgur Yilmaz
+#
+# This file is part of Stalker Pyramid.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation;
+# version 2.1 of the License.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+import unittest2
+
+from pyramid import testing
+from pyramid.authorization import ACLAuthorizationPolicy
+from pyramid.security import has_permission
+
+from stalker import db, User, Group, Permission
+from stalker.db import DBSession
+
+from stalker_pyramid.views import (compile_acl, PermissionChecker,
+                                   RootFactory, acl_cache, identity_cache)
+
+
+class CompileACLTestCase(unittest2.TestCase):
+    """tests the stalker_pyramid.views.compile_acl() function
+    """
+
+    def test_compile_acl(self):
+        """testing if compile_acl() keeps the position of the first ACE of
+        each principal and permission pair
+        """
+        acl = [
+            ('Allow', 'Group:Admins', ['Create_Asset', 'Delete_Asset']),
+            ('Deny', 'Group:Users', 'Delete_Asset'),
+            ('Allow', 'Group:Users', 'Delete_Asset'),
+            ('Allow', 'Group:Users', 'Create_Asset'),
+        ]
+        self.assertEqual(
+            {
+                'Group:Admins': {
+                    'Create_Asset': (0, True),
+                    'Delete_Asset': (0, True),
+                },
+                'Group:Users': {
+                    'Delete_Asset': (1, False),
+                    'Create_Asset': (3, True),
+                },
+            },
+            compile_acl(acl)
+        )
+
+
+class PermissionCheckerTestCase(unittest2.TestCase):
+    """tests the stalker_pyramid.views.PermissionChecker class
+    """
+
+    def setUp(self):
+        """setup the test
+        """
+        self.config = testing.setUp()
+        self.config.set_authorization_policy(ACLAuthorizationPolicy())
+        db.setup({'sqlalchemy.url': 'sqlite:///:memory:'})
+        acl_cache.invalidate()
+        identity_cache.invalidate()
+
+        create_asset = Permission('Allow', 'Create', 'Asset')
+        delete_asset = Permission('Allow', 'Delete', 'Asset')
+        deny_delete_asset = Permission('Deny', 'Delete', 'Asset')
+
+        self.group1 = Group(name='Group1')
+        self.group1.permissions = [create_asset, delete_asset]
+
+        self.group2 = Group(name='Group2')
+        self.group2.permissions = [deny_delete_asset]
+
+        self.user1 = User(
+            name='User1',
+            login='user1',
+            email='user1@users.com',
+            password='pass',
+            groups=[self.group2, self.group1]
+        )
+        DBSession.add(self.user1)
+        DBSession.flush()
+
+    def tearDown(self):
+        DBSession.remove()
+        acl_cache.invalidate()
+        identity_cache.invalidate()
+        testing.tearDown()
+
+    def create_request(self, groups):
+        """creates a request of user1 with the given groups
+        """
+        self.config.testing_securitypolicy(userid='user1', groupids=groups)
+        # set the authorization policy back
+        self.config.set_authorization_policy(ACLAuthorizationPolicy())
+        request = testing.DummyRequest()
+        request.context = RootFactory(request)
+        return request
+
+    def test_permission_checker_agrees_with_has_permission(self):
+        """testing if PermissionChecker returns the same results with the
+        has_permission() function of pyramid
+        """
+        for groups in [[], ['Group:Group1'], ['Group:Group2'],
+                       ['Group:Group1', 'Group:Group2']]:
+            request = self.create_request(groups)
+            checker = PermissionChecker(request)
+            for perm in ['Create_Asset', 'Delete_Asset', 'Update_Asset']:
+                self.assertEqual(
+                    bool(has_permission(perm, request.context, request)),
+                    checker(perm)
+                )
+
+    def test_deny_is_respected(self):
+        """testing if a Deny ACE coming before an Allow ACE wins
+        """
+        request = self.create_request(['Group:Group1', 'Group:Group2'])
+        checker = PermissionChecker(request)
+        self.assertTrue(checker('Create_Asset'))
+        self.assertFalse(checker('Delete_Asset'))
+
+    def test_results_are_memoized_per_request(self):
+        """testing if the results are memoized per request
+        """
+        request = self.create_request(['Group:Group1'])
+        self.assertTrue(PermissionChecker(request)('Delete_Asset'))
+
+        request.checked_permissions['Delete_Asset'] = False
+        self.assertFalse(PermissionChecker(request)('Delete_Asset'))
+
+        request = self.create_request(['Group:Group1'])
+        self.assertTrue(PermissionChecker(request)('Delete_Asset'))
+
+    def test_acl_is_updated_when_the_permissions_change(self):
+        """testing if the compiled ACL is updated after the permissions of a
+        group is changed
+        """
+        request = self.create_request(['Group:Group1'])
+        self.assertTrue(PermissionChecker(request)('Delete_Asset'))
+
+        self.group1.permissions = []
+        DBSession.flush()
+
+        request = self.create_request(['Group:Group1'])
+        self.assertFalse(PermissionChecker(request)('Delete_Asset'))
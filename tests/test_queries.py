@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+# Stalker Pyramid a Web Base Production Asset Management System
+# Copyright (C) 2009-2014 Erkan Ozgur Yilmaz
+#
+# This file is part of Stalker Pyramid.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation;
+# version 2.1 of the License.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+import unittest2
+
+from pyramid import testing
+
+from stalker import db
+
+from stalker_pyramid.db import queries
+
+
+class NamedQueryTestCase(unittest2.TestCase):
+    """tests the stalker_pyramid.db.queries module
+    """
+
+    def setUp(self):
+        """setup the test
+        """
+        self.config = testing.setUp()
+        db.setup({'sqlalchemy.url': 'sqlite:///:memory:'})
+
+        self.query = queries.register(
+            'test_named_query',
+            """select :id, :login %(order_by)s""",
+            id='integer',
+            login='text'
+        )
+
+    def tearDown(self):
+        queries.registry.pop('test_named_query', None)
+        testing.tearDown()
+
+    def test_register_raises_value_error_for_a_different_query(self):
+        """testing if register() raises a ValueError when there is already
+        a different query with the same name
+        """
+        self.assertRaises(
+            ValueError,
+            queries.register, 'test_named_query', 'select 1'
+        )
+
+    def test_register_accepts_the_same_query_again(self):
+        """testing if register() accepts the same query with the same name
+        again, so the modules can be reloaded
+        """
+        query = queries.register(
+            'test_named_query',
+            """select :id, :login %(order_by)s""",
+            id='integer',
+            login='text'
+        )
+        self.assertEqual('test_named_query', query.name)
+
+    def test_bind_places_the_fragments(self):
+        """testing if bind() places the fragments and collects the parameter
+        names in the order they appear
+        """
+        bound_query = queries.bind(
+            'test_named_query',
+            {'order_by': 'order by :login'},
+            login='a',
+            id=1,
+            unused=2
+        )
+        self.assertEqual(
+            'select :id, :login order by :login',
+            bound_query.sql
+        )
+        self.assertEqual(['id', 'login'], bound_query.param_names)
+        self.assertEqual({'id': 1, 'login': 'a'}, bound_query.values)
+
+    def test_bind_raises_key_error_for_missing_values(self):
+        """testing if bind() raises a KeyError when a parameter has no value
+        """
+        self.assertRaises(
+            KeyError,
+            queries.bind, 'test_named_query', {'order_by': ''}, id=1
+        )
+
+    def test_bind_raises_key_error_for_parameters_without_types(self):
+        """testing if bind() raises a KeyError when a fragment introduces a
+        parameter without a type
+        """
+        self.assertRaises(
+            KeyError,
+            queries.bind, 'test_named_query',
+            {'order_by': 'limit :limit'}, id=1, login='a', limit=10
+        )
+
+    def test_variants_have_different_statement_names(self):
+        """testing if the variants of a query with different fragments are
+        prepared with different names
+        """
+        bound_query1 = queries.bind(
+            'test_named_query', {'order_by': ''}, id=1, login='a'
+        )
+        bound_query2 = queries.bind(
+            'test_named_query', {'order_by': 'order by 1'}, id=1, login='a'
+        )
+        bound_query3 = queries.bind(
+            'test_named_query', {'order_by': ''}, id=2, login='b'
+        )
+        self.assertNotEqual(
+            bound_query1.statement_name, bound_query2.statement_name
+        )
+        self.assertEqual(
+            bound_query1.statement_name, bound_query3.statement_name
+        )
+
+    def test_prepare_sql(self):
+        """testing if prepare_sql() generates the PREPARE statement with the
+        types of the parameters
+        """
+        bound_query = queries.bind(
+            'test_named_query',
+            {'order_by': 'order by :login'},
+            id=1,
+            login='a'
+        )
+        self.assertEqual(
+            'PREPARE "%s"(integer, text) AS select $1, $2 order by $2' %
+            bound_query.statement_name,
+            bound_query.prepare_sql()
+        )
+        self.assertEqual(
+            'EXECUTE "%s"(:id, :login)' % bound_query.statement_name,
+            bound_query.execute_sql()
+        )
+
+    def test_typed_sql(self):
+        """testing if typed_sql() casts the parameters to their types
+        """
+        bound_query = queries.bind(
+            'test_named_query', {'order_by': ''}, id=1, login='a'
+        )
+        self.assertEqual(
+            'select CAST(:id AS integer), CAST(:login AS text) ',
+            bound_query.typed_sql()
+        )
+
+    def test_execute(self):
+        """testing if execute() runs the query with the given values
+        """
+        result = queries.execute(
+            'test_named_query', {'order_by': ''}, id=1, login='a'
+        )
+        self.assertEqual([(1, 'a')], result.fetchall())
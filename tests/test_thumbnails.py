@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+# Stalker Pyramid a Web Base Production Asset Management System
+# Copyright (C) 2009-2014 Erkan Ozgur Yilmaz
+#
+# This file is part of Stalker Pyramid.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation;
+# version 2.1 of the License.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+import os
+import shutil
+import tempfile
+
+import unittest2
+from PIL import Image
+
+from stalker import db, defaults, Link
+from stalker.db import DBSession
+
+from stalker_pyramid import thumbnails
+from stalker_pyramid.views.link import (generate_local_file_path,
+                                        convert_file_link_to_full_path)
+
+
+class ThumbnailsTestCase(unittest2.TestCase):
+    """tests the stalker_pyramid.thumbnails module
+    """
+
+    def setUp(self):
+        """set up the test
+        """
+        defaults.server_side_storage_path = tempfile.mkdtemp()
+        db.setup({'sqlalchemy.url': 'sqlite:///:memory:'})
+        thumbnails.start({'stalker_pyramid.thumbnail_workers': '2'})
+
+    def tearDown(self):
+        """clean up the test
+        """
+        DBSession.remove()
+        shutil.rmtree(defaults.server_side_storage_path)
+
+    def create_image(self, size, image_format, extension):
+        """creates an image file and returns its file and link paths
+        """
+        file_full_path, link_full_path = generate_local_file_path(extension)
+        os.makedirs(os.path.dirname(file_full_path))
+        Image.new('RGB', size).save(file_full_path, image_format)
+        return file_full_path, link_full_path
+
+    def test_resize_image(self):
+        """testing if resize_image() saves the image resized to fit in to the
+        thumbnail size
+        """
+        file_full_path, link_full_path = \
+            self.create_image((2048, 1024), 'JPEG', '.jpg')
+        target_path = os.path.join(
+            defaults.server_side_storage_path, 'thumbnails', 'thumb.jpg'
+        )
+        thumbnails.resize_image(file_full_path, target_path)
+        self.assertEqual((512, 256), Image.open(target_path).size)
+        self.assertFalse(os.path.exists(target_path + '~'))
+
+    def test_resize_image_keeps_gifs(self):
+        """testing if resize_image() doesn't resize the GIF images if
+        keep_gifs is True
+        """
+        file_full_path, link_full_path = \
+            self.create_image((1024, 1024), 'GIF', '.gif')
+        target_path = os.path.join(
+            defaults.server_side_storage_path, 'thumbnails', 'thumb.gif'
+        )
+        self.assertFalse(
+            thumbnails.resize_image(file_full_path, target_path, True)
+        )
+        self.assertFalse(os.path.exists(target_path))
+
+    def test_create_thumbnail_without_worker(self):
+        """testing if create_thumbnail() creates the thumbnail right away if
+        there is no worker
+        """
+        self.assertIsNone(thumbnails.get_worker())
+        file_full_path, link_full_path = \
+            self.create_image((1024, 2048), 'PNG', '.png')
+        link = Link(full_path=link_full_path, original_filename='plate.png')
+        DBSession.add(link)
+
+        thumbnail = thumbnails.create_thumbnail(link)
+        self.assertEqual(thumbnail, link.thumbnail)
+        self.assertEqual('plate_t.png', thumbnail.original_filename)
+        self.assertEqual(
+            (256, 512),
+            Image.open(
+                convert_file_link_to_full_path(thumbnail.full_path)
+            ).size
+        )
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+# Stalker Pyramid a Web Base Production Asset Management System
+# Copyright (C) 2009-2014 Erkan Ozgur Yilmaz
+#
+# This file is part of Stalker Pyramid.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation;
+# version 2.1 of the License.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+import os
+import shutil
+import hashlib
+import tempfile
+from StringIO import StringIO
+
+import unittest2
+
+from stalker import db, defaults
+from stalker.db import DBSession
+
+from stalker_pyramid import uploads
+
+
+class UploadsTestCase(unittest2.TestCase):
+    """tests the stalker_pyramid.uploads module
+    """
+
+    def setUp(self):
+        """set up the test
+        """
+        defaults.server_side_storage_path = tempfile.mkdtemp()
+        db.setup({'sqlalchemy.url': 'sqlite:///:memory:'})
+        self.data = os.urandom(300000)
+        self.upload = uploads.Upload.create('plate.exr', len(self.data), 10)
+
+    def tearDown(self):
+        """clean up the test
+        """
+        DBSession.remove()
+        shutil.rmtree(defaults.server_side_storage_path)
+
+    def write(self, start, end, length=None):
+        """writes the given part of the data to the upload
+        """
+        return self.upload.write(
+            start,
+            StringIO(self.data[start:end]),
+            length if length is not None else end - start
+        )
+
+    def test_upload_in_chunks(self):
+        """testing if the chunks are written in order and finish() moves the
+        file to the server side storage and returns its sha1
+        """
+        upload = uploads.Upload.get(self.upload.upload_id)
+        self.assertEqual('plate.exr', upload.filename)
+        self.assertEqual(10, upload.created_by_id)
+
+        self.assertEqual(100000, self.write(0, 100000))
+        self.assertEqual(300000, self.write(100000, 300000))
+        self.assertEqual(1.0, self.upload.to_dict()['progress'])
+
+        file_full_path, link_full_path, sha1 = self.upload.finish()
+        self.assertEqual(hashlib.sha1(self.data).hexdigest(), sha1)
+        self.assertTrue(link_full_path.endswith('.exr'))
+        with open(file_full_path, 'rb') as f:
+            self.assertEqual(self.data, f.read())
+        self.assertIsNone(uploads.Upload.get(self.upload.upload_id))
+
+    def test_upload_continues_after_a_broken_chunk(self):
+        """testing if the bytes of a broken chunk are kept and the upload
+        continues from the new offset
+        """
+        # the connection is lost after 50000 bytes
+        self.assertEqual(50000, self.write(0, 50000, length=100000))
+        self.assertEqual(50000, self.upload.offset)
+
+        # the same chunk can not be sent again
+        self.assertRaises(ValueError, self.write, 0, 100000)
+
+        self.write(50000, 300000)
+        file_full_path, link_full_path, sha1 = self.upload.finish(
+            hashlib.sha1(self.data).hexdigest()
+        )
+        self.assertEqual(hashlib.sha1(self.data).hexdigest(), sha1)
+
+    def test_upload_continued_by_another_process(self):
+        """testing if the hash is calculated from the file when the previous
+        chunks are written by another process
+        """
+        self.write(0, 100000)
+        uploads.hashes.clear()
+        self.write(100000, 300000)
+        file_full_path, link_full_path, sha1 = self.upload.finish()
+        self.assertEqual(hashlib.sha1(self.data).hexdigest(), sha1)
+
+    def test_finish_incomplete_upload(self):
+        """testing if finish() raises a ValueError if the upload is not
+        complete or the sha1 doesn't match
+        """
+        self.write(0, 100000)
+        self.assertRaises(ValueError, self.upload.finish)
+
+        self.write(100000, 300000)
+        self.assertRaises(ValueError, self.upload.finish, 'wrong sha1')
+        self.assertIsNone(uploads.Upload.get(self.upload.upload_id))